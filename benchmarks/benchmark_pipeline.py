@@ -0,0 +1,134 @@
+'''
+Benchmark of the stages of the tool on synthetic extracts of increasing sizes (see generate_osm.py). Each run is a
+separate process running osm_2_geodatabase from the command line, so that the peak memory of a run is its own, and
+the measures are read from its run report (see osm_metrics). The output is discarded by default (format NULL), so
+that the stages are measured without the cost of an output, and ArcGIS is not required.
+
+The extracts are generated once in the work folder and reused by the following runs with the same shape. The results
+are printed as a table and appended to a json lines file, to track the scaling of the stages over time.
+
+Usage: python benchmark_pipeline.py [--sizes 100000 1000000] [--join-methods CHUNKED DENSE_STORE] [--work-folder f]
+       [--results results.jsonl] [shape parameters of generate_osm.py]
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_FOLDER = os.path.join(BENCHMARKS_FOLDER, '..', 'scripts')
+sys.path.insert(0, SCRIPTS_FOLDER)
+
+from generate_osm import add_shape_arguments, shape_from_arguments, generate
+from osm_metrics import REPORT_FILE
+
+DEFAULT_SIZES = [100000, 1000000]
+DEFAULT_JOIN_METHODS = ['CHUNKED', 'SORT_MERGE', 'DENSE_STORE', 'SPARSE_STORE']
+
+
+def megabytes(value):
+    return None if value is None else value / 1048576.0
+
+
+def run_benchmark(osm_file, work_folder, join_method, output_format, extra_arguments):
+    """
+    Run the tool on a file and read its run report.
+    :param osm_file: The OSM file.
+    :param work_folder: The folder of the output and of the processing folder, emptied before the run.
+    :param join_method: The join method.
+    :param output_format: The output format.
+    :param extra_arguments: Other command line arguments of osm_2_geodatabase.
+    :return: The run report, as a dictionary.
+    """
+    processing_folder = os.path.join(work_folder, 'processing')
+    output = os.path.join(work_folder, 'output.gpkg' if output_format == 'GEOPACKAGE' else 'output')
+    for path in (processing_folder, output):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.isfile(path):
+            os.remove(path)
+    os.makedirs(processing_folder)
+
+    command = [
+        sys.executable,
+        os.path.join(SCRIPTS_FOLDER, 'osm_2_geodatabase.py'),
+        osm_file,
+        output,
+        processing_folder,
+        '--join-method', join_method,
+        '--format', output_format
+    ] + extra_arguments
+    with open(os.path.join(work_folder, 'log.txt'), 'w') as log_file:
+        subprocess.check_call(command, stdout=log_file, stderr=subprocess.STDOUT)
+    with open(os.path.join(processing_folder, REPORT_FILE), 'r') as report_file:
+        return json.load(report_file)
+
+
+def print_report(size, join_method, report):
+    run = report['run']
+    print('{} nodes, {}: {:.1f} s, CPU {:.1f} s, peak memory {:.0f} MB, peak temporary files {:.1f} MB'.format(
+        size,
+        join_method,
+        run['wall_time'],
+        run['cpu_time'],
+        megabytes(run['process_peak_rss']) or 0,
+        megabytes(report['peak_temp_disk_usage']) or 0
+    ))
+    print('    {:<36} {:>9} {:>9} {:>12} {:>14} {:>10}'.format(
+        'stage', 'wall (s)', 'CPU (s)', 'elements', 'elements/s', 'RSS (MB)'
+    ))
+    for stage in report['stages']:
+        if stage['depth'] > 0:
+            continue
+        print('    {:<36} {:>9.2f} {:>9.2f} {:>12} {:>14} {:>10.0f}'.format(
+            stage['name'],
+            stage['wall_time'],
+            stage['cpu_time'],
+            '' if stage['elements'] is None else stage['elements'],
+            '' if stage['elements_per_second'] is None else '{:.0f}'.format(stage['elements_per_second']),
+            megabytes(stage['process_peak_rss']) or 0
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of the tool on synthetic extracts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='The numbers of nodes.')
+    parser.add_argument('--join-methods', nargs='+', default=DEFAULT_JOIN_METHODS)
+    parser.add_argument('--format', default='NULL', help='The output format, NULL to discard the output.')
+    parser.add_argument('--pipelined', action='store_true')
+    parser.add_argument('--work-folder', default=os.path.join(tempfile.gettempdir(), 'osm2arcmap_benchmark'))
+    parser.add_argument('--results', help='A json lines file the results are appended to.')
+    add_shape_arguments(parser)
+    arguments = parser.parse_args()
+
+    if not os.path.isdir(arguments.work_folder):
+        os.makedirs(arguments.work_folder)
+    extra_arguments = ['--pipelined'] if arguments.pipelined else []
+
+    for size in arguments.sizes:
+        shape = shape_from_arguments(arguments, size)
+        osm_file = os.path.join(arguments.work_folder, shape.file_name())
+        if not os.path.isfile(osm_file):
+            start = time.time()
+            counts = generate(osm_file, shape)
+            print('Generated {nodes} nodes, {ways} ways and {relations} relations'.format(**counts) +
+                  ' in {:.1f} s'.format(time.time() - start))
+
+        for join_method in arguments.join_methods:
+            report = run_benchmark(osm_file, arguments.work_folder, join_method, arguments.format, extra_arguments)
+            print_report(size, join_method, report)
+            if arguments.results:
+                with open(arguments.results, 'a') as results_file:
+                    results_file.write(json.dumps({
+                        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'shape': shape.to_dict(),
+                        'osm_file_size': os.path.getsize(osm_file),
+                        'join_method': join_method,
+                        'format': arguments.format,
+                        'pipelined': arguments.pipelined,
+                        'report': report
+                    }, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
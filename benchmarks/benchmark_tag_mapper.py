@@ -0,0 +1,72 @@
+'''
+Microbenchmark of the mapping of element tags to attribute fields: the scan of every standard field that
+import_osm used to do for each element, against the precompiled TagMapper.
+
+Usage: python benchmark_tag_mapper.py [--elements 200000] [--repeat 3]
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, random, timeit, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_tags import STANDARD_FIELDS_ARRAY, TagMapper
+
+# Keys found on OSM elements that are not saved as fields.
+OTHER_KEYS = ['source', 'created_by', 'wikidata', 'wikipedia', 'opening_hours', 'website', 'phone', 'fixme']
+
+DEFAULT_ELEMENTS = 200000
+
+
+def make_tag_dicts(count, seed=1):
+    """
+    Make tag dictionaries with a distribution close to OSM data: most elements have no or few tags.
+    :param count: The number of dictionaries.
+    :param seed: The seed of the random generator.
+    :return: The list of dictionaries.
+    """
+    generator = random.Random(seed)
+    keys = STANDARD_FIELDS_ARRAY + ['addr:street', 'addr:housenumber', 'name:en', 'building:levels'] + OTHER_KEYS
+    tag_dicts = []
+    for index in range(count):
+        tag_count = min(generator.randint(0, 3), generator.randint(0, 8))
+        tag_dicts.append({generator.choice(keys): 'value' for tag in range(tag_count)})
+    return tag_dicts
+
+
+def scan_fields(tag_dicts, standard_fields_array):
+    for tag_dict in tag_dicts:
+        attrib_values = ['id', 'timestamp']
+        for key in standard_fields_array:
+            if key in tag_dict:
+                attrib_values.append(tag_dict[key])
+            else:
+                attrib_values.append(None)
+
+
+def map_tags(tag_dicts, tag_mapper):
+    for tag_dict in tag_dicts:
+        attrib_values = ['id', 'timestamp']
+        attrib_values.extend(tag_mapper.map(tag_dict))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mapping of element tags to attribute fields.')
+    parser.add_argument('--elements', type=int, default=DEFAULT_ELEMENTS, help='The number of tag dictionaries mapped.')
+    parser.add_argument('--repeat', type=int, default=3)
+    arguments = parser.parse_args()
+
+    count = arguments.elements
+    tag_dicts = make_tag_dicts(count)
+    tag_mapper = TagMapper(STANDARD_FIELDS_ARRAY)
+
+    for name, statement in (
+            ('field scan', lambda: scan_fields(tag_dicts, STANDARD_FIELDS_ARRAY)),
+            ('tag mapper', lambda: map_tags(tag_dicts, tag_mapper))):
+        seconds = min(timeit.repeat(statement, number=1, repeat=arguments.repeat))
+        print('{:<12} {:>8.3f} s {:>12.0f} elements/s'.format(name, seconds, count / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''
+Benchmark of the parsers of OSM files: lxml, ElementTree and the scanner of osm_xml_scanner on an xml extract, and the
+PBF reader of osm_pbf on the same extract converted to PBF. The files are read in memory first, so that the parsers
+are measured without the cost of bz2 decompression and of the disk. The zlib decompression of the PBF blocks is
+measured, since it is part of the format. Each parser yields the element records of
+osm_2_geodatabase.iter_xml_elements, and the records of the parsers are checked to be the same: the benchmark exits
+with status 1 when they differ. lxml is skipped when it is not installed.
+
+Usage: python benchmark_xml_parsers.py [--input extract.osm.bz2] [--pbf extract.osm.pbf] [--repeat 3]
+    [shape parameters of generate_osm.py]
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, io, sys, bz2, time, argparse, tempfile, itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from generate_osm import add_shape_arguments, shape_from_arguments, generate
+from osm_to_pbf import convert
+from osm_2_geodatabase import iter_xml_elements
+from osm_xml_scanner import iter_scanned_elements
+from osm_pbf import NODE_BLOCK, iter_pbf_elements, iter_element_records
+
+try:
+    import xml.etree.cElementTree as element_tree
+except ImportError:
+    import xml.etree.ElementTree as element_tree
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    izip_longest = itertools.izip_longest
+except AttributeError:
+    izip_longest = itertools.zip_longest
+
+DEFAULT_NODES = 1000000
+
+
+def parsers(xml_content, pbf_content):
+    """
+    :param xml_content: The xml content of the extract.
+    :param pbf_content: The content of the extract converted to PBF.
+    :return: A list of (name, function, content, records) tuples. The function takes a file object and yields element
+    records, the records function expands them into the records of iter_xml_elements.
+    """
+    same_records = lambda elements: elements
+    parsers = []
+    if lxml_etree is not None:
+        parsers.append(('lxml', lambda xml_file: iter_xml_elements(xml_file, lxml_etree), xml_content, same_records))
+    parsers.append(('ElementTree', lambda xml_file: iter_xml_elements(xml_file, element_tree), xml_content,
+                    same_records))
+    parsers.append(('scanner', iter_scanned_elements, xml_content, same_records))
+    parsers.append(('PBF', iter_pbf_elements, pbf_content, iter_element_records))
+    return parsers
+
+
+def read_xml(osm_file):
+    """
+    :param osm_file: An OSM XML file, compressed as bz2 or not.
+    :return: The xml content, decompressed.
+    """
+    if osm_file.endswith('.bz2'):
+        with bz2.BZ2File(osm_file, 'rb') as bz2_file:
+            return bz2_file.read()
+    with open(osm_file, 'rb') as xml_file:
+        return xml_file.read()
+
+
+def time_parser(parser, content, repeat):
+    """
+    Parse the content with a parser.
+    :param parser: A function taking a file object and yielding element records.
+    :param content: The content of the file.
+    :param repeat: The number of runs. The fastest one is kept.
+    :return: The best time in seconds, and the number of elements. A node block of the PBF reader counts its nodes.
+    """
+    best_time = None
+    for run in range(repeat):
+        count = 0
+        start = time.time()
+        for element in parser(io.BytesIO(content)):
+            count += len(element[1]) if element[0] == NODE_BLOCK else 1
+        elapsed = time.time() - start
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time, count
+
+
+def first_difference(parser, reference_parser):
+    """
+    Compare the records of two parsers.
+    :param parser: A (name, function, content, records) tuple, as returned by parsers.
+    :param reference_parser: The parser compared with.
+    :return: The first pair of records that differ, or None if the records are the same.
+    """
+    name, function, content, records = parser
+    reference_name, reference_function, reference_content, reference_records = reference_parser
+    for record, reference_record in izip_longest(records(function(io.BytesIO(content))),
+                                                 reference_records(reference_function(io.BytesIO(reference_content)))):
+        if record != reference_record:
+            return record, reference_record
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the parsers of OSM files.')
+    parser.add_argument('--input', help='An OSM XML file, compressed as bz2 or not. A synthetic file by default.')
+    parser.add_argument('--pbf', help='The same extract as a PBF file. By default, the xml file is converted.')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='The number of nodes of the synthetic file.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--work-folder', default=os.path.join(tempfile.gettempdir(), 'osm2arcmap_benchmark'))
+    add_shape_arguments(parser)
+    arguments = parser.parse_args()
+
+    osm_file = arguments.input
+    if osm_file is None:
+        if not os.path.isdir(arguments.work_folder):
+            os.makedirs(arguments.work_folder)
+        shape = shape_from_arguments(arguments, arguments.nodes)
+        osm_file = os.path.join(arguments.work_folder, shape.file_name())
+        if not os.path.isfile(osm_file):
+            counts = generate(osm_file, shape)
+            print('Generated {nodes} nodes, {ways} ways and {relations} relations'.format(**counts))
+
+    pbf_file = arguments.pbf
+    if pbf_file is None:
+        if not os.path.isdir(arguments.work_folder):
+            os.makedirs(arguments.work_folder)
+        name = os.path.basename(osm_file)
+        if name.endswith('.bz2'):
+            name = name[:-len('.bz2')]
+        pbf_file = os.path.join(arguments.work_folder, name + '.pbf')
+        if not os.path.isfile(pbf_file):
+            print('Converted {} elements to PBF'.format(convert(osm_file, pbf_file)))
+
+    content = read_xml(osm_file)
+    with open(pbf_file, 'rb') as pbf:
+        pbf_content = pbf.read()
+    print('{}: {:.1f} MB of xml, {:.1f} MB of PBF'.format(
+        os.path.basename(osm_file), len(content) / 1048576.0, len(pbf_content) / 1048576.0
+    ))
+    if lxml_etree is None:
+        print('lxml is not installed, it is skipped.')
+
+    print('    {:<12} {:>9} {:>12} {:>14} {:>9}'.format('parser', 'time (s)', 'elements', 'elements/s', 'MB/s'))
+    all_parsers = parsers(content, pbf_content)
+    for name, function, parser_content, records in all_parsers:
+        elapsed, count = time_parser(function, parser_content, arguments.repeat)
+        print('    {:<12} {:>9.2f} {:>12} {:>14.0f} {:>9.1f}'.format(
+            name, elapsed, count, count / elapsed, len(parser_content) / 1048576.0 / elapsed
+        ))
+
+    # The records of every parser are compared with the records of the first one.
+    reference_parser = all_parsers[0]
+    same = True
+    for parser in all_parsers[1:]:
+        difference = first_difference(parser, reference_parser)
+        if difference is None:
+            print('The records of {} and {} are the same.'.format(parser[0], reference_parser[0]))
+        else:
+            same = False
+            print('The records of {} and {} differ, first at:\n    {}\n    {}'.format(
+                parser[0], reference_parser[0], difference[0], difference[1]
+            ))
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+'''
+Generator of synthetic OSM files, to benchmark the tool on extracts of any size and shape. The files are
+reproducible: the same parameters and seed always give the same file.
+
+The shape of the extract is controlled by:
+    - the number of nodes, and the number of ways per node,
+    - the mean number of nodes of a way, and the fraction of closed ways,
+    - the fraction of nodes having tags, and the mean number of tags of a tagged element,
+    - the number of multipolygons, and their number of member ways. The outer ring of a multipolygon is split into
+      open member ways, so that they have to be assembled into a ring, and a closed inner way makes a hole.
+
+Usage: python generate_osm.py output.osm.bz2 [--nodes 100000] [--way-ratio 0.12] ...
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, bz2, math, random, argparse
+from xml.sax.saxutils import quoteattr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_tags import STANDARD_FIELDS_ARRAY
+
+TIMESTAMP = '2020-01-01T00:00:00Z'
+
+# The extent of the generated nodes, in decimal degrees.
+EXTENT = (-10.0, 40.0, 10.0, 55.0)
+
+# Values given to the tags, and keys that are not saved as fields.
+TAG_VALUES = ['yes', 'residential', 'primary', 'forest', 'water', 'house', 'school', 'park', 'parking', 'bus_stop']
+OTHER_KEYS = ['source', 'created_by', 'wikidata', 'opening_hours', 'website']
+
+DEFAULT_NODES = 100000
+DEFAULT_WAY_RATIO = 0.12
+DEFAULT_NODES_PER_WAY = 8
+DEFAULT_CLOSED_WAY_FRACTION = 0.3
+DEFAULT_TAGGED_NODE_FRACTION = 0.05
+DEFAULT_TAGS_PER_ELEMENT = 3
+DEFAULT_MULTIPOLYGONS = 1000
+DEFAULT_MEMBER_FANOUT = 4
+DEFAULT_SEED = 1
+
+
+class ShapeParameters(object):
+    """
+    The parameters of the shape of a synthetic extract.
+    """
+
+    def __init__(self, nodes=DEFAULT_NODES, way_ratio=DEFAULT_WAY_RATIO, nodes_per_way=DEFAULT_NODES_PER_WAY,
+                 closed_way_fraction=DEFAULT_CLOSED_WAY_FRACTION, tagged_node_fraction=DEFAULT_TAGGED_NODE_FRACTION,
+                 tags_per_element=DEFAULT_TAGS_PER_ELEMENT, multipolygons=DEFAULT_MULTIPOLYGONS,
+                 member_fanout=DEFAULT_MEMBER_FANOUT, seed=DEFAULT_SEED):
+        """
+        :param nodes: The number of nodes of the ways.
+        :param way_ratio: The number of ways per node.
+        :param nodes_per_way: The mean number of nodes of a way.
+        :param closed_way_fraction: The fraction of the ways that are closed.
+        :param tagged_node_fraction: The fraction of the nodes that have tags.
+        :param tags_per_element: The mean number of tags of the tagged elements.
+        :param multipolygons: The number of multipolygon relations.
+        :param member_fanout: The number of member ways of a multipolygon, at least 2: the open ways of the outer
+        ring, and a closed inner way.
+        :param seed: The seed of the random generator.
+        """
+        self.nodes = nodes
+        self.way_ratio = way_ratio
+        self.nodes_per_way = nodes_per_way
+        self.closed_way_fraction = closed_way_fraction
+        self.tagged_node_fraction = tagged_node_fraction
+        self.tags_per_element = tags_per_element
+        self.multipolygons = multipolygons
+        self.member_fanout = max(2, member_fanout)
+        self.seed = seed
+
+    def file_name(self):
+        """
+        :return: A file name identifying the parameters, to reuse the files generated with the same parameters.
+        """
+        return 'synthetic_n{}_w{}_l{}_c{}_t{}_k{}_m{}_f{}_s{}.osm.bz2'.format(
+            self.nodes, self.way_ratio, self.nodes_per_way, self.closed_way_fraction, self.tagged_node_fraction,
+            self.tags_per_element, self.multipolygons, self.member_fanout, self.seed
+        )
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class EncodedWriter(object):
+    """
+    Write text to a binary file as utf-8.
+    """
+
+    def __init__(self, binary_file):
+        self.binary_file = binary_file
+
+    def write(self, text):
+        self.binary_file.write(text.encode('utf-8'))
+
+    def close(self):
+        self.binary_file.close()
+
+
+def write_tags(output, generator, count):
+    keys = generator.sample(STANDARD_FIELDS_ARRAY + OTHER_KEYS, min(count, len(STANDARD_FIELDS_ARRAY)))
+    for key in keys:
+        output.write('  <tag k={} v={}/>\n'.format(quoteattr(key), quoteattr(generator.choice(TAG_VALUES))))
+
+
+def tag_count(generator, mean):
+    return max(1, int(generator.expovariate(1.0 / mean) + 0.5))
+
+
+def ring_coordinates(center, radius, count):
+    return [(center[0] + radius * math.cos(2 * math.pi * index / count),
+             center[1] + radius * math.sin(2 * math.pi * index / count)) for index in range(count)]
+
+
+def generate(path, shape):
+    """
+    Write a synthetic OSM file, compressed as bz2 if its extension is .bz2.
+    :param path: The output file.
+    :param shape: The ShapeParameters.
+    :return: A dictionary with the number of nodes, ways and relations written.
+    """
+    generator = random.Random(shape.seed)
+    xmin, ymin, xmax, ymax = EXTENT
+
+    # The multipolygons: the outer ring is split into open ways, the inner ring is a closed way.
+    outer_ways = shape.member_fanout - 1
+    outer_nodes = max(8, outer_ways * 4)
+    inner_nodes = 6
+    multipolygon_rings = []
+    for index in range(shape.multipolygons):
+        center = (generator.uniform(xmin + 1, xmax - 1), generator.uniform(ymin + 1, ymax - 1))
+        radius = generator.uniform(0.001, 0.05)
+        multipolygon_rings.append((
+            ring_coordinates(center, radius, outer_nodes),
+            ring_coordinates(center, radius / 3, inner_nodes)
+        ))
+
+    count_ways = int(shape.nodes * shape.way_ratio)
+    count_nodes = shape.nodes + shape.multipolygons * (outer_nodes + inner_nodes)
+    counts = {'nodes': count_nodes, 'ways': 0, 'relations': shape.multipolygons}
+
+    if path.lower().endswith('.bz2'):
+        output = EncodedWriter(bz2.BZ2File(path, 'w'))
+    else:
+        output = EncodedWriter(open(path, 'wb'))
+    try:
+        output.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="generate_osm.py">\n')
+
+        for node_id in range(1, shape.nodes + 1):
+            attributes = 'id="{}" lat="{:.7f}" lon="{:.7f}" timestamp="{}"'.format(
+                node_id, generator.uniform(ymin, ymax), generator.uniform(xmin, xmax), TIMESTAMP
+            )
+            if generator.random() < shape.tagged_node_fraction:
+                output.write(' <node {}>\n'.format(attributes))
+                write_tags(output, generator, tag_count(generator, shape.tags_per_element))
+                output.write(' </node>\n')
+            else:
+                output.write(' <node {}/>\n'.format(attributes))
+
+        node_id = shape.nodes
+        ring_node_ids = []
+        for outer_ring, inner_ring in multipolygon_rings:
+            ids = []
+            for ring in (outer_ring, inner_ring):
+                ring_ids = []
+                for lon, lat in ring:
+                    node_id += 1
+                    ring_ids.append(node_id)
+                    output.write(' <node id="{}" lat="{:.7f}" lon="{:.7f}" timestamp="{}"/>\n'.format(
+                        node_id, lat, lon, TIMESTAMP
+                    ))
+                ids.append(ring_ids)
+            ring_node_ids.append(ids)
+
+        for way_id in range(1, count_ways + 1):
+            length = max(2, min(shape.nodes, int(generator.expovariate(1.0 / shape.nodes_per_way) + 2)))
+            start = generator.randint(1, max(1, shape.nodes - length + 1))
+            refs = list(range(start, start + length))
+            if length >= 3 and generator.random() < shape.closed_way_fraction:
+                refs.append(refs[0])
+            output.write(' <way id="{}" timestamp="{}">\n'.format(way_id, TIMESTAMP))
+            for ref in refs:
+                output.write('  <nd ref="{}"/>\n'.format(ref))
+            if refs[0] != refs[-1] and generator.random() < 0.5:
+                output.write('  <tag k="highway" v="residential"/>\n')
+            write_tags(output, generator, tag_count(generator, shape.tags_per_element))
+            output.write(' </way>\n')
+
+        way_id = count_ways
+        members = []
+        for outer_ids, inner_ids in ring_node_ids:
+            relation_members = []
+            step = len(outer_ids) // outer_ways
+            for part in range(outer_ways):
+                start = part * step
+                end = (part + 1) * step if part < outer_ways - 1 else len(outer_ids)
+                refs = outer_ids[start:end + 1] if end < len(outer_ids) else outer_ids[start:] + [outer_ids[0]]
+                way_id += 1
+                output.write(' <way id="{}" timestamp="{}">\n'.format(way_id, TIMESTAMP))
+                for ref in refs:
+                    output.write('  <nd ref="{}"/>\n'.format(ref))
+                output.write(' </way>\n')
+                relation_members.append((way_id, 'outer'))
+            way_id += 1
+            output.write(' <way id="{}" timestamp="{}">\n'.format(way_id, TIMESTAMP))
+            for ref in inner_ids + [inner_ids[0]]:
+                output.write('  <nd ref="{}"/>\n'.format(ref))
+            output.write(' </way>\n')
+            relation_members.append((way_id, 'inner'))
+            members.append(relation_members)
+        counts['ways'] = way_id
+
+        for relation_id, relation_members in enumerate(members, 1):
+            output.write(' <relation id="{}" timestamp="{}">\n'.format(relation_id, TIMESTAMP))
+            for ref, role in relation_members:
+                output.write('  <member type="way" ref="{}" role="{}"/>\n'.format(ref, role))
+            output.write('  <tag k="type" v="multipolygon"/>\n')
+            write_tags(output, generator, tag_count(generator, shape.tags_per_element))
+            output.write(' </relation>\n')
+
+        output.write('</osm>\n')
+    finally:
+        output.close()
+    return counts
+
+
+def add_shape_arguments(parser):
+    """
+    Add the shape parameters to a command line parser.
+    :param parser: The argparse parser.
+    """
+    parser.add_argument('--way-ratio', type=float, default=DEFAULT_WAY_RATIO)
+    parser.add_argument('--nodes-per-way', type=int, default=DEFAULT_NODES_PER_WAY)
+    parser.add_argument('--closed-way-fraction', type=float, default=DEFAULT_CLOSED_WAY_FRACTION)
+    parser.add_argument('--tagged-node-fraction', type=float, default=DEFAULT_TAGGED_NODE_FRACTION)
+    parser.add_argument('--tags-per-element', type=int, default=DEFAULT_TAGS_PER_ELEMENT)
+    parser.add_argument('--multipolygons', type=int, default=DEFAULT_MULTIPOLYGONS)
+    parser.add_argument('--member-fanout', type=int, default=DEFAULT_MEMBER_FANOUT)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+
+
+def shape_from_arguments(arguments, nodes):
+    """
+    :param arguments: The arguments parsed by a parser with the shape arguments.
+    :param nodes: The number of nodes.
+    :return: The ShapeParameters.
+    """
+    return ShapeParameters(
+        nodes=nodes,
+        way_ratio=arguments.way_ratio,
+        nodes_per_way=arguments.nodes_per_way,
+        closed_way_fraction=arguments.closed_way_fraction,
+        tagged_node_fraction=arguments.tagged_node_fraction,
+        tags_per_element=arguments.tags_per_element,
+        multipolygons=arguments.multipolygons,
+        member_fanout=arguments.member_fanout,
+        seed=arguments.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic OSM file.')
+    parser.add_argument('output', help='The output file, .osm or .osm.bz2.')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES)
+    add_shape_arguments(parser)
+    arguments = parser.parse_args()
+    counts = generate(arguments.output, shape_from_arguments(arguments, arguments.nodes))
+    print('Wrote {nodes} nodes, {ways} ways and {relations} relations'.format(**counts))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+'''
+Converter of OSM XML files to the PBF format, so that the PBF reader of osm_pbf can be benchmarked on the same extract
+as the xml parsers. The elements are written in blocks of dense nodes, ways and relations, as the OSM tools write
+them, with the default granularity: the coordinates keep their 7 decimals and the timestamps their seconds. Only the
+attributes read by the tool are written: identifiers, coordinates, timestamps, tags, node references and members.
+
+Usage: python osm_to_pbf.py input.osm.bz2 output.osm.pbf [--block-size 8000]
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, bz2, time, zlib, struct, calendar, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_2_geodatabase import iter_xml_elements
+from osm_pbf import BLOB_HEADER_TYPE, BLOB_DATA_TYPE, SUPPORTED_FEATURES, MEMBER_TYPES, TIMESTAMP_FORMAT, \
+    WIRE_VARINT, WIRE_LENGTH_DELIMITED
+
+DEFAULT_BLOCK_SIZE = 8000
+
+# The field of a PrimitiveGroup holding each kind of element.
+GROUP_FIELDS = {'node': 2, 'way': 3, 'relation': 4}
+
+# The timestamps already converted to seconds.
+TIMESTAMP_SECONDS = {}
+
+
+def varint(value):
+    """
+    :param value: An integer. Negative integers are encoded as 64 bits two's complement.
+    :return: The varint encoding of the integer.
+    """
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def field(number, value):
+    """
+    :param number: The field number.
+    :param value: An integer, encoded as a varint, or bytes, encoded as a length delimited field.
+    :return: The encoded field.
+    """
+    if isinstance(value, bytes):
+        return varint(number << 3 | WIRE_LENGTH_DELIMITED) + varint(len(value)) + value
+    return varint(number << 3 | WIRE_VARINT) + varint(value)
+
+
+def packed(values):
+    return b''.join(varint(value) for value in values)
+
+
+def packed_deltas(values):
+    """
+    :return: The values delta coded, as packed zigzag varints (packed sint64 of the format).
+    """
+    previous = 0
+    encoded = []
+    for value in values:
+        encoded.append(varint(zigzag(value - previous)))
+        previous = value
+    return b''.join(encoded)
+
+
+def fixed_point(coordinate):
+    """
+    :return: The coordinate in units of 100 nanodegrees, the unit of the default granularity.
+    """
+    return int(round(float(coordinate) * 10000000))
+
+
+def seconds(timestamp):
+    """
+    :return: The timestamp in seconds since the epoch. The timestamps of an extract are often the same, they are
+    cached.
+    """
+    value = TIMESTAMP_SECONDS.get(timestamp)
+    if value is None:
+        value = TIMESTAMP_SECONDS[timestamp] = calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+    return value
+
+
+def file_block(blob_type, message):
+    """
+    :param blob_type: BLOB_HEADER_TYPE or BLOB_DATA_TYPE.
+    :param message: The encoded HeaderBlock or PrimitiveBlock.
+    :return: The BlobHeader and the zlib compressed Blob, preceded by the size of the BlobHeader.
+    """
+    blob = field(2, len(message)) + field(3, zlib.compress(message))
+    header = field(1, blob_type.encode('utf-8')) + field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+class StringTable(object):
+    """
+    The strings of a PrimitiveBlock, referenced by their index. The index 0 is the empty string, used as a delimiter.
+    """
+
+    def __init__(self):
+        self.strings = [u'']
+        self.indexes = {u'': 0}
+
+    def index(self, string):
+        index = self.indexes.get(string)
+        if index is None:
+            index = self.indexes[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def encode(self):
+        return b''.join(field(1, string.encode('utf-8')) for string in self.strings)
+
+
+def encode_dense_nodes(records, strings):
+    keys_vals = []
+    for record in records:
+        for key, value in record[5].items():
+            keys_vals.append(strings.index(key))
+            keys_vals.append(strings.index(value))
+        keys_vals.append(0)
+    dense_nodes = [
+        field(1, packed_deltas([int(record[1]) for record in records])),
+    ]
+    if all(record[4] is not None for record in records):
+        dense_nodes.append(field(5, field(2, packed_deltas([seconds(record[4]) for record in records]))))
+    dense_nodes.append(field(8, packed_deltas([fixed_point(record[3]) for record in records])))
+    dense_nodes.append(field(9, packed_deltas([fixed_point(record[2]) for record in records])))
+    if len(keys_vals) > len(records):
+        dense_nodes.append(field(10, packed(keys_vals)))
+    return field(2, b''.join(dense_nodes))
+
+
+def encode_element(record, strings):
+    """
+    Encode a way or a relation, with its identifier, tags, timestamp and its node references or members.
+    """
+    tags = record[3]
+    message = [
+        field(1, int(record[1])),
+        field(2, packed([strings.index(key) for key in tags])),
+        field(3, packed([strings.index(tags[key]) for key in tags])),
+    ]
+    if record[2] is not None:
+        message.append(field(4, field(2, seconds(record[2]))))
+    if record[0] == 'way':
+        message.append(field(8, packed_deltas([int(ref) for ref in record[4]])))
+    else:
+        members = record[4]
+        message.append(field(8, packed([strings.index(role) for member_type, ref, role in members])))
+        message.append(field(9, packed_deltas([int(ref) for member_type, ref, role in members])))
+        message.append(field(10, packed([MEMBER_TYPES.index(member_type) for member_type, ref, role in members])))
+    return field(GROUP_FIELDS[record[0]], b''.join(message))
+
+
+def encode_primitive_block(records):
+    """
+    Encode a PrimitiveBlock. Consecutive elements of the same kind are written in the same PrimitiveGroup.
+    :param records: Element records, as yielded by iter_xml_elements.
+    :return: The encoded PrimitiveBlock.
+    """
+    strings = StringTable()
+    groups = []
+    start = 0
+    while start < len(records):
+        end = start
+        while end < len(records) and records[end][0] == records[start][0]:
+            end += 1
+        if records[start][0] == 'node':
+            groups.append(encode_dense_nodes(records[start:end], strings))
+        else:
+            groups.append(b''.join(encode_element(record, strings) for record in records[start:end]))
+        start = end
+    return field(1, strings.encode()) + b''.join(field(2, group) for group in groups)
+
+
+def write_pbf(records, pbf_file, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Write element records to a PBF file.
+    :param records: An iterable of element records, as yielded by iter_xml_elements.
+    :param pbf_file: A file object opened in binary mode.
+    :param block_size: The number of elements of a PrimitiveBlock.
+    :return: The number of elements written.
+    """
+    header_block = b''.join(field(4, feature.encode('utf-8')) for feature in sorted(SUPPORTED_FEATURES))
+    pbf_file.write(file_block(BLOB_HEADER_TYPE, header_block))
+    count = 0
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) == block_size:
+            pbf_file.write(file_block(BLOB_DATA_TYPE, encode_primitive_block(block)))
+            count += len(block)
+            block = []
+    if len(block) > 0:
+        pbf_file.write(file_block(BLOB_DATA_TYPE, encode_primitive_block(block)))
+        count += len(block)
+    return count
+
+
+def convert(osm_file, pbf_path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Convert an OSM XML file to PBF.
+    :param osm_file: An OSM XML file, compressed as bz2 or not.
+    :param pbf_path: The PBF file written.
+    :param block_size: The number of elements of a PrimitiveBlock.
+    :return: The number of elements written.
+    """
+    xml_file = bz2.BZ2File(osm_file, 'rb') if osm_file.endswith('.bz2') else open(osm_file, 'rb')
+    try:
+        with open(pbf_path, 'wb') as pbf_file:
+            return write_pbf(iter_xml_elements(xml_file), pbf_file, block_size)
+    finally:
+        xml_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert an OSM XML file to the PBF format.')
+    parser.add_argument('input', help='An OSM XML file, compressed as bz2 or not.')
+    parser.add_argument('output', help='The PBF file written.')
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help='The number of elements of a block.')
+    arguments = parser.parse_args()
+    count = convert(arguments.input, arguments.output, arguments.block_size)
+    print('Wrote {} elements to {}'.format(count, arguments.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,56 +5,64 @@ Tested using ArcMap 10.5
 
 Summary:
 
-    This geoprocessing tool reads an Open Street Map file (.osm) compressed in the the .bz2 format.
-    It writes the output to a file geodatabase. Note that when parsing the relations, only multipolygons will be built
-    and added to the multipolygon feature class. Ways with a tag highway that is associated with a value will be
-    considered as lines, even lollipops. This tool is written for ArcMap.
+    This geoprocessing tool reads an Open Street Map file (.osm) compressed in the the .bz2 format, or an Open Street
+    Map PBF file (.osm.pbf). It writes the output to a file geodatabase, a GeoPackage or GeoParquet files (see
+    osm_sinks). Note that when parsing the relations, only
+    multipolygons, boundaries and routes will be built: the multipolygons and boundaries are added to the polygon
+    feature class, and the routes to the route feature class. Ways with a tag highway that is associated
+    with a value will be considered as lines, even lollipops. This tool is written for ArcMap.
 
     This tool parses the osm content using the built-in library xml.etree.ElementTree if lxml is not installed.
     Otherwise the lxml library will be used. Using this latter library makes a huge difference in performance
     (divides the execution time by 2). The documentation about the lxml project can be found here: http://lxml.de/
+    With the xml parser option SCANNER, the content is read by the scanner of osm_xml_scanner instead, which does not
+    build xml elements.
 
 Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
 '''
 
-import os, time, bz2, tempfile, time, csv, itertools, datetime, arcpy, numpy
+import os, sys, time, bz2, tempfile, time, struct, datetime, itertools, numpy
+import osm_pbf, osm_parallel, osm_pipeline, osm_metrics, osm_xml_scanner
+from osm_messages import add_message, add_warning, add_error
+from osm_sinks import FORMAT_FILE_GEODATABASE, FORMAT_GEOPACKAGE, FORMAT_GEOPARQUET, FORMAT_NULL, GEOMETRY_POINT, \
+    GEOMETRY_POLYLINE, GEOMETRY_POLYGON, GEOMETRY_FIELD, FIELD_STRING, FIELD_DOUBLE, WGS84, TAG_FIELD_LENGTH, Field, \
+    create_sink
+from osm_tags import STANDARD_FIELDS, STANDARD_FIELDS_ARRAY, OTHER_TAGS_FIELD, TagMapper, MeasuringTagMapper, \
+    TagStatistics, TagFieldLayout, TagFilter, encode_other_tags
+from osm_tag_store import TAG_STORE_TABLES, TagStoreWriter, create_tag_store_tables, tag_store_field_names
+from osm_intermediate import COORDINATE_PRECISION, MISSING_COORDINATE, NODE_DTYPE, REF_DTYPE, COORDINATES_DTYPE, \
+    WAY_NODE_REF_DTYPE, LOCATED_REF_DTYPE, FLAG_HIGHWAY, NodeWriter, ListWriter, to_fixed_point, to_degrees, \
+    to_coordinates, contains_identifiers, iter_record_blocks, iter_list_blocks, iter_list_values, \
+    merge_sorted_record_files, external_sort_records, remove_list_file, RowWriter, RowStore, sort_list_index, \
+    list_file_paths, iter_sized_record_blocks, count_records, ROW_DTYPE, ROW_SEPARATOR, decode_row
+from osm_checkpoint import Manifest, file_fingerprint, file_size
+from osm_spatial_order import SPATIAL_ORDER_NONE, SPATIAL_ORDER_HILBERT, SPATIAL_ORDER_QUADKEY, spatial_keys, \
+    coordinate_list_keys, order_list_file
+from osm_state import FLAG_TAGGED, UNMAINTAINED_BOUNDARY, UNMAINTAINED_ROUTE, UpdateState, update_state_folder
+from osm_relations import MEMBER_WAY, MEMBER_RELATION, RELATION_ROUTE, RELATION_BOUNDARY, RELATION_OTHER, \
+    RelationMemberWriter, RelationMemberIndex, relation_kind, relation_member_index_paths, \
+    remove_relation_member_index
 
 try:
     from lxml import etree
 except:
     import xml.etree.ElementTree as etree
 
-arcpy.env.overwriteOutput = True
-
-STANDARD_FIELDS = set((
-    'highway', 'name', 'name_en', 'ref', 'lanes', 'surface', 'oneway', 'maxspeed', 'tracktype', 'access', 'service',
-    'foot', 'bicycle', 'bridge', 'barrier', 'lit', 'layer', 'building', 'building_levels', 'building_height',
-    'addr_housenumber', 'addr_street', 'addr_city', 'addr_postcode', 'addr_country', 'addr_place', 'addr_state',
-    'natural', 'landuse', 'waterway', 'power', 'amenity', 'place', 'height', 'note', 'railway', 'public_transport',
-    'operator', 'guage', 'width', 'tunnel', 'leisure', 'is_in', 'ele', 'shop', 'man_made', 'parking', 'boundary',
-    'aerialway', 'aeroway', 'craft', 'emergency', 'geological', 'historic', 'military', 'office', 'sport', 'tourism',
-    'traffic_calming', 'entrance', 'crossing'
-))
-
-STANDARD_FIELDS_ARRAY = list(STANDARD_FIELDS)
-
-ID_FIELD = arcpy.Field()
-ID_FIELD.name = 'id'
-ID_FIELD.type = 'String'
-ID_FIELD.length = '30'
-
-NODE_LON_FIELD = arcpy.Field()
-NODE_LON_FIELD.name = 'lon'
-NODE_LON_FIELD.type = 'Double'
+# arcpy is only required to write a file geodatabase, to clip with a feature class, and to run as a geoprocessing tool.
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
 
-NODE_LAT_FIELD = arcpy.Field()
-NODE_LAT_FIELD.name = 'lat'
-NODE_LAT_FIELD.type = 'Double'
+ID_FIELD = Field('id', FIELD_STRING, 30)
+NODE_LON_FIELD = Field('lon', FIELD_DOUBLE)
+NODE_LAT_FIELD = Field('lat', FIELD_DOUBLE)
+TIMESTAMP_FIELD = Field('timestamp', FIELD_STRING, 20)
 
-TIMESTAMP_FIELD = arcpy.Field()
-TIMESTAMP_FIELD.name = 'timestamp'
-TIMESTAMP_FIELD.type = 'String'
-TIMESTAMP_FIELD.length = 20
+# The polygon layer holds both ways and multipolygon relations, whose identifiers may collide.
+OSM_TYPE_FIELD = Field('osm_type', FIELD_STRING, 8)
+OSM_TYPE_WAY = 'way'
+OSM_TYPE_RELATION = 'relation'
 
 NODE_SAVED_ATTRIBUTES = [
     ID_FIELD,
@@ -68,62 +76,120 @@ WAY_SAVED_ATTRIBUTES = [
     TIMESTAMP_FIELD
 ]
 
-COORDINATES_SYSTEM = arcpy.SpatialReference(4326)
+POLYGON_SAVED_ATTRIBUTES = WAY_SAVED_ATTRIBUTES + [OSM_TYPE_FIELD]
 
 BOOLEAN_YES = 'YES'
 BOOLEAN_NO = 'NO'
 
-IDENTIFIER_DELIMITER = '|'
-CSV_DELIMITER = ','
-CSV_NODES = 'nodes.csv'
-CSV_WAY_NODES = 'way_nodes.csv'
 CSV_RELATIONS = 'relations_member.csv'
 
+# The output layers.
+NODES_LAYER = 'nodes'
+WAY_LINES_LAYER = 'way_lines'
+WAY_POLYGONS_LAYER = 'way_polygons'
+ROUTE_LINES_LAYER = 'route_lines'
+
+# The binary intermediate files, described in osm_intermediate. Nodes are record files, the other ones are list files
+# made of an index file (.idx) and a values file (.dat).
+NODES_FILE = 'nodes.bin'
+WAY_NODES_FILE = 'way_nodes'
+WAY_ROWS_FILE = 'way_rows'
+MULTIPOLYGON_ROWS_FILE = 'multipolygon_rows'
+BUILT_WAYS_FILE = 'built_ways'
+BUILT_AREAS_FILE = 'built_areas'
+REJECTED_WAY_NODES_FILE = 'rejected_way_nodes'
+OUTSIDE_NODES_FILE = 'outside_nodes.bin'
+WAY_NODE_REFS_FILE = 'way_node_refs.bin'
+LOCATED_WAY_NODES_FILE = 'located_way_nodes.bin'
+RELATION_MEMBERS_FILE = 'relation_members'
+NODE_ROWS_FILE = 'node_rows'
+
+# The parsers of OSM XML files: lxml or ElementTree through the iterparse interface, or the scanner of osm_xml_scanner
+# yielding the element records without building xml elements.
+XML_PARSER_ETREE = 'ETREE'
+XML_PARSER_SCANNER = 'SCANNER'
+
+# The way / node join methods. The chunked method loads a chunk of nodes in memory and locates the node references of
+# the ways it can resolve, read from a file sorted by node identifier. The sort merge method sorts the way node
+# references by node identifier and merges them with the nodes file, which costs a constant number of sequential
+# passes whatever the size of the extract.
+JOIN_CHUNKED = 'CHUNKED'
+JOIN_SORT_MERGE = 'SORT_MERGE'
+
+# The node location store join methods. Node locations are stored during the import, then each way is resolved in a
+# single pass over the way_nodes file. The dense store is addressed directly by node identifier, the sparse store is a
+# sorted array of identifiers better suited to small regional extracts.
+JOIN_DENSE_STORE = 'DENSE_STORE'
+JOIN_SPARSE_STORE = 'SPARSE_STORE'
+NODE_LOCATIONS_FILE = 'node_locations.dat'
+
+# The sizing of the chunks of nodes of the chunked join from a memory budget. The memory of a node of a chunk is
+# estimated from a sample of the nodes file. The pending node references are located by blocks using about
+# PENDING_VALUE_MEMORY bytes per reference, and take at most PENDING_MEMORY_SHARE of the budget.
+NODE_CHUNK_SAMPLE_SIZE = 100000
+MIN_NODES_CHUNK_SIZE = 10000
+PENDING_VALUE_MEMORY = 64
+PENDING_MEMORY_SHARE = 0.25
+MAX_PENDING_BLOCK_SIZE = 1000000
+
+# The storage of the tags that are not saved in a field of their own: in the tables of the tag store (see
+# osm_tag_store), in the other_tags field of the layers, or both.
+OTHER_TAGS_NONE = 'NONE'
+OTHER_TAGS_TABLE = 'TABLE'
+OTHER_TAGS_COLUMN = 'COLUMN'
+OTHER_TAGS_BOTH = 'BOTH'
+
+# The stages of a run, in order. Each completed stage is recorded in the manifest of the processing folder, so that a
+# failed run resumes from the first stage not completed.
+STAGE_IMPORT = 'import'
+STAGE_PREPARE = 'prepare'
+STAGE_JOIN = 'join'
+STAGE_LINES = 'lines'
+STAGE_POLYGONS = 'polygons'
+STAGE_MULTIPOLYGONS = 'multipolygons'
+STAGE_ROUTES = 'routes'
+STAGES = [STAGE_IMPORT, STAGE_PREPARE, STAGE_JOIN, STAGE_LINES, STAGE_POLYGONS, STAGE_MULTIPOLYGONS, STAGE_ROUTES]
+
+# The number of rows or features buffered by the batched writers.
+DEFAULT_BATCH_SIZE = 10000
+
+# Well-known binary geometry types.
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON = 6
+
+# The roles of the members of the routes that are not part of their path, such as the platforms of a bus route.
+ROUTE_EXCLUDED_ROLE_PREFIXES = ('platform', 'stop')
+
+# The roles of the members of the boundaries that are part of their area. The other members, such as the subareas
+# or the administrative centre, are left out.
+BOUNDARY_AREA_ROLES = ('outer', 'inner', '')
+
 
 def timeit(method):
     """
-    Timing function. Used a decorator to measure the time taken by each function.
+    Timing function. Used a decorator to measure the time taken by each function, recorded as a stage of the active
+    run report (see osm_metrics).
     :param method:
     :return:
     """
     def timed(*args, **kw):
-        ts = datetime.datetime.now().replace(microsecond=0)
-        result = method(*args, **kw)
-        te = datetime.datetime.now().replace(microsecond=0)
-        arcpy.AddMessage('Method {} executed in {} (hours:minutes:seconds)'.format(method.__name__, te - ts))
+        with osm_metrics.measure(method.__name__) as stage:
+            result = method(*args, **kw)
+        message = 'Method {} executed in {} (hours:minutes:seconds), CPU {:.1f} seconds'.format(
+            method.__name__,
+            datetime.timedelta(seconds=round(stage.wall_time, 3)),
+            stage.cpu_time
+        )
+        if stage.elements is not None:
+            message += ', {} elements, {:.0f} elements per second'.format(stage.elements, stage.rate())
+        add_message(message)
         return result
 
     return timed
 
 
-def get_fields_numpy_definition(field_list):
-    """
-    Make a numpy array that can be used to add attribute to a table or feature class.
-    All fields are created as text fields with a length of 255.
-    :param field_list: An iterable collection of field names. Field names must occur once.
-    :return: the numpy array.
-    """
-    standard_fields_array_tuple = [('_ID', numpy.int)]
-    for f in field_list:
-        standard_fields_array_tuple.append((f, '|S255'))
-
-    return numpy.array(
-        [],
-        numpy.dtype(standard_fields_array_tuple)
-    )
-
-
-def create_output_workspace(workspace):
-    """
-    Create an output file geodatabase if it does not already exist.
-    :param workspace: The workspace to create.
-    :return:
-    """
-    split_path = os.path.split(workspace)
-    if not arcpy.Exists(workspace):
-        arcpy.CreateFileGDB_management(split_path[0], split_path[1])
-
-
 ###################################
 # PARSING FUNCTIONS FOR NODES, WAYS, AND RELATIONSHIPS
 ###################################
@@ -155,693 +221,3339 @@ def parse_relation_children(elem):
                 elem_type = child.attrib['v']
 
         elif child.tag == 'member':
-            # members.append(child)
+            members.append((child.attrib['type'], child.attrib['ref'], child.attrib.get('role', '')))
             if child.attrib['type'] == 'way':
                 way_members.append(child.attrib['ref'])
 
         child.clear()
     return tag_dict, members, elem_type, way_members
 
+
+def iter_xml_elements(osm_file, etree_module=None):
+    """
+    Parse an OSM XML stream and yield its element records:
+        ('node', id, lon, lat, timestamp, tags)
+        ('way', id, timestamp, tags, node_refs)
+        ('relation', id, timestamp, tags, members)
+    The xml elements are released once their record has been consumed, to keep the memory usage bounded.
+    :param osm_file: A file object holding the xml content.
+    :param etree_module: The module providing iterparse. lxml if it is installed, ElementTree otherwise, by default.
+    :return: A generator of element records.
+    """
+    parent = None
+    for event, elem in (etree_module or etree).iterparse(osm_file, events=('start', 'end')):
+        if event == 'start':
+            if parent is None and elem.tag == 'osm':
+                parent = elem
+        else:
+            if elem.tag == 'node':
+                attrib = elem.attrib
+                tag_dict = parse_node_children(elem) if len(elem) > 0 else {}
+                yield 'node', attrib['id'], attrib['lon'], attrib['lat'], attrib.get('timestamp'), tag_dict
+                elem.clear()
+                parent.remove(elem)
+
+            elif elem.tag == 'way':
+                tag_dict, nodes = parse_way_children(elem)
+                yield 'way', elem.attrib['id'], elem.attrib.get('timestamp'), tag_dict, nodes
+                elem.clear()
+                parent.remove(elem)
+
+            elif elem.tag == 'relation':
+                tag_dict, members, elem_type, way_members = parse_relation_children(elem)
+                yield 'relation', elem.attrib['id'], elem.attrib.get('timestamp'), tag_dict, members
+                elem.clear()
+                parent.remove(elem)
+
+
+def iter_xml_file_elements(xml_file, xml_parser=XML_PARSER_ETREE):
+    """
+    Parse an OSM XML stream with the selected parser.
+    :param xml_file: A file object holding the xml content.
+    :param xml_parser: XML_PARSER_ETREE or XML_PARSER_SCANNER.
+    :return: A generator of element records, as described in iter_xml_elements.
+    """
+    if xml_parser == XML_PARSER_SCANNER:
+        return osm_xml_scanner.iter_scanned_elements(xml_file)
+    return iter_xml_elements(xml_file)
+
+
+def iter_osm_elements(osm_file, workers=1, xml_parser=XML_PARSER_ETREE):
+    """
+    Read an OSM file and yield its element records. The format is derived from the file extension: PBF files
+    (.osm.pbf), xml files compressed as bz2 (.osm.bz2) or plain xml files (.osm).
+    :param osm_file: The path to the OSM file.
+    :param workers: The number of worker processes decoding the file. With more than one worker, the blobs of PBF
+    files are decompressed and parsed in parallel, and the streams of multistream bz2 files are decompressed in
+    parallel. The records are yielded in the order of the file in all cases.
+    :param xml_parser: The parser of the xml files: XML_PARSER_ETREE or XML_PARSER_SCANNER.
+    :return: A generator of element records, as described in iter_xml_elements. The records of PBF files also include
+    the node blocks of osm_pbf, and their node references are numpy arrays.
+    """
+    if osm_file.lower().endswith('.pbf'):
+        if workers > 1:
+            add_message('Decoding the PBF blobs with {} workers'.format(workers))
+            for element in osm_parallel.iter_pbf_elements(osm_file, workers):
+                yield element
+        else:
+            with open(osm_file, 'rb') as pbf_file:
+                for element in osm_pbf.iter_pbf_elements(pbf_file):
+                    yield element
+    elif osm_file.lower().endswith('.bz2'):
+        if workers > 1 and osm_parallel.is_multistream(osm_file):
+            add_message('Decompressing the bz2 streams with {} workers'.format(workers))
+            xml_file = osm_parallel.ChunkedReader(osm_parallel.iter_bz2_chunks(osm_file, workers))
+            for element in iter_xml_file_elements(xml_file, xml_parser):
+                yield element
+        else:
+            if workers > 1:
+                add_warning('{} is not a multistream bz2 file. It will be decompressed sequentially.'.format(
+                    osm_file
+                ))
+            bz2_file = bz2.BZ2File(osm_file, 'r')
+            try:
+                for element in iter_xml_file_elements(bz2_file, xml_parser):
+                    yield element
+            finally:
+                bz2_file.close()
+    else:
+        with open(osm_file, 'rb') as xml_file:
+            for element in iter_xml_file_elements(xml_file, xml_parser):
+                yield element
+
 ###################################
-# FUNCTIONS TO CREATE FEATURE CLASS
+# NODE LOCATION STORES
 ###################################
+class DenseNodeLocationStore(object):
+    """
+    Node locations stored in a memory mapped file of fixed point int32 (lon, lat) pairs, addressed directly by node
+    identifier (8 bytes per node). The latitude is stored shifted by LAT_OFFSET so that the zeros of the unwritten
+    parts of the file mean "no node". The file grows as larger identifiers are added. Negative identifiers, as found
+    in files edited but not uploaded, cannot be addressed: adding them raises a ValueError, and they are never found.
+    """
+    LAT_OFFSET = 90 * COORDINATE_PRECISION + 1
+
+    def __init__(self, path, capacity=2 ** 24, buffer_size=500000, overwrite=True):
+        """
+        :param path: The file backing the store.
+        :param capacity: The initial number of node identifiers the file can address.
+        :param buffer_size: The number of nodes buffered before being written to the file.
+        :param overwrite: If True the file is overwritten, otherwise the locations it already stores are kept.
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self._ids = []
+        self._lons = []
+        self._lats = []
+        self._capacity = 0
+        self._locations = None
+        if overwrite or not os.path.isfile(path):
+            open(path, 'wb').close()
+        else:
+            capacity = max(capacity, os.path.getsize(path) // 8)
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        if self._locations is not None:
+            self._locations.flush()
+            del self._locations
+        with open(self.path, 'r+b') as store_file:
+            store_file.truncate(capacity * 8)
+        self._capacity = capacity
+        self._locations = numpy.memmap(self.path, dtype=numpy.int32, mode='r+', shape=(capacity, 2))
+
+    def add(self, node_id, lon, lat):
+        """
+        Add a node location. Locations are buffered and written in bulk.
+        :param node_id: The node identifier.
+        :param lon: The longitude, as a number or as text.
+        :param lat: The latitude, as a number or as text.
+        """
+        self._ids.append(int(node_id))
+        self._lons.append(lon)
+        self._lats.append(lat)
+        if len(self._ids) >= self.buffer_size:
+            self.flush()
+
+    def _reserve(self, ids):
+        min_id = int(ids.min())
+        if min_id < 0:
+            raise ValueError(
+                'The dense node store cannot store negative node identifiers such as {}, use the join method {} '
+                'instead.'.format(min_id, JOIN_SPARSE_STORE)
+            )
+        max_id = int(ids.max())
+        if max_id >= self._capacity:
+            capacity = self._capacity
+            while capacity <= max_id:
+                capacity *= 2
+            self._grow(capacity)
+
+    def flush(self):
+        """
+        Write the buffered locations to the file.
+        """
+        if len(self._ids) == 0:
+            return
+        ids = numpy.array(self._ids, dtype=numpy.int64)
+        lons, lats = self._lons, self._lats
+        self._ids = []
+        self._lons = []
+        self._lats = []
+        self._reserve(ids)
+        self._locations[ids, 0] = to_fixed_point(lons)
+        self._locations[ids, 1] = to_fixed_point(lats) + self.LAT_OFFSET
+
+    def write(self, nodes):
+        """
+        Write a block of nodes directly to the file.
+        :param nodes: A numpy array of NODE_DTYPE.
+        """
+        self.flush()
+        if len(nodes) == 0:
+            return
+        self._reserve(nodes['id'])
+        self._locations[nodes['id'], 0] = nodes['lon']
+        self._locations[nodes['id'], 1] = nodes['lat'] + self.LAT_OFFSET
+
+    def remove(self, node_ids):
+        """
+        Forget the locations of a set of nodes.
+        :param node_ids: A numpy array of int64 node identifiers.
+        """
+        self.flush()
+        node_ids = node_ids[(node_ids >= 0) & (node_ids < self._capacity)]
+        self._locations[node_ids] = 0
+
+    def lookup(self, node_ids):
+        """
+        Look up the locations of a set of nodes.
+        :param node_ids: A numpy array of int64 node identifiers.
+        :return: A tuple with a numpy array of fixed point (lon, lat) pairs and a numpy array of booleans telling
+        which nodes have been found.
+        """
+        in_range = (node_ids >= 0) & (node_ids < self._capacity)
+        coordinates = numpy.zeros((len(node_ids), 2), dtype=numpy.int32)
+        coordinates[in_range] = self._locations[node_ids[in_range]]
+        found = coordinates[:, 1] != 0
+        coordinates[:, 1] -= self.LAT_OFFSET
+        return coordinates, found
+
+    def close(self, remove=True):
+        """
+        Release the memory mapped file.
+        :param remove: If True, the file is deleted.
+        """
+        del self._locations
+        self._locations = None
+        if remove and os.path.isfile(self.path):
+            os.remove(self.path)
+
+
+class SparseNodeLocationStore(object):
+    """
+    Node locations stored as a sorted array of int64 identifiers and a matching array of fixed point int32
+    (lon, lat) pairs (16 bytes per node), queried with binary searches. Better suited to small regional extracts, for
+    which the dense store would mostly address missing identifiers.
+    """
 
+    def __init__(self, buffer_size=500000):
+        """
+        :param buffer_size: The number of nodes buffered before being converted to numpy arrays.
+        """
+        self.buffer_size = buffer_size
+        self._ids = []
+        self._lons = []
+        self._lats = []
+        self._id_chunks = []
+        self._coordinate_chunks = []
+        self._sorted_ids = None
+        self._sorted_coordinates = None
+
+    def add(self, node_id, lon, lat):
+        """
+        Add a node location. Locations are buffered and converted in bulk.
+        :param node_id: The node identifier.
+        :param lon: The longitude, as a number or as text.
+        :param lat: The latitude, as a number or as text.
+        """
+        self._ids.append(int(node_id))
+        self._lons.append(lon)
+        self._lats.append(lat)
+        if len(self._ids) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Convert the buffered locations to numpy arrays.
+        """
+        if len(self._ids) == 0:
+            return
+        self._id_chunks.append(numpy.array(self._ids, dtype=numpy.int64))
+        self._coordinate_chunks.append(numpy.column_stack((to_fixed_point(self._lons), to_fixed_point(self._lats))))
+        self._ids = []
+        self._lons = []
+        self._lats = []
+        self._sorted_ids = None
+
+    def write(self, nodes):
+        """
+        Add a block of node locations.
+        :param nodes: A numpy array of NODE_DTYPE.
+        """
+        self.flush()
+        if len(nodes) == 0:
+            return
+        self._id_chunks.append(nodes['id'].copy())
+        self._coordinate_chunks.append(numpy.column_stack((nodes['lon'], nodes['lat'])))
+        self._sorted_ids = None
+
+    def _finalize(self):
+        self.flush()
+        if len(self._id_chunks) == 0:
+            self._sorted_ids = numpy.zeros(0, dtype=numpy.int64)
+            self._sorted_coordinates = numpy.zeros((0, 2), dtype=numpy.int32)
+            return
+        ids = numpy.concatenate(self._id_chunks)
+        coordinates = numpy.concatenate(self._coordinate_chunks)
+        if len(ids) > 1 and not numpy.all(ids[1:] > ids[:-1]):
+            order = numpy.argsort(ids, kind='mergesort')
+            ids = ids[order]
+            coordinates = coordinates[order]
+        self._id_chunks = [ids]
+        self._coordinate_chunks = [coordinates]
+        self._sorted_ids = ids
+        self._sorted_coordinates = coordinates
+
+    def lookup(self, node_ids):
+        """
+        Look up the locations of a set of nodes.
+        :param node_ids: A numpy array of int64 node identifiers.
+        :return: A tuple with a numpy array of fixed point (lon, lat) pairs and a numpy array of booleans telling
+        which nodes have been found.
+        """
+        if self._sorted_ids is None:
+            self._finalize()
+        if len(self._sorted_ids) == 0:
+            return numpy.zeros((len(node_ids), 2), dtype=numpy.int32), numpy.zeros(len(node_ids), dtype=bool)
+        positions = numpy.searchsorted(self._sorted_ids, node_ids)
+        positions[positions == len(self._sorted_ids)] = 0
+        found = self._sorted_ids[positions] == node_ids
+        return self._sorted_coordinates[positions], found
+
+    def close(self, remove=True):
+        """
+        Release the arrays.
+        :param remove: Unused, the store does not have a file.
+        """
+        self._id_chunks = []
+        self._coordinate_chunks = []
+        self._sorted_ids = None
+        self._sorted_coordinates = None
 
-@timeit
-def create_node_feature_class(workspace, feature_class_name, standard_fields):
-    """
-    Create the node feature class table. The table is created with a set of valid tags.
-    :param workspace: The geodatabase where the feature class will be created.
-    :param feature_class_name: The name of the output feature class.
-    :param standard_fields: The numpy array representing the OSM attribute fields
-    :return: The full path to the feature class.
-    """
-    node_feature_class = os.path.join(workspace, feature_class_name)
-    arcpy.CreateFeatureclass_management(
-        workspace,
-        feature_class_name,
-        "point",
-        "#",
-        "DISABLED",
-        "DISABLED",
-        COORDINATES_SYSTEM
-    )
 
-    # The list of xml element attributes that will be added as
-    for field in NODE_SAVED_ATTRIBUTES:
-        arcpy.AddField_management(node_feature_class, field.name, field.type, "#", "#", field.length)
+###################################
+# BATCHED WRITERS
+###################################
+class BatchedCursor(object):
+    """
+    Buffer the rows inserted into a cursor and insert them by batches. Cursors with an insertRows method receive each
+    batch in a single call; the rows are inserted one by one in the other cursors, such as the arcpy insert cursors.
+    The rows are inserted in the order they are received.
+    """
+
+    def __init__(self, cursor, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param cursor: The insert cursor.
+        :param batch_size: The number of rows buffered before being inserted.
+        """
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self._rows = []
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.flush()
+        return self.cursor.__exit__(exception_type, exception_value, traceback)
+
+    def insertRow(self, row):
+        """
+        Buffer a row, and insert the buffered rows if the batch is full.
+        :param row: The row.
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered rows.
+        """
+        if len(self._rows) == 0:
+            return
+        insert_rows = getattr(self.cursor, 'insertRows', None)
+        if insert_rows is not None:
+            insert_rows(self._rows)
+        else:
+            insert_row = self.cursor.insertRow
+            for row in self._rows:
+                insert_row(row)
+        self._rows = []
+
+
+class StagedNodeCursor(object):
+    """
+    Stand in for the insert cursor of the nodes layer, writing the rows of the tagged nodes to a row list file
+    instead. The nodes are inserted by insert_staged_nodes once the tag fields are sized.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the row list file, without extension.
+        """
+        self._writer = RowWriter(path)
 
-    # The fields for the "tag" children xml elements of each "node" element
-    arcpy.da.ExtendTable(node_feature_class, "OID@", standard_fields, "_ID")
-    return node_feature_class
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._writer.close()
+        return False
 
-@timeit
-def create_way_line_geom_feature_class(workspace, feature_class_name):
+    def insertRow(self, row):
+        """
+        Write a row of the nodes layer: the point, the identifier, the coordinates, the timestamp and the tag values.
+        :param row: The row.
+        """
+        self._writer.add_row(row[1], row[2:])
+
+
+class GeometryBatch(object):
     """
-    Create the feature class that will contain only the line geometries and their OSM identifiers.
-    :param workspace: The geodatabase where the feature class will be created.
-    :param feature_class_name: The name of the output feature class.
-    :return: The full path to the feature class.
+    A column oriented batch of features: their identifiers, and the coordinates of all the features in a single
+    float64 array of (x, y) pairs, with the offsets of the first coordinates of each feature.
     """
-    way_tag_feature_class = os.path.join(workspace, feature_class_name)
-    arcpy.CreateFeatureclass_management(workspace, feature_class_name, "POLYLINE", "#", "DISABLED", "DISABLED",COORDINATES_SYSTEM)
-    arcpy.AddField_management(way_tag_feature_class, ID_FIELD.name, 'STRING', "#", "#", ID_FIELD.length)
-    return way_tag_feature_class
 
+    def __init__(self, identifiers, offsets, coordinates):
+        """
+        :param identifiers: The list of feature identifiers.
+        :param offsets: A numpy array of len(identifiers) + 1 offsets into the coordinates.
+        :param coordinates: A numpy array of float64 (x, y) pairs.
+        """
+        self.identifiers = identifiers
+        self.offsets = offsets
+        self.coordinates = coordinates
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def features(self):
+        """
+        Iterate over the features of the batch.
+        :return: A generator of (identifier, coordinates) tuples. The coordinates are a view on the coordinates of
+        the batch.
+        """
+        offsets = self.offsets.tolist()
+        coordinates = self.coordinates
+        for index, identifier in enumerate(self.identifiers):
+            yield identifier, coordinates[offsets[index]:offsets[index + 1]]
+
+
+def iter_geometry_batches(built_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Read a built ways or built areas list file by batches of features. The fixed point coordinates of a batch are all
+    converted to decimal degrees at once.
+    :param built_path: The list file, containing the fixed point coordinates of each feature.
+    :param batch_size: The number of features of a batch.
+    :return: A generator of GeometryBatch.
+    """
+    for block in iter_list_blocks(built_path, COORDINATES_DTYPE, batch_size):
+        offsets = numpy.zeros(len(block) + 1, dtype=numpy.int64)
+        offsets[1:] = block.ends
+        coordinates = numpy.column_stack((to_degrees(block.values['lon']), to_degrees(block.values['lat'])))
+        yield GeometryBatch([str(identifier) for identifier in block.index['id'].tolist()], offsets, coordinates)
 
-@timeit
-def create_way_polygon_geom_feature_class(workspace, feature_class_name):
+
+def linestring_wkb(coordinates):
+    """
+    Encode a line as well-known binary.
+    :param coordinates: A numpy array of float64 (x, y) pairs.
+    :return: A bytearray.
+    """
+    return bytearray(struct.pack('<BII', 1, WKB_LINESTRING, len(coordinates)) +
+                     numpy.ascontiguousarray(coordinates, dtype='<f8').tobytes())
+
+
+def polygon_wkb(rings):
+    """
+    Encode a polygon as well-known binary.
+    :param rings: A list of numpy arrays of float64 (x, y) pairs. The first ring is the outer ring.
+    :return: A bytearray.
+    """
+    parts = [struct.pack('<BII', 1, WKB_POLYGON, len(rings))]
+    for ring in rings:
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(numpy.ascontiguousarray(ring, dtype='<f8').tobytes())
+    return bytearray(b''.join(parts))
+
+
+def multilinestring_wkb(lines):
+    """
+    Encode a multilinestring as well-known binary.
+    :param lines: A list of lines already encoded by linestring_wkb.
+    :return: A bytearray.
+    """
+    return bytearray(struct.pack('<BII', 1, WKB_MULTILINESTRING, len(lines)) + b''.join(bytes(line) for line in lines))
+
+
+def multipolygon_wkb(polygons):
+    """
+    Encode a multipolygon as well-known binary.
+    :param polygons: A list of polygons, each one a list of rings as described in polygon_wkb.
+    :return: A bytearray.
+    """
+    parts = [struct.pack('<BII', 1, WKB_MULTIPOLYGON, len(polygons))]
+    for rings in polygons:
+        parts.append(bytes(polygon_wkb(rings)))
+    return bytearray(b''.join(parts))
+
+
+###################################
+# CLIPPING
+###################################
+class IdentifierSet(object):
+    """
+    A set of OSM identifiers held in a sorted numpy array (8 bytes per identifier). Identifiers are buffered when
+    added, and merged into the array when the set is queried.
+    """
+
+    def __init__(self, buffer_size=1000000):
+        """
+        :param buffer_size: The number of identifiers buffered before being converted to a numpy array.
+        """
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._chunks = []
+        self._identifiers = numpy.zeros(0, dtype=numpy.int64)
+
+    def add(self, identifier):
+        """
+        Add an identifier.
+        :param identifier: The identifier, as a number or as text.
+        """
+        self._buffer.append(int(identifier))
+        if len(self._buffer) >= self.buffer_size:
+            self._chunks.append(numpy.array(self._buffer, dtype=numpy.int64))
+            self._buffer = []
+
+    def update(self, identifiers):
+        """
+        Add identifiers.
+        :param identifiers: A numpy array of int64.
+        """
+        if len(identifiers) > 0:
+            self._chunks.append(identifiers.astype(numpy.int64))
+
+    def _merge(self):
+        if len(self._buffer) > 0:
+            self._chunks.append(numpy.array(self._buffer, dtype=numpy.int64))
+            self._buffer = []
+        if len(self._chunks) > 0:
+            self._identifiers = numpy.unique(numpy.concatenate([self._identifiers] + self._chunks))
+            self._chunks = []
+
+    def contains_any(self, identifiers):
+        """
+        Tell whether at least one of the identifiers is part of the set.
+        :param identifiers: A list of identifiers, as numbers or as text.
+        :return: True if one of the identifiers is part of the set.
+        """
+        if len(self._buffer) > 0 or len(self._chunks) > 0:
+            self._merge()
+        return bool(contains_identifiers(self._identifiers, numpy.array(identifiers, dtype=numpy.int64)).any())
+
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    Tell whether the segments AB and CD cross each other.
     """
-    Create the feature class that will contain only the polygon geometries and their OSM identifiers.
-    :param workspace: The geodatabase where the feature class will be created.
-    :param feature_class_name: The name of the output feature class.
-    :return: The full path to the feature class.
+    d1 = (dx - cx) * (ay - cy) - (dy - cy) * (ax - cx)
+    d2 = (dx - cx) * (by - cy) - (dy - cy) * (bx - cx)
+    d3 = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+    d4 = (bx - ax) * (dy - ay) - (by - ay) * (dx - ax)
+    return ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0))
+
+
+class ClipArea(object):
+    """
+    The area nodes are clipped to during the import: a bounding box, or polygons given as rings of (lon, lat)
+    coordinates combined with the even-odd rule, so that inner rings are holes.
+
+    To test nodes quickly against complex polygons, the bounding box of the polygons is divided into a grid. Each cell
+    records whether its center is inside the polygons, and which edges of the rings cross it. A node falling in a cell
+    that no edge crosses has the state of the center of the cell. Otherwise, the state of the center is flipped for
+    every edge of the cell crossing the segment between the node and the center.
+    """
+
+    def __init__(self, xmin, ymin, xmax, ymax, rings=None, grid_size=256):
+        """
+        :param xmin: The minimum longitude of the area.
+        :param ymin: The minimum latitude of the area.
+        :param xmax: The maximum longitude of the area.
+        :param ymax: The maximum latitude of the area.
+        :param rings: Optional polygons rings, each one a list of (lon, lat) tuples.
+        :param grid_size: The number of grid cells along each axis.
+        """
+        self.xmin = xmin
+        self.ymin = ymin
+        self.xmax = xmax
+        self.ymax = ymax
+        self.rings = rings
+        if rings is None:
+            return
+
+        self.grid_size = grid_size
+        self.cell_width = (xmax - xmin) / float(grid_size) or 1.0
+        self.cell_height = (ymax - ymin) / float(grid_size) or 1.0
+
+        edges = []
+        for ring in rings:
+            for index in range(len(ring)):
+                edges.append(ring[index - 1] + ring[index])
+        edges = numpy.array(edges, dtype=numpy.float64).reshape(-1, 4)
+
+        # The state of the center of every cell, with a vectorised ray casting over the edges.
+        columns, rows = numpy.meshgrid(numpy.arange(grid_size), numpy.arange(grid_size))
+        center_x = xmin + (columns.ravel() + 0.5) * self.cell_width
+        center_y = ymin + (rows.ravel() + 0.5) * self.cell_height
+        inside = numpy.zeros(grid_size * grid_size, dtype=bool)
+        for x1, y1, x2, y2 in edges.tolist():
+            if y1 == y2:
+                continue
+            crossing = (y1 > center_y) != (y2 > center_y)
+            crossing &= center_x < (x2 - x1) * (center_y - y1) / (y2 - y1) + x1
+            inside ^= crossing
+        self.cell_inside = inside.tolist()
+
+        # The edges crossing each cell, approximated by the cells covered by the bounding box of the edge.
+        self.cell_edges = {}
+        for edge in edges.tolist():
+            first_column, first_row = self._cell(min(edge[0], edge[2]), min(edge[1], edge[3]))
+            last_column, last_row = self._cell(max(edge[0], edge[2]), max(edge[1], edge[3]))
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    self.cell_edges.setdefault(row * grid_size + column, []).append(edge)
+
+    @classmethod
+    def from_bounding_box(cls, xmin, ymin, xmax, ymax):
+        return cls(xmin, ymin, xmax, ymax)
+
+    @classmethod
+    def from_rings(cls, rings, grid_size=256):
+        lons = [point[0] for ring in rings for point in ring]
+        lats = [point[1] for ring in rings for point in ring]
+        return cls(min(lons), min(lats), max(lons), max(lats), rings, grid_size)
+
+    def _cell(self, lon, lat):
+        column = min(max(int((lon - self.xmin) / self.cell_width), 0), self.grid_size - 1)
+        row = min(max(int((lat - self.ymin) / self.cell_height), 0), self.grid_size - 1)
+        return column, row
+
+    def contains(self, lon, lat):
+        """
+        Tell whether a location is inside the area.
+        :param lon: The longitude.
+        :param lat: The latitude.
+        :return: True if the location is inside the area.
+        """
+        if lon < self.xmin or lon > self.xmax or lat < self.ymin or lat > self.ymax:
+            return False
+        if self.rings is None:
+            return True
+
+        column, row = self._cell(lon, lat)
+        cell = row * self.grid_size + column
+        inside = self.cell_inside[cell]
+        edges = self.cell_edges.get(cell)
+        if edges is not None:
+            center_x = self.xmin + (column + 0.5) * self.cell_width
+            center_y = self.ymin + (row + 0.5) * self.cell_height
+            for x1, y1, x2, y2 in edges:
+                if segments_intersect(lon, lat, center_x, center_y, x1, y1, x2, y2):
+                    inside = not inside
+        return inside
+
+    def contains_points(self, lons, lats):
+        """
+        Tell which locations are inside the area.
+        :param lons: A numpy array of longitudes.
+        :param lats: A numpy array of latitudes.
+        :return: A numpy array of booleans.
+        """
+        inside = (lons >= self.xmin) & (lons <= self.xmax) & (lats >= self.ymin) & (lats <= self.ymax)
+        if self.rings is not None:
+            indexes = numpy.flatnonzero(inside)
+            inside[indexes] = [self.contains(lon, lat) for lon, lat in zip(lons[indexes].tolist(),
+                                                                            lats[indexes].tolist())]
+        return inside
+
+
+def create_clip_area(clip):
+    """
+    Create the clip area from the clip tool parameter.
+    :param clip: Either a bounding box as text ("xmin ymin xmax ymax", in decimal degrees), or the path to a polygon
+    feature class or shapefile.
+    :return: The ClipArea.
     """
-    way_tag_feature_class = os.path.join(workspace, feature_class_name)
-    arcpy.CreateFeatureclass_management(workspace, feature_class_name, "POLYGON", "#", "DISABLED", "DISABLED",COORDINATES_SYSTEM)
-    arcpy.AddField_management(way_tag_feature_class, ID_FIELD.name, 'STRING', "#", "#", ID_FIELD.length)
-    return way_tag_feature_class
+    values = clip.replace(',', ' ').split()
+    if len(values) >= 4:
+        try:
+            xmin, ymin, xmax, ymax = [float(value) for value in values[:4]]
+            return ClipArea.from_bounding_box(xmin, ymin, xmax, ymax)
+        except ValueError:
+            pass
+
+    if arcpy is None:
+        raise ValueError('The clip area {} is not an extent, and arcpy is required to read a feature class'.format(
+            clip
+        ))
+
+    rings = []
+    with arcpy.da.SearchCursor(clip, ['SHAPE@'], spatial_reference=arcpy.SpatialReference(WGS84)) as clip_cursor:
+        for row in clip_cursor:
+            if row[0] is None:
+                continue
+            for part in row[0]:
+                ring = []
+                for point in part:
+                    # Inner rings are separated from the outer ring by a null point.
+                    if point is None:
+                        rings.append(ring)
+                        ring = []
+                    else:
+                        ring.append((point.X, point.Y))
+                rings.append(ring)
+    rings = [ring for ring in rings if len(ring) >= 3]
+    if len(rings) == 0:
+        raise ValueError('The clip polygons {} do not have any geometry'.format(clip))
+    return ClipArea.from_rings(rings)
+
+
+###################################
+# FUNCTIONS TO CREATE FEATURE CLASS
+###################################
 
 
 @timeit
-def create_way_table(workspace, table_name, standard_fields):
+def create_node_layer(sink, name, tag_fields, tag_field_lengths=None):
     """
-    Create a table that will contains the tag associated with way elements.
-    :param workspace: The geodatabase where the feature class will be created.
-    :param table_name: The name of the output table.
-    :param standard_fields: The numpy array representing the OSM attribute fields
-    :return: The full path to the table.
+    Create the layer that will contain the nodes with attributes.
+    :param sink: The OutputSink.
+    :param name: The name of the layer.
+    :param tag_fields: The names of the OSM tag fields.
+    :param tag_field_lengths: An optional dictionary of the length of the tag fields.
+    :return: The name of the layer.
     """
-    way_tag_table = os.path.join(workspace, table_name)
-    arcpy.CreateTable_management(workspace, table_name)
-    for field in WAY_SAVED_ATTRIBUTES:
-        arcpy.AddField_management(way_tag_table, field.name, field.type, "#", "#", field.length)
-    arcpy.da.ExtendTable(way_tag_table, "OID@", standard_fields, "_ID")
-    return way_tag_table
+    return sink.create_layer(name, GEOMETRY_POINT, NODE_SAVED_ATTRIBUTES, tag_fields, tag_field_lengths)
 
 
 @timeit
-def create_multipolygon_table(workspace, feature_class_name, standard_fields):
+def create_way_line_layer(sink, name, tag_fields, tag_field_lengths=None):
+    """
+    Create the layer that will contain the line geometries and the tags of the ways.
+    :param sink: The OutputSink.
+    :param name: The name of the layer.
+    :param tag_fields: The names of the OSM tag fields.
+    :param tag_field_lengths: An optional dictionary of the length of the tag fields.
+    :return: The name of the layer.
     """
+    return sink.create_layer(name, GEOMETRY_POLYLINE, WAY_SAVED_ATTRIBUTES, tag_fields, tag_field_lengths)
 
-    :param workspace: The geodatabase where the feature class will be created.
-    :param feature_class_name: The name of the output feature class.
-    :param standard_fields: The numpy array representing the OSM attribute fields
-    :return: The full path to the feature class.
+
+@timeit
+def create_way_polygon_layer(sink, name, tag_fields, tag_field_lengths=None):
+    """
+    Create the layer that will contain the polygon geometries and the tags of the ways and multipolygons.
+    :param sink: The OutputSink.
+    :param name: The name of the layer.
+    :param tag_fields: The names of the OSM tag fields.
+    :param tag_field_lengths: An optional dictionary of the length of the tag fields.
+    :return: The name of the layer.
     """
-    multipolygon_feature_class = os.path.join(workspace, feature_class_name)
-    arcpy.CreateFeatureclass_management(workspace, feature_class_name, "POLYGON", "#", "DISABLED", "DISABLED",
-                                        COORDINATES_SYSTEM)
-    for field in WAY_SAVED_ATTRIBUTES:
-        arcpy.AddField_management(multipolygon_feature_class, field.name, field.type, "#", "#", field.length)
-    arcpy.da.ExtendTable(multipolygon_feature_class, "OID@", standard_fields, "_ID")
-    return multipolygon_feature_class
+    return sink.create_layer(name, GEOMETRY_POLYGON, POLYGON_SAVED_ATTRIBUTES, tag_fields, tag_field_lengths)
 
 
 @timeit
-def create_relations_member(workspace, table_name):
-    relations_table = os.path.join(workspace, table_name)
-    arcpy.CreateTable_management(workspace, table_name)
-    arcpy.AddField_management(relations_table, ID_FIELD.name, ID_FIELD.type, "#", "#", ID_FIELD.length)
-    arcpy.AddField_management(relations_table, 'type', 'STRING', "#", "#", 30)
-    arcpy.AddField_management(relations_table, 'ref', ID_FIELD.type, "#", "#", ID_FIELD.length)
-    arcpy.AddField_management(relations_table, 'role', 'STRING', "#", "#", 30)
-    return relations_table
+def create_route_line_layer(sink, name, tag_fields, tag_field_lengths=None):
+    """
+    Create the layer that will contain the line geometries and the tags of the route relations.
+    :param sink: The OutputSink.
+    :param name: The name of the layer.
+    :param tag_fields: The names of the OSM tag fields.
+    :param tag_field_lengths: An optional dictionary of the length of the tag fields.
+    :return: The name of the layer.
+    """
+    return sink.create_layer(name, GEOMETRY_POLYLINE, WAY_SAVED_ATTRIBUTES, tag_fields, tag_field_lengths)
 
 
 ###################################
 # PARSING FUNCTION
 ###################################
 @timeit
-def import_osm(osm_file, output_geodatabase, nodes_feature_class, csv_nodes_path, way_feature_class, csv_way_nodes, multipolygon_feature_class, multipolygon_temporary_file):
-    """
-    Parse the OSM file and put the relevant information into temporaries csv files and feature class.
-    :param osm_file: The path to the xml file compressed as bz2.
-    :param output_geodatabase: The geodatabase that contains the temporary feature class
-    (used for controlling the edit session)
-    :param nodes_feature_class: The feature class the contains nodes and their attributes. Only nodes with
-    attributes will be written here.
-    :param csv_nodes_path: The path to the csv file that will contain the association between ways and nodes.
-    :param way_feature_class: The feature class that will contain the line geometries.
-    :param csv_way_nodes: The csv file that will contain the association between ways and nodes.
-    :param multipolygon_feature_class: The feature class that will contain the multipolygons and their tags.
+def import_osm(osm_file, sink, nodes_layer, nodes_path, way_rows_path, way_nodes_path, multipolygon_rows_path, multipolygon_temporary_file, node_store=None, workers=1, tag_filter=None, rejected_way_nodes_path=None, clip_area=None, complete_ways=False, outside_nodes_path=None, batch_size=DEFAULT_BATCH_SIZE, pipelined=False, relation_members_path=None, size_fields=False, node_rows_path=None, other_tags=OTHER_TAGS_NONE, xml_parser=XML_PARSER_ETREE):
+    """
+    Parse the OSM file and put the relevant information into temporaries binary files and feature class.
+    :param osm_file: The path to the OSM file: xml compressed as bz2, plain xml, or PBF.
+    :param sink: The OutputSink the nodes are written to.
+    :param nodes_layer: The layer that contains nodes and their attributes. Only nodes with attributes will be
+    written here.
+    :param nodes_path: The path to the record file that will contain the nodes and their fixed point coordinates.
+    :param way_rows_path: The list file that will contain the attribute values of the ways, sorted by way identifier.
+    :param way_nodes_path: The list file that will contain the association between ways and nodes.
+    :param multipolygon_rows_path: The list file that will contain the attribute values of the multipolygons, routes
+    and boundaries, sorted by relation identifier.
     :param multipolygon_temporary_file: The temporary files used to write multipolygons components.
-    :return:
+    :param node_store: An optional node location store filled with the location of every node.
+    :param workers: The number of worker processes decoding the OSM file. This process remains the only one writing
+    to the output and to the intermediate files, in the order of the file.
+    :param tag_filter: An optional TagFilter. Nodes, ways and relations it rejects are not written. Every node is
+    still written to the nodes file, since the nodes of the kept ways are not known yet.
+    :param rejected_way_nodes_path: The list file where the ways rejected by the filter are written, in the format of
+    the way_nodes file, in case they are members of a multipolygon. Required with a tag filter.
+    :param clip_area: An optional ClipArea. Only the nodes inside the area, the ways with at least one node inside
+    the area, and the multipolygons with at least one of those ways are imported.
+    :param complete_ways: If True, the nodes outside of the clip area are written to outside_nodes_path (or to the
+    node store), so that the ways crossing the border of the area can be completed.
+    :param outside_nodes_path: The record file where the nodes outside of the clip area are written, in the format of
+    the nodes file. Required with complete_ways, unless a node store is used.
+    :param batch_size: The number of rows buffered by the insert cursors.
+    :param pipelined: If True, the OSM file is decoded and parsed in a separate thread, while this one writes the
+    elements.
+    :param relation_members_path: The relation member index where the members of every relation are written, as
+    described in osm_relations.
+    :param size_fields: If True, the tag values of the nodes, ways and relations are measured to size the tag fields
+    of the output.
+    :param node_rows_path: The row list file the tagged nodes are written to when nodes_layer is None, to be inserted
+    with insert_staged_nodes.
+    :param other_tags: Where the tags that are not saved in a field of their own are written: OTHER_TAGS_NONE,
+    OTHER_TAGS_TABLE for the tables of the tag store, OTHER_TAGS_COLUMN for the other_tags field appended to the rows,
+    or OTHER_TAGS_BOTH. The tables must have been created with create_tag_store_tables.
+    :param xml_parser: The parser of the xml files: XML_PARSER_ETREE or XML_PARSER_SCANNER.
+    :return: With size_fields, a dictionary of the TagStatistics of the 'node', 'way' and 'relation' elements
+    imported. None otherwise.
     """
     # Local copies of global variable. Referencing local variables in faster in python than global ones.
     standard_fields_array = STANDARD_FIELDS_ARRAY
-    identifier_delimiter = IDENTIFIER_DELIMITER
-
+    if size_fields:
+        node_tag_mapper = MeasuringTagMapper(standard_fields_array)
+        way_tag_mapper = MeasuringTagMapper(standard_fields_array)
+        relation_tag_mapper = MeasuringTagMapper(standard_fields_array)
+    else:
+        node_tag_mapper = way_tag_mapper = relation_tag_mapper = TagMapper(standard_fields_array)
+
+    # The element records hold the saved attributes in the order of NODE_SAVED_ATTRIBUTES and WAY_SAVED_ATTRIBUTES.
     node_base_attr = [field.name for field in NODE_SAVED_ATTRIBUTES]
-    node_all_attr = ['SHAPE@XY'] + node_base_attr + standard_fields_array
+    node_all_attr = [GEOMETRY_FIELD] + node_base_attr + standard_fields_array
+
+    other_tags_column = other_tags in (OTHER_TAGS_COLUMN, OTHER_TAGS_BOTH)
+    other_tags_table = other_tags in (OTHER_TAGS_TABLE, OTHER_TAGS_BOTH)
+    if other_tags_column:
+        node_all_attr.append(OTHER_TAGS_FIELD)
+    tag_store_cursors = None
+    if other_tags_table:
+        tag_store_cursors = dict(
+            (table, BatchedCursor(sink.insert_cursor(table, tag_store_field_names(table)), batch_size))
+            for table in TAG_STORE_TABLES
+        )
 
-    way_base_attr = [field.name for field in WAY_SAVED_ATTRIBUTES]
-    way_tags_all_attr = way_base_attr + standard_fields_array
+    def add_other_tags(element_type, element_id, tag_dict, attrib_values):
+        # The tags without a field of their own are added to the tag store, or to the row of the element.
+        tags = node_tag_mapper.other_tags(tag_dict)
+        if other_tags_table:
+            tag_store.add(element_type, element_id, tags)
+        if other_tags_column:
+            attrib_values.append(encode_other_tags(tags))
 
     count_nodes = 0
     count_nodes_with_attributes = 0
     count_ways = 0
     count_ways_with_attributes = 0
     count_multipolygons = 0
-
-    # Edit session is required to edit multiple feature class at a time within the same workspace
-    with arcpy.da.Editor(output_geodatabase) as edit:
-        with arcpy.da.InsertCursor(nodes_feature_class, node_all_attr) as insert_nodes_cursor:
-            with open(csv_nodes_path, 'w') as csv_nodes_file:
-                with arcpy.da.InsertCursor(way_feature_class, way_tags_all_attr) as insert_way_line_cursor:
-                    with open(csv_way_nodes, 'w') as csv_way_nodes_file:
-                        with arcpy.da.InsertCursor(multipolygon_feature_class, way_tags_all_attr) as multipolygon_cursor:
-                            csv_nodes_file_writer = csv.writer(csv_nodes_file, delimiter=CSV_DELIMITER)
-                            way_nodes_writer = csv.writer(csv_way_nodes_file, delimiter=CSV_DELIMITER)
-
-                            parent = None
-                            for event, elem in etree.iterparse(osm_file, events=('start', 'end')):
-                                if event == 'start':
-                                    if parent is None and elem.tag == 'osm':
-                                        parent = elem
-                                else:
-                                    if elem.tag == 'node':
-                                        lat = elem.attrib['lat']
-                                        lon = elem.attrib['lon']
-                                        point_geom = [float(lon), float(lat)]
-                                        if len(elem) > 0:
-                                            tag_dict = parse_node_children(elem)
-                                            attrib_values = [point_geom]
-                                            for attr in node_base_attr:
-                                                attrib_values.append(elem.attrib[attr])
-                                            for key in standard_fields_array:
-                                                if key in tag_dict:
-                                                    attrib_values.append(tag_dict[key])
+    count_routes = 0
+    count_boundaries = 0
+    count_rejected_elements = 0
+    count_clipped_elements = 0
+    count_elements = 0
+
+    # The nodes inside the clip area, and the ways with at least one of those nodes.
+    clipped_node_ids = IdentifierSet()
+    clipped_way_ids = IdentifierSet()
+
+    if nodes_layer is None:
+        nodes_cursor = StagedNodeCursor(node_rows_path)
+    else:
+        nodes_cursor = BatchedCursor(sink.insert_cursor(nodes_layer, node_all_attr), batch_size)
+
+    with sink.session() as edit:
+        with nodes_cursor as insert_nodes_cursor, TagStoreWriter(tag_store_cursors) as tag_store:
+            with NodeWriter(nodes_path) as nodes_writer:
+                with RowWriter(way_rows_path) as way_rows_writer:
+                    with ListWriter(way_nodes_path, REF_DTYPE) as way_nodes_writer, \
+                            ListWriter(rejected_way_nodes_path, REF_DTYPE) as rejected_way_nodes_writer, \
+                            NodeWriter(outside_nodes_path) as outside_nodes_writer:
+                        with RowWriter(multipolygon_rows_path) as multipolygon_rows_writer, \
+                                RelationMemberWriter(relation_members_path) as relation_members_writer:
+                            elements = osm_pipeline.pipeline(
+                                iter_osm_elements(osm_file, workers, xml_parser),
+                                'parse',
+                                'import',
+                                pipelined
+                            )
+                            throughput = osm_metrics.ProgressRate()
+                            for element in elements:
+                                count_elements += 1
+                                if element[0] == 'node' or element[0] == osm_pbf.NODE_BLOCK:
+                                    previous_count_nodes = count_nodes
+                                    if element[0] == 'node':
+                                        node_type, node_id, lon, lat, timestamp, tag_dict = element
+                                        if clip_area is not None:
+                                            if not clip_area.contains(float(lon), float(lat)):
+                                                count_clipped_elements += 1
+                                                if complete_ways:
+                                                    if node_store is not None:
+                                                        node_store.add(node_id, lon, lat)
+                                                    else:
+                                                        outside_nodes_writer.add(node_id, lon, lat)
+                                                continue
+                                            clipped_node_ids.add(node_id)
+
+                                        nodes_writer.add(node_id, lon, lat)
+                                        if node_store is not None:
+                                            node_store.add(node_id, lon, lat)
+                                        count_nodes += 1
+                                        tagged_nodes = (element,) if len(tag_dict) > 0 else ()
+                                    else:
+                                        # The nodes of a PBF block are written as fixed point arrays. Only the tagged
+                                        # nodes get a record.
+                                        node_block = element[1]
+                                        nodes = node_block.nodes
+                                        count_elements += len(nodes) - 1
+                                        inside = None
+                                        if clip_area is not None:
+                                            inside = clip_area.contains_points(to_degrees(nodes['lon']),
+                                                                               to_degrees(nodes['lat']))
+                                            count_clipped_elements += len(nodes) - int(inside.sum())
+                                            if complete_ways:
+                                                if node_store is not None:
+                                                    node_store.write(nodes[~inside])
                                                 else:
-                                                    attrib_values.append(None)
-
+                                                    outside_nodes_writer.write(nodes[~inside])
+                                            nodes = nodes[inside]
+                                            clipped_node_ids.update(nodes['id'])
+
+                                        nodes_writer.write(nodes)
+                                        if node_store is not None:
+                                            node_store.write(nodes)
+                                        count_nodes += len(nodes)
+                                        tagged_nodes = node_block.tagged_records(inside)
+
+                                    for node_type, node_id, lon, lat, timestamp, tag_dict in tagged_nodes:
+                                        if tag_filter is None or tag_filter.accepts('node', tag_dict):
+                                            attrib_values = [[float(lon), float(lat)], node_id, lon, lat, timestamp]
+                                            attrib_values.extend(node_tag_mapper.map(tag_dict))
+                                            if other_tags != OTHER_TAGS_NONE:
+                                                add_other_tags('node', node_id, tag_dict, attrib_values)
                                             insert_nodes_cursor.insertRow(attrib_values)
                                             count_nodes_with_attributes += 1
+                                        else:
+                                            count_rejected_elements += 1
+
+                                    if count_nodes // 1000000 > previous_count_nodes // 1000000:
+                                        add_message(
+                                            'Loaded {} nodes ({:.0f} elements per second) ... Still loading '
+                                            '...'.format(count_nodes, throughput.rate(count_elements))
+                                        )
+
+                                elif element[0] == 'way':
+                                    way_type, way_id, timestamp, tag_dict, nodes = element
+
+                                    if len(nodes) >= 2:
+                                        if clip_area is not None:
+                                            if not clipped_node_ids.contains_any(nodes):
+                                                count_clipped_elements += 1
+                                                continue
+                                            clipped_way_ids.add(way_id)
+
+                                        way_flags = 0
+                                        if 'highway' in tag_dict and tag_dict['highway'] != '':
+                                            way_flags = FLAG_HIGHWAY
+
+                                        if tag_filter is not None and not tag_filter.accepts('way', tag_dict):
+                                            count_rejected_elements += 1
+                                            rejected_way_nodes_writer.add(way_id, nodes, way_flags)
+                                            continue
+
+                                        if len(tag_dict) > 0:
+                                            # Add the attributes coming from children tags. They are inserted
+                                            # with the geometry of the way once it is built.
+                                            attrib_values = [timestamp]
+                                            attrib_values.extend(way_tag_mapper.map(tag_dict))
+                                            if other_tags != OTHER_TAGS_NONE:
+                                                add_other_tags('way', way_id, tag_dict, attrib_values)
+                                            count_ways_with_attributes += 1
+                                            way_rows_writer.add_row(way_id, attrib_values)
+
+                                        count_ways += 1
+                                        if count_ways % 1000000 == 0:
+                                            add_message(
+                                                'Loaded {} ways ({:.0f} elements per second) ... Still loading '
+                                                '...'.format(count_ways, throughput.rate(count_elements))
+                                            )
 
-                                        csv_nodes_file_writer.writerow([
-                                            elem.attrib['id'],
-                                            lon,
-                                            lat
-                                        ])
+                                        way_nodes_writer.add(way_id, nodes, way_flags)
+
+                                    else:
+                                        add_warning('Way with id {} has less than 2 nodes'.format(way_id))
+
+                                elif element[0] == 'relation':
+                                    relation_type, relation_id, timestamp, tag_dict, members = element
+                                    kind = relation_kind(tag_dict)
+                                    # Every relation is indexed, since the routes and boundaries may nest any of them.
+                                    relation_members_writer.add(relation_id, members, kind)
+
+                                    if 'type' in tag_dict:
+                                        if tag_dict['type'] == 'multipolygon':
+                                            if tag_filter is not None and not tag_filter.accepts('relation', tag_dict):
+                                                count_rejected_elements += 1
+                                                continue
+                                            way_members = [ref for member_type, ref, role in members
+                                                           if member_type == 'way']
+                                            way_roles = [role for member_type, ref, role in members
+                                                         if member_type == 'way']
+                                            if clip_area is not None and not clipped_way_ids.contains_any(way_members):
+                                                count_clipped_elements += 1
+                                                continue
+                                            # The attributes are inserted with the geometry of the multipolygon
+                                            # once it is assembled.
+                                            attrib_values = [timestamp]
+                                            attrib_values.extend(relation_tag_mapper.map(tag_dict))
+                                            if other_tags != OTHER_TAGS_NONE:
+                                                add_other_tags('relation', relation_id, tag_dict, attrib_values)
+                                            count_multipolygons += 1
+                                            multipolygon_rows_writer.add_row(relation_id, attrib_values)
+                                            multipolygon_temporary_file.write('{}|{}|{}\n'.format(
+                                                relation_id,
+                                                ','.join(way_members),
+                                                ','.join(role.replace(',', ' ').replace('|', ' ') for role in way_roles)
+                                            ))
+                                        elif kind != RELATION_OTHER:
+                                            if tag_filter is not None and not tag_filter.accepts('relation', tag_dict):
+                                                count_rejected_elements += 1
+                                                continue
+                                            way_members = [ref for member_type, ref, role in members
+                                                           if member_type == 'way']
+                                            has_relation_members = any(member_type == 'relation'
+                                                                       for member_type, ref, role in members)
+                                            if clip_area is not None and not has_relation_members and \
+                                                    not clipped_way_ids.contains_any(way_members):
+                                                count_clipped_elements += 1
+                                                continue
+                                            # The attributes are inserted with the geometry of the route or boundary
+                                            # once its member ways are resolved.
+                                            attrib_values = [timestamp]
+                                            attrib_values.extend(relation_tag_mapper.map(tag_dict))
+                                            if other_tags != OTHER_TAGS_NONE:
+                                                add_other_tags('relation', relation_id, tag_dict, attrib_values)
+                                            if kind == RELATION_ROUTE:
+                                                count_routes += 1
+                                            else:
+                                                count_boundaries += 1
+                                            multipolygon_rows_writer.add_row(relation_id, attrib_values)
 
-                                        count_nodes += 1
-                                        if count_nodes % 1000000 == 0:
-                                            arcpy.AddMessage(
-                                                'Loaded {0} nodes ... Still loading ...'.format(count_nodes)
-                                            )
-                                        elem.clear()
-                                        parent.remove(elem)
+            if node_store is not None:
+                node_store.flush()
 
-                                    elif elem.tag == 'way':
-                                        tag_dict, nodes = parse_way_children(elem)
+            if not way_rows_writer.sorted:
+                add_message('Ways are not ordered by identifier. Sorting their attributes.')
+                sort_list_index(way_rows_path, os.path.dirname(way_rows_path))
 
-                                        if len(nodes) >= 2:
-                                            attrib_values = [elem.attrib[attr] for attr in way_base_attr]
+            if not multipolygon_rows_writer.sorted:
+                add_message('Relations are not ordered by identifier. Sorting their attributes.')
+                sort_list_index(multipolygon_rows_path, os.path.dirname(multipolygon_rows_path))
 
-                                            # Add the attributes coming from children tags
-                                            for key in standard_fields_array:
-                                                if key in tag_dict:
-                                                    attrib_values.append(tag_dict[key])
-                                                else:
-                                                    attrib_values.append(None)
+            osm_metrics.add_elements(count_elements)
+            add_message('Imported {} nodes. {} nodes have attributes.'.format(
+                count_nodes,
+                count_nodes_with_attributes
+            ))
 
-                                            if len(tag_dict) > 0:
-                                                count_ways_with_attributes += 1
-                                                insert_way_line_cursor.insertRow(attrib_values)
+            add_message('Imported {} ways. {} have attributes.'.format(
+                count_ways,
+                count_ways_with_attributes
+            ))
 
-                                            empty_coordinates = ['' for node in nodes]
+            add_message('Derived {} multipolygons, {} routes and {} boundaries from the relations.'.format(
+                count_multipolygons,
+                count_routes,
+                count_boundaries
+            ))
 
-                                            is_highway = 'n'
-                                            if 'highway' in tag_dict and tag_dict['highway'] != '':
-                                                is_highway = 'y'
+            if tag_filter is not None:
+                add_message('{} elements rejected by the filter {}'.format(
+                    count_rejected_elements,
+                    tag_filter.expression
+                ))
 
-                                            count_ways += 1
-                                            if count_ways % 1000000 == 0:
-                                                arcpy.AddMessage(
-                                                    'Loaded {} ways ... Still loading ...'.format(count_ways)
-                                                )
+            if clip_area is not None:
+                add_message('{} elements outside of the clip area'.format(count_clipped_elements))
 
-                                            way_nodes_writer.writerow([
-                                                elem.attrib['id'],
-                                                identifier_delimiter.join(nodes),
-                                                identifier_delimiter.join(empty_coordinates),
-                                                is_highway
-                                            ])
+            if other_tags_table:
+                add_message('Stored {} other tags, with {} distinct keys and {} distinct values'.format(
+                    tag_store.count_tags,
+                    len(tag_store.keys),
+                    len(tag_store.values)
+                ))
 
-                                        else:
-                                            arcpy.AddWarning('Way with id {} has less than 2 nodes'.format(
-                                                elem.attrib['id'])
-                                            )
+            for message in osm_pipeline.report(elements):
+                add_message(message)
 
-                                        elem.clear()
-                                        parent.remove(elem)
+    if size_fields:
+        return {
+            'node': node_tag_mapper.statistics(),
+            'way': way_tag_mapper.statistics(),
+            'relation': relation_tag_mapper.statistics()
+        }
+    return None
 
-                                    elif elem.tag == 'relation':
-                                        tag_dict, members, elem_type, way_members = parse_relation_children(elem)
 
-                                        attrib_values = [elem.attrib[attr] for attr in way_base_attr]
+@timeit
+def insert_staged_nodes(sink, nodes_layer, node_rows_path, tag_layout, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert the tagged nodes written by import_osm to a row list file into the nodes layer.
+    :param sink: The OutputSink.
+    :param nodes_layer: The nodes layer.
+    :param node_rows_path: The row list file of the tagged nodes.
+    :param tag_layout: The TagFieldLayout of the nodes layer.
+    :param batch_size: The number of rows buffered by the insert cursor.
+    :return: The number of nodes inserted.
+    """
+    node_all_attr = [GEOMETRY_FIELD] + [field.name for field in NODE_SAVED_ATTRIBUTES] + tag_layout.layer_fields()
+    count = 0
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(nodes_layer, node_all_attr), batch_size) as insert_cursor:
+            for block in iter_list_blocks(node_rows_path, ROW_DTYPE):
+                for node_id, values, flags in block.lists():
+                    # The rows hold the coordinates, the timestamp and the tag values.
+                    row = tag_layout.select(decode_row(values.tobytes()), 3)
+                    insert_cursor.insertRow([[float(row[0]), float(row[1])], str(node_id)] + row)
+                    count += 1
 
-                                        for key in standard_fields_array:
-                                            if key in tag_dict:
-                                                attrib_values.append(tag_dict[key])
-                                            else:
-                                                attrib_values.append(None)
-
-                                        if 'type' in tag_dict:
-                                            if tag_dict['type'] == 'multipolygon':
-                                                count_multipolygons += 1
-                                                multipolygon_cursor.insertRow(attrib_values)
-                                                multipolygon_temporary_file.write(
-                                                    '{}|{}\n'.format(elem.attrib['id'], ','.join(way_members))
-                                                )
-                                        elem.clear()
-                                        parent.remove(elem)
-
-            arcpy.AddMessage('Imported {} nodes. {} nodes have attributes.'.format(
-                count_nodes,
-                count_nodes_with_attributes
-            ))
+    osm_metrics.add_elements(count)
+    add_message('Inserted {} nodes'.format(count))
+    return count
 
-            arcpy.AddMessage('Imported {} ways. {} have attributes.'.format(
-                count_ways,
-                count_ways_with_attributes
-            ))
 
-            arcpy.AddMessage('Derived {} multipolygons from the relations.'.format(
-                count_multipolygons
-            ))
+def node_row_keys(block, spatial_order):
+    """
+    Compute the spatial keys of the tagged nodes of a block of a row list file, from their coordinates.
+    :param block: A ListBlock of rows written by StagedNodeCursor.
+    :param spatial_order: SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY.
+    :return: A numpy array of the int64 keys of the nodes.
+    """
+    lons = []
+    lats = []
+    for node_id, values, flags in block.lists():
+        # The rows start with the longitude and the latitude.
+        lon, lat = values.tobytes().split(ROW_SEPARATOR, 2)[:2]
+        lons.append(float(lon))
+        lats.append(float(lat))
+    return spatial_keys(to_fixed_point(lons), to_fixed_point(lats), spatial_order)
+
+
+@timeit
+def order_staged_nodes(node_rows_path, spatial_order, processing_folder):
+    """
+    Reorder the tagged nodes written by import_osm to a row list file, so that they are inserted in spatial order.
+    :param node_rows_path: The row list file of the tagged nodes.
+    :param spatial_order: SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY.
+    :param processing_folder: The folder of the temporary files of the sort.
+    :return: The number of nodes.
+    """
+    count = order_list_file(
+        node_rows_path,
+        ROW_DTYPE,
+        lambda block: node_row_keys(block, spatial_order),
+        processing_folder
+    )
+    osm_metrics.add_elements(count)
+    add_message('Ordered {} nodes in {} order'.format(count, spatial_order.lower()))
+    return count
+
+
+def tag_field_layouts(statistics, other_tags_column=False):
+    """
+    Define the tag fields of the output layers.
+    :param statistics: The dictionary of TagStatistics returned by import_osm to size the fields from the data, or
+    None to give every layer all the standard fields with a fixed length.
+    :param other_tags_column: If True, the layers have the other_tags field.
+    :return: A dictionary of the TagFieldLayout of each layer.
+    """
+    if statistics is None:
+        layout = TagFieldLayout(STANDARD_FIELDS_ARRAY, other_tags=other_tags_column)
+        return dict((layer, layout) for layer in (NODES_LAYER, WAY_LINES_LAYER, WAY_POLYGONS_LAYER, ROUTE_LINES_LAYER))
+
+    # The lines and polygons are told apart once the ways are built, and the polygon layer also holds the relations.
+    layer_statistics = {
+        NODES_LAYER: statistics['node'],
+        WAY_LINES_LAYER: statistics['way'],
+        WAY_POLYGONS_LAYER: statistics['way'].merge(statistics['relation']),
+        ROUTE_LINES_LAYER: statistics['relation']
+    }
+    layouts = {}
+    for layer in sorted(layer_statistics):
+        layout = TagFieldLayout.from_statistics(layer_statistics[layer], TAG_FIELD_LENGTH, other_tags=other_tags_column)
+        layouts[layer] = layout
+        add_message('Layer {}: {} of {} tag fields used, {} characters per row instead of {}'.format(
+            layer,
+            len(layout.fields),
+            len(STANDARD_FIELDS_ARRAY),
+            sum(layout.lengths.values()),
+            TAG_FIELD_LENGTH * len(STANDARD_FIELDS_ARRAY)
+        ))
+    return layouts
+
+
+def iter_multipolygon_members(csv_relations_members):
+    """
+    Read the file associating the multipolygons with their member ways.
+    :param csv_relations_members: The file written by import_osm, one line per multipolygon.
+    :return: A generator of (relation identifier, list of way identifiers, list of roles) tuples, in the order of the
+    multipolygons feature class.
+    """
+    with open(csv_relations_members, 'r') as relations_members_file:
+        for line in relations_members_file:
+            relation_id, members, roles = line.rstrip('\n').split('|')
+            if members == '':
+                yield relation_id, [], []
+            else:
+                yield relation_id, members.split(','), roles.split(',')
+
+
+def read_multipolygon_member_identifiers(csv_relations_members):
+    """
+    Collect the identifiers of the member ways of all the multipolygons.
+    :param csv_relations_members: The file associating the multipolygons with their member ways.
+    :return: A sorted numpy array of int64, without duplicates.
+    """
+    member_identifiers = []
+    for relation_id, members, roles in iter_multipolygon_members(csv_relations_members):
+        member_identifiers.extend(members)
+    return numpy.unique(numpy.array(member_identifiers, dtype=numpy.int64))
+
+
+@timeit
+def restore_multipolygon_member_ways(csv_relations_members, rejected_way_nodes_path, way_nodes_path,
+                                     relation_members_path=None):
+    """
+    Append to the way_nodes file the ways rejected by the tag filter that are members of a kept multipolygon, such as
+    untagged outer ways, or members of a relation of the relation member index. Their geometries are built, but since
+    their tags have not been written they are not part of the output ways.
+    :param csv_relations_members: The file associating the multipolygons with their member ways.
+    :param rejected_way_nodes_path: The list file of the ways rejected by the filter, in the format of the way_nodes
+    file.
+    :param way_nodes_path: The list file that contains the association between ways and nodes.
+    :param relation_members_path: The optional relation member index written by import_osm.
+    :return: None.
+    """
+    member_identifiers = read_multipolygon_member_identifiers(csv_relations_members)
+    if relation_members_path is not None:
+        relation_index = RelationMemberIndex(relation_members_path)
+        member_identifiers = numpy.union1d(member_identifiers, relation_index.member_way_identifiers())
+        relation_index.close()
+
+    count = 0
+    with ListWriter(way_nodes_path, REF_DTYPE, mode='ab') as way_nodes_writer:
+        for block in iter_list_blocks(rejected_way_nodes_path, REF_DTYPE):
+            index, values = block.select(contains_identifiers(member_identifiers, block.index['id']))
+            way_nodes_writer.write(index, values)
+            count += len(index)
+
+    add_message('Restored {} relation member ways rejected by the filter'.format(count))
+
+
+def sorted_unique_identifiers(blocks):
+    """
+    Collect blocks of identifiers into a sorted numpy array without duplicates.
+    :param blocks: An iterable of numpy arrays of int64.
+    :return: A numpy array of int64.
+    """
+    chunks = [numpy.zeros(0, dtype=numpy.int64)]
+    for block in blocks:
+        chunks.append(numpy.unique(block))
+        if len(chunks) > 16:
+            chunks = [numpy.unique(numpy.concatenate(chunks))]
+    return numpy.unique(numpy.concatenate(chunks))
+
+
+@timeit
+def retain_referenced_nodes(nodes_path, way_nodes_path, batch_size=1000000):
+    """
+    Rewrite the nodes file keeping only the nodes referenced by the ways of the way_nodes file, so that the join only
+    reads the nodes of the ways kept by the tag filter.
+    :param nodes_path: The record file containing nodes.
+    :param way_nodes_path: The list file that contains the association between ways and nodes.
+    :param batch_size: The number of identifiers read at once.
+    :return: None.
+    """
+    referenced = sorted_unique_identifiers(iter_list_values(way_nodes_path, REF_DTYPE, batch_size))
+
+    count_nodes = 0
+    nodes_temp = nodes_path + '_temp'
+    with NodeWriter(nodes_temp) as nodes_writer:
+        for nodes in iter_record_blocks(nodes_path, NODE_DTYPE, batch_size):
+            nodes_writer.write(nodes[contains_identifiers(referenced, nodes['id'])])
+            count_nodes += len(nodes)
+
+    os.remove(nodes_path)
+    os.rename(nodes_temp, nodes_path)
+    add_message('Retained {} of {} nodes, referenced by the kept ways'.format(nodes_writer.count, count_nodes))
+
+
+@timeit
+def merge_outside_nodes(nodes_path, outside_nodes_path, way_nodes_path):
+    """
+    Complete the ways crossing the border of the clip area: the nodes outside of the area that are referenced by the
+    kept ways are merged into the nodes file, which remains ordered by node identifier.
+    :param nodes_path: The record file containing the nodes inside the clip area.
+    :param outside_nodes_path: The record file containing the nodes outside of the clip area.
+    :param way_nodes_path: The list file that contains the association between ways and nodes.
+    :return: None.
+    """
+    retain_referenced_nodes(outside_nodes_path, way_nodes_path)
+    nodes_temp = nodes_path + '_temp'
+    merge_sorted_record_files([nodes_path, outside_nodes_path], NODE_DTYPE, 'id', nodes_temp)
+    os.remove(nodes_path)
+    os.rename(nodes_temp, nodes_path)
 
 
 ###################################
 # FUNCTIONS TO BUILD LINES
 ###################################
+def select_located_lists(block, mask, coordinates, found, reclosed=None):
+    """
+    Select some lists of the block, keeping only their located nodes.
+    :param block: A ListBlock of ways.
+    :param mask: A numpy array of booleans, one per way.
+    :param coordinates: A numpy array of COORDINATES_DTYPE, the coordinates of the nodes of the ways of the block.
+    :param found: A numpy array of booleans telling which nodes have been located.
+    :param reclosed: An optional numpy array of booleans, one per way, telling which ways are closed again with their
+    first located node.
+    :return: A tuple with the index and the coordinates of the selected lists.
+    """
+    kept = numpy.repeat(mask, block.index['count']) & found
+    index = block.index[mask]
+    counts = numpy.add.reduceat(kept.astype(numpy.int64), block.starts)[mask]
+    values = coordinates[kept]
+    if reclosed is not None and reclosed[mask].any():
+        reclosed = reclosed[mask]
+        ends = numpy.cumsum(counts)
+        values = numpy.insert(values, ends[reclosed], values[(ends - counts)[reclosed]])
+        counts = counts + reclosed
+    index['count'] = counts
+    return index, values
+
+
+def write_built_ways(block, node_ids, coordinates, found, built_ways_writer, built_areas_writer, clipped=False):
+    """
+    Write the ways of a block whose nodes have all been located. A closed way is written as an area, unless it is a
+    highway.
+    :param block: A ListBlock of ways.
+    :param node_ids: A numpy array of the node identifiers of the ways of the block.
+    :param coordinates: A numpy array of COORDINATES_DTYPE, the coordinates of the nodes of the ways of the block.
+    :param found: A numpy array of booleans telling which nodes have been located.
+    :param built_ways_writer: The ListWriter of the line geometries.
+    :param built_areas_writer: The ListWriter of the polygon geometries.
+    :param clipped: If True, the nodes outside of the clip area are missing. The ways are built from their located
+    nodes: a line is kept with at least 2 of them, an area with at least 4 once closed again.
+    :return: A tuple with the number of built lines, the number of built areas, and a numpy array of booleans telling
+    which ways of the block have not been built.
+    """
+    is_area = (node_ids[block.starts] == node_ids[block.ends - 1]) & (block.index['flags'] & FLAG_HIGHWAY == 0)
+
+    if clipped:
+        located = numpy.add.reduceat(found.astype(numpy.int32), block.starts)
+        # An area whose first and last node is outside is closed again with its first located node.
+        reclosed = is_area & ~found[block.starts]
+        built_ways = ~is_area & (located >= 2)
+        built_areas = is_area & (located + reclosed >= 4)
+        built_ways_writer.write(*select_located_lists(block, built_ways, coordinates, found))
+        built_areas_writer.write(*select_located_lists(block, built_areas, coordinates, found, reclosed))
+        return int(built_ways.sum()), int(built_areas.sum()), ~(built_ways | built_areas)
+
+    missing = numpy.add.reduceat((~found).astype(numpy.int32), block.starts)
+    completed = missing == 0
+
+    built_ways = completed & ~is_area
+    built_areas = completed & is_area
+    built_ways_writer.write(*block.select(built_ways, coordinates))
+    built_areas_writer.write(*block.select(built_areas, coordinates))
+    return int(built_ways.sum()), int(built_areas.sum()), ~completed
+
+
+def warn_remaining_ways(count_remaining_ways, clipped=False):
+    """
+    Report the ways that could not be built.
+    :param count_remaining_ways: The number of ways not built.
+    :param clipped: If True, the nodes outside of the clip area are missing.
+    """
+    if count_remaining_ways == 0:
+        return
+    if clipped:
+        add_message('{} ways have less than 2 nodes, or 4 for an area, inside the clip area. They are not '
+                    'built.'.format(count_remaining_ways))
+    else:
+        add_warning('{} ways have been left unprocessed. This indicates that the nodes for those ways could not be '
+                    'found.'.format(count_remaining_ways))
+
+
+def node_chunk_memory(nodes):
+    """
+    Estimate the memory used by a chunk of nodes while it is processed: the records, and when they are not sorted by
+    identifier, the sort indices and the sorted copy.
+    :param nodes: A numpy array of NODE_DTYPE.
+    :return: The memory used per node, in bytes.
+    """
+    node_ids = nodes['id']
+    if len(node_ids) > 1 and not numpy.all(node_ids[1:] > node_ids[:-1]):
+        return 2 * NODE_DTYPE.itemsize + numpy.dtype(numpy.intp).itemsize
+    return NODE_DTYPE.itemsize
+
+
+class NodeChunkSizer(object):
+    """
+    Size the chunks of nodes of the chunked join from a memory budget, instead of a fixed number of nodes. Before each
+    chunk is read, its size is the memory left in the budget by the resident memory of the process and by the block of
+    pending references being located, divided by the memory of a node. The memory of a node is first estimated from a
+    sample of the nodes file, then corrected with every chunk processed.
+    """
+
+    def __init__(self, memory_budget, nodes_path, start=0):
+        """
+        :param memory_budget: The memory the process may use during the join, in bytes.
+        :param nodes_path: The record file containing nodes.
+        :param start: The number of nodes already processed.
+        """
+        self.memory_budget = memory_budget
+        self.total_nodes = count_records(nodes_path, NODE_DTYPE)
+        self.nodes_read = start
+
+        self.pending_block_size = int(min(
+            MAX_PENDING_BLOCK_SIZE,
+            max(MIN_NODES_CHUNK_SIZE, memory_budget * PENDING_MEMORY_SHARE // PENDING_VALUE_MEMORY)
+        ))
+        self.pending_memory = self.pending_block_size * PENDING_VALUE_MEMORY
+
+        sample = next(iter_record_blocks(nodes_path, NODE_DTYPE, NODE_CHUNK_SAMPLE_SIZE, start=start), None)
+        self.node_memory = node_chunk_memory(sample) if sample is not None else NODE_DTYPE.itemsize
+        self.chunk_size = None
+        self.budget_exceeded = False
+        self._resident_before = None
+        self._peak_before = None
+
+    def next_chunk_size(self):
+        """
+        :return: The number of nodes of the next chunk, from the memory left in the budget. When the budget cannot
+        be met, the chunks have MIN_NODES_CHUNK_SIZE nodes, and a warning is added once.
+        """
+        self._resident_before = osm_metrics.resident_memory()
+        self._peak_before = osm_metrics.process_counters()['peak_rss']
+        available = self.memory_budget - (self._resident_before or 0) - self.pending_memory
+        chunk_size = int(available // self.node_memory)
+        if chunk_size < MIN_NODES_CHUNK_SIZE and not self.budget_exceeded:
+            self.budget_exceeded = True
+            add_warning('The memory budget of {:.0f} MB cannot be met: the process already uses {:.0f} MB and the '
+                        'pending references {:.0f} MB. The nodes are read by chunks of {} nodes'.format(
+                            self.memory_budget / 1048576.0,
+                            (self._resident_before or 0) / 1048576.0,
+                            self.pending_memory / 1048576.0,
+                            MIN_NODES_CHUNK_SIZE
+                        ))
+        self.chunk_size = max(MIN_NODES_CHUNK_SIZE, chunk_size)
+        return self.chunk_size
+
+    def iter_chunk_sizes(self):
+        while True:
+            yield self.next_chunk_size()
+
+    def remaining_passes(self):
+        """
+        :return: The number of chunks left to read at the current chunk size.
+        """
+        remaining_nodes = max(0, self.total_nodes - self.nodes_read)
+        return -(-remaining_nodes // max(1, self.chunk_size or MIN_NODES_CHUNK_SIZE))
+
+    def observe(self, nodes):
+        """
+        Correct the memory of a node after a chunk has been processed. When the peak memory of the process grew during
+        the chunk, the growth beyond the resident memory and the pending references is attributed to the nodes of the
+        chunk.
+        :param nodes: The chunk of nodes processed.
+        """
+        self.nodes_read += len(nodes)
+        node_memory = node_chunk_memory(nodes)
+        peak_after = osm_metrics.process_counters()['peak_rss']
+        if None not in (peak_after, self._peak_before, self._resident_before) and peak_after > self._peak_before:
+            measured = float(peak_after - self._resident_before - self.pending_memory) / max(1, len(nodes))
+            node_memory = max(node_memory, measured)
+        self.node_memory = max(self.node_memory, node_memory)
+
+
+def locate_references(nodes, refs):
+    """
+    Locate node references in a chunk of nodes sorted by identifier.
+    :param nodes: A numpy array of NODE_DTYPE, sorted by identifier.
+    :param refs: A numpy array of WAY_NODE_REF_DTYPE.
+    :return: A tuple with a numpy array of LOCATED_REF_DTYPE, the references located and their coordinates, and a
+    numpy array of WAY_NODE_REF_DTYPE, the references not located.
+    """
+    node_ids = nodes['id']
+    positions = numpy.searchsorted(node_ids, refs['node'])
+    positions[positions == len(node_ids)] = 0
+    found = node_ids[positions] == refs['node']
+    located = numpy.empty(int(found.sum()), dtype=LOCATED_REF_DTYPE)
+    located['position'] = refs['position'][found]
+    located['lon'] = nodes['lon'][positions[found]]
+    located['lat'] = nodes['lat'][positions[found]]
+    return located, refs[~found]
+
+
+def iter_located_blocks(way_nodes_path, located_path):
+    """
+    Regroup the located references by way, in the order of the way_nodes file.
+    :param way_nodes_path: The list file containing the way / nodes association.
+    :param located_path: The located references, as a record file of LOCATED_REF_DTYPE sorted by position.
+    :return: A generator of tuples with a ListBlock of ways and a numpy array of COORDINATES_DTYPE, the coordinates of
+    their nodes. The latitude is MISSING_COORDINATE for the nodes that were not located.
+    """
+    located_blocks = iter_record_blocks(located_path, LOCATED_REF_DTYPE)
+    located = next(located_blocks, None)
+    position = 0
+    for block in iter_list_blocks(way_nodes_path, REF_DTYPE):
+        end = position + len(block.values)
+        coordinates = numpy.empty(len(block.values), dtype=COORDINATES_DTYPE)
+        coordinates['lon'] = 0
+        coordinates['lat'] = MISSING_COORDINATE
+        while located is not None:
+            cut = numpy.searchsorted(located['position'], end)
+            head = located[:cut]
+            coordinates['lon'][head['position'] - position] = head['lon']
+            coordinates['lat'][head['position'] - position] = head['lat']
+            if cut < len(located):
+                located = located[cut:]
+                break
+            located = next(located_blocks, None)
+        position = end
+        yield block, coordinates
+
+
 @timeit
-def build_ways(csv_nodes_path, csv_way_nodes, csv_built_ways, csv_built_areas, nodes_chunk_size=500000):
+def build_ways(nodes_path, way_nodes_path, built_ways_path, built_areas_path, nodes_chunk_size=500000, manifest=None,
+               nodes_memory_budget=0, clipped=False):
     """
-    Derive geometries from way lines and way polygons from the csv representing nodes and way_nodes files
-    :param csv_nodes_path: The csv files containing nodes.
-    :param csv_way_nodes: The csv files containing the way / nodes association.
-    :param csv_built_ways: The output csv files where line geometries will be written
-    :param csv_built_areas: The output csv file where polygons geometries will be written.
+    Derive geometries from way lines and way polygons from the nodes and way_nodes files. The node references of the
+    ways are sorted by node identifier into a pending file, then the nodes are loaded in memory by chunks. A chunk only
+    reads the pending references up to its largest node identifier: the other ones cannot be located by it. The
+    located coordinates are appended to a separate file, and the references left unresolved by a chunk are checked
+    again by the following ones. Once all the chunks are read, the located coordinates are regrouped by way.
+    :param nodes_path: The record file containing nodes.
+    :param way_nodes_path: The list file containing the way / nodes association.
+    :param built_ways_path: The output list file where line geometries will be written
+    :param built_areas_path: The output list file where polygons geometries will be written.
     :param nodes_chunk_size: The number of nodes loaded in memory at once in memory.
+    :param manifest: An optional osm_checkpoint.Manifest. The progress of the join is saved after each chunk of
+    nodes, and the join resumes from the last saved chunk.
+    :param nodes_memory_budget: If set, the memory the process may use during the join, in megabytes. The chunks of
+    nodes are then sized from this budget (see NodeChunkSizer), and nodes_chunk_size is ignored.
+    :param clipped: If True, the nodes outside of the clip area are missing, and the ways are built from their nodes
+    inside of it (see write_built_ways).
     :return:
     """
     nodes_read = 0
-    arcpy.AddMessage('Building ways')
-    node_dict = {}
+    add_message('Building ways')
+
+    processing_folder = os.path.dirname(os.path.abspath(way_nodes_path))
+    pending_refs_path = way_nodes_path + '_pending.bin'
+    unresolved_refs_path = way_nodes_path + '_unresolved.bin'
+    located_refs_path = way_nodes_path + '_located.bin'
+    progress = manifest.progress(STAGE_JOIN) if manifest is not None else None
+
+    if nodes_memory_budget:
+        sizer = NodeChunkSizer(nodes_memory_budget * 1048576, nodes_path)
+        pending_block_size = sizer.pending_block_size
+        add_message('Sizing the chunks of nodes for a memory budget of {} MB: {:.0f} bytes per node, pending '
+                    'references located by blocks of {}'.format(nodes_memory_budget, sizer.node_memory,
+                                                                 pending_block_size))
+    else:
+        sizer = None
+        pending_block_size = MAX_PENDING_BLOCK_SIZE
+
+    # The unresolved references file is rewritten after each chunk: the progress is only valid if it was saved after
+    # the last rewrite.
+    if progress is not None and file_size(pending_refs_path) == progress['pending_size'] and \
+            file_size(unresolved_refs_path) == progress['unresolved_size']:
+        nodes_read = progress['nodes_read']
+        pending_start = progress['pending_start']
+        with open(located_refs_path, 'r+b') as located_refs_file:
+            located_refs_file.truncate(progress['located_size'])
+        add_message('Resuming the join after {} nodes'.format(nodes_read))
+    else:
+        count_refs = external_sort_records(
+            explode_way_nodes(way_nodes_path),
+            WAY_NODE_REF_DTYPE,
+            'node',
+            pending_refs_path,
+            processing_folder,
+            pending_block_size
+        )
+        add_message('Sorted {} way node references by node identifier'.format(count_refs))
+        pending_start = 0
+        open(unresolved_refs_path, 'wb').close()
+        open(located_refs_path, 'wb').close()
+
+    if sizer is not None:
+        sizer.nodes_read = nodes_read
+        chunk_sizes = sizer.iter_chunk_sizes()
+    else:
+        chunk_sizes = itertools.repeat(nodes_chunk_size)
+
+    passes = 0
+    logged_chunk_size = None
+    with open(located_refs_path, 'ab') as located_refs_file:
+        throughput = osm_metrics.ProgressRate()
+        start_nodes_read = nodes_read
+        for nodes in iter_sized_record_blocks(nodes_path, NODE_DTYPE, chunk_sizes, start=nodes_read):
+            if sizer is not None and sizer.chunk_size != logged_chunk_size:
+                logged_chunk_size = sizer.chunk_size
+                add_message('Chunks of {} nodes, about {} chunks left'.format(
+                    sizer.chunk_size,
+                    sizer.remaining_passes()
+                ))
+            nodes_read += len(nodes)
+            passes += 1
+            add_message('{} nodes read ({:.0f} nodes per second)'.format(
+                nodes_read,
+                throughput.rate(nodes_read - start_nodes_read)
+            ))
+            # Call function to process chunk
+            pending_start = process_way_chunk(
+                nodes,
+                pending_refs_path,
+                pending_start,
+                unresolved_refs_path,
+                located_refs_file,
+                pending_block_size
+            )
+            if sizer is not None:
+                sizer.observe(nodes)
+            # Release the chunk before the size of the next one is computed from the resident memory.
+            del nodes
+
+            if manifest is not None:
+                located_refs_file.flush()
+                os.fsync(located_refs_file.fileno())
+                manifest.save_progress(
+                    STAGE_JOIN,
+                    nodes_read=nodes_read,
+                    pending_start=pending_start,
+                    pending_size=file_size(pending_refs_path),
+                    unresolved_size=file_size(unresolved_refs_path),
+                    located_size=located_refs_file.tell()
+                )
+
+    os.remove(pending_refs_path)
+    os.remove(unresolved_refs_path)
+
+    # Regroup the located coordinates by way.
+    sorted_located_refs_path = way_nodes_path + '_located_sorted.bin'
+    external_sort_records(
+        iter_record_blocks(located_refs_path, LOCATED_REF_DTYPE),
+        LOCATED_REF_DTYPE,
+        'position',
+        sorted_located_refs_path,
+        processing_folder,
+        pending_block_size
+    )
+    os.remove(located_refs_path)
 
     count_remaining_ways = 0
     count_built_ways = 0
     count_built_areas = 0
-
-    with open(csv_built_ways, 'w') as csv_built_ways_file:
-        build_way_csv_writer = csv.writer(csv_built_ways_file, delimiter=CSV_DELIMITER)
-        with open(csv_built_areas, 'w') as csv_built_areas_file:
-            build_areas_csv_writer = csv.writer(csv_built_areas_file, delimiter=CSV_DELIMITER)
-            with open(csv_nodes_path, 'r') as csv_nodes:
-                nodes_reader = csv.reader(csv_nodes, delimiter=CSV_DELIMITER)
-                for node_row in nodes_reader:
-                    node_dict[node_row[0]] = node_row[1] + ' ' + node_row[2]
-                    nodes_read += 1
-                    if nodes_read % nodes_chunk_size == 0:
-                        arcpy.AddMessage('{} nodes read'.format(nodes_read))
-                        # Call function to process chunk
-                        remaining_ways, built_ways, built_areas = process_way_chunk(
-                            node_dict,
-                            csv_way_nodes,
-                            build_way_csv_writer,
-                            build_areas_csv_writer
-                        )
-                        count_remaining_ways = remaining_ways
-                        count_built_ways += built_ways
-                        count_built_areas += built_areas
-                        node_dict.clear()
-
-            # Call function to process chunk
-            if len(node_dict) > 0:
-                arcpy.AddMessage('{} nodes read'.format(nodes_read))
-                remaining_ways, built_ways, built_areas = process_way_chunk(
-                    node_dict,
-                    csv_way_nodes,
-                    build_way_csv_writer,
-                    build_areas_csv_writer
+    with ListWriter(built_ways_path, COORDINATES_DTYPE) as built_ways_writer:
+        with ListWriter(built_areas_path, COORDINATES_DTYPE) as built_areas_writer:
+            for block, coordinates in iter_located_blocks(way_nodes_path, sorted_located_refs_path):
+                built_ways, built_areas, remaining = write_built_ways(
+                    block,
+                    block.values,
+                    coordinates,
+                    coordinates['lat'] != MISSING_COORDINATE,
+                    built_ways_writer,
+                    built_areas_writer,
+                    clipped
                 )
-                count_remaining_ways = remaining_ways
+                count_remaining_ways += int(remaining.sum())
                 count_built_ways += built_ways
                 count_built_areas += built_areas
+    os.remove(sorted_located_refs_path)
 
-    if count_remaining_ways > 0:
-        arcpy.AddWarning(
-            '{} ways have been left unprocessed. This indicates that the nodes for those ways could not be found.'.format(
-                count_remaining_ways
-            ))
+    warn_remaining_ways(count_remaining_ways, clipped)
 
-    arcpy.AddMessage('Total built lines: {}, Total built areas: {}'.format(count_built_ways, count_built_areas))
+    osm_metrics.add_elements(count_built_ways + count_built_areas)
+    add_message('Total built lines: {}, Total built areas: {}, in {} chunks of nodes'.format(
+        count_built_ways,
+        count_built_areas,
+        passes
+    ))
 
 
 @timeit
-def process_way_chunk(nodes_dict, csv_way_nodes, build_way_csv_writer, build_areas_csv_writer):
+def process_way_chunk(nodes, pending_refs_path, pending_start, unresolved_refs_path, located_refs_file,
+                      pending_block_size=MAX_PENDING_BLOCK_SIZE):
+    """
+    Process a chunk of nodes loaded in-memory. Locate the pending references up to the largest identifier of the
+    chunk, and the references left unresolved by the previous chunks. The located references are appended to the
+    located file, and the unresolved references file is rewritten with the others.
+    :param nodes: A chunk of nodes loaded in memory, as a numpy array of NODE_DTYPE.
+    :param pending_refs_path: The record file of the node references of the ways not read yet, of WAY_NODE_REF_DTYPE
+    sorted by node identifier.
+    :param pending_start: The number of pending references already read.
+    :param unresolved_refs_path: The record file of the references read but not located yet, of WAY_NODE_REF_DTYPE.
+    :param located_refs_file: The file where the located references are appended, as LOCATED_REF_DTYPE.
+    :param pending_block_size: The number of references located at once.
+    :return: The number of pending references read after this chunk.
+    """
+    node_ids = nodes['id']
+    if len(node_ids) > 1 and not numpy.all(node_ids[1:] > node_ids[:-1]):
+        nodes = nodes[numpy.argsort(node_ids, kind='mergesort')]
+        node_ids = nodes['id']
+    last_node_id = node_ids[-1]
+
+    count_located = 0
+    count_read = 0
+    unresolved_refs_temp = unresolved_refs_path + '_temp'
+    with open(unresolved_refs_temp, 'wb') as unresolved_refs_file:
+        for refs in iter_record_blocks(unresolved_refs_path, WAY_NODE_REF_DTYPE, pending_block_size):
+            located, unresolved = locate_references(nodes, refs)
+            located.tofile(located_refs_file)
+            unresolved.tofile(unresolved_refs_file)
+            count_located += len(located)
+
+        # The pending references are sorted by node identifier: the ones after the last node of the chunk are left
+        # for the following chunks.
+        for refs in iter_record_blocks(pending_refs_path, WAY_NODE_REF_DTYPE, pending_block_size, start=pending_start):
+            cut = int(numpy.searchsorted(refs['node'], last_node_id, side='right'))
+            located, unresolved = locate_references(nodes, refs[:cut])
+            located.tofile(located_refs_file)
+            unresolved.tofile(unresolved_refs_file)
+            count_located += len(located)
+            count_read += cut
+            if cut < len(refs):
+                break
+        count_unresolved = unresolved_refs_file.tell() // WAY_NODE_REF_DTYPE.itemsize
+
+    os.remove(unresolved_refs_path)
+    os.rename(unresolved_refs_temp, unresolved_refs_path)
+
+    pending_start += count_read
+    add_message('Statistics for node chunk: {} references located, {} references unresolved, {} references left to '
+                'read'.format(
+                    count_located,
+                    count_unresolved,
+                    count_records(pending_refs_path, WAY_NODE_REF_DTYPE) - pending_start
+                ))
+
+    return pending_start
+
+
+def explode_way_nodes(way_nodes_path, block_size=1000000):
+    """
+    Explode the ways of the way_nodes file into one record per node reference. Each record holds the node identifier
+    and the position of the reference in the values of the way_nodes file.
+    :param way_nodes_path: The list file that contains the association between ways and nodes.
+    :param block_size: The number of references of a block.
+    :return: A generator of numpy arrays of WAY_NODE_REF_DTYPE.
+    """
+    position = 0
+    for values in iter_list_values(way_nodes_path, REF_DTYPE, block_size):
+        refs = numpy.empty(len(values), dtype=WAY_NODE_REF_DTYPE)
+        refs['node'] = values
+        refs['position'] = numpy.arange(position, position + len(values), dtype=numpy.int64)
+        position += len(values)
+        yield refs
+
+
+def iter_ordered_node_blocks(nodes_path, block_size=1000000):
     """
-    Process a chunk of nodes loaded in-memory. Associated then with ways and write lines and polygons to a csv file.
-    :param nodes_dict: A chunk of nodes loaded in memory.
-    :param csv_way_nodes: The csv that contains the association between ways and nodes.
-    :param build_way_csv_writer: The csv writer files where line geometries will be written
-    :param build_areas_csv_writer: The csv writer file where polygons geometries will be written.
+    Read the nodes file by blocks, checking that the nodes are ordered by identifier.
+    :param nodes_path: The record file containing nodes.
+    :param block_size: The number of nodes of a block.
+    :return: A generator of numpy arrays of NODE_DTYPE.
+    """
+    previous_id = None
+    for nodes in iter_record_blocks(nodes_path, NODE_DTYPE, block_size):
+        node_ids = nodes['id']
+        if (previous_id is not None and node_ids[0] < previous_id) or numpy.any(node_ids[1:] < node_ids[:-1]):
+            raise ValueError('Nodes are not ordered by identifier. Use the {} join method.'.format(JOIN_CHUNKED))
+        previous_id = node_ids[-1]
+        yield nodes
+
+
+def locate_way_nodes(nodes_path, way_node_refs_path, block_size=1000000):
+    """
+    Merge join the node references sorted by node identifier with the nodes file, that is expected to be ordered by
+    node identifier like the OSM file it comes from. Both files are read by blocks.
+    :param nodes_path: The record file containing nodes.
+    :param way_node_refs_path: The node references sorted by node identifier, as produced by explode_way_nodes.
+    :param block_size: The number of records of a block.
+    :return: A generator of numpy arrays of LOCATED_REF_DTYPE, holding the position of each reference and the
+    coordinates of its node. The latitude is MISSING_COORDINATE when the node could not be found.
+    """
+    node_blocks = iter_ordered_node_blocks(nodes_path, block_size)
+    ref_blocks = iter_record_blocks(way_node_refs_path, WAY_NODE_REF_DTYPE, block_size)
+    nodes = next(node_blocks, None)
+    refs = next(ref_blocks, None)
+    while refs is not None:
+        # The references up to the last node of the current block of nodes can only match nodes of this block.
+        head_nodes = nodes
+        if nodes is None:
+            head = refs
+            refs = next(ref_blocks, None)
+        else:
+            cut = numpy.searchsorted(refs['node'], nodes['id'][-1], side='right')
+            head = refs[:cut]
+            if cut == len(refs):
+                refs = next(ref_blocks, None)
+            else:
+                refs = refs[cut:]
+                nodes = next(node_blocks, None)
+        if len(head) == 0:
+            continue
+
+        located = numpy.empty(len(head), dtype=LOCATED_REF_DTYPE)
+        located['position'] = head['position']
+        located['lon'] = 0
+        located['lat'] = MISSING_COORDINATE
+        if head_nodes is not None:
+            positions = numpy.searchsorted(head_nodes['id'], head['node'])
+            positions[positions == len(head_nodes)] = 0
+            found = head_nodes['id'][positions] == head['node']
+            located['lon'][found] = head_nodes['lon'][positions[found]]
+            located['lat'][found] = head_nodes['lat'][positions[found]]
+        yield located
+
+
+@timeit
+def build_ways_sort_merge(nodes_path, way_nodes_path, built_ways_path, built_areas_path, processing_folder,
+                          run_size=500000, clipped=False):
+    """
+    Derive geometries from way lines and way polygons from the nodes and way_nodes files. The node references of the
+    ways are sorted by node identifier, merged with the nodes file, and then sorted back in the order of the way_nodes
+    file, so that the join costs a constant number of sequential passes over the files whatever the number of nodes.
+    :param nodes_path: The record file containing nodes.
+    :param way_nodes_path: The list file containing the way / nodes association.
+    :param built_ways_path: The output list file where line geometries will be written
+    :param built_areas_path: The output list file where polygons geometries will be written.
+    :param processing_folder: The folder where the intermediate sorted files are written.
+    :param run_size: The number of records sorted in memory at once.
+    :param clipped: If True, the nodes outside of the clip area are missing, and the ways are built from their nodes
+    inside of it (see write_built_ways).
     :return:
     """
-    # Local copies of global variable. Referencing local variables in faster in python than global ones.
-    identifier_delimiter = IDENTIFIER_DELIMITER
+    add_message('Building ways')
+
+    way_node_refs = os.path.join(processing_folder, WAY_NODE_REFS_FILE)
+    located_way_nodes = os.path.join(processing_folder, LOCATED_WAY_NODES_FILE)
+
+    count_refs = external_sort_records(
+        explode_way_nodes(way_nodes_path),
+        WAY_NODE_REF_DTYPE,
+        'node',
+        way_node_refs,
+        processing_folder,
+        run_size
+    )
+    add_message('Sorted {} way node references by node identifier'.format(count_refs))
+
+    external_sort_records(
+        locate_way_nodes(nodes_path, way_node_refs),
+        LOCATED_REF_DTYPE,
+        'position',
+        located_way_nodes,
+        processing_folder,
+        run_size
+    )
+    os.remove(way_node_refs)
+    add_message('Regrouped located way node references by way')
 
     count_remaining_ways = 0
     count_built_ways = 0
     count_built_areas = 0
-    csv_way_nodes_temp = csv_way_nodes + '_temp'
-    with open(csv_way_nodes, 'r') as csv_way_nodes_file:
-        with open(csv_way_nodes_temp, 'w') as csv_way_nodes_file_temp:
-                    reader = csv.reader(csv_way_nodes_file, delimiter=CSV_DELIMITER)
-                    writer = csv.writer(csv_way_nodes_file_temp, delimiter=CSV_DELIMITER)
-                    for row in reader:
-                        identifier = row[0]
-                        nodes = row[1].split(identifier_delimiter)
-                        coordinates = row[2].split(identifier_delimiter)
-                        is_linear = row[3]
-
-                        completed = True
-                        for index, node_id in enumerate(nodes):
-                            if node_id in nodes_dict:
-                                node = nodes_dict[node_id]
-                                coordinates[index] = node
-                            elif coordinates[index] == '':
-                                completed = False
-
-                        if completed:
-                            csv_array = [
-                                identifier,
-                                identifier_delimiter.join(coordinates)
-                            ]
-                            if nodes[-1] == nodes[0] and is_linear == 'n':
-                                count_built_areas += 1
-                                build_areas_csv_writer.writerow(csv_array)
-                            else:
-                                count_built_ways += 1
-                                build_way_csv_writer.writerow(csv_array)
-                        else:
-                            count_remaining_ways += 1
-                            csv_array = [
-                                identifier,
-                                row[1],
-                                identifier_delimiter.join(coordinates),
-                                is_linear
-                            ]
-
-                            writer.writerow(csv_array)
-
-    os.remove(csv_way_nodes)
-    os.rename(csv_way_nodes_temp, csv_way_nodes)
-
-    arcpy.AddMessage('Statistics for node chunk: {} remaining ways to build, {} built lines, {} built areas'.format(
-        count_remaining_ways,
-        count_built_ways,
-        count_built_areas
-    ))
+    with ListWriter(built_ways_path, COORDINATES_DTYPE) as built_ways_writer:
+        with ListWriter(built_areas_path, COORDINATES_DTYPE) as built_areas_writer:
+            with open(located_way_nodes, 'rb') as located_way_nodes_file:
+                for block in iter_list_blocks(way_nodes_path, REF_DTYPE):
+                    located = numpy.fromfile(located_way_nodes_file, dtype=LOCATED_REF_DTYPE, count=len(block.values))
+                    built_ways, built_areas, remaining = write_built_ways(
+                        block,
+                        block.values,
+                        to_coordinates(located['lon'], located['lat']),
+                        located['lat'] != MISSING_COORDINATE,
+                        built_ways_writer,
+                        built_areas_writer,
+                        clipped
+                    )
+                    count_remaining_ways += int(remaining.sum())
+                    count_built_ways += built_ways
+                    count_built_areas += built_areas
+
+    os.remove(located_way_nodes)
+
+    warn_remaining_ways(count_remaining_ways, clipped)
+
+    osm_metrics.add_elements(count_built_ways + count_built_areas)
+    add_message('Total built lines: {}, Total built areas: {}'.format(count_built_ways, count_built_areas))
 
-    return count_remaining_ways, count_built_ways, count_built_areas
+
+@timeit
+def build_ways_node_store(node_store, way_nodes_path, built_ways_path, built_areas_path, batch_size=10000,
+                          clipped=False):
+    """
+    Derive geometries from way lines and way polygons from a node location store and the way_nodes file. Every way is
+    resolved in a single pass over the way_nodes file. The node lists of a batch of ways are looked up at once.
+    :param node_store: The node location store filled during the import.
+    :param way_nodes_path: The list file containing the way / nodes association.
+    :param built_ways_path: The output list file where line geometries will be written
+    :param built_areas_path: The output list file where polygons geometries will be written.
+    :param batch_size: The number of ways looked up at once.
+    :param clipped: If True, the nodes outside of the clip area are missing, and the ways are built from their nodes
+    inside of it (see write_built_ways).
+    :return:
+    """
+    add_message('Building ways')
+
+    count_remaining_ways = 0
+    count_built_ways = 0
+    count_built_areas = 0
+    with ListWriter(built_ways_path, COORDINATES_DTYPE) as built_ways_writer:
+        with ListWriter(built_areas_path, COORDINATES_DTYPE) as built_areas_writer:
+            for block in iter_list_blocks(way_nodes_path, REF_DTYPE, batch_size):
+                coordinates, found = node_store.lookup(block.values)
+                built_ways, built_areas, remaining = write_built_ways(
+                    block,
+                    block.values,
+                    to_coordinates(coordinates[:, 0], coordinates[:, 1]),
+                    found,
+                    built_ways_writer,
+                    built_areas_writer,
+                    clipped
+                )
+                count_remaining_ways += int(remaining.sum())
+                count_built_ways += built_ways
+                count_built_areas += built_areas
+
+    warn_remaining_ways(count_remaining_ways, clipped)
+
+    osm_metrics.add_elements(count_built_ways + count_built_areas)
+    add_message('Total built lines: {}, Total built areas: {}'.format(count_built_ways, count_built_areas))
 
 
 @timeit
-def build_lines(line_feature_class, build_ways_path):
+def order_built_ways(built_paths, spatial_order, processing_folder):
     """
-    Insert the content of the a csv file into a line feature class. The csv file is expected to contain an id and
-    a sequence of coordinates as text.
-    :param line_feature_class: The line feature class.
-    :param build_ways_path: The csv that contains the line features definition.
-    :return: None.
+    Reorder the built ways and built areas list files written by the joins, so that the lines and polygons are
+    inserted in spatial order. The key of a way is computed from the center of its bounding box.
+    :param built_paths: The list files.
+    :param spatial_order: SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY.
+    :param processing_folder: The folder of the temporary files of the sort.
+    :return: The number of ways.
     """
     count = 0
-    with arcpy.da.Editor(output_geodatabase) as edit:
-        with arcpy.da.InsertCursor(line_feature_class, [ID_FIELD.name, 'SHAPE@']) as insert_cursor:
-            with open(build_ways_path, 'rb') as build_ways_path_file:
-                csv_reader = csv.reader(build_ways_path_file, delimiter=CSV_DELIMITER)
-                for row in csv_reader:
-                    geometry_txt = row[1].split(IDENTIFIER_DELIMITER)
-                    geometries = [g.split(' ') for g in geometry_txt]
-                    point_array = []
-                    for geom in geometries:
-                        point_array.append((float(geom[0]), float(geom[1])))
-                    insert_cursor.insertRow((row[0], point_array))
-                    count += 1
+    for built_path in built_paths:
+        count += order_list_file(
+            built_path,
+            COORDINATES_DTYPE,
+            lambda block: coordinate_list_keys(block, spatial_order),
+            processing_folder
+        )
+    osm_metrics.add_elements(count)
+    add_message('Ordered {} built ways in {} order'.format(count, spatial_order.lower()))
+    return count
+
+
+def iter_way_features(built_path, way_rows, encode, batch_size=DEFAULT_BATCH_SIZE, trailing_values=(),
+                      tag_layout=None):
+    """
+    Prepare the rows inserted into a way feature class: the well-known binary geometry of each built way, followed by
+    its attributes. Ways without attributes are skipped.
+    :param built_path: The built ways or built areas list file.
+    :param way_rows: The RowStore holding the attribute values of the ways.
+    :param encode: The function encoding the coordinates of a way as well-known binary.
+    :param batch_size: The number of features converted at once.
+    :param trailing_values: Values appended to every row, after the attributes of the way.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: A generator of rows.
+    """
+    trailing_values = list(trailing_values)
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    for batch in iter_geometry_batches(built_path, batch_size):
+        rows = way_rows.lookup(numpy.array(batch.identifiers, dtype=numpy.int64))
+        for (identifier, coordinates), row in zip(batch.features(), rows):
+            if row is not None:
+                yield [encode(coordinates), identifier] + tag_layout.select(row, 1) + trailing_values
+
 
-    arcpy.AddMessage('Inserted {} line geometries'.format(count))
+def encode_way_polygon(coordinates):
+    """
+    Encode the coordinates of a closed way as a polygon with a single ring.
+    :param coordinates: The coordinates of the way.
+    :return: The well-known binary of the polygon.
+    """
+    return polygon_wkb([coordinates])
 
 
 @timeit
-def build_polygons(polygon_feature_class, built_areas_path):
+def build_lines(sink, line_layer, built_ways_path, way_rows, batch_size=DEFAULT_BATCH_SIZE, pipelined=False,
+                tag_layout=None):
     """
-    Insert the content of the a csv file into a polygon feature class. The csv file is expected to contain an id and
-    a sequence of coordinates as text. The first coordinates in the sequence must be the same than the last coordinates.
-    :param polygon_feature_class: The line feature class.
-    :param built_areas_path: The csv that contains the polygon features definition.
-    :return: None.
+    Insert the content of a built ways list file into a line layer, with the attributes of the ways. Ways without
+    attributes are not inserted.
+    :param sink: The OutputSink.
+    :param line_layer: The line layer.
+    :param built_ways_path: The list file that contains the line features definition.
+    :param way_rows: The RowStore holding the attribute values of the ways.
+    :param batch_size: The number of features converted and inserted at once.
+    :param pipelined: If True, the features are prepared in a separate thread, while this one inserts them.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: The number of features inserted.
     """
-    identifier_delimiter = IDENTIFIER_DELIMITER
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    way_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + tag_layout.layer_fields()
     count = 0
-    with arcpy.da.Editor(output_geodatabase) as edit:
-        with arcpy.da.InsertCursor(polygon_feature_class, [ID_FIELD.name, 'SHAPE@']) as insert_cursor:
-            with open(built_areas_path, 'r') as build_ways_path_file:
-                csv_reader = csv.reader(build_ways_path_file, delimiter=CSV_DELIMITER)
-                for row in csv_reader:
-                    geometry_txt = row[1].split(identifier_delimiter)
-                    geometries = [g.split(' ') for g in geometry_txt]
-                    point_array = [(float(geom[0]), float(geom[1])) for geom in geometries]
-                    insert_cursor.insertRow((row[0], point_array))
-                    count += 1
-    arcpy.AddMessage('Inserted {} polygon geometries'.format(count))
+    features = osm_pipeline.pipeline(
+        iter_way_features(built_ways_path, way_rows, linestring_wkb, batch_size, tag_layout=tag_layout),
+        'encode lines',
+        'insert lines',
+        pipelined
+    )
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(line_layer, way_all_attr), batch_size) as insert_cursor:
+            for feature in features:
+                insert_cursor.insertRow(feature)
+                count += 1
+
+    osm_metrics.add_elements(count)
+    add_message('Inserted {} lines'.format(count))
+    for message in osm_pipeline.report(features):
+        add_message(message)
+    return count
 
 
 @timeit
-def load_multipolygon_relations(multipolygons, multipolygon_member_temp_file, ways):
-    multipolygon_member_temp_file.seek(0)
-    coordinate_system = COORDINATES_SYSTEM
-    id_field_name = ID_FIELD.name
-    with arcpy.da.UpdateCursor(multipolygons, [id_field_name, 'SHAPE@']) as multipolygon_update_cursor:
-        for row in multipolygon_update_cursor:
-            line = multipolygon_member_temp_file.readline().rstrip('\n')
-            infos = line.split('|')
-            if row[0] != infos[0]:
-                arcpy.AddError('Identifiers mismatch: {} - {}'.format(row[0], infos[0]))
-
-            # Find the way members associated with this relation.Identifiers here should pertain only to ways elements.
-            member_identifiers = infos[1].split(',')
-            if len(member_identifiers) == 0:
-                arcpy.AddWarning('Relation with identifiers does not have any way identifier. Disregarded')
+def build_polygons(sink, polygon_layer, built_areas_path, way_rows, batch_size=DEFAULT_BATCH_SIZE, pipelined=False,
+                   tag_layout=None):
+    """
+    Insert the content of a built areas list file into a polygon layer, with the attributes of the ways. The first
+    coordinates of each feature must be the same than the last coordinates. Ways without attributes are not inserted.
+    :param sink: The OutputSink.
+    :param polygon_layer: The polygon layer.
+    :param built_areas_path: The list file that contains the polygon features definition.
+    :param way_rows: The RowStore holding the attribute values of the ways.
+    :param batch_size: The number of features converted and inserted at once.
+    :param pipelined: If True, the features are prepared in a separate thread, while this one inserts them.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: The number of features inserted.
+    """
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    way_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + tag_layout.layer_fields() + \
+        [OSM_TYPE_FIELD.name]
+    count = 0
+    features = osm_pipeline.pipeline(
+        iter_way_features(built_areas_path, way_rows, encode_way_polygon, batch_size, [OSM_TYPE_WAY], tag_layout),
+        'encode polygons',
+        'insert polygons',
+        pipelined
+    )
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(polygon_layer, way_all_attr), batch_size) as insert_cursor:
+            for feature in features:
+                insert_cursor.insertRow(feature)
+                count += 1
+
+    osm_metrics.add_elements(count)
+    add_message('Inserted {} polygons'.format(count))
+    for message in osm_pipeline.report(features):
+        add_message(message)
+    return count
+
+
+###################################
+# MULTIPOLYGONS
+###################################
+class WayGeometryIndex(object):
+    """
+    The coordinates of a set of built ways held in memory and keyed by way identifier: the sorted identifiers, and for
+    each of them the offset and the number of its coordinates in a single array of fixed point coordinates, and the
+    identifiers of its first and last nodes.
+    """
+
+    def __init__(self, identifiers, starts, counts, coordinates, first_nodes, last_nodes):
+        """
+        :param identifiers: A numpy array of int64 way identifiers.
+        :param starts: A numpy array of the offsets of the first coordinates of each way.
+        :param counts: A numpy array of the number of coordinates of each way.
+        :param coordinates: A numpy array of COORDINATES_DTYPE.
+        :param first_nodes: A numpy array of the identifiers of the first node of each way.
+        :param last_nodes: A numpy array of the identifiers of the last node of each way.
+        """
+        order = numpy.argsort(identifiers, kind='mergesort')
+        self.identifiers = identifiers[order]
+        self.starts = starts[order]
+        self.counts = counts[order]
+        self.coordinates = coordinates
+        self.first_nodes = first_nodes[order]
+        self.last_nodes = last_nodes[order]
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    @classmethod
+    def from_built_files(cls, built_paths, way_nodes_path, selected_identifiers):
+        """
+        Load the ways of built ways or built areas list files.
+        :param built_paths: The list files, as written by the joins.
+        :param way_nodes_path: The list file containing the way / nodes association, to read the end nodes of the ways.
+        :param selected_identifiers: A sorted numpy array of the identifiers of the ways to load.
+        :return: The WayGeometryIndex.
+        """
+        identifiers = [numpy.zeros(0, dtype=numpy.int64)]
+        counts = [numpy.zeros(0, dtype=numpy.int64)]
+        coordinates = [numpy.zeros(0, dtype=COORDINATES_DTYPE)]
+        for built_path in built_paths:
+            for block in iter_list_blocks(built_path, COORDINATES_DTYPE):
+                index, values = block.select(contains_identifiers(selected_identifiers, block.index['id']))
+                identifiers.append(index['id'])
+                counts.append(index['count'].astype(numpy.int64))
+                coordinates.append(values)
+        counts = numpy.concatenate(counts)
+        identifiers = numpy.concatenate(identifiers)
+
+        end_identifiers = [numpy.zeros(0, dtype=numpy.int64)]
+        first_nodes = [numpy.zeros(0, dtype=numpy.int64)]
+        last_nodes = [numpy.zeros(0, dtype=numpy.int64)]
+        for block in iter_list_blocks(way_nodes_path, REF_DTYPE):
+            selected = contains_identifiers(selected_identifiers, block.index['id'])
+            end_identifiers.append(block.index['id'][selected])
+            first_nodes.append(block.values[block.starts[selected]])
+            last_nodes.append(block.values[block.ends[selected] - 1])
+        end_identifiers = numpy.concatenate(end_identifiers)
+        order = numpy.argsort(end_identifiers, kind='mergesort')
+        positions = order[numpy.searchsorted(end_identifiers[order], identifiers)]
+
+        return cls(
+            identifiers,
+            numpy.cumsum(counts) - counts,
+            counts,
+            numpy.concatenate(coordinates),
+            numpy.concatenate(first_nodes)[positions],
+            numpy.concatenate(last_nodes)[positions]
+        )
+
+    def get(self, identifier):
+        """
+        Get the coordinates and the end nodes of a way.
+        :param identifier: The way identifier, as a number or as text.
+        :return: A tuple with a numpy array of float64 (x, y) pairs in decimal degrees and the identifiers of the first
+        and last nodes of the way, or None if the way is not part of the index.
+        """
+        position = numpy.searchsorted(self.identifiers, int(identifier))
+        if position == len(self.identifiers) or self.identifiers[position] != int(identifier):
+            return None
+        start = self.starts[position]
+        coordinates = self.coordinates[start:start + self.counts[position]]
+        return (
+            numpy.column_stack((to_degrees(coordinates['lon']), to_degrees(coordinates['lat']))),
+            int(self.first_nodes[position]),
+            int(self.last_nodes[position])
+        )
+
+
+def assemble_rings(member_ways):
+    """
+    Assemble the member ways of a multipolygon into closed rings. Closed ways are rings on their own. Open ways are
+    joined end to end by their shared end nodes, found with a dictionary of the end nodes of the ways.
+    :param member_ways: A list of (coordinates, first node, last node, role) tuples.
+    :return: A tuple with the list of (coordinates, role) rings, and the number of member ways that could not be
+    closed into a ring. The role of a ring is the role of its first way.
+    """
+    rings = []
+    open_ways = []
+    for member_way in member_ways:
+        if member_way[1] == member_way[2]:
+            rings.append((member_way[0], member_way[3]))
+        else:
+            open_ways.append(member_way)
+
+    end_nodes = {}
+    for index, (coordinates, first_node, last_node, role) in enumerate(open_ways):
+        end_nodes.setdefault(first_node, []).append(index)
+        end_nodes.setdefault(last_node, []).append(index)
+
+    count_unclosed = 0
+    used = [False] * len(open_ways)
+    for index, (coordinates, start_node, end_node, role) in enumerate(open_ways):
+        if used[index]:
+            continue
+        used[index] = True
+        parts = [coordinates]
+        count_ways = 1
+        while end_node != start_node:
+            following = None
+            for candidate in end_nodes[end_node]:
+                if not used[candidate]:
+                    following = candidate
+                    break
+            if following is None:
+                break
+            used[following] = True
+            count_ways += 1
+            following_coordinates, first_node, last_node, following_role = open_ways[following]
+            if first_node == end_node:
+                parts.append(following_coordinates[1:])
+                end_node = last_node
+            else:
+                parts.append(following_coordinates[-2::-1])
+                end_node = first_node
+        if end_node == start_node:
+            rings.append((numpy.concatenate(parts), role))
+        else:
+            count_unclosed += count_ways
+
+    return [ring for ring in rings if len(ring[0]) >= 4], count_unclosed
+
+
+def ring_signed_area(ring):
+    """
+    Compute the signed area of a closed ring, positive when the ring is counter clockwise.
+    :param ring: A numpy array of float64 (x, y) pairs, the last pair being the same than the first one.
+    :return: The signed area.
+    """
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return 0.5 * float(numpy.dot(x[:-1], y[1:]) - numpy.dot(x[1:], y[:-1]))
+
+
+def ring_contains(ring, points):
+    """
+    Tell which points are inside a closed ring, with a ray casting over the edges of the ring.
+    :param ring: A numpy array of float64 (x, y) pairs, the last pair being the same than the first one.
+    :param points: A numpy array of float64 (x, y) pairs.
+    :return: A numpy array of booleans.
+    """
+    x1 = ring[:-1, 0]
+    y1 = ring[:-1, 1]
+    x2 = ring[1:, 0]
+    y2 = ring[1:, 1]
+    px = points[:, 0:1]
+    py = points[:, 1:2]
+    crossing = (y1 > py) != (y2 > py)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        crossing &= px < (x2 - x1) * (py - y1) / (y2 - y1) + x1
+    return numpy.logical_xor.reduce(crossing, axis=1)
+
+
+# The number of vertices of a ring tested against the other rings to find the rings containing it.
+CONTAINMENT_SAMPLE_SIZE = 16
+
+
+def nest_rings(rings):
+    """
+    Classify the rings of a multipolygon by containment: a ring inside an even number of other rings is an outer
+    ring, otherwise it is an inner ring, a hole of the smallest ring containing it. A ring is inside another one when
+    most of its vertices are, so that rings touching each other are still classified.
+    :param rings: A list of (coordinates, role) rings.
+    :return: A tuple with the list of polygons, each one a list of rings with the outer ring first, clockwise, and
+    the inner rings counter clockwise, and the number of rings whose role does not match their classification.
+    """
+    areas = [ring_signed_area(coordinates) for coordinates, role in rings]
+    order = sorted(range(len(rings)), key=lambda index: -abs(areas[index]))
+    extents = [(coordinates.min(axis=0), coordinates.max(axis=0)) for coordinates, role in rings]
+
+    parents = {}
+    depths = {}
+    placed = []
+    for index in order:
+        coordinates = rings[index][0]
+        step = max(1, (len(coordinates) - 1) // CONTAINMENT_SAMPLE_SIZE)
+        sample = coordinates[:-1:step]
+        parent = None
+        # The rings are placed from the largest to the smallest, so the first container found is the smallest one.
+        for candidate in reversed(placed):
+            candidate_min, candidate_max = extents[candidate]
+            if (extents[index][0] < candidate_min).any() or (extents[index][1] > candidate_max).any():
                 continue
+            if ring_contains(rings[candidate][0], sample).mean() > 0.5:
+                parent = candidate
+                break
+        parents[index] = parent
+        depths[index] = 0 if parent is None else depths[parent] + 1
+        placed.append(index)
+
+    count_role_mismatches = 0
+    polygons = {}
+    for index in order:
+        coordinates, role = rings[index]
+        if depths[index] % 2 == 0:
+            if role == 'inner':
+                count_role_mismatches += 1
+            polygons[index] = [coordinates if areas[index] < 0 else coordinates[::-1]]
+        else:
+            if role == 'outer':
+                count_role_mismatches += 1
+            polygons[parents[index]].append(coordinates if areas[index] > 0 else coordinates[::-1])
+
+    return [polygons[index] for index in order if depths[index] % 2 == 0], count_role_mismatches
+
+
+def multipolygon_geometry(member_ways):
+    """
+    Assemble the geometry of a multipolygon: the member ways are assembled into rings, which are nested into polygons
+    with holes.
+    :param member_ways: A list of (coordinates, first node, last node, role) tuples, as described in assemble_rings.
+    :return: A tuple with the well-known binary or None if no ring could be closed, the number of unclosed member ways
+    and the number of role mismatches.
+    """
+    rings, unclosed = assemble_rings(member_ways)
+    if len(rings) == 0:
+        return None, unclosed, 0
+    polygons, role_mismatches = nest_rings(rings)
+    return multipolygon_wkb(polygons), unclosed, role_mismatches
 
-            # Fetch the ways associated with the identifiers
-            where_clause = '{} IN (\'{}\')'.format(
-                id_field_name,
-                '\',\''.join(member_identifiers)
-            )
 
-            shape = arcpy.Array()
-            shape_added = 0
-            with arcpy.da.SearchCursor(ways, [id_field_name, 'SHAPE@'], where_clause=where_clause) as ways_search_cursor:
-                for way_row in ways_search_cursor:
-                    if way_row[1] is not None:
-                        for part in way_row[1]:
-                            shape.add(part)
-                            shape_added += 1
+def iter_multipolygon_geometries(csv_relations_members, way_index):
+    """
+    Assemble the geometry of each multipolygon listed in the members file. The member ways are assembled into rings,
+    which are nested into polygons with holes.
+    :param csv_relations_members: The file associating the multipolygons with their member ways.
+    :param way_index: The WayGeometryIndex of the member ways.
+    :return: A generator of tuples (relation identifier, number of member ways, well-known binary or None, number of
+    unclosed member ways, number of role mismatches), in the order of the members file.
+    """
+    for relation_id, member_identifiers, member_roles in iter_multipolygon_members(csv_relations_members):
+        member_ways = []
+        seen_identifiers = set()
+        for identifier, role in zip(member_identifiers, member_roles):
+            way = way_index.get(identifier)
+            if way is None or identifier in seen_identifiers:
+                continue
+            seen_identifiers.add(identifier)
+            member_ways.append(way + (role,))
 
-            if shape_added > 0:
-                row[1] = arcpy.Polygon(shape, coordinate_system)
-                multipolygon_update_cursor.updateRow(row)
+        wkb, unclosed, role_mismatches = multipolygon_geometry(member_ways)
+        yield relation_id, len(member_identifiers), wkb, unclosed, role_mismatches
 
 
 @timeit
-def join_way_attribute(geometry_feature_class, attribute_table, output_feature_class):
-
-    # Make a feature class layer
-    feature_class_layer = 'v_feature_class'
-    arcpy.MakeFeatureLayer_management(geometry_feature_class, feature_class_layer)
-
-    try:
-        arcpy.AddJoin_management(
-            feature_class_layer,
-            ID_FIELD.name,
-            attribute_table,
-            ID_FIELD.name,
-            join_type='KEEP_COMMON'
-        )
+def load_multipolygon_relations(sink, polygon_layer, csv_relations_members, multipolygon_rows, way_index,
+                                batch_size=DEFAULT_BATCH_SIZE, pipelined=False, tag_layout=None):
+    """
+    Build the geometries of the multipolygons from the coordinates of their member ways, and insert them into the
+    polygon layer with the attributes of the relations.
+    :param sink: The OutputSink.
+    :param polygon_layer: The polygon layer.
+    :param csv_relations_members: The file associating the multipolygons with their member ways.
+    :param multipolygon_rows: The RowStore holding the attribute values of the multipolygons.
+    :param way_index: The WayGeometryIndex of the member ways.
+    :param batch_size: The number of features inserted at once.
+    :param pipelined: If True, the geometries are assembled in a separate thread, while this one inserts them.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: The number of multipolygons inserted.
+    """
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    multipolygon_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + \
+        tag_layout.layer_fields() + [OSM_TYPE_FIELD.name]
+    count_built = 0
+    count_inserted = 0
+    count_unclosed = 0
+    count_role_mismatches = 0
+    geometries = osm_pipeline.pipeline(
+        iter_multipolygon_geometries(csv_relations_members, way_index),
+        'assemble multipolygons',
+        'insert multipolygons',
+        pipelined
+    )
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(polygon_layer, multipolygon_all_attr), batch_size) as insert_cursor:
+            for relation_id, count_members, wkb, unclosed, role_mismatches in geometries:
+                row = multipolygon_rows.lookup([int(relation_id)])[0]
+                if row is None:
+                    add_error('No attributes for the relation with identifier {}'.format(relation_id))
+                    continue
+
+                # Identifiers here should pertain only to ways elements.
+                if count_members == 0:
+                    add_warning('Relation with identifier {} does not have any way identifier. Disregarded'.format(
+                        relation_id
+                    ))
+                else:
+                    count_unclosed += unclosed
+                    count_role_mismatches += role_mismatches
+                    if wkb is not None:
+                        count_built += 1
+
+                insert_cursor.insertRow([wkb, relation_id] + tag_layout.select(row, 1) + [OSM_TYPE_RELATION])
+                count_inserted += 1
+
+    osm_metrics.add_elements(count_inserted)
+    add_message('Built {} multipolygon geometries'.format(count_built))
+    if count_unclosed > 0:
+        add_warning('{} multipolygon member ways could not be assembled into closed rings'.format(count_unclosed))
+    if count_role_mismatches > 0:
+        add_message('{} multipolygon rings have a role that does not match their position'.format(
+            count_role_mismatches
+        ))
+    for message in osm_pipeline.report(geometries):
+        add_message(message)
+    return count_inserted
 
-        table_base_name = arcpy.Describe(attribute_table).name
-
-        field_mappings = arcpy.FieldMappings()
-        fields = arcpy.ListFields(feature_class_layer)
-        for f in fields:
-            alias_name = f.aliasName
-            alias_info = alias_name.split('.')
-
-            field_name = f.baseName
-            if f.baseName.upper() not in ['OBJECTID', 'SHAPE']:
-                if not (alias_info[0].lower() == table_base_name.lower() and field_name == ID_FIELD.name):
-                    field_map = arcpy.FieldMap()
-                    field_map.addInputField(feature_class_layer, f.aliasName)
-                    output_field = field_map.outputField
-                    output_field.name = field_name
-                    output_field.aliasName = field_name
-                    field_map.outputField = output_field
-                    field_mappings.addFieldMap(field_map)
-
-        arcpy.FeatureClassToFeatureClass_conversion(
-            feature_class_layer,
-            os.path.dirname(output_feature_class),
-            os.path.basename(output_feature_class),
-            field_mapping=field_mappings
-        )
-        arcpy.RemoveJoin_management(feature_class_layer)
 
-    except Exception:
-        raise
-    finally:
-        arcpy.Delete_management(feature_class_layer)
+###################################
+# ROUTES AND BOUNDARIES
+###################################
+class RelationResolver(object):
+    """
+    Resolve the route and boundary relations into their member ways, following their nested relations: a route
+    master into its routes, a super route into its sections. The member ways of each relation are resolved once and
+    memoized, so that a relation nested in several others is only read once. A cycle of relations is broken at the
+    relation met twice.
+    """
+
+    def __init__(self, relation_index):
+        """
+        :param relation_index: The RelationMemberIndex.
+        """
+        self.relation_index = relation_index
+        self._resolved = {}
+
+    @staticmethod
+    def keeps_member(kind, role):
+        """
+        :param kind: The kind of the relation.
+        :param role: The role of a member.
+        :return: True if the member is part of the geometry of the relation.
+        """
+        if kind == RELATION_BOUNDARY:
+            return role in BOUNDARY_AREA_ROLES
+        if kind == RELATION_ROUTE:
+            return not role.startswith(ROUTE_EXCLUDED_ROLE_PREFIXES)
+        return True
+
+    def resolve(self, relation_id):
+        """
+        :param relation_id: A relation identifier.
+        :return: A list of (way identifier, role) tuples, the member ways of the relation and of its nested relations
+        in the order of the relation. Nested relations missing from the index are left out.
+        """
+        relation_id = int(relation_id)
+        resolved = self._resolved.get(relation_id)
+        if resolved is not None:
+            return resolved
+        # The relation resolves to nothing while its members are resolved, which breaks the cycles.
+        self._resolved[relation_id] = []
+        kind = self.relation_index.kind(relation_id)
+        resolved = []
+        for member_type, ref, role in self.relation_index.members(relation_id) or []:
+            if not self.keeps_member(kind, role):
+                continue
+            if member_type == MEMBER_WAY:
+                resolved.append((ref, role))
+            elif member_type == MEMBER_RELATION:
+                resolved.extend(self.resolve(ref))
+        self._resolved[relation_id] = resolved
+        return resolved
+
+    def resolve_all(self, relation_ids):
+        """
+        Resolve relations, without duplicated ways.
+        :param relation_ids: The relation identifiers.
+        :return: A list of (relation identifier, list of (way identifier, role) tuples) tuples.
+        """
+        relations = []
+        for relation_id in relation_ids:
+            seen = set()
+            ways = []
+            for way_id, role in self.resolve(relation_id):
+                if way_id not in seen:
+                    seen.add(way_id)
+                    ways.append((way_id, role))
+            relations.append((int(relation_id), ways))
+        return relations
+
+
+class SharedWayCache(object):
+    """
+    The geometries of the member ways of a set of relations, each one computed once. The geometry of a way used by
+    several relations is kept until its last use, the others are not kept at all.
+    """
+
+    def __init__(self, compute, relations):
+        """
+        :param compute: The function computing the geometry of a way from its identifier.
+        :param relations: The resolved relations, as returned by RelationResolver.resolve_all, in the order they are
+        processed.
+        """
+        self.compute = compute
+        self.uses = {}
+        for relation_id, ways in relations:
+            for way_id, role in ways:
+                self.uses[way_id] = self.uses.get(way_id, 0) + 1
+        self.uses = dict((way_id, count) for way_id, count in self.uses.items() if count > 1)
+        self.count_computed = 0
+        self._geometries = {}
+
+    def get(self, way_id):
+        """
+        :param way_id: A way identifier.
+        :return: The geometry of the way.
+        """
+        if way_id in self._geometries:
+            geometry = self._geometries[way_id]
+        else:
+            geometry = self.compute(way_id)
+            self.count_computed += 1
+        remaining = self.uses.get(way_id)
+        if remaining is not None:
+            if remaining > 1:
+                self.uses[way_id] = remaining - 1
+                self._geometries[way_id] = geometry
+            else:
+                del self.uses[way_id]
+                self._geometries.pop(way_id, None)
+        return geometry
+
+
+def read_resolved_way_identifiers(relations):
+    """
+    :param relations: The resolved relations, as returned by RelationResolver.resolve_all.
+    :return: A sorted numpy array of the identifiers of their member ways, without duplicates.
+    """
+    identifiers = [way_id for relation_id, ways in relations for way_id, role in ways]
+    return numpy.unique(numpy.array(identifiers, dtype=numpy.int64))
+
+
+def kept_relations(relation_index, relation_rows, kind):
+    """
+    :param relation_index: The RelationMemberIndex.
+    :param relation_rows: The RowStore holding the attribute values of the relations kept by the import.
+    :param kind: A kind of relation.
+    :return: A numpy array of the identifiers of the relations of this kind kept by the import.
+    """
+    identifiers = relation_index.relation_identifiers(kind)
+    if len(identifiers) == 0 or len(relation_rows) == 0:
+        return identifiers[:0]
+    return identifiers[contains_identifiers(numpy.asarray(relation_rows.index['id']), identifiers)]
+
+
+def iter_boundary_geometries(relations, way_cache):
+    """
+    Assemble the geometry of each boundary, like a multipolygon.
+    :param relations: The resolved boundaries, as returned by RelationResolver.resolve_all.
+    :param way_cache: The SharedWayCache of the member ways, computing them with WayGeometryIndex.get.
+    :return: A generator of tuples (relation identifier, number of member ways, well-known binary or None, number of
+    unclosed member ways, number of role mismatches).
+    """
+    for relation_id, ways in relations:
+        member_ways = []
+        for way_id, role in ways:
+            way = way_cache.get(way_id)
+            if way is not None:
+                member_ways.append(way + (role,))
+        wkb, unclosed, role_mismatches = multipolygon_geometry(member_ways)
+        yield relation_id, len(ways), wkb, unclosed, role_mismatches
+
+
+def iter_route_geometries(relations, way_cache):
+    """
+    Assemble the geometry of each route: a multilinestring of its member ways.
+    :param relations: The resolved routes, as returned by RelationResolver.resolve_all.
+    :param way_cache: The SharedWayCache of the member ways, encoding them with linestring_wkb.
+    :return: A generator of tuples (relation identifier, number of member ways, well-known binary or None).
+    """
+    for relation_id, ways in relations:
+        lines = [line for line in (way_cache.get(way_id) for way_id, role in ways) if line is not None]
+        yield relation_id, len(ways), multilinestring_wkb(lines) if len(lines) > 0 else None
+
+
+def way_line_wkb(way_index, way_id):
+    way = way_index.get(way_id)
+    return None if way is None else linestring_wkb(way[0])
+
+
+@timeit
+def load_boundary_relations(sink, polygon_layer, relations, relation_rows, way_index, batch_size=DEFAULT_BATCH_SIZE,
+                            pipelined=False, tag_layout=None):
+    """
+    Build the geometries of the boundaries from the coordinates of their member ways, and insert them into the polygon
+    layer with the attributes of the relations.
+    :param sink: The OutputSink.
+    :param polygon_layer: The polygon layer.
+    :param relations: The resolved boundaries, as returned by RelationResolver.resolve_all.
+    :param relation_rows: The RowStore holding the attribute values of the relations.
+    :param way_index: The WayGeometryIndex of the member ways.
+    :param batch_size: The number of features inserted at once.
+    :param pipelined: If True, the geometries are assembled in a separate thread, while this one inserts them.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: The number of boundaries inserted.
+    """
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    boundary_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + \
+        tag_layout.layer_fields() + [OSM_TYPE_FIELD.name]
+    way_cache = SharedWayCache(way_index.get, relations)
+    count_built = 0
+    count_inserted = 0
+    count_unclosed = 0
+    geometries = osm_pipeline.pipeline(
+        iter_boundary_geometries(relations, way_cache),
+        'assemble boundaries',
+        'insert boundaries',
+        pipelined
+    )
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(polygon_layer, boundary_all_attr), batch_size) as insert_cursor:
+            for relation_id, count_members, wkb, unclosed, role_mismatches in geometries:
+                row = relation_rows.lookup([relation_id])[0]
+                if row is None:
+                    continue
+                count_unclosed += unclosed
+                if wkb is not None:
+                    count_built += 1
+                insert_cursor.insertRow([wkb, str(relation_id)] + tag_layout.select(row, 1) + [OSM_TYPE_RELATION])
+                count_inserted += 1
+
+    osm_metrics.add_elements(count_inserted)
+    add_message('Built {} boundary geometries from {} member ways'.format(count_built, way_cache.count_computed))
+    if count_unclosed > 0:
+        add_warning('{} boundary member ways could not be assembled into closed rings'.format(count_unclosed))
+    for message in osm_pipeline.report(geometries):
+        add_message(message)
+    return count_inserted
 
 
 @timeit
-def append_polygons(source, destination):
-    arcpy.Append_management(source, destination)
+def load_route_relations(sink, route_layer, relations, relation_rows, way_index, batch_size=DEFAULT_BATCH_SIZE,
+                         pipelined=False, tag_layout=None):
+    """
+    Build the geometries of the routes from the coordinates of their member ways, and insert them into the route
+    layer with the attributes of the relations. The line of a way shared by several routes is encoded once.
+    :param sink: The OutputSink.
+    :param route_layer: The route layer.
+    :param relations: The resolved routes, as returned by RelationResolver.resolve_all.
+    :param relation_rows: The RowStore holding the attribute values of the relations.
+    :param way_index: The WayGeometryIndex of the member ways.
+    :param batch_size: The number of features inserted at once.
+    :param pipelined: If True, the geometries are assembled in a separate thread, while this one inserts them.
+    :param tag_layout: The TagFieldLayout of the layer. All the standard fields by default.
+    :return: The number of routes inserted.
+    """
+    tag_layout = tag_layout or TagFieldLayout(STANDARD_FIELDS_ARRAY)
+    route_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + tag_layout.layer_fields()
+    way_cache = SharedWayCache(lambda way_id: way_line_wkb(way_index, way_id), relations)
+    count_built = 0
+    count_inserted = 0
+    geometries = osm_pipeline.pipeline(
+        iter_route_geometries(relations, way_cache),
+        'assemble routes',
+        'insert routes',
+        pipelined
+    )
+    with sink.session() as edit:
+        with BatchedCursor(sink.insert_cursor(route_layer, route_all_attr), batch_size) as insert_cursor:
+            for relation_id, count_members, wkb in geometries:
+                row = relation_rows.lookup([relation_id])[0]
+                if row is None:
+                    continue
+                if count_members == 0:
+                    add_warning('Route with identifier {} does not have any member way'.format(relation_id))
+                if wkb is not None:
+                    count_built += 1
+                insert_cursor.insertRow([wkb, str(relation_id)] + tag_layout.select(row, 1))
+                count_inserted += 1
+
+    osm_metrics.add_elements(count_inserted)
+    add_message('Built {} route geometries from {} member ways'.format(count_built, way_cache.count_computed))
+    for message in osm_pipeline.report(geometries):
+        add_message(message)
+    return count_inserted
 
 
-def process(osm_file, output_geodatabase, processing_folder, nodes_chunk_size=500000):
+@timeit
+def write_update_state(output, nodes_path, node_locations_path, way_nodes_path, way_rows_path,
+                       csv_relations_members, relation_members_path, relation_rows_path, block_size=100000):
+    """
+    Write the state required by osm_update to apply change files to the output, as described in osm_state.
+    :param output: The output.
+    :param nodes_path: The record file of all the nodes.
+    :param node_locations_path: The file of the dense node location store filled by the import, or None to fill a
+    new store from the nodes file. The file is moved to the state folder.
+    :param way_nodes_path: The list file containing the way / nodes association.
+    :param way_rows_path: The list file of the attribute values of the ways, to tell which ways are in the output.
+    :param csv_relations_members: The file associating the multipolygons with their member ways.
+    :param relation_members_path: The relation member index, to record the member ways of the boundaries and routes.
+    :param relation_rows_path: The row list file of the attribute values of the relations, to tell which boundaries
+    and routes are in the output.
+    :param block_size: The number of ways or nodes written at once.
+    :return: None.
+    """
+    state = UpdateState(update_state_folder(output), create=True)
+    if os.path.isfile(state.node_locations_path):
+        os.remove(state.node_locations_path)
+    if node_locations_path is not None:
+        os.rename(node_locations_path, state.node_locations_path)
+    else:
+        node_store = DenseNodeLocationStore(state.node_locations_path)
+        for nodes in iter_record_blocks(nodes_path, NODE_DTYPE, block_size):
+            node_store.write(nodes)
+        node_store.close(remove=False)
+
+    way_rows = RowStore(way_rows_path)
+    tagged_identifiers = numpy.array(way_rows.index['id'])
+    way_rows.close()
+    count_ways = 0
+    for block in iter_list_blocks(way_nodes_path, REF_DTYPE, block_size):
+        flags = block.index['flags'] | numpy.where(
+            contains_identifiers(tagged_identifiers, block.index['id']), FLAG_TAGGED, 0
+        )
+        state.add_ways(
+            block.index['id'].tolist(),
+            flags.tolist(),
+            [block.values[start:end] for start, end in zip(block.starts.tolist(), block.ends.tolist())]
+        )
+        count_ways += len(block)
+    state.add_relations(iter_multipolygon_members(csv_relations_members))
+
+    # The boundaries and routes are not maintained by the updates, but recorded so that they can be reported.
+    relation_index = RelationMemberIndex(relation_members_path)
+    relation_resolver = RelationResolver(relation_index)
+    relation_rows = RowStore(relation_rows_path)
+    for kind, state_kind in ((RELATION_BOUNDARY, UNMAINTAINED_BOUNDARY), (RELATION_ROUTE, UNMAINTAINED_ROUTE)):
+        state.add_unmaintained_relations(
+            (relation_id, state_kind, [way_id for way_id, role in ways])
+            for relation_id, ways in relation_resolver.resolve_all(kept_relations(relation_index, relation_rows, kind))
+        )
+    relation_rows.close()
+    relation_index.close()
+    state.close()
+    osm_metrics.add_elements(count_ways)
+    add_message('Wrote the update state of {} ways to {}'.format(count_ways, state.folder))
+
+
+def process(osm_file, output_geodatabase, processing_folder, nodes_chunk_size=500000, join_method=JOIN_CHUNKED,
+            workers=1, filter_expression='', clip='', complete_ways=False, batch_size=DEFAULT_BATCH_SIZE,
+            pipelined=False, output_format=None, update_state=False, profile=False, nodes_memory_budget=0,
+            size_fields=False, other_tags=OTHER_TAGS_NONE, xml_parser=XML_PARSER_ETREE,
+            spatial_order=SPATIAL_ORDER_NONE):
     """
     The main function. Parse the xml and create the required features from it.
-    :param osm_file: The osm file, compressed as bz2
-    :param output_geodatabase: The output geodatabase.
+    :param osm_file: The osm file, as xml compressed as bz2 (.osm.bz2) or as PBF (.osm.pbf)
+    :param output_geodatabase: The output file geodatabase, GeoPackage, or GeoParquet folder.
     :param processing_folder: The processing folder. This is where temporary files will be created.
-    :param nodes_chunk_size: The number of nodes loaded in memory at once when loading nodes.
+    :param nodes_chunk_size: The number of nodes loaded in memory at once when loading nodes. With the sort merge join
+    method, this is the number of records sorted in memory at once.
+    :param join_method: The method used to join ways and nodes: JOIN_CHUNKED, JOIN_SORT_MERGE, JOIN_DENSE_STORE or
+    JOIN_SPARSE_STORE.
+    :param workers: The number of worker processes decoding the OSM file.
+    :param filter_expression: An optional tag filter expression, as described in osm_tags.TagFilter. Only the
+    elements it keeps are imported, and only the nodes of the kept ways are joined.
+    :param clip: An optional bounding box ("xmin ymin xmax ymax" in decimal degrees) or polygon feature class. Only
+    the elements inside this area are imported.
+    :param complete_ways: If True, the ways crossing the border of the clip area keep their nodes outside of the area.
+    :param batch_size: The number of rows or features buffered by the writers before being inserted.
+    :param pipelined: If True, the parsing, the encoding of the features and the assembly of the multipolygons run in
+    separate threads, overlapped with the writing to the output.
+    :param output_format: The format of the output, as described in osm_sinks.create_sink. Deduced from the
+    extension of the output when not set.
+    :param update_state: If True, the state required to apply change files to the output with osm_update is written
+    next to it. Not compatible with a filter or a clip area, since the changes could not be filtered the same way.
+    :param profile: If True, the functions of the run are profiled with cProfile, and the most expensive ones are
+    listed in the run report.
+    :param nodes_memory_budget: If set, the memory in megabytes the process may use during the chunked join. The
+    chunks of nodes are then sized from this budget instead of nodes_chunk_size.
+    :param size_fields: If True, the tag fields are sized from the values measured during the import, and the fields
+    without any value are left out. Otherwise every layer has all the standard tag fields, 255 characters long.
+    :param other_tags: Where the tags that are not saved in a field of their own are kept: OTHER_TAGS_NONE to discard
+    them, OTHER_TAGS_TABLE for the tables of the tag store described in osm_tag_store, OTHER_TAGS_COLUMN for an
+    other_tags field in each layer, or OTHER_TAGS_BOTH.
+    :param xml_parser: The parser of the xml files: XML_PARSER_ETREE for lxml, or ElementTree if lxml is not
+    installed, or XML_PARSER_SCANNER for the faster scanner of osm_xml_scanner.
+    :param spatial_order: The order the nodes, lines and polygons are inserted in: SPATIAL_ORDER_NONE for the order of
+    their identifiers, or SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY to cluster them spatially, as described in
+    osm_spatial_order.
+    :return:
+    """
+    if update_state and (filter_expression or clip):
+        raise ValueError('The update state cannot be written for a filtered or clipped output')
+    if update_state and size_fields:
+        raise ValueError('The update state cannot be written for an output with sized fields, since the changes '
+                         'could have longer values or other tags')
+    if update_state and other_tags != OTHER_TAGS_NONE:
+        raise ValueError('The update state cannot be written for an output keeping the other tags, since the '
+                         'updates do not maintain them')
+
+    parameters = {
+        'osm_file': osm_file,
+        'osm_file_size': os.path.getsize(osm_file),
+        'output': output_geodatabase,
+        'output_format': output_format,
+        'nodes_chunk_size': nodes_chunk_size,
+        'nodes_memory_budget': nodes_memory_budget,
+        'join_method': join_method,
+        'workers': workers,
+        'filter': filter_expression,
+        'clip': clip,
+        'complete_ways': complete_ways,
+        'batch_size': batch_size,
+        'pipelined': pipelined,
+        'update_state': update_state,
+        'size_fields': size_fields,
+        'other_tags': other_tags,
+        'xml_parser': xml_parser,
+        'spatial_order': spatial_order
+    }
+    with osm_metrics.RunReport(processing_folder, parameters, profile) as report:
+        run_stages(
+            osm_file,
+            output_geodatabase,
+            processing_folder,
+            nodes_chunk_size,
+            join_method,
+            workers,
+            filter_expression,
+            clip,
+            complete_ways,
+            batch_size,
+            pipelined,
+            output_format,
+            update_state,
+            nodes_memory_budget,
+            size_fields,
+            other_tags,
+            xml_parser,
+            spatial_order
+        )
+    add_message('Run completed in {:.1f} seconds. Report written to {}'.format(
+        report.run.wall_time,
+        os.path.join(processing_folder, osm_metrics.REPORT_FILE)
+    ))
+
+
+def run_stages(osm_file, output_geodatabase, processing_folder, nodes_chunk_size, join_method, workers,
+               filter_expression, clip, complete_ways, batch_size, pipelined, output_format, update_state,
+               nodes_memory_budget, size_fields, other_tags, xml_parser, spatial_order):
+    """
+    Run the stages of a conversion, resuming a previous run if possible. The parameters are described in process.
     :return:
     """
 
-    create_output_workspace(output_geodatabase)
+    nodes_path = os.path.join(processing_folder, NODES_FILE)
+    way_nodes_path = os.path.join(processing_folder, WAY_NODES_FILE)
+    way_rows_path = os.path.join(processing_folder, WAY_ROWS_FILE)
+    multipolygon_rows_path = os.path.join(processing_folder, MULTIPOLYGON_ROWS_FILE)
+    csv_relations_members = os.path.join(processing_folder, CSV_RELATIONS)
+    built_ways_path = os.path.join(processing_folder, BUILT_WAYS_FILE)
+    built_areas_path = os.path.join(processing_folder, BUILT_AREAS_FILE)
 
-    additional_fields = get_fields_numpy_definition(STANDARD_FIELDS_ARRAY)
+    rejected_way_nodes_path = os.path.join(processing_folder, REJECTED_WAY_NODES_FILE)
 
-    # Temporary feature classes
-    multipolygon_feature_class = create_multipolygon_table(output_geodatabase, 'multipolygons', additional_fields)
-    way_line_geom_feature_class = create_way_line_geom_feature_class(output_geodatabase, 'ways_line_geom')
-    way_polygon_geom_feature_class = create_way_polygon_geom_feature_class(output_geodatabase, 'ways_polygon_geom')
-    way_attr_table = create_way_table(output_geodatabase, 'temp_ways', additional_fields)
+    outside_nodes_path = os.path.join(processing_folder, OUTSIDE_NODES_FILE)
 
-    # Output feature classes
-    output_nodes_feature_class = create_node_feature_class(output_geodatabase, 'nodes', additional_fields)
-    output_line_feature_class = os.path.join(output_geodatabase, 'way_lines')
-    output_polygon_feature_class = os.path.join(output_geodatabase, 'way_polygons')
+    node_locations_path = os.path.join(processing_folder, NODE_LOCATIONS_FILE)
 
-    csv_nodes = os.path.join(processing_folder, CSV_NODES)
-    csv_way_nodes = os.path.join(processing_folder, CSV_WAY_NODES)
-    csv_relations_members = os.path.join(processing_folder, CSV_RELATIONS)
-    csv_built_ways = os.path.join(processing_folder, 'built_ways.csv')
-    csv_built_areas = os.path.join(processing_folder, 'built_areas.csv')
+    relation_members_path = os.path.join(processing_folder, RELATION_MEMBERS_FILE)
 
-    csv_to_remove = [csv_nodes, csv_way_nodes, csv_built_ways, csv_built_areas]
+    node_rows_path = os.path.join(processing_folder, NODE_ROWS_FILE)
 
-    feature_class_to_remove = [
-        way_line_geom_feature_class,
-        way_polygon_geom_feature_class,
-        multipolygon_feature_class,
-        way_attr_table
+    files_to_remove = [
+        nodes_path,
+        outside_nodes_path,
+        node_locations_path
     ]
 
-    with open(csv_relations_members, 'w') as multipolygon_temporary_file:
-        # Parse the XML file
-        import_osm(
-                bz2.BZ2File(osm_file, 'r'),
-                output_geodatabase,
-                output_nodes_feature_class,
-                csv_nodes,
-                way_attr_table,
-                csv_way_nodes,
-                multipolygon_feature_class,
-                multipolygon_temporary_file
+    list_files_to_remove = [
+        way_nodes_path,
+        way_rows_path,
+        multipolygon_rows_path,
+        built_ways_path,
+        built_areas_path,
+        rejected_way_nodes_path,
+        node_rows_path
+    ]
+
+    # The options changing the intermediate files or the output. A manifest recorded with other options is discarded.
+    manifest = Manifest(processing_folder, {
+        'osm_file': file_fingerprint(osm_file),
+        'output': os.path.abspath(output_geodatabase),
+        'output_format': output_format,
+        'nodes_chunk_size': nodes_chunk_size,
+        'join_method': join_method,
+        'filter': filter_expression,
+        'clip': clip,
+        'complete_ways': complete_ways,
+        'fields': STANDARD_FIELDS_ARRAY,
+        'size_fields': size_fields,
+        'other_tags': other_tags,
+        'spatial_order': spatial_order
+    })
+
+    output_exists = os.path.exists(output_geodatabase)
+    sink = create_sink(output_geodatabase, output_format)
+    sink.create()
+
+    if not output_exists:
+        manifest.invalidate_from(STAGE_IMPORT, STAGES)
+    if join_method == JOIN_SPARSE_STORE and not manifest.is_complete(STAGE_JOIN):
+        # The sparse node store is held in memory, so it has to be filled again by the import.
+        manifest.invalidate_from(STAGE_IMPORT, STAGES)
+    if not manifest.is_complete(STAGE_MULTIPOLYGONS):
+        # The multipolygons are added to the polygon layer, which is created again to discard them.
+        manifest.invalidate_from(STAGE_POLYGONS, STAGES)
+
+    resume_stage = manifest.first_incomplete(STAGES)
+    if resume_stage is None:
+        add_message('All the stages have been completed by a previous run')
+    else:
+        manifest.invalidate_from(resume_stage, STAGES)
+        if resume_stage != STAGE_IMPORT:
+            add_message('Resuming the previous run from the stage {}'.format(resume_stage))
+
+    def should_run(stage):
+        return resume_stage is not None and STAGES.index(stage) >= STAGES.index(resume_stage)
+
+    tag_filter = None
+    if filter_expression:
+        tag_filter = TagFilter(filter_expression)
+
+    clip_area = None
+    if clip and should_run(STAGE_IMPORT):
+        clip_area = create_clip_area(clip)
+
+    node_store = None
+    if should_run(STAGE_JOIN):
+        if join_method == JOIN_DENSE_STORE:
+            node_store = DenseNodeLocationStore(node_locations_path, overwrite=should_run(STAGE_IMPORT))
+        elif join_method == JOIN_SPARSE_STORE:
+            node_store = SparseNodeLocationStore()
+
+    other_tags_column = other_tags in (OTHER_TAGS_COLUMN, OTHER_TAGS_BOTH)
+    # The tagged nodes are written to a temporary file during the import, to be inserted once their tag fields are
+    # sized or once they are ordered.
+    stage_nodes = size_fields or spatial_order != SPATIAL_ORDER_NONE
+
+    if should_run(STAGE_IMPORT):
+        output_nodes_layer = None
+        if not stage_nodes:
+            node_layout = tag_field_layouts(None, other_tags_column)[NODES_LAYER]
+            output_nodes_layer = create_node_layer(
+                sink,
+                NODES_LAYER,
+                node_layout.layer_fields(),
+                node_layout.layer_field_lengths()
+            )
+        if other_tags in (OTHER_TAGS_TABLE, OTHER_TAGS_BOTH):
+            create_tag_store_tables(sink)
+        with open(csv_relations_members, 'w') as multipolygon_temporary_file:
+            # Parse the XML file
+            tag_statistics = import_osm(
+                    osm_file,
+                    sink,
+                    output_nodes_layer,
+                    nodes_path,
+                    way_rows_path,
+                    way_nodes_path,
+                    multipolygon_rows_path,
+                    multipolygon_temporary_file,
+                    node_store,
+                    workers,
+                    tag_filter,
+                    rejected_way_nodes_path,
+                    clip_area,
+                    complete_ways,
+                    outside_nodes_path,
+                    batch_size,
+                    pipelined,
+                    relation_members_path,
+                    size_fields,
+                    node_rows_path,
+                    other_tags,
+                    xml_parser
+            )
+        tag_layouts = tag_field_layouts(tag_statistics, other_tags_column)
+        if stage_nodes:
+            if spatial_order != SPATIAL_ORDER_NONE:
+                order_staged_nodes(node_rows_path, spatial_order, processing_folder)
+            node_layout = tag_layouts[NODES_LAYER]
+            output_nodes_layer = create_node_layer(
+                sink,
+                NODES_LAYER,
+                node_layout.layer_fields(),
+                node_layout.layer_field_lengths()
+            )
+            insert_staged_nodes(sink, output_nodes_layer, node_rows_path, node_layout, batch_size)
+        sink.build_index(output_nodes_layer, ID_FIELD.name)
+        sink.close_layer(output_nodes_layer)
+
+        import_files = [nodes_path, outside_nodes_path, csv_relations_members]
+        import_files.extend(relation_member_index_paths(relation_members_path))
+        for list_file_path in [way_nodes_path, way_rows_path, multipolygon_rows_path, rejected_way_nodes_path]:
+            import_files.extend(list_file_paths(list_file_path))
+        if join_method == JOIN_DENSE_STORE:
+            import_files.append(node_locations_path)
+        if tag_statistics is not None:
+            tag_statistics = dict((element_type, element_statistics.to_dict())
+                                  for element_type, element_statistics in tag_statistics.items())
+        manifest.complete(STAGE_IMPORT, import_files, tag_statistics=tag_statistics)
+    else:
+        # The tag fields of a resumed run are sized from the values measured by the import of the previous run.
+        tag_statistics = manifest.details(STAGE_IMPORT).get('tag_statistics')
+        if tag_statistics is not None:
+            tag_statistics = dict((element_type, TagStatistics.from_dict(STANDARD_FIELDS_ARRAY, content))
+                                  for element_type, content in tag_statistics.items())
+        tag_layouts = tag_field_layouts(tag_statistics, other_tags_column)
+
+    if should_run(STAGE_PREPARE):
+        if tag_filter is not None:
+            restore_multipolygon_member_ways(
+                csv_relations_members,
+                rejected_way_nodes_path,
+                way_nodes_path,
+                relation_members_path
+            )
+            if node_store is None:
+                retain_referenced_nodes(nodes_path, way_nodes_path)
+
+        if clip and complete_ways and node_store is None:
+            merge_outside_nodes(nodes_path, outside_nodes_path, way_nodes_path)
+
+        manifest.complete(STAGE_PREPARE, [nodes_path, outside_nodes_path] + list_file_paths(way_nodes_path))
+
+    # Read the intermediate files and associate nodes identifier with way nodes.
+    if should_run(STAGE_JOIN):
+        # Without complete ways, the nodes outside of the clip area are not kept.
+        clipped = bool(clip) and not complete_ways
+        if node_store is not None:
+            build_ways_node_store(
+                node_store,
+                way_nodes_path,
+                built_ways_path,
+                built_areas_path,
+                clipped=clipped
+            )
+            node_store.close(remove=False)
+        elif join_method == JOIN_SORT_MERGE:
+            build_ways_sort_merge(
+                nodes_path,
+                way_nodes_path,
+                built_ways_path,
+                built_areas_path,
+                processing_folder,
+                nodes_chunk_size,
+                clipped
+            )
+        else:
+            build_ways(
+                nodes_path,
+                way_nodes_path,
+                built_ways_path,
+                built_areas_path,
+                nodes_chunk_size,
+                manifest,
+                nodes_memory_budget,
+                clipped
+            )
+        if spatial_order != SPATIAL_ORDER_NONE:
+            order_built_ways([built_ways_path, built_areas_path], spatial_order, processing_folder)
+        manifest.complete(STAGE_JOIN, list_file_paths(built_ways_path) + list_file_paths(built_areas_path))
+
+    # The route and boundary relations, resolved once for the multipolygons and routes stages.
+    relation_index = None
+    if should_run(STAGE_POLYGONS) or should_run(STAGE_ROUTES):
+        relation_index = RelationMemberIndex(relation_members_path)
+        relation_resolver = RelationResolver(relation_index)
+
+    # Build the lines and polygons geometries, with the attributes of the ways
+    if should_run(STAGE_LINES) or should_run(STAGE_POLYGONS):
+        way_rows = RowStore(way_rows_path)
+        if should_run(STAGE_LINES):
+            line_layout = tag_layouts[WAY_LINES_LAYER]
+            output_line_layer = create_way_line_layer(
+                sink,
+                WAY_LINES_LAYER,
+                line_layout.layer_fields(),
+                line_layout.layer_field_lengths()
+            )
+            count_lines = build_lines(
+                sink,
+                output_line_layer,
+                built_ways_path,
+                way_rows,
+                batch_size,
+                pipelined,
+                line_layout
+            )
+            sink.build_index(output_line_layer, ID_FIELD.name)
+            sink.close_layer(output_line_layer)
+            manifest.complete(STAGE_LINES, [], lines=count_lines)
+
+        polygon_layout = tag_layouts[WAY_POLYGONS_LAYER]
+        output_polygon_layer = create_way_polygon_layer(
+            sink,
+            WAY_POLYGONS_LAYER,
+            polygon_layout.layer_fields(),
+            polygon_layout.layer_field_lengths()
+        )
+        count_polygons = build_polygons(
+            sink,
+            output_polygon_layer,
+            built_areas_path,
+            way_rows,
+            batch_size,
+            pipelined,
+            polygon_layout
         )
+        way_rows.close()
+        manifest.complete(STAGE_POLYGONS, [], polygons=count_polygons)
 
-    arcpy.AddIndex_management(
-        output_nodes_feature_class,
-        [ID_FIELD.name],
-        index_name='{}_idx'.format(ID_FIELD.name),
-        unique=True)
-
-    arcpy.AddIndex_management(
-        way_attr_table,
-        [ID_FIELD.name],
-        index_name='{}_idx'.format(ID_FIELD.name),
-        unique=True)
-
-    arcpy.AddIndex_management(
-        way_line_geom_feature_class,
-        [ID_FIELD.name],
-        index_name='{}_idx'.format(ID_FIELD.name),
-        unique=True)
-
-    arcpy.AddIndex_management(
-        way_polygon_geom_feature_class,
-        [ID_FIELD.name],
-        index_name='{}_idx'.format(ID_FIELD.name),
-        unique=True)
-
-    # Parse the csv files and associated nodes identifier with way nodes.
-    build_ways(
-        csv_nodes,
-        csv_way_nodes,
-        csv_built_ways,
-        csv_built_areas,
-        nodes_chunk_size
-    )
+        # Load the multipolygon and boundaries, from the member ways that are lines or polygons
+        multipolygon_rows = RowStore(multipolygon_rows_path)
+        boundaries = relation_resolver.resolve_all(
+            kept_relations(relation_index, multipolygon_rows, RELATION_BOUNDARY)
+        )
+        way_index = WayGeometryIndex.from_built_files(
+            [built_ways_path, built_areas_path],
+            way_nodes_path,
+            numpy.union1d(
+                read_multipolygon_member_identifiers(csv_relations_members),
+                read_resolved_way_identifiers(boundaries)
+            )
+        )
+        add_message('Loaded {} multipolygon and boundary member ways'.format(len(way_index)))
+        count_multipolygons = load_multipolygon_relations(
+            sink,
+            output_polygon_layer,
+            csv_relations_members,
+            multipolygon_rows,
+            way_index,
+            batch_size,
+            pipelined,
+            polygon_layout
+        )
+        count_boundaries = load_boundary_relations(
+            sink,
+            output_polygon_layer,
+            boundaries,
+            multipolygon_rows,
+            way_index,
+            batch_size,
+            pipelined,
+            polygon_layout
+        )
+        multipolygon_rows.close()
+        del way_index
+        sink.build_index(output_polygon_layer, ID_FIELD.name)
+        sink.close_layer(output_polygon_layer)
+        manifest.complete(STAGE_MULTIPOLYGONS, [], multipolygons=count_multipolygons, boundaries=count_boundaries)
+
+    # Build the routes, from the member ways of the routes and of their nested relations
+    if should_run(STAGE_ROUTES):
+        relation_rows = RowStore(multipolygon_rows_path)
+        routes = relation_resolver.resolve_all(kept_relations(relation_index, relation_rows, RELATION_ROUTE))
+        way_index = WayGeometryIndex.from_built_files(
+            [built_ways_path, built_areas_path],
+            way_nodes_path,
+            read_resolved_way_identifiers(routes)
+        )
+        add_message('Loaded {} route member ways'.format(len(way_index)))
+        route_layout = tag_layouts[ROUTE_LINES_LAYER]
+        output_route_layer = create_route_line_layer(
+            sink,
+            ROUTE_LINES_LAYER,
+            route_layout.layer_fields(),
+            route_layout.layer_field_lengths()
+        )
+        count_routes = load_route_relations(
+            sink,
+            output_route_layer,
+            routes,
+            relation_rows,
+            way_index,
+            batch_size,
+            pipelined,
+            route_layout
+        )
+        relation_rows.close()
+        del way_index
+        sink.build_index(output_route_layer, ID_FIELD.name)
+        sink.close_layer(output_route_layer)
+        manifest.complete(STAGE_ROUTES, [], routes=count_routes)
+
+    if relation_index is not None:
+        relation_index.close()
+
+    if update_state:
+        write_update_state(
+            output_geodatabase,
+            nodes_path,
+            node_locations_path if join_method == JOIN_DENSE_STORE else None,
+            way_nodes_path,
+            way_rows_path,
+            csv_relations_members,
+            relation_members_path,
+            multipolygon_rows_path
+        )
 
-    # Build the lines geometries - no attributes
-    build_lines(
-        way_line_geom_feature_class,
-        csv_built_ways
-    )
+    sink.finalise()
 
-    join_way_attribute(
-        way_line_geom_feature_class,
-        way_attr_table,
-        output_line_feature_class
-    )
+    for file_path in files_to_remove:
+        if os.path.isfile(file_path):
+            os.remove(file_path)
 
-    # Build the polygons geometries - no attributes
-    build_polygons(
-        way_polygon_geom_feature_class,
-        csv_built_areas
-    )
+    for list_file_path in list_files_to_remove:
+        remove_list_file(list_file_path)
+    remove_relation_member_index(relation_members_path)
 
-    join_way_attribute(
-        way_polygon_geom_feature_class,
-        way_attr_table,
-        output_polygon_feature_class
-    )
-    with open(csv_relations_members, 'r') as multipolygon_temporary_file:
-        # Load the multipolygon
-        load_multipolygon_relations(
-            multipolygon_feature_class,
-            multipolygon_temporary_file,
-            way_polygon_geom_feature_class
-        )
+    manifest.remove()
 
-    append_polygons(multipolygon_feature_class, output_polygon_feature_class)
 
-    for csv_path in csv_to_remove:
-        if os.path.isfile(csv_path):
-            os.remove(csv_path)
+def get_tool_parameter(index, default=None, as_text=False):
+    """
+    Read a parameter of the script tool. A toolbox defining fewer parameters leaves the others to their default.
+    :param index: The index of the parameter.
+    :param default: The value of a parameter that is not defined by the toolbox or has no value.
+    :param as_text: If True, the value is read as text.
+    :return: The value of the parameter.
+    """
+    if index >= arcpy.GetArgumentCount():
+        return default
+    value = arcpy.GetParameterAsText(index) if as_text else arcpy.GetParameter(index)
+    if value is None or value == '':
+        return default
+    return value
 
-    for fc in feature_class_to_remove:
-        if arcpy.Exists(fc):
-            arcpy.Delete_management(fc)
 
+def parse_arguments(arguments):
+    """
+    Read the parameters of the tool from the command line, when it does not run as a geoprocessing tool.
+    :param arguments: The command line arguments.
+    :return: The parsed arguments.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description='Import an OSM file into a file geodatabase, a GeoPackage or '
+                                                 'GeoParquet files.')
+    parser.add_argument('osm_file', help='The .osm, .osm.bz2 or .osm.pbf file.')
+    parser.add_argument('output', help='The output file geodatabase (.gdb), GeoPackage (.gpkg) or GeoParquet folder.')
+    parser.add_argument('processing_folder', help='The folder of the temporary files.')
+    parser.add_argument('--nodes-chunk-size', type=int, default=500000)
+    parser.add_argument('--nodes-memory-budget', type=int, default=0,
+                        help='The memory in megabytes the chunked join may use, instead of a fixed chunk size.')
+    parser.add_argument('--join-method', default=JOIN_CHUNKED,
+                        choices=[JOIN_CHUNKED, JOIN_SORT_MERGE, JOIN_DENSE_STORE, JOIN_SPARSE_STORE])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--filter', default='')
+    parser.add_argument('--clip', default='')
+    parser.add_argument('--complete-ways', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pipelined', action='store_true')
+    parser.add_argument('--format', choices=[FORMAT_FILE_GEODATABASE, FORMAT_GEOPACKAGE, FORMAT_GEOPARQUET, FORMAT_NULL])
+    parser.add_argument('--update-state', action='store_true')
+    parser.add_argument('--profile', action='store_true')
+    parser.add_argument('--size-fields', action='store_true',
+                        help='Size the tag fields from the data, and leave out the fields without values.')
+    parser.add_argument('--other-tags', default=OTHER_TAGS_NONE,
+                        choices=[OTHER_TAGS_NONE, OTHER_TAGS_TABLE, OTHER_TAGS_COLUMN, OTHER_TAGS_BOTH],
+                        help='Keep the tags without a field in the tag store tables, an other_tags field, or both.')
+    parser.add_argument('--xml-parser', default=XML_PARSER_ETREE, choices=[XML_PARSER_ETREE, XML_PARSER_SCANNER])
+    parser.add_argument('--spatial-order', default=SPATIAL_ORDER_NONE,
+                        choices=[SPATIAL_ORDER_NONE, SPATIAL_ORDER_HILBERT, SPATIAL_ORDER_QUADKEY],
+                        help='Insert the nodes, lines and polygons in the order of a Hilbert curve or of quadkeys.')
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__' and arcpy is None:
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    arguments = parse_arguments(sys.argv[1:])
+    process(
+        arguments.osm_file,
+        arguments.output,
+        arguments.processing_folder,
+        nodes_chunk_size=arguments.nodes_chunk_size,
+        join_method=arguments.join_method,
+        workers=arguments.workers,
+        filter_expression=arguments.filter,
+        clip=arguments.clip,
+        complete_ways=arguments.complete_ways,
+        batch_size=arguments.batch_size,
+        pipelined=arguments.pipelined,
+        output_format=arguments.format,
+        update_state=arguments.update_state,
+        profile=arguments.profile,
+        nodes_memory_budget=arguments.nodes_memory_budget,
+        size_fields=arguments.size_fields,
+        other_tags=arguments.other_tags,
+        xml_parser=arguments.xml_parser,
+        spatial_order=arguments.spatial_order
+    )
 
-if __name__ == '__main__':
+elif __name__ == '__main__':
+    # The toolbox OSM2ArcGIS.tbx only defines the first parameters, the others take their default value.
     input_osm_file = arcpy.GetParameterAsText(0)
     output_geodatabase = arcpy.GetParameterAsText(1)
     temporary_workspace = arcpy.GetParameterAsText(2)
     nodes_chunk_size = arcpy.GetParameter(3)
-    process(input_osm_file, output_geodatabase, temporary_workspace, nodes_chunk_size=int(nodes_chunk_size))
+    join_method = get_tool_parameter(4, JOIN_CHUNKED, as_text=True)
+    workers = get_tool_parameter(5, 1)
+    filter_expression = get_tool_parameter(6, '', as_text=True)
+    clip = get_tool_parameter(7, '', as_text=True)
+    complete_ways = get_tool_parameter(8)
+    batch_size = get_tool_parameter(9, DEFAULT_BATCH_SIZE)
+    pipelined = get_tool_parameter(10)
+    output_format = get_tool_parameter(11, as_text=True)
+    update_state = get_tool_parameter(12)
+    profile = get_tool_parameter(13)
+    nodes_memory_budget = get_tool_parameter(14, 0)
+    size_fields = get_tool_parameter(15)
+    other_tags = get_tool_parameter(16, OTHER_TAGS_NONE, as_text=True)
+    xml_parser = get_tool_parameter(17, XML_PARSER_ETREE, as_text=True)
+    spatial_order = get_tool_parameter(18, SPATIAL_ORDER_NONE, as_text=True)
+    process(
+        input_osm_file,
+        output_geodatabase,
+        temporary_workspace,
+        nodes_chunk_size=int(nodes_chunk_size),
+        join_method=join_method,
+        workers=int(workers),
+        filter_expression=filter_expression,
+        clip=clip,
+        complete_ways=bool(complete_ways),
+        batch_size=int(batch_size),
+        pipelined=bool(pipelined),
+        output_format=output_format or None,
+        update_state=bool(update_state),
+        profile=bool(profile),
+        nodes_memory_budget=int(nodes_memory_budget),
+        size_fields=bool(size_fields),
+        other_tags=other_tags,
+        xml_parser=xml_parser,
+        spatial_order=spatial_order
+    )
@@ -0,0 +1,175 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Checkpoints of the stages of the tool, so that a failed run can be resumed. The manifest, a json file of the
+    processing folder, records:
+
+    * the fingerprint of the run: the input file (path, size, modification time) and the options changing the
+      results. A rerun with a different fingerprint starts from scratch.
+    * the completed stages, in order, with the intermediate files they produced and some counts.
+    * the size of every intermediate file when it was last written by a completed stage. A stage is only considered
+      complete if its files still have these sizes.
+    * the progress of the stage running, for the stages that can be resumed where they stopped.
+
+    The manifest is rewritten to a temporary file then renamed, so that a failure while saving it does not corrupt it.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, json
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_fingerprint(path):
+    """
+    Identify the content of a file without reading it.
+    :param path: The file.
+    :return: A list with the absolute path, the size and the modification time of the file.
+    """
+    return [os.path.abspath(path), os.path.getsize(path), int(os.path.getmtime(path))]
+
+
+def file_size(path):
+    """
+    :param path: A file.
+    :return: The size of the file, or None if it does not exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    return os.path.getsize(path)
+
+
+class Manifest(object):
+    """
+    The completion manifest of the stages of a run.
+    """
+
+    def __init__(self, processing_folder, fingerprint):
+        """
+        Load the manifest of the processing folder. It is reset if it was written for another fingerprint.
+        :param processing_folder: The processing folder.
+        :param fingerprint: A json serializable description of the input and of the options of the run.
+        """
+        self.path = os.path.join(processing_folder, MANIFEST_FILE)
+        self.fingerprint = json.loads(json.dumps(fingerprint))
+        self.content = None
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as manifest_file:
+                    content = json.load(manifest_file)
+                if content.get('version') == MANIFEST_VERSION and content.get('fingerprint') == self.fingerprint:
+                    self.content = content
+            except ValueError:
+                pass
+        self.resumed = self.content is not None
+        if self.content is None:
+            self.content = {
+                'version': MANIFEST_VERSION,
+                'fingerprint': self.fingerprint,
+                'stages': [],
+                'files': {},
+                'progress': {}
+            }
+
+    def _stage(self, name):
+        for stage in self.content['stages']:
+            if stage['name'] == name:
+                return stage
+        return None
+
+    def is_complete(self, name):
+        """
+        Tell whether a stage has been completed, and whether its files have not changed since.
+        :param name: The name of the stage.
+        :return: True if the stage can be skipped.
+        """
+        stage = self._stage(name)
+        if stage is None:
+            return False
+        files = self.content['files']
+        return all(file_size(path) == files.get(path) for path in stage['files'])
+
+    def complete(self, name, files, **details):
+        """
+        Record the completion of a stage. The progress of the stage is discarded.
+        :param name: The name of the stage.
+        :param files: The intermediate files produced or modified by the stage.
+        :param details: Json serializable counts describing the outputs of the stage.
+        """
+        for path in files:
+            self.content['files'][path] = file_size(path)
+        self.content['stages'] = [stage for stage in self.content['stages'] if stage['name'] != name]
+        self.content['stages'].append({'name': name, 'files': list(files), 'details': details})
+        self.content['progress'].pop(name, None)
+        self.save()
+
+    def details(self, name):
+        """
+        :param name: The name of a completed stage.
+        :return: The details recorded with the completion of the stage, or an empty dictionary.
+        """
+        stage = self._stage(name)
+        if stage is None:
+            return {}
+        return stage.get('details', {})
+
+    def invalidate_from(self, name, stage_names):
+        """
+        Forget a stage and the stages following it, which have to run again. The progress of the stage is kept, so
+        that it can resume where it stopped, but the following stages start from scratch.
+        :param name: The name of the first stage to run again.
+        :param stage_names: The names of all the stages, in order.
+        """
+        position = stage_names.index(name)
+        invalidated = set(stage_names[position:])
+        self.content['stages'] = [stage for stage in self.content['stages'] if stage['name'] not in invalidated]
+        for stage_name in stage_names[position + 1:]:
+            self.content['progress'].pop(stage_name, None)
+        self.save()
+
+    def first_incomplete(self, stage_names):
+        """
+        Find the stage the run resumes from: the first stage that has not been completed.
+        :param stage_names: The names of all the stages, in order.
+        :return: The name of the stage, or None if all of them are complete.
+        """
+        for name in stage_names:
+            if not self.is_complete(name):
+                return name
+        return None
+
+    def progress(self, name):
+        """
+        :param name: The name of a stage.
+        :return: The last progress saved by the stage, or None.
+        """
+        return self.content['progress'].get(name)
+
+    def save_progress(self, name, **progress):
+        """
+        Save the progress of a stage, for instance after each flushed batch.
+        :param name: The name of the stage.
+        :param progress: Json serializable values describing the progress.
+        """
+        self.content['progress'][name] = progress
+        self.save()
+
+    def save(self):
+        temporary_path = self.path + '_temp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(self.content, manifest_file, indent=1, sort_keys=True)
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        os.rename(temporary_path, self.path)
+
+    def remove(self):
+        """
+        Remove the manifest, once the run is complete.
+        """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
@@ -0,0 +1,638 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Binary intermediate files written by the parsing and read by the joins and the geometry builders. They replace
+    text csv files, so that identifiers and coordinates are not converted to and from text at every step.
+
+    There are two kinds of files:
+        - Record files: a sequence of fixed size numpy records, such as the nodes (int64 identifier, int32 fixed
+          point longitude and latitude, 16 bytes per node).
+        - List files: variable length lists, such as the node identifiers of the ways or the coordinates of the built
+          geometries. The lists are stored one after the other in a values file (.dat), and an index file (.idx)
+          holds for each list its identifier, the offset of its first value, its number of values and flags.
+
+    Both kinds of files can be read by blocks with numpy.fromfile, or memory mapped with numpy.memmap.
+
+    Rows of attribute values are stored in list files of bytes, the values of a row being encoded as utf-8 text
+    separated by ROW_SEPARATOR. A RowStore memory maps such a file to look up rows by identifier.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, itertools, numpy
+
+# Coordinates are stored as fixed point integers with 7 decimals, the precision of the OSM database.
+COORDINATE_PRECISION = 10000000
+
+# The latitude of a node that has not been located yet.
+MISSING_COORDINATE = numpy.iinfo(numpy.int32).min
+
+NODE_DTYPE = numpy.dtype([('id', '<i8'), ('lon', '<i4'), ('lat', '<i4')])
+INDEX_DTYPE = numpy.dtype([('id', '<i8'), ('offset', '<i8'), ('count', '<i4'), ('flags', '<i4')])
+REF_DTYPE = numpy.dtype('<i8')
+COORDINATES_DTYPE = numpy.dtype([('lon', '<i4'), ('lat', '<i4')])
+
+# The node references of the ways, with their position in the values of the way_nodes file, before and after being
+# located by the sort merge join.
+WAY_NODE_REF_DTYPE = numpy.dtype([('node', '<i8'), ('position', '<i8')])
+LOCATED_REF_DTYPE = numpy.dtype([('position', '<i8'), ('lon', '<i4'), ('lat', '<i4')])
+
+INDEX_EXTENSION = '.idx'
+VALUES_EXTENSION = '.dat'
+
+# Flags of the way lists.
+FLAG_HIGHWAY = 1
+
+# The encoding of the rows of attribute values.
+ROW_DTYPE = numpy.dtype('u1')
+ROW_SEPARATOR = b'\x1f'
+ROW_NULL = b'\x00'
+
+DEFAULT_BLOCK_SIZE = 1000000
+
+# The maximum number of sorted runs merged at once by the external sort.
+MERGE_FAN_IN = 64
+
+
+def to_fixed_point(values):
+    """
+    Convert decimal degrees to fixed point integers.
+    :param values: A sequence of coordinates, as numbers or text.
+    :return: A numpy array of int32.
+    """
+    return numpy.rint(numpy.array(values, dtype=numpy.float64) * COORDINATE_PRECISION).astype(numpy.int32)
+
+
+def to_degrees(values):
+    """
+    Convert fixed point integers to decimal degrees.
+    :param values: A numpy array of int32.
+    :return: A numpy array of float64.
+    """
+    return values / float(COORDINATE_PRECISION)
+
+
+def to_coordinates(lons, lats):
+    """
+    Pair fixed point longitudes and latitudes.
+    :param lons: A numpy array of int32.
+    :param lats: A numpy array of int32.
+    :return: A numpy array of COORDINATES_DTYPE.
+    """
+    coordinates = numpy.empty(len(lons), dtype=COORDINATES_DTYPE)
+    coordinates['lon'] = lons
+    coordinates['lat'] = lats
+    return coordinates
+
+
+def contains_identifiers(sorted_identifiers, identifiers):
+    """
+    Tell which identifiers are part of a sorted array of identifiers.
+    :param sorted_identifiers: A sorted numpy array of int64.
+    :param identifiers: A numpy array of int64.
+    :return: A numpy array of booleans.
+    """
+    if len(sorted_identifiers) == 0:
+        return numpy.zeros(len(identifiers), dtype=bool)
+    positions = numpy.searchsorted(sorted_identifiers, identifiers)
+    positions[positions == len(sorted_identifiers)] = 0
+    return sorted_identifiers[positions] == identifiers
+
+
+def remove_list_file(path):
+    """
+    Remove the index and values files of a list file, if they exist.
+    :param path: The path of the list file, without extension.
+    """
+    for extension in (INDEX_EXTENSION, VALUES_EXTENSION):
+        if os.path.isfile(path + extension):
+            os.remove(path + extension)
+
+
+def list_file_paths(path):
+    """
+    :param path: The path of a list file, without extension.
+    :return: The paths of its index and values files.
+    """
+    return [path + INDEX_EXTENSION, path + VALUES_EXTENSION]
+
+
+def rename_list_file(source, destination):
+    """
+    Replace a list file by another one.
+    :param source: The path of the list file to rename, without extension.
+    :param destination: The path of the list file to replace, without extension.
+    """
+    remove_list_file(destination)
+    for extension in (INDEX_EXTENSION, VALUES_EXTENSION):
+        os.rename(source + extension, destination + extension)
+
+
+###################################
+# WRITERS
+###################################
+class NodeWriter(object):
+    """
+    Write nodes to a record file of NODE_DTYPE. The nodes are buffered as text or numbers, and converted in bulk.
+    """
+
+    def __init__(self, path, buffer_size=DEFAULT_BLOCK_SIZE, mode='wb'):
+        """
+        :param path: The record file, or None to discard the nodes.
+        :param buffer_size: The number of nodes buffered before being converted and written.
+        :param mode: 'wb' to overwrite the file, 'ab' to append to it.
+        """
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._file = open(path or os.devnull, mode)
+        self._ids = []
+        self._lons = []
+        self._lats = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+
+    def add(self, node_id, lon, lat):
+        """
+        Add a node.
+        :param node_id: The node identifier.
+        :param lon: The longitude in decimal degrees, as a number or as text.
+        :param lat: The latitude in decimal degrees, as a number or as text.
+        """
+        self._ids.append(node_id)
+        self._lons.append(lon)
+        self._lats.append(lat)
+        if len(self._ids) >= self.buffer_size:
+            self.flush()
+
+    def write(self, nodes):
+        """
+        Write an array of nodes.
+        :param nodes: A numpy array of NODE_DTYPE.
+        """
+        self.flush()
+        nodes.tofile(self._file)
+        self.count += len(nodes)
+
+    def flush(self):
+        if len(self._ids) == 0:
+            return
+        nodes = numpy.empty(len(self._ids), dtype=NODE_DTYPE)
+        nodes['id'] = numpy.array(self._ids, dtype=numpy.int64)
+        nodes['lon'] = to_fixed_point(self._lons)
+        nodes['lat'] = to_fixed_point(self._lats)
+        nodes.tofile(self._file)
+        self.count += len(nodes)
+        self._ids = []
+        self._lons = []
+        self._lats = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class ListWriter(object):
+    """
+    Write variable length lists to a list file: an index file of INDEX_DTYPE and a values file.
+    """
+
+    def __init__(self, path, value_dtype, buffer_size=DEFAULT_BLOCK_SIZE, mode='wb'):
+        """
+        :param path: The path of the list file without extension, or None to discard the lists.
+        :param value_dtype: The numpy dtype of the values.
+        :param buffer_size: The number of values buffered before being written.
+        :param mode: 'wb' to overwrite the files, 'ab' to append to them.
+        """
+        self.path = path
+        self.value_dtype = numpy.dtype(value_dtype)
+        self.buffer_size = buffer_size
+        self.count = 0
+        if path is None:
+            self._index_file = open(os.devnull, mode)
+            self._values_file = open(os.devnull, mode)
+            self._offset = 0
+        else:
+            self._index_file = open(path + INDEX_EXTENSION, mode)
+            self._values_file = open(path + VALUES_EXTENSION, mode)
+            self._offset = 0
+            if mode.startswith('a') and os.path.isfile(path + VALUES_EXTENSION):
+                self._offset = os.path.getsize(path + VALUES_EXTENSION) // self.value_dtype.itemsize
+        self._index = []
+        self._values = []
+        self._buffered_values = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+
+    def add(self, identifier, values, flags=0):
+        """
+        Add a list.
+        :param identifier: The identifier of the list.
+        :param values: The values, as a list or a numpy array. Values of lists are converted in bulk.
+        :param flags: Integer flags stored in the index.
+        """
+        self._index.append((int(identifier), self._offset, len(values), flags))
+        self._values.append(values)
+        self._offset += len(values)
+        self._buffered_values += len(values)
+        if self._buffered_values >= self.buffer_size:
+            self.flush()
+
+    def write(self, index, values):
+        """
+        Write a block of lists. The offsets of the index are recomputed.
+        :param index: A numpy array of INDEX_DTYPE.
+        :param values: A numpy array of values holding the lists of the index, one after the other.
+        """
+        self.flush()
+        index = index.copy()
+        counts = index['count'].astype(numpy.int64)
+        index['offset'] = self._offset + numpy.cumsum(counts) - counts
+        index.tofile(self._index_file)
+        numpy.asarray(values, dtype=self.value_dtype).tofile(self._values_file)
+        self._offset += int(counts.sum())
+        self.count += len(index)
+
+    def flush(self):
+        if len(self._index) == 0:
+            return
+        numpy.array(self._index, dtype=INDEX_DTYPE).tofile(self._index_file)
+        if all(isinstance(values, numpy.ndarray) for values in self._values):
+            values = numpy.concatenate(self._values).astype(self.value_dtype)
+        else:
+            values = numpy.array(list(itertools.chain.from_iterable(self._values)), dtype=self.value_dtype)
+        values.tofile(self._values_file)
+        self.count += len(self._index)
+        self._index = []
+        self._values = []
+        self._buffered_values = 0
+
+    def sync(self):
+        """
+        Write the buffered lists and make sure they are on disk, so that the list file can be resumed from this
+        point.
+        :return: The sizes in bytes of the index and values files.
+        """
+        self.flush()
+        sizes = []
+        for list_file in (self._index_file, self._values_file):
+            list_file.flush()
+            if self.path is not None:
+                os.fsync(list_file.fileno())
+            sizes.append(list_file.tell())
+        return sizes
+
+    def close(self):
+        self.flush()
+        self._index_file.close()
+        self._values_file.close()
+
+
+def encode_row(values):
+    """
+    Encode a row of attribute values.
+    :param values: A list of text values or None.
+    :return: The encoded row, as bytes.
+    """
+    encoded = []
+    for value in values:
+        if value is None:
+            encoded.append(ROW_NULL)
+        elif isinstance(value, bytes):
+            encoded.append(value)
+        else:
+            encoded.append(value.encode('utf-8'))
+    return ROW_SEPARATOR.join(encoded)
+
+
+def decode_row(data):
+    """
+    Decode a row of attribute values.
+    :param data: The encoded row, as bytes.
+    :return: A list of text values or None.
+    """
+    return [None if value == ROW_NULL else value.decode('utf-8') for value in data.split(ROW_SEPARATOR)]
+
+
+class RowWriter(ListWriter):
+    """
+    Write rows of attribute values to a list file of bytes.
+    """
+
+    def __init__(self, path, buffer_size=DEFAULT_BLOCK_SIZE * 16):
+        """
+        :param path: The path of the list file without extension.
+        :param buffer_size: The number of bytes buffered before being written.
+        """
+        ListWriter.__init__(self, path, ROW_DTYPE, buffer_size)
+        self.sorted = True
+        self._last_identifier = None
+
+    def add_row(self, identifier, values):
+        """
+        Add a row.
+        :param identifier: The identifier of the row.
+        :param values: A list of text values or None.
+        """
+        identifier = int(identifier)
+        if self._last_identifier is not None and identifier <= self._last_identifier:
+            self.sorted = False
+        self._last_identifier = identifier
+        self.add(identifier, numpy.frombuffer(encode_row(values), dtype=ROW_DTYPE))
+
+
+###################################
+# READERS
+###################################
+def count_records(path, dtype):
+    """
+    Count the records of a record file.
+    :param path: The record file.
+    :param dtype: The numpy dtype of the records.
+    :return: The number of records.
+    """
+    if not os.path.isfile(path):
+        return 0
+    return os.path.getsize(path) // numpy.dtype(dtype).itemsize
+
+
+def iter_record_blocks(path, dtype, block_size=DEFAULT_BLOCK_SIZE, start=0):
+    """
+    Read a record file by blocks.
+    :param path: The record file.
+    :param dtype: The numpy dtype of the records.
+    :param block_size: The number of records of a block.
+    :param start: The number of records skipped at the beginning of the file.
+    :return: A generator of numpy arrays.
+    """
+    with open(path, 'rb') as record_file:
+        record_file.seek(start * numpy.dtype(dtype).itemsize)
+        while True:
+            block = numpy.fromfile(record_file, dtype=dtype, count=block_size)
+            if len(block) == 0:
+                return
+            yield block
+
+
+def iter_sized_record_blocks(path, dtype, block_sizes, start=0):
+    """
+    Read a record file by blocks of varying sizes.
+    :param path: The record file.
+    :param dtype: The numpy dtype of the records.
+    :param block_sizes: An iterator of the numbers of records of the blocks. The next size is only taken when the
+    next block is read, so that it can depend on the blocks already processed.
+    :param start: The number of records skipped at the beginning of the file.
+    :return: A generator of numpy arrays.
+    """
+    with open(path, 'rb') as record_file:
+        record_file.seek(start * numpy.dtype(dtype).itemsize)
+        for block_size in block_sizes:
+            block = numpy.fromfile(record_file, dtype=dtype, count=block_size)
+            if len(block) == 0:
+                return
+            yield block
+
+
+class ListBlock(object):
+    """
+    A block of consecutive lists read from a list file.
+    """
+
+    def __init__(self, index, values):
+        """
+        :param index: A numpy array of INDEX_DTYPE.
+        :param values: The values of the lists of the index.
+        """
+        self.index = index
+        self.values = values
+        counts = index['count'].astype(numpy.int64)
+        self.ends = numpy.cumsum(counts)
+        self.starts = self.ends - counts
+
+    def __len__(self):
+        return len(self.index)
+
+    def lists(self):
+        """
+        Iterate over the lists of the block.
+        :return: A generator of (identifier, values, flags) tuples. The values are a view on the values of the block.
+        """
+        values = self.values
+        for identifier, start, end, flags in zip(
+                self.index['id'].tolist(), self.starts.tolist(), self.ends.tolist(), self.index['flags'].tolist()):
+            yield identifier, values[start:end], flags
+
+    def select(self, mask, values=None):
+        """
+        Select some lists of the block.
+        :param mask: A numpy array of booleans, one per list.
+        :param values: Optional values to select from instead of the values of the block, one per value of the block.
+        :return: A tuple with the index and the values of the selected lists.
+        """
+        if values is None:
+            values = self.values
+        return self.index[mask], values[numpy.repeat(mask, self.index['count'])]
+
+
+def iter_list_blocks(path, value_dtype, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Read a list file by blocks of lists.
+    :param path: The path of the list file, without extension.
+    :param value_dtype: The numpy dtype of the values.
+    :param block_size: The number of lists of a block.
+    :return: A generator of ListBlock.
+    """
+    with open(path + INDEX_EXTENSION, 'rb') as index_file:
+        with open(path + VALUES_EXTENSION, 'rb') as values_file:
+            while True:
+                index = numpy.fromfile(index_file, dtype=INDEX_DTYPE, count=block_size)
+                if len(index) == 0:
+                    return
+                values_count = int(index['count'].astype(numpy.int64).sum())
+                values = numpy.fromfile(values_file, dtype=value_dtype, count=values_count)
+                yield ListBlock(index, values)
+
+
+def iter_list_values(path, value_dtype, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Read the values of a list file by blocks, regardless of the lists they belong to.
+    :param path: The path of the list file, without extension.
+    :param value_dtype: The numpy dtype of the values.
+    :param block_size: The number of values of a block.
+    :return: A generator of numpy arrays.
+    """
+    return iter_record_blocks(path + VALUES_EXTENSION, value_dtype, block_size)
+
+
+class RowStore(object):
+    """
+    Rows of attribute values looked up by identifier. The index and the values of a row list file sorted by
+    identifier are memory mapped, so only the pages holding the rows looked up are read.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the list file without extension, with an index sorted by identifier.
+        """
+        self.index = numpy.zeros(0, dtype=INDEX_DTYPE)
+        self.values = numpy.zeros(0, dtype=ROW_DTYPE)
+        if os.path.getsize(path + INDEX_EXTENSION) > 0:
+            self.index = numpy.memmap(path + INDEX_EXTENSION, dtype=INDEX_DTYPE, mode='r')
+        if os.path.getsize(path + VALUES_EXTENSION) > 0:
+            self.values = numpy.memmap(path + VALUES_EXTENSION, dtype=ROW_DTYPE, mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, identifiers):
+        """
+        Look up the rows of a set of identifiers.
+        :param identifiers: A numpy array of int64.
+        :return: A list holding for each identifier its list of values, or None when there is no row.
+        """
+        identifiers = numpy.asarray(identifiers, dtype=numpy.int64)
+        if len(self.index) == 0:
+            return [None] * len(identifiers)
+        index_identifiers = self.index['id']
+        positions = numpy.searchsorted(index_identifiers, identifiers)
+        positions[positions == len(index_identifiers)] = 0
+        records = self.index[positions]
+        found = records['id'] == identifiers
+        rows = []
+        values = self.values
+        for is_found, offset, count in zip(found.tolist(), records['offset'].tolist(), records['count'].tolist()):
+            rows.append(decode_row(values[offset:offset + count].tobytes()) if is_found else None)
+        return rows
+
+    def close(self):
+        """
+        Release the memory mapped files.
+        """
+        self.index = None
+        self.values = None
+
+
+###################################
+# SORTING
+###################################
+def merge_sorted_record_files(paths, dtype, key, output_path, block_size=DEFAULT_BLOCK_SIZE // 16):
+    """
+    Merge record files that are sorted on a field into a single sorted record file. The files are read by blocks, and
+    at each step every record lower or equal to the smallest of the last keys of the current blocks is written.
+    :param paths: The sorted record files.
+    :param dtype: The numpy dtype of the records.
+    :param key: The name of the field the records are sorted on.
+    :param output_path: The output record file.
+    :param block_size: The number of records read at once from each file.
+    :return: None.
+    """
+    readers = [iter_record_blocks(path, dtype, block_size) for path in paths]
+    buffers = [next(reader, None) for reader in readers]
+    with open(output_path, 'wb') as output_file:
+        while True:
+            active = [index for index, buffer in enumerate(buffers) if buffer is not None]
+            if len(active) == 0:
+                break
+            threshold = min(buffers[index][key][-1] for index in active)
+            parts = []
+            for index in active:
+                buffer = buffers[index]
+                cut = numpy.searchsorted(buffer[key], threshold, side='right')
+                parts.append(buffer[:cut])
+                if cut == len(buffer):
+                    buffers[index] = next(readers[index], None)
+                else:
+                    buffers[index] = buffer[cut:]
+            merged = numpy.concatenate(parts)
+            merged[numpy.argsort(merged[key], kind='mergesort')].tofile(output_file)
+
+
+def external_sort_records(blocks, dtype, key, output_path, temporary_folder, run_size=DEFAULT_BLOCK_SIZE):
+    """
+    Sort records that do not fit in memory on a field, and write them to a record file. The records are sorted in
+    memory by runs of run_size records written to temporary files, then the runs are merged, at most MERGE_FAN_IN at
+    a time.
+    :param blocks: An iterable of numpy arrays of records.
+    :param dtype: The numpy dtype of the records.
+    :param key: The name of the field to sort on.
+    :param output_path: The output record file.
+    :param temporary_folder: The folder where the sorted runs are written.
+    :param run_size: The number of records sorted in memory at once.
+    :return: The number of records sorted.
+    """
+    run_template = os.path.join(temporary_folder, os.path.basename(output_path) + '_run_{}')
+    run_paths = []
+    count_records_sorted = 0
+    pending = []
+    pending_count = 0
+
+    def write_run(records):
+        run_path = run_template.format(len(run_paths))
+        records[numpy.argsort(records[key], kind='mergesort')].tofile(run_path)
+        run_paths.append(run_path)
+
+    for block in itertools.chain(blocks, [None]):
+        if block is not None:
+            pending.append(block)
+            pending_count += len(block)
+            count_records_sorted += len(block)
+        while pending_count >= run_size or (block is None and pending_count > 0):
+            records = numpy.concatenate(pending)
+            write_run(records[:run_size])
+            pending = [records[run_size:]]
+            pending_count = len(pending[0])
+
+    if len(run_paths) == 0:
+        open(output_path, 'wb').close()
+        return 0
+
+    generation = len(run_paths)
+    while len(run_paths) > MERGE_FAN_IN:
+        merged_paths = []
+        for start in range(0, len(run_paths), MERGE_FAN_IN):
+            merged_path = run_template.format(generation)
+            generation += 1
+            merge_sorted_record_files(run_paths[start:start + MERGE_FAN_IN], dtype, key, merged_path)
+            for run_path in run_paths[start:start + MERGE_FAN_IN]:
+                os.remove(run_path)
+            merged_paths.append(merged_path)
+        run_paths = merged_paths
+
+    merge_sorted_record_files(run_paths, dtype, key, output_path)
+    for run_path in run_paths:
+        os.remove(run_path)
+    return count_records_sorted
+
+
+def sort_list_index(path, temporary_folder, run_size=DEFAULT_BLOCK_SIZE):
+    """
+    Sort the index of a list file by identifier. The values are left in place, the offsets of the index still
+    pointing to them.
+    :param path: The path of the list file, without extension.
+    :param temporary_folder: The folder where the sorted runs are written.
+    :param run_size: The number of index records sorted in memory at once.
+    :return: None.
+    """
+    sorted_index = path + '_sorted' + INDEX_EXTENSION
+    external_sort_records(
+        iter_record_blocks(path + INDEX_EXTENSION, INDEX_DTYPE, run_size),
+        INDEX_DTYPE,
+        'id',
+        sorted_index,
+        temporary_folder,
+        run_size
+    )
+    os.remove(path + INDEX_EXTENSION)
+    os.rename(sorted_index, path + INDEX_EXTENSION)
@@ -0,0 +1,53 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    The messages of the tool. They are sent to the geoprocessing messages when arcpy is available, and to the python
+    logging module otherwise, so that the tool can run without ArcGIS.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import logging
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+LOGGER = logging.getLogger('osm2arcmap')
+
+
+def add_message(message):
+    """
+    Report an informative message.
+    :param message: The message.
+    """
+    if arcpy is not None:
+        arcpy.AddMessage(message)
+    else:
+        LOGGER.info(message)
+
+
+def add_warning(message):
+    """
+    Report a warning.
+    :param message: The message.
+    """
+    if arcpy is not None:
+        arcpy.AddWarning(message)
+    else:
+        LOGGER.warning(message)
+
+
+def add_error(message):
+    """
+    Report an error.
+    :param message: The message.
+    """
+    if arcpy is not None:
+        arcpy.AddError(message)
+    else:
+        LOGGER.error(message)
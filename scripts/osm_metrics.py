@@ -0,0 +1,414 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Profiling of the runs of the tool. Each function decorated with timeit is measured as a stage: wall and CPU time,
+    number of elements processed and rate, bytes read and written by the process, peak resident memory of the
+    process when the stage ends, and disk usage of the processing folder.
+
+    While a RunReport is active, the stages are recorded and written at the end of the run as a json report, so that
+    runs can be compared across machines and extract sizes. The report can also hold a cProfile profile of the
+    functions of the run, written as a pstats file next to it.
+
+    The process counters are read from the operating system without additional dependency: /proc and the resource
+    module on Linux, the kernel32 and psapi functions through ctypes on Windows. Counters that cannot be read are
+    reported as null.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, time, json, platform, datetime
+from osm_messages import add_warning
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPORT_FILE = 'run_report.json'
+PROFILE_FILE = 'run_profile.pstats'
+REPORT_VERSION = 2
+
+# The number of functions of the profile listed in the report.
+PROFILE_TOP_FUNCTIONS = 30
+
+_active_report = None
+
+
+###################################
+# PROCESS COUNTERS
+###################################
+def _windows_memory_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+            (name, ctypes.c_size_t) for name in (
+                'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage'
+            )
+        ]
+
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    memory_counters = PROCESS_MEMORY_COUNTERS()
+    memory_counters.cb = ctypes.sizeof(memory_counters)
+    if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(memory_counters), memory_counters.cb):
+        return memory_counters
+    return None
+
+
+def _windows_process_counters():
+    import ctypes
+
+    class IO_COUNTERS(ctypes.Structure):
+        _fields_ = [(name, ctypes.c_ulonglong) for name in (
+            'ReadOperationCount', 'WriteOperationCount', 'OtherOperationCount',
+            'ReadTransferCount', 'WriteTransferCount', 'OtherTransferCount'
+        )]
+
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    io_counters = IO_COUNTERS()
+    counters = {'bytes_read': None, 'bytes_written': None, 'peak_rss': None}
+    if ctypes.windll.kernel32.GetProcessIoCounters(process, ctypes.byref(io_counters)):
+        counters['bytes_read'] = int(io_counters.ReadTransferCount)
+        counters['bytes_written'] = int(io_counters.WriteTransferCount)
+    memory_counters = _windows_memory_counters()
+    if memory_counters is not None:
+        counters['peak_rss'] = int(memory_counters.PeakWorkingSetSize)
+    return counters
+
+
+def _posix_process_counters():
+    counters = {'bytes_read': None, 'bytes_written': None, 'peak_rss': None}
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            for line in io_file:
+                name, value = line.split(':')
+                if name == 'rchar':
+                    counters['bytes_read'] = int(value)
+                elif name == 'wchar':
+                    counters['bytes_written'] = int(value)
+    except (IOError, OSError, ValueError):
+        pass
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # The peak resident memory is in kilobytes on Linux, and in bytes on macOS.
+        counters['peak_rss'] = int(peak_rss if sys.platform == 'darwin' else peak_rss * 1024)
+    return counters
+
+
+def process_counters():
+    """
+    Read the counters of the current process.
+    :return: A dictionary with the bytes read and written since the process started, including the files read from
+    the system cache, and the peak resident memory in bytes. The counters that cannot be read are None.
+    """
+    try:
+        if sys.platform == 'win32':
+            return _windows_process_counters()
+        return _posix_process_counters()
+    except Exception:
+        return {'bytes_read': None, 'bytes_written': None, 'peak_rss': None}
+
+
+def resident_memory():
+    """
+    :return: The current resident memory of the process in bytes, or None if it cannot be read.
+    """
+    try:
+        if sys.platform == 'win32':
+            memory_counters = _windows_memory_counters()
+            return None if memory_counters is None else int(memory_counters.WorkingSetSize)
+        with open('/proc/self/statm', 'r') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return None
+
+
+def cpu_time():
+    """
+    :return: The user and system CPU time of the process, in seconds.
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+
+def folder_size(folder):
+    """
+    :param folder: A folder.
+    :return: The total size of the files of the folder and of its sub folders, in bytes.
+    """
+    size = 0
+    for root, folders, files in os.walk(folder):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return size
+
+
+def _difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+###################################
+# STAGES
+###################################
+class StageMetrics(object):
+    """
+    The measures of a stage of a run.
+    """
+
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self.start_time = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.elements = None
+        self.bytes_read = None
+        self.bytes_written = None
+        self.process_peak_rss = None
+        self.temp_disk_usage = None
+        self._start_cpu_time = None
+        self._start_counters = None
+
+    def start(self):
+        self._start_counters = process_counters()
+        self._start_cpu_time = cpu_time()
+        self.start_time = time.time()
+
+    def stop(self, processing_folder=None):
+        self.wall_time = time.time() - self.start_time
+        self.cpu_time = cpu_time() - self._start_cpu_time
+        counters = process_counters()
+        self.bytes_read = _difference(counters['bytes_read'], self._start_counters['bytes_read'])
+        self.bytes_written = _difference(counters['bytes_written'], self._start_counters['bytes_written'])
+        # The peak of the process since it started, not the memory used by the stage alone.
+        self.process_peak_rss = counters['peak_rss']
+        if processing_folder is not None:
+            self.temp_disk_usage = folder_size(processing_folder)
+
+    def add_elements(self, count):
+        self.elements = (self.elements or 0) + count
+
+    def rate(self):
+        """
+        :return: The number of elements processed per second, or None.
+        """
+        if self.elements is None or not self.wall_time:
+            return None
+        return self.elements / self.wall_time
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'depth': self.depth,
+            'start': datetime.datetime.fromtimestamp(self.start_time).isoformat(),
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'elements': self.elements,
+            'elements_per_second': self.rate(),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'process_peak_rss': self.process_peak_rss,
+            'temp_disk_usage': self.temp_disk_usage
+        }
+
+
+class RunReport(object):
+    """
+    The report of a run: the stages measured while it is active, in the order they started. A single report is
+    active at a time.
+    """
+
+    def __init__(self, processing_folder, parameters=None, profile=False):
+        """
+        :param processing_folder: The processing folder, where the report is written and whose disk usage is measured.
+        :param parameters: A json serializable description of the parameters of the run.
+        :param profile: If True, the functions called by the thread running the report are profiled with cProfile.
+        The functions run by the threads of a pipelined run and by the worker processes are not profiled.
+        """
+        self.processing_folder = processing_folder
+        self.parameters = parameters or {}
+        self.profile = profile
+        self.stages = []
+        self.run = StageMetrics('run')
+        self.peak_temp_disk_usage = 0
+        self._running = []
+        self._profiler = None
+
+    def __enter__(self):
+        global _active_report
+        _active_report = self
+        if self.profile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self.run.start()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        global _active_report
+        self.run.stop(self.processing_folder)
+        if self._profiler is not None:
+            self._profiler.disable()
+        _active_report = None
+        if exception_value is None:
+            self.write()
+        else:
+            # The report of a failed run must not hide the exception that stopped it.
+            try:
+                self.write(exception_value)
+            except Exception as error:
+                add_warning('The run report could not be written: {}'.format(error))
+        return False
+
+    def start_stage(self, name):
+        stage = StageMetrics(name, len(self._running))
+        self.stages.append(stage)
+        self._running.append(stage)
+        stage.start()
+        return stage
+
+    def stop_stage(self, stage):
+        stage.stop(self.processing_folder)
+        self.peak_temp_disk_usage = max(self.peak_temp_disk_usage, stage.temp_disk_usage)
+        if stage in self._running:
+            self._running.remove(stage)
+
+    def add_elements(self, count):
+        """
+        Add elements processed by the innermost running stage.
+        :param count: The number of elements.
+        """
+        if len(self._running) > 0:
+            self._running[-1].add_elements(count)
+
+    def profile_summary(self):
+        """
+        Write the profile of the run as a pstats file and list its most expensive functions.
+        :return: A list of dictionaries describing the functions, by decreasing cumulative time.
+        """
+        import pstats
+        profile_path = os.path.join(self.processing_folder, PROFILE_FILE)
+        self._profiler.dump_stats(profile_path)
+        statistics = pstats.Stats(profile_path)
+        functions = []
+        for (file_name, line, function), (primitive_calls, calls, total_time, cumulative_time, callers) in \
+                statistics.stats.items():
+            functions.append({
+                'function': '{}:{}({})'.format(os.path.basename(file_name), line, function),
+                'calls': calls,
+                'total_time': total_time,
+                'cumulative_time': cumulative_time
+            })
+        functions.sort(key=lambda function: -function['cumulative_time'])
+        return functions[:PROFILE_TOP_FUNCTIONS]
+
+    def to_dict(self, error=None):
+        return {
+            'version': REPORT_VERSION,
+            'parameters': self.parameters,
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'machine': platform.machine(),
+                'processor': platform.processor(),
+                'cpu_count': _cpu_count()
+            },
+            'status': 'failed' if error is not None else 'completed',
+            'error': None if error is None else repr(error),
+            'run': self.run.to_dict(),
+            'peak_temp_disk_usage': self.peak_temp_disk_usage,
+            'stages': [stage.to_dict() for stage in self.stages],
+            'profile': self.profile_summary() if self._profiler is not None else None
+        }
+
+    def write(self, error=None):
+        """
+        Write the report to the processing folder.
+        :param error: The exception that stopped the run, if any.
+        :return: The path of the report.
+        """
+        path = os.path.join(self.processing_folder, REPORT_FILE)
+        with open(path, 'w') as report_file:
+            json.dump(self.to_dict(error), report_file, indent=1, sort_keys=True)
+        return path
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
+
+
+###################################
+# INSTRUMENTATION
+###################################
+class Measure(object):
+    """
+    A context manager measuring a stage. The stage is recorded in the active report, if any.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.report = _active_report
+        self.stage = None
+
+    def __enter__(self):
+        if self.report is not None:
+            self.stage = self.report.start_stage(self.name)
+        else:
+            self.stage = StageMetrics(self.name)
+            self.stage.start()
+        return self.stage
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if self.report is not None:
+            self.report.stop_stage(self.stage)
+        else:
+            self.stage.stop()
+        return False
+
+
+def measure(name):
+    """
+    Measure a stage.
+    :param name: The name of the stage.
+    :return: A context manager returning the StageMetrics of the stage.
+    """
+    return Measure(name)
+
+
+def add_elements(count):
+    """
+    Add elements processed by the innermost stage of the active report, if any.
+    :param count: The number of elements.
+    """
+    if _active_report is not None:
+        _active_report.add_elements(count)
+
+
+class ProgressRate(object):
+    """
+    The rate of a loop, for the progress messages.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+
+    def rate(self, count):
+        """
+        :param count: The number of elements processed since the loop started.
+        :return: The number of elements per second.
+        """
+        return count / max(time.time() - self.start_time, 1e-9)
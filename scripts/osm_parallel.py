@@ -0,0 +1,216 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Parallel decoding of Open Street Map files. The input file is split into units that can be decoded independently:
+    the blobs of a PBF file, or the bz2 streams of a multistream bz2 file (as produced by pbzip2 or lbzip2). The units
+    are decoded by a pool of worker processes, and the results are returned in the order of the file, so that the
+    single process writing the output sees the elements in the same order than when reading the file sequentially.
+
+    PBF blobs are decompressed and decoded into element records by the workers. The xml fragments held by bz2 streams
+    are not well formed documents on their own, so for bz2 files the workers only decompress the streams, and the xml
+    is parsed by the calling process.
+
+    This module does not depend on arcpy, so that the worker processes do not have to load it.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, bz2, collections, multiprocessing
+import osm_pbf
+
+# The bz2 stream header: the magic 'BZh', the block size from 1 to 9, and the magic of the first block.
+BZ2_STREAM_MAGIC = b'BZh'
+BZ2_BLOCK_MAGIC = b'1AY&SY'
+BZ2_BLOCK_SIZES = b'123456789'
+
+# The size of the blocks read when looking for bz2 streams, and the minimum compressed size of a task.
+READ_BLOCK_SIZE = 8 * 1024 * 1024
+BZ2_TASK_SIZE = 4 * 1024 * 1024
+
+# The number of tasks queued per worker. It bounds the memory used by the pending results.
+TASKS_PER_WORKER = 4
+
+
+def create_pool(workers):
+    """
+    Create a pool of worker processes. When running inside ArcMap, sys.executable is ArcMap itself, so the workers
+    are started with the python interpreter instead.
+    :param workers: The number of worker processes.
+    :return: The pool.
+    """
+    executable = os.path.basename(sys.executable).lower()
+    if not executable.startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+    return multiprocessing.Pool(workers)
+
+
+def ordered_map(pool, function, tasks, workers):
+    """
+    Apply a function to tasks in a pool of workers, and yield the results in the order of the tasks. Unlike
+    Pool.imap, at most TASKS_PER_WORKER tasks per worker are submitted ahead, so that the tasks are not all read in
+    memory when the workers are slower than the reading of the file.
+    :param pool: The pool of workers.
+    :param function: The function to apply. It must be importable by the workers.
+    :param tasks: An iterable of task arguments.
+    :param workers: The number of workers of the pool.
+    :return: A generator of results.
+    """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= workers * TASKS_PER_WORKER:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+###################################
+# PBF FILES
+###################################
+def iter_data_blobs(osm_file):
+    """
+    Iterate over the OSMData blobs of a PBF file, checking the OSMHeader blobs on the way.
+    :param osm_file: A file object opened in binary mode.
+    :return: A generator of serialized blobs.
+    """
+    for blob_type, blob in osm_pbf.iter_blobs(osm_file):
+        if blob_type == osm_pbf.BLOB_HEADER_TYPE:
+            osm_pbf.check_header_block(osm_pbf.decode_blob(blob))
+        elif blob_type == osm_pbf.BLOB_DATA_TYPE:
+            yield blob
+
+
+def iter_pbf_elements(osm_file, workers):
+    """
+    Parse a PBF file with a pool of workers and yield its element records in the order of the file.
+    :param osm_file: The path to the PBF file.
+    :param workers: The number of worker processes.
+    :return: A generator of element records.
+    """
+    pool = create_pool(workers)
+    try:
+        with open(osm_file, 'rb') as pbf_file:
+            for elements in ordered_map(pool, osm_pbf.decode_data_blob, iter_data_blobs(pbf_file), workers):
+                for element in elements:
+                    yield element
+    finally:
+        pool.terminate()
+
+
+###################################
+# MULTISTREAM BZ2 FILES
+###################################
+def find_stream_starts(data, start):
+    """
+    Find the positions of the bz2 stream headers in a buffer.
+    :param data: The buffer.
+    :param start: The position where the search starts.
+    :return: The list of positions.
+    """
+    positions = []
+    position = data.find(BZ2_STREAM_MAGIC, start)
+    while position != -1:
+        header_end = position + len(BZ2_STREAM_MAGIC)
+        if data[header_end:header_end + 1] in BZ2_BLOCK_SIZES and \
+                data[header_end + 1:header_end + 1 + len(BZ2_BLOCK_MAGIC)] == BZ2_BLOCK_MAGIC:
+            positions.append(position)
+        position = data.find(BZ2_STREAM_MAGIC, position + 1)
+    return positions
+
+
+def iter_bz2_streams(bz2_file, task_size=BZ2_TASK_SIZE):
+    """
+    Split a multistream bz2 file into groups of complete streams of at least task_size bytes.
+    :param bz2_file: A file object opened in binary mode.
+    :param task_size: The minimum size of a group of streams.
+    :return: A generator of byte strings, each one holding one or more complete bz2 streams.
+    """
+    header_size = len(BZ2_STREAM_MAGIC) + 1 + len(BZ2_BLOCK_MAGIC)
+    data = b''
+    search_start = 1
+    while True:
+        block = bz2_file.read(READ_BLOCK_SIZE)
+        data += block
+        last_task_end = 0
+        for position in find_stream_starts(data, search_start):
+            if position - last_task_end >= task_size:
+                yield data[last_task_end:position]
+                last_task_end = position
+        data = data[last_task_end:]
+        if len(block) == 0:
+            break
+        # Headers may straddle two blocks, so the end of the buffer is searched again with the next block.
+        search_start = max(1, len(data) - header_size)
+    if len(data) > 0:
+        yield data
+
+
+def decompress_bz2_streams(data):
+    """
+    Decompress one or more complete bz2 streams.
+    :param data: The compressed streams.
+    :return: The decompressed data.
+    """
+    parts = []
+    while len(data) > 0:
+        decompressor = bz2.BZ2Decompressor()
+        parts.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b''.join(parts)
+
+
+class ChunkedReader(object):
+    """
+    A read only file object over an iterator of byte strings, that can be given to the xml parsers.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self._buffer[self._position:] + b''.join(self._chunks)
+            self._buffer = b''
+            self._position = 0
+            return data
+        while self._position >= len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._buffer = chunk
+            self._position = 0
+        end = min(self._position + size, len(self._buffer))
+        data = self._buffer[self._position:end]
+        self._position = end
+        return data
+
+
+def is_multistream(osm_file):
+    """
+    Tell whether a bz2 file holds more than one stream, looking for a second stream header in its first block.
+    :param osm_file: The path to the bz2 file.
+    :return: True if the file is a multistream bz2 file.
+    """
+    with open(osm_file, 'rb') as bz2_file:
+        return len(find_stream_starts(bz2_file.read(READ_BLOCK_SIZE), 1)) > 0
+
+
+def iter_bz2_chunks(osm_file, workers):
+    """
+    Decompress the streams of a multistream bz2 file with a pool of workers.
+    :param osm_file: The path to the bz2 file.
+    :param workers: The number of worker processes.
+    :return: A generator of decompressed byte strings, in the order of the file.
+    """
+    pool = create_pool(workers)
+    try:
+        with open(osm_file, 'rb') as bz2_file:
+            for data in ordered_map(pool, decompress_bz2_streams, iter_bz2_streams(bz2_file), workers):
+                yield data
+    finally:
+        pool.terminate()
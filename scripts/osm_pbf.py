@@ -0,0 +1,614 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Reader for the Open Street Map PBF format (.osm.pbf), as distributed by Geofabrik and planet.openstreetmap.org.
+    The file is a sequence of blobs, each one holding a zlib compressed protocol buffer message. The first blob is the
+    OSMHeader, the following ones are OSMData blocks (PrimitiveBlock). The protocol buffer messages are decoded
+    directly, so that the reader does not depend on the protobuf library.
+
+    The reader yields the element records of the XML reader of osm_2_geodatabase:
+        ('node', id, lon, lat, timestamp, tags)
+        ('way', id, timestamp, tags, node_refs)
+        ('relation', id, timestamp, tags, members)
+    where identifiers and coordinates are text, tags is a dictionary, node_refs is a list of node identifiers and
+    members is a list of (type, ref, role) tuples. The packed fields are decoded with numpy, and the results are kept
+    as numpy arrays where the import can use them as is:
+        - the node_refs of the ways are numpy arrays of int64,
+        - the nodes of a DenseNodes group, most of the nodes of a file, make a single (NODE_BLOCK, DenseNodeBlock)
+          record holding their identifiers and fixed point coordinates. The records of its nodes are only built on
+          request. iter_element_records expands these records into the records of the XML reader.
+
+    The format is documented here: https://wiki.openstreetmap.org/wiki/PBF_Format
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import struct, zlib, datetime, numpy
+
+from osm_intermediate import COORDINATE_PRECISION, NODE_DTYPE
+
+BLOB_HEADER_TYPE = 'OSMHeader'
+BLOB_DATA_TYPE = 'OSMData'
+
+SUPPORTED_FEATURES = set(('OsmSchema-V0.6', 'DenseNodes'))
+
+MEMBER_TYPES = ('node', 'way', 'relation')
+
+# The type of the records of the DenseNodes groups.
+NODE_BLOCK = 'node_block'
+
+WIRE_VARINT = 0
+WIRE_64BIT = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_32BIT = 5
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+###################################
+# PROTOCOL BUFFER DECODING
+###################################
+def decode_varint(buf, pos):
+    """
+    Decode a varint.
+    :param buf: A bytearray.
+    :param pos: The position of the varint in the buffer.
+    :return: The decoded value and the position following the varint.
+    """
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value):
+    """
+    Decode a zigzag encoded signed integer (sint32, sint64).
+    """
+    return (value >> 1) ^ -(value & 1)
+
+
+def signed(value):
+    """
+    Decode a varint encoded as a two's complement 64 bits integer (int32, int64).
+    """
+    if value & 0x8000000000000000:
+        return value - 0x10000000000000000
+    return value
+
+
+def iter_fields(buf):
+    """
+    Iterate over the fields of a protocol buffer message.
+    :param buf: A bytearray holding the message.
+    :return: A generator of (field number, wire type, value). The value is an integer for varint and fixed size fields
+    and a bytearray for length delimited fields.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = decode_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 0x7
+        if wire_type == WIRE_VARINT:
+            value, pos = decode_varint(buf, pos)
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            length, pos = decode_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_64BIT:
+            value = struct.unpack('<Q', bytes(buf[pos:pos + 8]))[0]
+            pos += 8
+        elif wire_type == WIRE_32BIT:
+            value = struct.unpack('<I', bytes(buf[pos:pos + 4]))[0]
+            pos += 4
+        else:
+            raise ValueError('Unsupported protocol buffer wire type {}'.format(wire_type))
+        yield field_number, wire_type, value
+
+
+def decode_packed(wire_type, value):
+    """
+    Decode a packed repeated varint field. Repeated fields that are not packed are decoded as a one item list.
+    :param wire_type: The wire type of the field.
+    :param value: The value of the field.
+    :return: A list of integers.
+    """
+    if wire_type != WIRE_LENGTH_DELIMITED:
+        return [value]
+    values = []
+    append = values.append
+    pos = 0
+    end = len(value)
+    while pos < end:
+        result = 0
+        shift = 0
+        while True:
+            b = value[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+        append(result)
+    return values
+
+
+def decode_varints(data):
+    """
+    Decode a packed repeated varint field at once with numpy.
+    :param data: A bytearray holding the packed varints.
+    :return: A numpy array of uint64.
+    """
+    if len(data) == 0:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    ends = buf < 0x80
+    if ends.all():
+        return buf.astype(numpy.uint64)
+    if not ends[-1]:
+        raise ValueError('Truncated packed varints')
+    # The bytes of a varint hold 7 bits each, the least significant first.
+    end_positions = numpy.flatnonzero(ends)
+    starts = numpy.zeros(len(end_positions), dtype=numpy.int64)
+    starts[1:] = end_positions[:-1] + 1
+    varint_indexes = numpy.cumsum(ends) - ends
+    shifts = (numpy.arange(len(buf)) - starts[varint_indexes]) * 7
+    values = (buf & 0x7f).astype(numpy.uint64) << shifts.astype(numpy.uint64)
+    return numpy.add.reduceat(values, starts)
+
+
+def decode_packed_array(wire_type, value):
+    """
+    Decode a packed repeated varint field into a numpy array. Repeated fields that are not packed are decoded as a one
+    item array.
+    :param wire_type: The wire type of the field.
+    :param value: The value of the field.
+    :return: A numpy array of uint64.
+    """
+    if wire_type != WIRE_LENGTH_DELIMITED:
+        return numpy.array([value], dtype=numpy.uint64)
+    return decode_varints(value)
+
+
+def delta_decode(values):
+    """
+    Decode delta coded zigzag integers.
+    :param values: The raw varints, as a numpy array of uint64.
+    :return: A numpy array of int64.
+    """
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    deltas = (values >> numpy.uint64(1)).astype(numpy.int64) ^ -(values & numpy.uint64(1)).astype(numpy.int64)
+    return numpy.cumsum(deltas)
+
+
+###################################
+# FILE BLOCKS
+###################################
+def iter_blobs(osm_file):
+    """
+    Iterate over the blobs of a PBF file.
+    :param osm_file: A file object opened in binary mode.
+    :return: A generator of (blob type, serialized blob).
+    """
+    while True:
+        header_size_bytes = osm_file.read(4)
+        if len(header_size_bytes) == 0:
+            return
+        if len(header_size_bytes) != 4:
+            raise ValueError('Truncated PBF file')
+        header_size = struct.unpack('>I', header_size_bytes)[0]
+        blob_type = None
+        data_size = 0
+        for field_number, wire_type, value in iter_fields(bytearray(osm_file.read(header_size))):
+            if field_number == 1:
+                blob_type = bytes(value).decode('utf-8')
+            elif field_number == 3:
+                data_size = value
+        blob = osm_file.read(data_size)
+        if len(blob) != data_size:
+            raise ValueError('Truncated PBF file')
+        yield blob_type, blob
+
+
+def decode_blob(blob):
+    """
+    Decompress a serialized blob.
+    :param blob: The serialized blob.
+    :return: A bytearray holding the decompressed message.
+    """
+    for field_number, wire_type, value in iter_fields(bytearray(blob)):
+        if field_number == 1:
+            return value
+        elif field_number == 3:
+            return bytearray(zlib.decompress(bytes(value)))
+        elif field_number in (4, 5, 6, 7):
+            raise ValueError('Unsupported PBF blob compression (field {})'.format(field_number))
+    return bytearray()
+
+
+def check_header_block(data):
+    """
+    Make sure the file does not require features this reader does not support.
+    :param data: The decompressed HeaderBlock message.
+    :return: None.
+    """
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 4:
+            feature = bytes(value).decode('utf-8')
+            if feature not in SUPPORTED_FEATURES:
+                raise ValueError('Unsupported PBF required feature: {}'.format(feature))
+
+
+###################################
+# PRIMITIVE BLOCKS
+###################################
+class TimestampFormatter(object):
+    """
+    Format the timestamps of a PrimitiveBlock as text. The elements of a block often share their timestamp, so the
+    formatted timestamps are cached.
+    """
+
+    def __init__(self, date_granularity=1000):
+        """
+        :param date_granularity: The number of milliseconds of a timestamp unit.
+        """
+        self.date_granularity = date_granularity
+        self._texts = {}
+
+    def format(self, value):
+        """
+        :param value: A timestamp, in units of date_granularity, or None.
+        :return: The timestamp as text, or None.
+        """
+        if value is None:
+            return None
+        text = self._texts.get(value)
+        if text is None:
+            milliseconds = value * self.date_granularity
+            text = (EPOCH + datetime.timedelta(milliseconds=milliseconds)).strftime(TIMESTAMP_FORMAT)
+            self._texts[value] = text
+        return text
+
+
+class BlockContext(object):
+    """
+    The parameters shared by the elements of a PrimitiveBlock: string table, coordinates and timestamps scaling.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.granularity = 100
+        self.lat_offset = 0
+        self.lon_offset = 0
+        self.timestamps = TimestampFormatter()
+
+    def coordinate(self, offset, value):
+        return '{:.7f}'.format(1e-9 * (offset + self.granularity * value))
+
+    def fixed_point(self, offset, values):
+        """
+        Convert coordinates of the block to the fixed point integers of osm_intermediate.
+        :param offset: The latitude or longitude offset of the block.
+        :param values: A numpy array of int64 coordinates, in units of the granularity.
+        :return: A numpy array of int32.
+        """
+        nanodegrees_per_unit = 1000000000 // COORDINATE_PRECISION
+        if offset == 0 and self.granularity == nanodegrees_per_unit:
+            return values.astype(numpy.int32)
+        return numpy.rint((offset + self.granularity * values) / float(nanodegrees_per_unit)).astype(numpy.int32)
+
+    def timestamp(self, value):
+        return self.timestamps.format(value)
+
+    def tags(self, keys, values):
+        strings = self.strings
+        return {strings[k]: strings[v] for k, v in zip(keys, values)}
+
+
+class DenseNodeBlock(object):
+    """
+    The nodes of a DenseNodes group. Their identifiers and coordinates are decoded into a numpy array of NODE_DTYPE,
+    that is written to the intermediate files as is. The records of the nodes, with their coordinates and timestamp
+    as text, are only built on request, which is mostly for the tagged nodes.
+    """
+
+    def __init__(self, nodes, timestamps, tags, timestamp_formatter):
+        """
+        :param nodes: A numpy array of NODE_DTYPE.
+        :param timestamps: A numpy array of the timestamps of the nodes, in units of the date granularity, or None.
+        :param tags: A dictionary of the tags of the tagged nodes, keyed by their index in the block.
+        :param timestamp_formatter: The TimestampFormatter of the block.
+        """
+        self.nodes = nodes
+        self.timestamps = timestamps
+        self.tags = tags
+        self.timestamp_formatter = timestamp_formatter
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def record(self, index):
+        """
+        :param index: The index of a node in the block.
+        :return: The record of the node: ('node', id, lon, lat, timestamp, tags), as yielded by the xml readers.
+        """
+        node_id, lon, lat = self.nodes[index].tolist()
+        return (
+            'node',
+            str(node_id),
+            '{:.7f}'.format(lon / float(COORDINATE_PRECISION)),
+            '{:.7f}'.format(lat / float(COORDINATE_PRECISION)),
+            None if self.timestamps is None else self.timestamp_formatter.format(int(self.timestamps[index])),
+            self.tags.get(index, {})
+        )
+
+    def records(self):
+        """
+        :return: The records of all the nodes of the block.
+        """
+        return [self.record(index) for index in range(len(self.nodes))]
+
+    def tagged_records(self, kept=None):
+        """
+        :param kept: An optional numpy array of booleans telling which nodes of the block are kept.
+        :return: The records of the tagged nodes, in the order of the block.
+        """
+        return [self.record(index) for index in sorted(self.tags) if kept is None or kept[index]]
+
+
+def decode_info_timestamp(data):
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 2:
+            return signed(value)
+    return None
+
+
+def decode_dense_nodes(data, context, elements):
+    ids = lats = lons = numpy.zeros(0, dtype=numpy.int64)
+    keys_vals = None
+    timestamps = None
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 1:
+            ids = delta_decode(decode_packed_array(wire_type, value))
+        elif field_number == 5:
+            for info_field, info_wire_type, info_value in iter_fields(value):
+                if info_field == 2:
+                    timestamps = delta_decode(decode_packed_array(info_wire_type, info_value))
+        elif field_number == 8:
+            lats = delta_decode(decode_packed_array(wire_type, value))
+        elif field_number == 9:
+            lons = delta_decode(decode_packed_array(wire_type, value))
+        elif field_number == 10:
+            keys_vals = decode_packed_array(wire_type, value)
+    if len(ids) == 0:
+        return
+
+    nodes = numpy.empty(len(ids), dtype=NODE_DTYPE)
+    nodes['id'] = ids
+    nodes['lon'] = context.fixed_point(context.lon_offset, lons)
+    nodes['lat'] = context.fixed_point(context.lat_offset, lats)
+
+    # The keys and values of the nodes follow each other, the tags of a node ending with a 0.
+    tags = {}
+    if keys_vals is not None and len(keys_vals) > len(ids):
+        strings = context.strings
+        ends = numpy.flatnonzero(keys_vals == 0)
+        starts = numpy.zeros(len(ends), dtype=numpy.int64)
+        starts[1:] = ends[:-1] + 1
+        keys_vals = keys_vals.tolist()
+        for index in numpy.flatnonzero(ends > starts).tolist():
+            tags[index] = {
+                strings[keys_vals[position]]: strings[keys_vals[position + 1]]
+                for position in range(int(starts[index]), int(ends[index]), 2)
+            }
+    elements.append((NODE_BLOCK, DenseNodeBlock(nodes, timestamps, tags, context.timestamps)))
+
+
+def decode_node(data, context, elements):
+    node_id = 0
+    keys = []
+    values = []
+    lat = 0
+    lon = 0
+    timestamp = None
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 1:
+            node_id = zigzag(value)
+        elif field_number == 2:
+            keys.extend(decode_packed(wire_type, value))
+        elif field_number == 3:
+            values.extend(decode_packed(wire_type, value))
+        elif field_number == 4:
+            timestamp = decode_info_timestamp(value)
+        elif field_number == 8:
+            lat = zigzag(value)
+        elif field_number == 9:
+            lon = zigzag(value)
+    elements.append((
+        'node',
+        str(node_id),
+        context.coordinate(context.lon_offset, lon),
+        context.coordinate(context.lat_offset, lat),
+        context.timestamp(timestamp),
+        context.tags(keys, values)
+    ))
+
+
+def decode_ways(messages, context, elements):
+    """
+    Decode the ways of a PrimitiveGroup. The node references of all the ways are decoded at once.
+    :param messages: The Way messages of the group.
+    :param context: The BlockContext.
+    :param elements: The list the way records are appended to.
+    """
+    ways = []
+    refs = []
+    for data in messages:
+        way_id = 0
+        keys = []
+        values = []
+        way_refs = bytearray()
+        timestamp = None
+        for field_number, wire_type, value in iter_fields(data):
+            if field_number == 1:
+                way_id = signed(value)
+            elif field_number == 2:
+                keys.extend(decode_packed(wire_type, value))
+            elif field_number == 3:
+                values.extend(decode_packed(wire_type, value))
+            elif field_number == 4:
+                timestamp = decode_info_timestamp(value)
+            elif field_number == 8 and wire_type == WIRE_LENGTH_DELIMITED:
+                way_refs = value
+        ways.append((way_id, timestamp, keys, values))
+        refs.append(way_refs)
+
+    # The deltas of every way start from 0, so the sum of the references of the previous ways is subtracted.
+    byte_offsets = numpy.zeros(len(ways) + 1, dtype=numpy.int64)
+    byte_offsets[1:] = numpy.cumsum([len(way_refs) for way_refs in refs])
+    refs = bytearray().join(refs)
+    varint_ends = numpy.zeros(len(refs) + 1, dtype=numpy.int64)
+    varint_ends[1:] = numpy.cumsum(numpy.frombuffer(refs, dtype=numpy.uint8) < 0x80)
+    offsets = varint_ends[byte_offsets]
+    sums = numpy.zeros(offsets[-1] + 1, dtype=numpy.int64)
+    sums[1:] = delta_decode(decode_varints(refs))
+    way_refs = sums[1:] - numpy.repeat(sums[offsets[:-1]], numpy.diff(offsets))
+
+    for index, (way_id, timestamp, keys, values) in enumerate(ways):
+        elements.append((
+            'way',
+            str(way_id),
+            context.timestamp(timestamp),
+            context.tags(keys, values),
+            way_refs[offsets[index]:offsets[index + 1]]
+        ))
+
+
+def decode_relation(data, context, elements):
+    relation_id = 0
+    keys = []
+    values = []
+    roles = []
+    member_ids = []
+    member_types = []
+    timestamp = None
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 1:
+            relation_id = signed(value)
+        elif field_number == 2:
+            keys.extend(decode_packed(wire_type, value))
+        elif field_number == 3:
+            values.extend(decode_packed(wire_type, value))
+        elif field_number == 4:
+            timestamp = decode_info_timestamp(value)
+        elif field_number == 8:
+            roles.extend(decode_packed(wire_type, value))
+        elif field_number == 9:
+            member_ids.extend(decode_packed(wire_type, value))
+        elif field_number == 10:
+            member_types.extend(decode_packed(wire_type, value))
+    strings = context.strings
+    members = [
+        (MEMBER_TYPES[member_type], str(member_id), strings[role])
+        for member_type, member_id, role in zip(member_types, delta_decode(member_ids).tolist(), roles)
+    ]
+    elements.append((
+        'relation',
+        str(relation_id),
+        context.timestamp(timestamp),
+        context.tags(keys, values),
+        members
+    ))
+
+
+def decode_primitive_block(data):
+    """
+    Decode a PrimitiveBlock into element records.
+    :param data: The decompressed PrimitiveBlock message.
+    :return: The list of element records, in the order of the file.
+    """
+    context = BlockContext()
+    groups = []
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == 1:
+            context.strings = [
+                bytes(s).decode('utf-8') for string_field, string_wire_type, s in iter_fields(value)
+                if string_field == 1
+            ]
+        elif field_number == 2:
+            groups.append(value)
+        elif field_number == 17:
+            context.granularity = value
+        elif field_number == 18:
+            context.timestamps = TimestampFormatter(value)
+        elif field_number == 19:
+            context.lat_offset = signed(value)
+        elif field_number == 20:
+            context.lon_offset = signed(value)
+
+    elements = []
+    for group in groups:
+        ways = []
+        for field_number, wire_type, value in iter_fields(group):
+            if field_number == 1:
+                decode_node(value, context, elements)
+            elif field_number == 2:
+                decode_dense_nodes(value, context, elements)
+            elif field_number == 3:
+                ways.append(value)
+            elif field_number == 4:
+                decode_relation(value, context, elements)
+        # A group holds a single kind of element.
+        if len(ways) > 0:
+            decode_ways(ways, context, elements)
+    return elements
+
+
+def decode_data_blob(blob):
+    """
+    Decompress and decode an OSMData blob.
+    :param blob: The serialized blob.
+    :return: The list of element records of the blob.
+    """
+    return decode_primitive_block(decode_blob(blob))
+
+
+def iter_pbf_elements(osm_file):
+    """
+    Parse a PBF file and yield its element records.
+    :param osm_file: A file object opened in binary mode.
+    :return: A generator of element records.
+    """
+    for blob_type, blob in iter_blobs(osm_file):
+        if blob_type == BLOB_HEADER_TYPE:
+            check_header_block(decode_blob(blob))
+        elif blob_type == BLOB_DATA_TYPE:
+            for element in decode_data_blob(blob):
+                yield element
+
+
+def iter_element_records(elements):
+    """
+    Expand the records of the PBF reader into the records of the XML reader: the node blocks into the records of
+    their nodes, and the node references of the ways into text. Used to compare the readers.
+    :param elements: An iterable of element records of the PBF reader.
+    :return: A generator of element records.
+    """
+    for element in elements:
+        if element[0] == NODE_BLOCK:
+            for record in element[1].records():
+                yield record
+        elif element[0] == 'way':
+            yield element[:4] + ([str(ref) for ref in element[4].tolist()],)
+        else:
+            yield element
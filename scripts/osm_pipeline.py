@@ -0,0 +1,165 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Pipelined execution of the stages of the tool. A producer stage, such as the parsing of the OSM file, runs in a
+    thread and hands its results to the consumer stage, such as the writing to the geodatabase, through a bounded
+    queue. When the queue is full the producer waits, so the memory used by the pending results stays bounded.
+
+    Each stage measures the time it spends working and waiting, so that the bottleneck of the pipeline can be
+    reported: a producer that is mostly blocked waits for a slower consumer, a consumer that mostly waits is starved
+    by a slower producer.
+
+    The consumer stage remains the only one calling arcpy.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import time, threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# The number of batches of items a queue holds, and the number of items of a batch.
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_BATCH_SIZE = 1000
+
+# How often a blocked producer checks whether the consumer stopped.
+PUT_TIMEOUT = 0.1
+
+_END = object()
+
+
+class PipelineStage(object):
+    """
+    Run an iterable in a producer thread and iterate over its items in the consumer thread. The items are handed over
+    by batches through a bounded queue. An exception raised by the producer is raised again in the consumer.
+    """
+
+    def __init__(self, source, name, consumer_name, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param source: The iterable run by the producer.
+        :param name: The name of the producer stage, used in the report.
+        :param consumer_name: The name of the consumer stage, used in the report.
+        :param queue_size: The maximum number of batches waiting in the queue.
+        :param batch_size: The number of items of a batch.
+        """
+        self.source = source
+        self.name = name
+        self.consumer_name = consumer_name
+        self.batch_size = batch_size
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        self.starved_time = 0.0
+        self.start_time = None
+        self.end_time = None
+        self.count = 0
+        self._queue = queue.Queue(queue_size)
+        self._stopped = threading.Event()
+        self._error = None
+
+    def _put(self, item):
+        start = time.time()
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=PUT_TIMEOUT)
+                break
+            except queue.Full:
+                continue
+        self.blocked_time += time.time() - start
+
+    def _produce(self):
+        try:
+            iterator = iter(self.source)
+            batch = []
+            while not self._stopped.is_set():
+                start = time.time()
+                item = next(iterator, _END)
+                self.busy_time += time.time() - start
+                if item is _END:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._put(batch)
+                    batch = []
+            if len(batch) > 0:
+                self._put(batch)
+        except Exception as error:
+            self._error = error
+        finally:
+            self._put(_END)
+
+    def __iter__(self):
+        self.start_time = time.time()
+        thread = threading.Thread(target=self._produce, name=self.name)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                start = time.time()
+                batch = self._queue.get()
+                self.starved_time += time.time() - start
+                if batch is _END:
+                    break
+                for item in batch:
+                    self.count += 1
+                    yield item
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stopped.set()
+            self.end_time = time.time()
+
+    def report(self):
+        """
+        Describe the utilisation of the producer and consumer stages.
+        :return: A list of messages.
+        """
+        elapsed = max((self.end_time or time.time()) - (self.start_time or time.time()), 1e-9)
+        return [
+            'Stage {}: {} items in {:.1f} seconds, busy {:.0%}, blocked by stage {} {:.0%}'.format(
+                self.name,
+                self.count,
+                elapsed,
+                self.busy_time / elapsed,
+                self.consumer_name,
+                self.blocked_time / elapsed
+            ),
+            'Stage {}: busy {:.0%}, waiting for stage {} {:.0%}'.format(
+                self.consumer_name,
+                max(0.0, 1.0 - self.starved_time / elapsed),
+                self.name,
+                self.starved_time / elapsed
+            )
+        ]
+
+
+def pipeline(source, name, consumer_name, enabled=True, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run an iterable as a producer stage if pipelining is enabled.
+    :param source: The iterable.
+    :param name: The name of the producer stage.
+    :param consumer_name: The name of the consumer stage.
+    :param enabled: If False, the iterable is returned as is, and runs in the consumer thread.
+    :param queue_size: The maximum number of batches waiting in the queue.
+    :param batch_size: The number of items of a batch.
+    :return: The PipelineStage, or the iterable itself.
+    """
+    if not enabled:
+        return source
+    return PipelineStage(source, name, consumer_name, queue_size, batch_size)
+
+
+def report(stage):
+    """
+    Describe the utilisation of a stage returned by pipeline.
+    :param stage: A PipelineStage, or an iterable if pipelining was disabled.
+    :return: A list of messages, empty if pipelining was disabled.
+    """
+    if isinstance(stage, PipelineStage):
+        return stage.report()
+    return []
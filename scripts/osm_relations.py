@@ -0,0 +1,246 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Index of the members of the relations, written while parsing so that relations referencing other relations can
+    be resolved once all of them are known. The index is made of:
+
+    * a list file of the members of each relation, in their order in the relation: the type of the member (node, way
+      or relation), its identifier, and its role. The roles are interned: the values hold the position of the role in
+      a roles file written next to the list file. The flags of the index tell the kind of the relation (route,
+      boundary or other).
+    * a record file of the (way, relation) pairs sorted by way identifier, to find the relations of a way.
+
+    The route and boundary relations are resolved into member ways by osm_2_geodatabase, following their nested
+    relations.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, io, numpy
+from osm_intermediate import INDEX_DTYPE, INDEX_EXTENSION, VALUES_EXTENSION, ListWriter, iter_list_blocks, \
+    iter_record_blocks, external_sort_records, remove_list_file
+
+MEMBER_DTYPE = numpy.dtype([('ref', '<i8'), ('type', '<i4'), ('role', '<i4')])
+WAY_RELATION_DTYPE = numpy.dtype([('way', '<i8'), ('relation', '<i8')])
+
+MEMBER_NODE = 0
+MEMBER_WAY = 1
+MEMBER_RELATION = 2
+MEMBER_TYPES = {'node': MEMBER_NODE, 'way': MEMBER_WAY, 'relation': MEMBER_RELATION}
+
+# The kinds of relations, stored in the flags of the index.
+RELATION_OTHER = 0
+RELATION_ROUTE = 1
+RELATION_BOUNDARY = 2
+
+# The values of the type tag of the route and boundary relations. Route masters and super routes group routes.
+ROUTE_TYPES = ('route', 'route_master', 'superroute')
+BOUNDARY_TYPES = ('boundary',)
+
+ROLES_EXTENSION = '.roles'
+WAY_RELATIONS_SUFFIX = '_way_relations.bin'
+
+
+def relation_kind(tag_dict):
+    """
+    :param tag_dict: The tags of a relation.
+    :return: RELATION_ROUTE, RELATION_BOUNDARY or RELATION_OTHER.
+    """
+    relation_type = tag_dict.get('type')
+    if relation_type in ROUTE_TYPES:
+        return RELATION_ROUTE
+    if relation_type in BOUNDARY_TYPES:
+        return RELATION_BOUNDARY
+    return RELATION_OTHER
+
+
+def remove_relation_member_index(path):
+    """
+    Remove the files of a relation member index, if they exist.
+    :param path: The path of the index, without extension.
+    """
+    remove_list_file(path)
+    for file_path in (path + ROLES_EXTENSION, path + WAY_RELATIONS_SUFFIX):
+        if os.path.isfile(file_path):
+            os.remove(file_path)
+
+
+def relation_member_index_paths(path):
+    """
+    :param path: The path of the index, without extension.
+    :return: The paths of the files of the index.
+    """
+    return [path + INDEX_EXTENSION, path + VALUES_EXTENSION, path + ROLES_EXTENSION, path + WAY_RELATIONS_SUFFIX]
+
+
+class RelationMemberWriter(object):
+    """
+    Write the members of the relations to a relation member index.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the index without extension, or None to discard the relations.
+        """
+        self.path = path
+        self.count = 0
+        self._writer = ListWriter(path, MEMBER_DTYPE)
+        self._roles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+
+    def add(self, relation_id, members, kind=RELATION_OTHER):
+        """
+        Add a relation.
+        :param relation_id: The relation identifier.
+        :param members: A list of (member type, identifier, role) tuples, the type being 'node', 'way' or 'relation'.
+        :param kind: The kind of the relation.
+        """
+        roles = self._roles
+        values = []
+        for member_type, ref, role in members:
+            role_code = roles.get(role)
+            if role_code is None:
+                role_code = roles[role] = len(roles)
+            values.append((int(ref), MEMBER_TYPES.get(member_type, MEMBER_NODE), role_code))
+        self._writer.add(relation_id, values, kind)
+        self.count += 1
+
+    def close(self):
+        """
+        Write the roles, and sort the way members by way identifier to build the reverse index.
+        """
+        self._writer.close()
+        if self.path is None:
+            return
+        roles = sorted(self._roles, key=self._roles.get)
+        with io.open(self.path + ROLES_EXTENSION, 'w', encoding='utf-8') as roles_file:
+            for role in roles:
+                roles_file.write(u'{}\n'.format(role.replace('\n', ' ')))
+        external_sort_records(
+            iter_way_relations(self.path),
+            WAY_RELATION_DTYPE,
+            'way',
+            self.path + WAY_RELATIONS_SUFFIX,
+            os.path.dirname(os.path.abspath(self.path))
+        )
+
+
+def iter_way_relations(path):
+    """
+    Read the way members of the relations of an index.
+    :param path: The path of the index, without extension.
+    :return: A generator of numpy arrays of WAY_RELATION_DTYPE.
+    """
+    for block in iter_list_blocks(path, MEMBER_DTYPE):
+        is_way = block.values['type'] == MEMBER_WAY
+        pairs = numpy.empty(int(is_way.sum()), dtype=WAY_RELATION_DTYPE)
+        pairs['way'] = block.values['ref'][is_way]
+        pairs['relation'] = numpy.repeat(block.index['id'], block.index['count'])[is_way]
+        yield pairs
+
+
+class RelationMemberIndex(object):
+    """
+    A relation member index loaded in memory, except the reverse index of the ways which is memory mapped.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the index, without extension.
+        """
+        self.path = path
+        indexes = [numpy.zeros(0, dtype=INDEX_DTYPE)]
+        values = [numpy.zeros(0, dtype=MEMBER_DTYPE)]
+        for block in iter_list_blocks(path, MEMBER_DTYPE):
+            indexes.append(block.index)
+            values.append(block.values)
+        index = numpy.concatenate(indexes)
+        self.values = numpy.concatenate(values)
+
+        counts = index['count'].astype(numpy.int64)
+        order = numpy.argsort(index['id'], kind='mergesort')
+        self.identifiers = index['id'][order]
+        self.kinds = index['flags'][order]
+        self.counts = counts[order]
+        self.starts = (numpy.cumsum(counts) - counts)[order]
+
+        with io.open(path + ROLES_EXTENSION, 'r', encoding='utf-8') as roles_file:
+            self.roles = [line.rstrip(u'\n') for line in roles_file]
+
+        self.way_relations = numpy.zeros(0, dtype=WAY_RELATION_DTYPE)
+        if os.path.getsize(path + WAY_RELATIONS_SUFFIX) > 0:
+            self.way_relations = numpy.memmap(path + WAY_RELATIONS_SUFFIX, dtype=WAY_RELATION_DTYPE, mode='r')
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def _position(self, relation_id):
+        position = numpy.searchsorted(self.identifiers, int(relation_id))
+        if position == len(self.identifiers) or self.identifiers[position] != int(relation_id):
+            return None
+        return position
+
+    def kind(self, relation_id):
+        """
+        :param relation_id: A relation identifier.
+        :return: The kind of the relation, or None if it is not part of the index.
+        """
+        position = self._position(relation_id)
+        return None if position is None else int(self.kinds[position])
+
+    def members(self, relation_id):
+        """
+        :param relation_id: A relation identifier.
+        :return: A list of (member type, identifier, role) tuples, in the order of the relation, or None if the
+        relation is not part of the index. The member types are MEMBER_NODE, MEMBER_WAY or MEMBER_RELATION.
+        """
+        position = self._position(relation_id)
+        if position is None:
+            return None
+        start = self.starts[position]
+        members = self.values[start:start + self.counts[position]]
+        roles = self.roles
+        return [(member_type, ref, roles[role]) for ref, member_type, role in zip(
+            members['ref'].tolist(), members['type'].tolist(), members['role'].tolist()
+        )]
+
+    def relation_identifiers(self, kind):
+        """
+        :param kind: A kind of relation.
+        :return: A sorted numpy array of the identifiers of the relations of this kind.
+        """
+        return self.identifiers[self.kinds == kind]
+
+    def relations_of_way(self, way_id):
+        """
+        :param way_id: A way identifier.
+        :return: A numpy array of the identifiers of the relations having the way as a direct member.
+        """
+        ways = self.way_relations['way']
+        start = numpy.searchsorted(ways, int(way_id), side='left')
+        end = numpy.searchsorted(ways, int(way_id), side='right')
+        return numpy.array(self.way_relations['relation'][start:end])
+
+    def member_way_identifiers(self):
+        """
+        :return: A sorted numpy array of the identifiers of the ways that are a direct member of a relation.
+        """
+        identifiers = [numpy.zeros(0, dtype=numpy.int64)]
+        for block in iter_record_blocks(self.path + WAY_RELATIONS_SUFFIX, WAY_RELATION_DTYPE):
+            identifiers.append(numpy.unique(block['way']))
+        return numpy.unique(numpy.concatenate(identifiers))
+
+    def close(self):
+        """
+        Release the memory mapped reverse index.
+        """
+        self.way_relations = None
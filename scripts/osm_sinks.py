@@ -0,0 +1,908 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    The outputs of the tool. A sink creates the output layers, inserts their rows by batches, indexes them, and
+    finalises the output once every layer is written:
+
+    * FileGeodatabaseSink writes feature classes to a file geodatabase with arcpy.
+    * GeoPackageSink writes the tables of a GeoPackage with the sqlite3 module of the standard library.
+    * GeoParquetSink writes a GeoParquet file per layer with pyarrow.
+    * NullSink counts the rows and discards them, to benchmark the tool without the cost of an output.
+
+    The rows inserted in a layer start with the geometry: a (x, y) tuple for points, a well-known binary for lines
+    and polygons, or None. The coordinates are longitudes and latitudes in WGS 84.
+
+    An existing layer can also be opened to apply the changes of an OSM change file: its rows are deleted, or their
+    geometries replaced, by the values of a text field such as the OSM id.
+
+    Only the file geodatabase sink requires arcpy, so the other ones can run where ArcGIS is not installed.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, json, struct, sqlite3, numpy
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# The output formats.
+FORMAT_FILE_GEODATABASE = 'FILE_GEODATABASE'
+FORMAT_GEOPACKAGE = 'GEOPACKAGE'
+FORMAT_GEOPARQUET = 'GEOPARQUET'
+# Discard the output, to measure the processing alone.
+FORMAT_NULL = 'NULL'
+
+# The geometry types of the layers. None creates a table without geometry.
+GEOMETRY_POINT = 'POINT'
+GEOMETRY_POLYLINE = 'POLYLINE'
+GEOMETRY_POLYGON = 'POLYGON'
+
+# The name of the geometry in the field lists of the insert cursors.
+GEOMETRY_FIELD = 'SHAPE'
+
+# The field types, named as in arcpy.
+FIELD_STRING = 'String'
+FIELD_DOUBLE = 'Double'
+FIELD_LONG = 'Long'
+
+# The length of the text fields holding the OSM tags.
+TAG_FIELD_LENGTH = 255
+
+WGS84 = 4326
+WGS84_WKT = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],' \
+            'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],' \
+            'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+
+WKB_POINT = 1
+
+
+class Field(object):
+    """
+    The definition of an attribute field, with the name, type and length properties of arcpy.Field.
+    """
+
+    def __init__(self, name, type, length=None):
+        """
+        :param name: The name of the field.
+        :param type: The type of the field: FIELD_STRING, FIELD_DOUBLE or FIELD_LONG.
+        :param length: The length of a text field.
+        """
+        self.name = name
+        self.type = type
+        self.length = length
+
+
+def tag_fields(names, lengths=None):
+    """
+    Define the text fields holding the OSM tags.
+    :param names: The field names.
+    :param lengths: An optional dictionary of the length of each field. The fields without a length are
+    TAG_FIELD_LENGTH long.
+    :return: A list of Field.
+    """
+    lengths = lengths or {}
+    return [Field(name, FIELD_STRING, lengths.get(name, TAG_FIELD_LENGTH)) for name in names]
+
+
+def point_wkb(point):
+    """
+    Encode a point as well-known binary.
+    :param point: A (x, y) tuple.
+    :return: The well-known binary, as bytes.
+    """
+    return struct.pack('<BIdd', 1, WKB_POINT, float(point[0]), float(point[1]))
+
+
+def geometry_wkb(geometry_type, geometry):
+    """
+    Encode the geometry value of a row as well-known binary.
+    :param geometry_type: The geometry type of the layer.
+    :param geometry: A (x, y) tuple for points, a well-known binary, or None.
+    :return: The well-known binary as bytes, or None.
+    """
+    if geometry is None:
+        return None
+    if geometry_type == GEOMETRY_POINT:
+        return point_wkb(geometry)
+    return bytes(geometry)
+
+
+def create_sink(path, output_format=None):
+    """
+    Create the sink writing to a path.
+    :param path: The output file geodatabase, GeoPackage, or GeoParquet folder.
+    :param output_format: FORMAT_FILE_GEODATABASE, FORMAT_GEOPACKAGE, FORMAT_GEOPARQUET or FORMAT_NULL. When not set, the format
+    is deduced from the extension of the path: .gdb for a file geodatabase, .gpkg or .sqlite for a GeoPackage, any
+    other path being a GeoParquet folder.
+    :return: The OutputSink.
+    """
+    if not output_format:
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.gdb':
+            output_format = FORMAT_FILE_GEODATABASE
+        elif extension in ('.gpkg', '.sqlite'):
+            output_format = FORMAT_GEOPACKAGE
+        else:
+            output_format = FORMAT_GEOPARQUET
+
+    if output_format == FORMAT_FILE_GEODATABASE:
+        return FileGeodatabaseSink(path)
+    elif output_format == FORMAT_GEOPACKAGE:
+        return GeoPackageSink(path)
+    elif output_format == FORMAT_GEOPARQUET:
+        return GeoParquetSink(path)
+    elif output_format == FORMAT_NULL:
+        return NullSink(path)
+    raise ValueError('Unknown output format {}'.format(output_format))
+
+
+class OutputSink(object):
+    """
+    The interface of the outputs. A layer is designated by its name.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the output.
+        """
+        self.path = path
+
+    def create(self):
+        """
+        Create the output if it does not exist yet.
+        """
+        raise NotImplementedError()
+
+    def create_layer(self, name, geometry_type, fields, tag_field_names=(), tag_field_lengths=None):
+        """
+        Create a layer, replacing any existing layer with the same name.
+        :param name: The name of the layer.
+        :param geometry_type: GEOMETRY_POINT, GEOMETRY_POLYLINE, GEOMETRY_POLYGON, or None for a table.
+        :param fields: The list of Field of the layer.
+        :param tag_field_names: The names of the text fields holding the OSM tags, added after the fields.
+        :param tag_field_lengths: An optional dictionary of the length of the tag fields, as in tag_fields.
+        :return: The name of the layer.
+        """
+        raise NotImplementedError()
+
+    def open_layer(self, name, geometry_type, fields, tag_field_names=()):
+        """
+        Open an existing layer, to update it.
+        :param name: The name of the layer.
+        :param geometry_type: The geometry type of the layer, as in create_layer.
+        :param fields: The list of Field of the layer.
+        :param tag_field_names: The names of the text fields holding the OSM tags.
+        :return: The name of the layer.
+        """
+        raise NotImplementedError()
+
+    def session(self):
+        """
+        A context manager wrapping the insertions in several layers at once.
+        """
+        raise NotImplementedError()
+
+    def insert_cursor(self, name, field_names):
+        """
+        Open a cursor inserting rows in a layer. The cursor is a context manager with the insertRow and insertRows
+        methods.
+        :param name: The name of the layer.
+        :param field_names: The names of the fields of the rows, GEOMETRY_FIELD designating the geometry.
+        :return: The cursor.
+        """
+        raise NotImplementedError()
+
+    def delete_rows(self, name, field_name, values, filters=None):
+        """
+        Delete the rows of a layer whose field has one of a set of values.
+        :param name: The name of the layer.
+        :param field_name: The name of the field, a text field.
+        :param values: The values of the rows to delete.
+        :param filters: An optional dictionary of field names and values the rows must also have.
+        """
+        raise NotImplementedError()
+
+    def update_geometries(self, name, field_name, geometries, filters=None):
+        """
+        Replace the geometries of the rows of a layer.
+        :param name: The name of the layer.
+        :param field_name: The name of the field identifying the rows, a text field.
+        :param geometries: A dictionary of field values and geometries, as described in the module summary.
+        :param filters: An optional dictionary of field names and values the rows must also have.
+        """
+        raise NotImplementedError()
+
+    def build_index(self, name, field_name):
+        """
+        Index an attribute field of a layer.
+        :param name: The name of the layer.
+        :param field_name: The name of the field.
+        """
+        raise NotImplementedError()
+
+    def close_layer(self, name):
+        """
+        Complete a layer once all its rows are inserted and indexed. The layer is kept if a later step fails.
+        :param name: The name of the layer.
+        """
+        raise NotImplementedError()
+
+    def finalise(self):
+        """
+        Complete the output once every layer is written.
+        """
+        raise NotImplementedError()
+
+
+###################################
+# FILE GEODATABASE
+###################################
+# The number of values listed in a where clause of the file geodatabase updates.
+WHERE_CLAUSE_SIZE = 500
+
+
+class FileGeodatabaseSink(OutputSink):
+    """
+    Write feature classes to a file geodatabase with arcpy.
+    """
+
+    GEOMETRY_TOKENS = {GEOMETRY_POINT: 'SHAPE@XY', GEOMETRY_POLYLINE: 'SHAPE@WKB', GEOMETRY_POLYGON: 'SHAPE@WKB'}
+
+    def __init__(self, path):
+        if arcpy is None:
+            raise ImportError('arcpy is required to write a file geodatabase')
+        OutputSink.__init__(self, path)
+        self.geometry_types = {}
+
+    def create(self):
+        arcpy.env.overwriteOutput = True
+        split_path = os.path.split(self.path)
+        if not arcpy.Exists(self.path):
+            arcpy.CreateFileGDB_management(split_path[0], split_path[1])
+
+    def create_layer(self, name, geometry_type, fields, tag_field_names=(), tag_field_lengths=None):
+        layer = os.path.join(self.path, name)
+        if geometry_type is None:
+            arcpy.CreateTable_management(self.path, name)
+        else:
+            arcpy.CreateFeatureclass_management(
+                self.path,
+                name,
+                geometry_type,
+                "#",
+                "DISABLED",
+                "DISABLED",
+                arcpy.SpatialReference(WGS84)
+            )
+        for field in fields:
+            arcpy.AddField_management(layer, field.name, field.type, "#", "#", field.length)
+
+        # The tag fields are added at once, which is much faster than adding them one by one.
+        if len(tag_field_names) > 0:
+            arcpy.da.ExtendTable(layer, "OID@", get_fields_numpy_definition(tag_field_names, tag_field_lengths),
+                                 "_ID")
+        self.geometry_types[name] = geometry_type
+        return name
+
+    def open_layer(self, name, geometry_type, fields, tag_field_names=()):
+        self.geometry_types[name] = geometry_type
+        return name
+
+    def session(self):
+        # Edit session is required to edit multiple feature class at a time within the same workspace
+        return arcpy.da.Editor(self.path)
+
+    def _iter_where_clauses(self, name, field_name, values, filters):
+        layer = os.path.join(self.path, name)
+        conditions = ["{} = '{}'".format(arcpy.AddFieldDelimiters(layer, field), value)
+                      for field, value in sorted((filters or {}).items())]
+        values = list(values)
+        for start in range(0, len(values), WHERE_CLAUSE_SIZE):
+            clause = '{} IN ({})'.format(
+                arcpy.AddFieldDelimiters(layer, field_name),
+                ', '.join("'{}'".format(value) for value in values[start:start + WHERE_CLAUSE_SIZE])
+            )
+            yield ' AND '.join([clause] + conditions)
+
+    def delete_rows(self, name, field_name, values, filters=None):
+        layer = os.path.join(self.path, name)
+        for where_clause in self._iter_where_clauses(name, field_name, values, filters):
+            with arcpy.da.UpdateCursor(layer, [field_name], where_clause) as update_cursor:
+                for row in update_cursor:
+                    update_cursor.deleteRow()
+
+    def update_geometries(self, name, field_name, geometries, filters=None):
+        layer = os.path.join(self.path, name)
+        token = self.GEOMETRY_TOKENS[self.geometry_types[name]]
+        for where_clause in self._iter_where_clauses(name, field_name, geometries.keys(), filters):
+            with arcpy.da.UpdateCursor(layer, [field_name, token], where_clause) as update_cursor:
+                for row in update_cursor:
+                    row[1] = geometries[row[0]]
+                    update_cursor.updateRow(row)
+
+    def insert_cursor(self, name, field_names):
+        token = self.GEOMETRY_TOKENS.get(self.geometry_types.get(name))
+        field_names = [token if field_name == GEOMETRY_FIELD else field_name for field_name in field_names]
+        return arcpy.da.InsertCursor(os.path.join(self.path, name), field_names)
+
+    def build_index(self, name, field_name):
+        arcpy.AddIndex_management(os.path.join(self.path, name), field_name, '{}_{}_idx'.format(name, field_name))
+
+    def close_layer(self, name):
+        pass
+
+    def finalise(self):
+        pass
+
+
+def get_fields_numpy_definition(field_list, field_lengths=None):
+    """
+    Make a numpy array that can be used to add attribute to a table or feature class.
+    All fields are created as text fields, with a length of 255 unless set otherwise.
+    :param field_list: An iterable collection of field names. Field names must occur once.
+    :param field_lengths: An optional dictionary of the length of each field.
+    :return: the numpy array.
+    """
+    standard_fields_array_tuple = [('_ID', numpy.int)]
+    for field in tag_fields(field_list, field_lengths):
+        standard_fields_array_tuple.append((field.name, '|S{}'.format(field.length)))
+
+    return numpy.array(
+        [],
+        numpy.dtype(standard_fields_array_tuple)
+    )
+
+
+###################################
+# GEOPACKAGE
+###################################
+GEOPACKAGE_APPLICATION_ID = 0x47504B47
+GEOPACKAGE_VERSION = 10200
+
+# The geometry header of the GeoPackage binary format: magic, version, flags (little endian, no envelope), srs id.
+GEOPACKAGE_HEADER = struct.pack('<2sBBi', b'GP', 0, 1, WGS84)
+
+# The line layers hold the linestrings of the ways and the multilinestrings of the routes.
+GEOPACKAGE_GEOMETRY_TYPES = {GEOMETRY_POINT: 'POINT', GEOMETRY_POLYLINE: 'GEOMETRY', GEOMETRY_POLYGON: 'GEOMETRY'}
+GEOPACKAGE_FIELD_TYPES = {FIELD_STRING: 'TEXT', FIELD_DOUBLE: 'DOUBLE', FIELD_LONG: 'INTEGER'}
+GEOPACKAGE_GEOMETRY_COLUMN = 'geom'
+
+GEOPACKAGE_METADATA = [
+    '''CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL,
+        definition TEXT NOT NULL,
+        description TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY,
+        data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE,
+        description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+        min_x DOUBLE,
+        min_y DOUBLE,
+        max_x DOUBLE,
+        max_y DOUBLE,
+        srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL,
+        z TINYINT NOT NULL,
+        m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id)
+    )'''
+]
+
+GEOPACKAGE_SPATIAL_REFERENCES = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', WGS84, 'EPSG', WGS84, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees')
+]
+
+
+def quote_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class GeoPackageCursor(object):
+    """
+    Insert rows in a table of a GeoPackage. The geometries are converted to the GeoPackage binary format.
+    """
+
+    def __init__(self, connection, name, geometry_type, field_names):
+        self.connection = connection
+        self.geometry_type = geometry_type
+        self.geometry_position = field_names.index(GEOMETRY_FIELD) if GEOMETRY_FIELD in field_names else None
+        columns = [GEOPACKAGE_GEOMETRY_COLUMN if field_name == GEOMETRY_FIELD else field_name
+                   for field_name in field_names]
+        self.statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote_identifier(name),
+            ', '.join(quote_identifier(column) for column in columns),
+            ', '.join('?' * len(columns))
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+    def convert(self, row):
+        row = list(row)
+        position = self.geometry_position
+        if position is not None:
+            wkb = geometry_wkb(self.geometry_type, row[position])
+            row[position] = None if wkb is None else sqlite3.Binary(GEOPACKAGE_HEADER + wkb)
+        return row
+
+    def insertRow(self, row):
+        self.insertRows([row])
+
+    def insertRows(self, rows):
+        convert = self.convert
+        self.connection.executemany(self.statement, [convert(row) for row in rows])
+
+
+class GeoPackageSink(OutputSink):
+    """
+    Write the layers to a GeoPackage, with the sqlite3 module. The rows are inserted in a single transaction,
+    committed when the output is finalised.
+    """
+
+    def __init__(self, path):
+        OutputSink.__init__(self, path)
+        self.connection = None
+        self.geometry_types = {}
+
+    def create(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA application_id = {}'.format(GEOPACKAGE_APPLICATION_ID))
+        connection.execute('PRAGMA user_version = {}'.format(GEOPACKAGE_VERSION))
+        # The output is written in bulk and rebuilt from scratch on failure, so the rollback journal is not needed.
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('PRAGMA journal_mode = MEMORY')
+        for statement in GEOPACKAGE_METADATA:
+            connection.execute(statement)
+        connection.executemany(
+            'INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+            GEOPACKAGE_SPATIAL_REFERENCES
+        )
+        connection.commit()
+        self.connection = connection
+
+    def create_layer(self, name, geometry_type, fields, tag_field_names=(), tag_field_lengths=None):
+        connection = self.connection
+        connection.execute('DROP TABLE IF EXISTS {}'.format(quote_identifier(name)))
+        connection.execute('DELETE FROM gpkg_geometry_columns WHERE table_name = ?', (name,))
+        connection.execute('DELETE FROM gpkg_contents WHERE table_name = ?', (name,))
+
+        columns = ['fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL']
+        if geometry_type is not None:
+            columns.append('{} {}'.format(GEOPACKAGE_GEOMETRY_COLUMN, GEOPACKAGE_GEOMETRY_TYPES[geometry_type]))
+        for field in list(fields) + tag_fields(tag_field_names, tag_field_lengths):
+            columns.append('{} {}'.format(quote_identifier(field.name), GEOPACKAGE_FIELD_TYPES[field.type]))
+        connection.execute('CREATE TABLE {} ({})'.format(quote_identifier(name), ', '.join(columns)))
+
+        if geometry_type is None:
+            connection.execute(
+                'INSERT INTO gpkg_contents (table_name, data_type, identifier) VALUES (?, ?, ?)',
+                (name, 'attributes', name)
+            )
+        else:
+            connection.execute(
+                'INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                (name, 'features', name, WGS84)
+            )
+            connection.execute(
+                'INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+                (name, GEOPACKAGE_GEOMETRY_COLUMN, GEOPACKAGE_GEOMETRY_TYPES[geometry_type], WGS84)
+            )
+        connection.commit()
+        self.geometry_types[name] = geometry_type
+        return name
+
+    def open_layer(self, name, geometry_type, fields, tag_field_names=()):
+        self.geometry_types[name] = geometry_type
+        return name
+
+    def session(self):
+        return GeoPackageSession(self.connection)
+
+    def insert_cursor(self, name, field_names):
+        return GeoPackageCursor(self.connection, name, self.geometry_types.get(name), field_names)
+
+    def _where_clause(self, field_name, filters):
+        fields = [field_name] + sorted((filters or {}).keys())
+        return ' AND '.join('{} = ?'.format(quote_identifier(field)) for field in fields), \
+            [value for field, value in sorted((filters or {}).items())]
+
+    def delete_rows(self, name, field_name, values, filters=None):
+        where_clause, filter_values = self._where_clause(field_name, filters)
+        self.connection.executemany(
+            'DELETE FROM {} WHERE {}'.format(quote_identifier(name), where_clause),
+            [[value] + filter_values for value in values]
+        )
+
+    def update_geometries(self, name, field_name, geometries, filters=None):
+        where_clause, filter_values = self._where_clause(field_name, filters)
+        geometry_type = self.geometry_types[name]
+        parameters = []
+        for value, geometry in geometries.items():
+            wkb = geometry_wkb(geometry_type, geometry)
+            parameters.append([None if wkb is None else sqlite3.Binary(GEOPACKAGE_HEADER + wkb), value] + filter_values)
+        self.connection.executemany(
+            'UPDATE {} SET {} = ? WHERE {}'.format(quote_identifier(name), GEOPACKAGE_GEOMETRY_COLUMN, where_clause),
+            parameters
+        )
+
+    def build_index(self, name, field_name):
+        self.connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+            quote_identifier('{}_{}_idx'.format(name, field_name)),
+            quote_identifier(name),
+            quote_identifier(field_name)
+        ))
+        self.connection.commit()
+
+    def close_layer(self, name):
+        self.connection.commit()
+
+    def finalise(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+class GeoPackageSession(object):
+    """
+    Commit the rows inserted during the session, or roll them back on error.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if exception_type is None:
+            self.connection.commit()
+        else:
+            self.connection.rollback()
+        return False
+
+
+###################################
+# GEOPARQUET
+###################################
+GEOPARQUET_VERSION = '1.0.0'
+GEOPARQUET_GEOMETRY_COLUMN = 'geometry'
+GEOPARQUET_GEOMETRY_TYPES = {GEOMETRY_POINT: ['Point'], GEOMETRY_POLYLINE: ['LineString', 'MultiLineString'],
+                             GEOMETRY_POLYGON: ['Polygon', 'MultiPolygon']}
+
+
+def geoparquet_metadata(geometry_type):
+    """
+    Make the "geo" metadata of a GeoParquet file. The coordinate reference system is not written, so it is the
+    default one, longitudes and latitudes in WGS 84.
+    :param geometry_type: The geometry type of the layer.
+    :return: The metadata, as a json text.
+    """
+    return json.dumps({
+        'version': GEOPARQUET_VERSION,
+        'primary_column': GEOPARQUET_GEOMETRY_COLUMN,
+        'columns': {
+            GEOPARQUET_GEOMETRY_COLUMN: {
+                'encoding': 'WKB',
+                'geometry_types': GEOPARQUET_GEOMETRY_TYPES[geometry_type]
+            }
+        }
+    })
+
+
+class GeoParquetLayer(object):
+    """
+    A layer written as a GeoParquet file. Each batch of rows inserted is written as a row group.
+    """
+
+    def __init__(self, path, geometry_type, fields):
+        self.path = path
+        self.geometry_type = geometry_type
+        self.fields = fields
+        columns = []
+        if geometry_type is not None:
+            columns.append(pyarrow.field(GEOPARQUET_GEOMETRY_COLUMN, pyarrow.binary()))
+        for field in fields:
+            if field.type == FIELD_DOUBLE:
+                columns.append(pyarrow.field(field.name, pyarrow.float64()))
+            elif field.type == FIELD_LONG:
+                columns.append(pyarrow.field(field.name, pyarrow.int64()))
+            else:
+                columns.append(pyarrow.field(field.name, pyarrow.string()))
+        metadata = None
+        if geometry_type is not None:
+            metadata = {b'geo': geoparquet_metadata(geometry_type).encode('utf-8')}
+        self.schema = pyarrow.schema(columns, metadata=metadata)
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, field_names, rows):
+        """
+        Write a batch of rows as a row group. The fields missing from the rows are null.
+        :param field_names: The names of the fields of the rows, GEOMETRY_FIELD designating the geometry.
+        :param rows: The list of rows.
+        """
+        self.writer.write_table(self.make_table(field_names, rows))
+
+    def make_table(self, field_names, rows):
+        """
+        Convert a batch of rows to a table of the schema of the layer.
+        :param field_names: The names of the fields of the rows, GEOMETRY_FIELD designating the geometry.
+        :param rows: The list of rows.
+        :return: The pyarrow table.
+        """
+        positions = dict((field_name, position) for position, field_name in enumerate(field_names))
+        arrays = []
+        if self.geometry_type is not None:
+            position = positions.get(GEOMETRY_FIELD)
+            geometries = [None] * len(rows)
+            if position is not None:
+                geometries = [geometry_wkb(self.geometry_type, row[position]) for row in rows]
+            arrays.append(pyarrow.array(geometries, type=pyarrow.binary()))
+        for field in self.fields:
+            position = positions.get(field.name)
+            if position is None:
+                values = [None] * len(rows)
+            elif field.type == FIELD_DOUBLE:
+                values = [None if row[position] is None else float(row[position]) for row in rows]
+            elif field.type == FIELD_LONG:
+                values = [None if row[position] is None else int(row[position]) for row in rows]
+            else:
+                values = [row[position] for row in rows]
+            arrays.append(pyarrow.array(values, type=self.schema.field(field.name).type))
+        return pyarrow.Table.from_arrays(arrays, schema=self.schema)
+
+    def close(self):
+        self.writer.close()
+
+
+class GeoParquetUpdatedLayer(GeoParquetLayer):
+    """
+    An existing GeoParquet layer being updated. Parquet files cannot be modified in place: the layer is read in
+    memory, modified, and written again to the file when it is closed.
+    """
+
+    def __init__(self, path, geometry_type, fields):
+        self.table = pyarrow.parquet.read_table(path)
+        self.final_path = path
+        GeoParquetLayer.__init__(self, path + '_temp', geometry_type, fields)
+        self.table = self.table.cast(self.schema)
+
+    def write(self, field_names, rows):
+        self.table = pyarrow.concat_tables([self.table, self.make_table(field_names, rows)])
+
+    def _mask(self, field_name, values, filters):
+        values = set(values)
+        mask = [value in values for value in self.table.column(field_name).to_pylist()]
+        for filter_name, filter_value in (filters or {}).items():
+            mask = [selected and value == filter_value
+                    for selected, value in zip(mask, self.table.column(filter_name).to_pylist())]
+        return mask
+
+    def delete_rows(self, field_name, values, filters=None):
+        mask = self._mask(field_name, values, filters)
+        self.table = self.table.filter(pyarrow.array([not selected for selected in mask], type=pyarrow.bool_()))
+
+    def update_geometries(self, field_name, geometries, filters=None):
+        mask = self._mask(field_name, geometries.keys(), filters)
+        keys = self.table.column(field_name).to_pylist()
+        column = self.table.column(GEOPARQUET_GEOMETRY_COLUMN).to_pylist()
+        for position, selected in enumerate(mask):
+            if selected:
+                column[position] = geometry_wkb(self.geometry_type, geometries[keys[position]])
+        self.table = self.table.set_column(
+            self.table.schema.get_field_index(GEOPARQUET_GEOMETRY_COLUMN),
+            self.schema.field(GEOPARQUET_GEOMETRY_COLUMN),
+            pyarrow.array(column, type=pyarrow.binary())
+        )
+
+    def close(self):
+        self.writer.write_table(self.table)
+        self.writer.close()
+        os.remove(self.final_path)
+        os.rename(self.path, self.final_path)
+
+
+class GeoParquetCursor(object):
+    """
+    Insert rows in a GeoParquet layer.
+    """
+
+    def __init__(self, layer, field_names):
+        self.layer = layer
+        self.field_names = list(field_names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+    def insertRow(self, row):
+        self.insertRows([row])
+
+    def insertRows(self, rows):
+        self.layer.write(self.field_names, rows)
+
+
+class GeoParquetSink(OutputSink):
+    """
+    Write each layer to a GeoParquet file, in the output folder. The files are complete once the output is
+    finalised.
+    """
+
+    def __init__(self, path):
+        if pyarrow is None:
+            raise ImportError('pyarrow is required to write GeoParquet files')
+        OutputSink.__init__(self, path)
+        self.layers = {}
+
+    def create(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def create_layer(self, name, geometry_type, fields, tag_field_names=(), tag_field_lengths=None):
+        if name in self.layers:
+            self.layers.pop(name).close()
+        self.layers[name] = GeoParquetLayer(
+            os.path.join(self.path, name + '.parquet'),
+            geometry_type,
+            list(fields) + tag_fields(tag_field_names, tag_field_lengths)
+        )
+        return name
+
+    def open_layer(self, name, geometry_type, fields, tag_field_names=()):
+        if name in self.layers:
+            self.layers.pop(name).close()
+        self.layers[name] = GeoParquetUpdatedLayer(
+            os.path.join(self.path, name + '.parquet'),
+            geometry_type,
+            list(fields) + tag_fields(tag_field_names)
+        )
+        return name
+
+    def session(self):
+        return GeoParquetSession()
+
+    def insert_cursor(self, name, field_names):
+        return GeoParquetCursor(self.layers[name], field_names)
+
+    def delete_rows(self, name, field_name, values, filters=None):
+        self.layers[name].delete_rows(field_name, values, filters)
+
+    def update_geometries(self, name, field_name, geometries, filters=None):
+        self.layers[name].update_geometries(field_name, geometries, filters)
+
+    def build_index(self, name, field_name):
+        # Parquet files do not have indexes: the statistics of the row groups are used to filter them.
+        pass
+
+    def close_layer(self, name):
+        if name in self.layers:
+            self.layers.pop(name).close()
+
+    def finalise(self):
+        for layer in self.layers.values():
+            layer.close()
+        self.layers = {}
+
+
+class GeoParquetSession(object):
+    """
+    The GeoParquet files are written as the rows are inserted, so a session does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+
+###################################
+# NULL
+###################################
+class NullCursor(object):
+    """
+    Count the rows inserted in a layer of a NullSink.
+    """
+
+    def __init__(self, counts, name):
+        self.counts = counts
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+    def insertRow(self, row):
+        self.counts[self.name] += 1
+
+    def insertRows(self, rows):
+        self.counts[self.name] += len(rows)
+
+
+class NullSession(object):
+    """
+    Nothing is written, so a session does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+
+class NullSink(OutputSink):
+    """
+    Discard the rows, only counting them by layer. Nothing is written to the output path.
+    """
+
+    def __init__(self, path):
+        OutputSink.__init__(self, path)
+        self.counts = {}
+
+    def create(self):
+        pass
+
+    def create_layer(self, name, geometry_type, fields, tag_field_names=(), tag_field_lengths=None):
+        self.counts[name] = 0
+        return name
+
+    def open_layer(self, name, geometry_type, fields, tag_field_names=()):
+        self.counts.setdefault(name, 0)
+        return name
+
+    def session(self):
+        return NullSession()
+
+    def insert_cursor(self, name, field_names):
+        return NullCursor(self.counts, name)
+
+    def delete_rows(self, name, field_name, values, filters=None):
+        pass
+
+    def update_geometries(self, name, field_name, geometries, filters=None):
+        pass
+
+    def build_index(self, name, field_name):
+        pass
+
+    def close_layer(self, name):
+        pass
+
+    def finalise(self):
+        pass
@@ -0,0 +1,182 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Spatial ordering of the features written to the output. By default, the features are inserted in the order of
+    their OSM identifiers, so features close to each other end up scattered across the output files, and drawing a
+    map or querying an area reads many more pages than needed. The lists of a list file (see osm_intermediate) can be
+    reordered by a spatial key computed from their coordinates:
+
+    * HILBERT: the position of the center of their bounding box along a Hilbert curve.
+    * QUADKEY: the quadkey of the tile holding the center of their bounding box, as used by the web map tiles. The
+      quadkeys are compared as numbers, in the order of their digits (a Z-order curve).
+
+    Both keys are computed on a grid of 2^KEY_LEVEL by 2^KEY_LEVEL cells covering the world in decimal degrees. The
+    lists are sorted on their key with an external sort of their index, then their values are copied in that order to
+    a new list file replacing the original one.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, numpy
+from osm_intermediate import COORDINATE_PRECISION, DEFAULT_BLOCK_SIZE, INDEX_DTYPE, VALUES_EXTENSION, \
+    ListWriter, iter_list_blocks, iter_record_blocks, external_sort_records, rename_list_file
+
+SPATIAL_ORDER_NONE = 'NONE'
+SPATIAL_ORDER_HILBERT = 'HILBERT'
+SPATIAL_ORDER_QUADKEY = 'QUADKEY'
+SPATIAL_ORDERS = [SPATIAL_ORDER_NONE, SPATIAL_ORDER_HILBERT, SPATIAL_ORDER_QUADKEY]
+
+# The level of the grid of the keys: 2^24 cells by longitude and latitude, about 2.4 meters by 1.2 meters at the
+# equator. The keys of both curves then fit in 48 bits.
+KEY_LEVEL = 24
+
+# The index records of a list file, with the key they are sorted on.
+KEYED_INDEX_DTYPE = numpy.dtype([('key', '<i8')] + [(name, INDEX_DTYPE.fields[name][0]) for name in INDEX_DTYPE.names])
+
+ORDERED_SUFFIX = '_ordered'
+KEYS_SUFFIX = '_keys.bin'
+
+
+def grid_cells(lons, lats, level=KEY_LEVEL):
+    """
+    Locate fixed point coordinates on the grid of the keys.
+    :param lons: A numpy array of fixed point longitudes.
+    :param lats: A numpy array of fixed point latitudes.
+    :param level: The level of the grid.
+    :return: A tuple of numpy arrays of int64: the columns, from the west, and the rows, from the north.
+    """
+    size = 1 << level
+    columns = (numpy.asarray(lons, dtype=numpy.int64) + 180 * COORDINATE_PRECISION) * size // \
+        (360 * COORDINATE_PRECISION)
+    rows = (90 * COORDINATE_PRECISION - numpy.asarray(lats, dtype=numpy.int64)) * size // \
+        (180 * COORDINATE_PRECISION)
+    return numpy.clip(columns, 0, size - 1), numpy.clip(rows, 0, size - 1)
+
+
+def hilbert_keys(columns, rows, level=KEY_LEVEL):
+    """
+    Compute the positions of grid cells along a Hilbert curve.
+    :param columns: A numpy array of int64 columns.
+    :param rows: A numpy array of int64 rows.
+    :param level: The level of the grid.
+    :return: A numpy array of int64 keys.
+    """
+    size = 1 << level
+    x = numpy.array(columns, dtype=numpy.int64)
+    y = numpy.array(rows, dtype=numpy.int64)
+    keys = numpy.zeros(len(x), dtype=numpy.int64)
+    step = size >> 1
+    while step > 0:
+        rx = (x & step) > 0
+        ry = (y & step) > 0
+        keys += step * step * ((3 * rx.astype(numpy.int64)) ^ ry.astype(numpy.int64))
+        # Rotate the quadrant, so that the curve is continuous.
+        flip = rx & ~ry
+        x[flip] = size - 1 - x[flip]
+        y[flip] = size - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        step >>= 1
+    return keys
+
+
+def quadkey_keys(columns, rows, level=KEY_LEVEL):
+    """
+    Compute the quadkeys of grid cells, as numbers: each digit of a quadkey is two bits of the key.
+    :param columns: A numpy array of int64 columns.
+    :param rows: A numpy array of int64 rows.
+    :param level: The level of the grid.
+    :return: A numpy array of int64 keys.
+    """
+    columns = numpy.asarray(columns, dtype=numpy.int64)
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    keys = numpy.zeros(len(columns), dtype=numpy.int64)
+    for bit in range(level):
+        keys |= ((columns >> bit) & 1) << (2 * bit)
+        keys |= ((rows >> bit) & 1) << (2 * bit + 1)
+    return keys
+
+
+def spatial_keys(lons, lats, spatial_order):
+    """
+    :param lons: A numpy array of fixed point longitudes.
+    :param lats: A numpy array of fixed point latitudes.
+    :param spatial_order: SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY.
+    :return: A numpy array of the int64 keys of the coordinates.
+    """
+    columns, rows = grid_cells(lons, lats)
+    if spatial_order == SPATIAL_ORDER_HILBERT:
+        return hilbert_keys(columns, rows)
+    if spatial_order == SPATIAL_ORDER_QUADKEY:
+        return quadkey_keys(columns, rows)
+    raise ValueError('Unknown spatial order: {}'.format(spatial_order))
+
+
+def coordinate_list_keys(block, spatial_order):
+    """
+    Compute the keys of the lists of coordinates of a block, from the center of their bounding box.
+    :param block: A ListBlock of COORDINATES_DTYPE values, without empty lists.
+    :param spatial_order: SPATIAL_ORDER_HILBERT or SPATIAL_ORDER_QUADKEY.
+    :return: A numpy array of the int64 keys of the lists.
+    """
+    if len(block) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    centers = []
+    for name in ('lon', 'lat'):
+        values = block.values[name]
+        minimums = numpy.minimum.reduceat(values, block.starts).astype(numpy.int64)
+        maximums = numpy.maximum.reduceat(values, block.starts).astype(numpy.int64)
+        centers.append((minimums + maximums) // 2)
+    return spatial_keys(centers[0], centers[1], spatial_order)
+
+
+def order_list_file(path, value_dtype, list_keys, temporary_folder, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Reorder the lists of a list file by key. Lists with the same key keep their order.
+    :param path: The path of the list file, without extension.
+    :param value_dtype: The numpy dtype of the values.
+    :param list_keys: A function taking a ListBlock, and returning a numpy array of the int64 keys of its lists.
+    :param temporary_folder: The folder where the sorted index and its runs are written.
+    :param block_size: The number of lists keyed and copied at once.
+    :return: The number of lists.
+    """
+    def iter_keyed_index():
+        for block in iter_list_blocks(path, value_dtype, block_size):
+            keyed_index = numpy.empty(len(block), dtype=KEYED_INDEX_DTYPE)
+            keyed_index['key'] = list_keys(block)
+            for name in INDEX_DTYPE.names:
+                keyed_index[name] = block.index[name]
+            yield keyed_index
+
+    keys_path = os.path.join(temporary_folder, os.path.basename(path) + KEYS_SUFFIX)
+    count_lists = external_sort_records(
+        iter_keyed_index(),
+        KEYED_INDEX_DTYPE,
+        'key',
+        keys_path,
+        temporary_folder,
+        block_size
+    )
+    if count_lists == 0 or os.path.getsize(path + VALUES_EXTENSION) == 0:
+        os.remove(keys_path)
+        return count_lists
+
+    ordered_path = path + ORDERED_SUFFIX
+    source_values = numpy.memmap(path + VALUES_EXTENSION, dtype=value_dtype, mode='r')
+    with ListWriter(ordered_path, value_dtype) as writer:
+        for keyed_index in iter_record_blocks(keys_path, KEYED_INDEX_DTYPE, block_size):
+            index = numpy.empty(len(keyed_index), dtype=INDEX_DTYPE)
+            for name in INDEX_DTYPE.names:
+                index[name] = keyed_index[name]
+            # The positions of the values of the lists, in their new order.
+            counts = index['count'].astype(numpy.int64)
+            ends = numpy.cumsum(counts)
+            positions = numpy.repeat(index['offset'] - (ends - counts), counts) + numpy.arange(ends[-1])
+            writer.write(index, source_values[positions])
+    del source_values
+    os.remove(keys_path)
+    rename_list_file(ordered_path, path)
+    return count_lists
@@ -0,0 +1,273 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    The state kept alongside an output so that OSM change files can be applied to it, instead of importing a full
+    dump again (see osm_update). The state folder holds:
+
+    * the node location store: the memory mapped file of a DenseNodeLocationStore, holding the location of every
+      node.
+    * a sqlite database with the nodes of every way, the member ways of every multipolygon, and the reverse indexes
+      used to find the ways of a moved node and the multipolygons of a changed way. The boundaries and routes are not
+      maintained by the updates, but their member ways are recorded too, so that the updates can report the ones
+      they leave out of date.
+
+    The state is written by osm_2_geodatabase.process when it runs with update_state, and kept up to date by
+    osm_update.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sqlite3, numpy
+
+STATE_FOLDER_SUFFIX = '_update_state'
+STATE_DATABASE_FILE = 'state.sqlite'
+STATE_NODE_LOCATIONS_FILE = 'node_locations.dat'
+
+# Flags of the ways, in addition to the flags of the way lists of osm_intermediate.
+FLAG_TAGGED = 2
+
+# The number of identifiers listed in a query.
+QUERY_SIZE = 500
+
+STATE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS ways (id INTEGER PRIMARY KEY, flags INTEGER NOT NULL, nodes BLOB NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS node_ways (node_id INTEGER NOT NULL, way_id INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS node_ways_node_id ON node_ways (node_id)',
+    'CREATE TABLE IF NOT EXISTS relations (id INTEGER PRIMARY KEY, ways TEXT NOT NULL, roles TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS way_relations (way_id INTEGER NOT NULL, relation_id INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS way_relations_way_id ON way_relations (way_id)',
+    'CREATE TABLE IF NOT EXISTS unmaintained_relations (id INTEGER PRIMARY KEY, kind TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS way_unmaintained_relations (way_id INTEGER NOT NULL, relation_id INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS way_unmaintained_relations_way_id ON way_unmaintained_relations (way_id)'
+]
+
+# The kinds of the relations that are in the output, but not maintained by the updates.
+UNMAINTAINED_BOUNDARY = 'boundary'
+UNMAINTAINED_ROUTE = 'route'
+
+
+def update_state_folder(output):
+    """
+    :param output: The output file geodatabase, GeoPackage or GeoParquet folder.
+    :return: The folder of the update state of the output, next to it.
+    """
+    return os.path.splitext(os.path.abspath(output))[0] + STATE_FOLDER_SUFFIX
+
+
+def iter_chunks(values, size=QUERY_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class UpdateState(object):
+    """
+    The ways and multipolygons of an output, and their reverse indexes, stored in a sqlite database.
+    """
+
+    def __init__(self, folder, create=False):
+        """
+        :param folder: The state folder.
+        :param create: If True, the state is created from scratch. Otherwise it must exist.
+        """
+        self.folder = folder
+        self.node_locations_path = os.path.join(folder, STATE_NODE_LOCATIONS_FILE)
+        database_path = os.path.join(folder, STATE_DATABASE_FILE)
+        if create:
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            if os.path.isfile(database_path):
+                os.remove(database_path)
+        elif not os.path.isfile(database_path):
+            raise ValueError('No update state in {}. Import the output with update_state first.'.format(folder))
+        self.connection = sqlite3.connect(database_path)
+        for statement in STATE_SCHEMA:
+            self.connection.execute(statement)
+
+    def _select(self, query, identifiers):
+        rows = []
+        for chunk in iter_chunks(identifiers):
+            rows.extend(self.connection.execute(
+                query.format(', '.join('?' * len(chunk))),
+                [int(identifier) for identifier in chunk]
+            ).fetchall())
+        return rows
+
+    def add_ways(self, identifiers, flags, node_lists):
+        """
+        Add new ways, without removing previous ones first.
+        :param identifiers: The way identifiers.
+        :param flags: The flags of each way.
+        :param node_lists: The numpy array of int64 node identifiers of each way.
+        """
+        self.connection.executemany('INSERT INTO ways VALUES (?, ?, ?)', [
+            (int(identifier), int(way_flags), sqlite3.Binary(numpy.ascontiguousarray(nodes, dtype='<i8').tobytes()))
+            for identifier, way_flags, nodes in zip(identifiers, flags, node_lists)
+        ])
+        self.connection.executemany('INSERT INTO node_ways VALUES (?, ?)', [
+            (node_id, int(identifier))
+            for identifier, nodes in zip(identifiers, node_lists)
+            for node_id in numpy.unique(nodes).tolist()
+        ])
+
+    def set_way(self, identifier, flags, nodes):
+        """
+        Add or replace a way.
+        :param identifier: The way identifier.
+        :param flags: The flags of the way.
+        :param nodes: A numpy array of int64 node identifiers.
+        """
+        self.delete_ways([identifier])
+        self.add_ways([identifier], [flags], [nodes])
+
+    def delete_ways(self, identifiers):
+        """
+        Remove ways, if they exist.
+        :param identifiers: The way identifiers.
+        """
+        for chunk in iter_chunks(identifiers):
+            parameters = [int(identifier) for identifier in chunk]
+            placeholders = ', '.join('?' * len(chunk))
+            self.connection.execute('DELETE FROM ways WHERE id IN ({})'.format(placeholders), parameters)
+            self.connection.execute('DELETE FROM node_ways WHERE way_id IN ({})'.format(placeholders), parameters)
+
+    def get_ways(self, identifiers):
+        """
+        :param identifiers: The way identifiers.
+        :return: A dictionary of the ways found, keyed by integer identifier, with (flags, nodes) values, the nodes
+        being a numpy array of int64.
+        """
+        return {
+            identifier: (flags, numpy.frombuffer(bytes(nodes), dtype='<i8'))
+            for identifier, flags, nodes in self._select('SELECT id, flags, nodes FROM ways WHERE id IN ({})', identifiers)
+        }
+
+    def ways_of_nodes(self, node_ids):
+        """
+        :param node_ids: The node identifiers.
+        :return: The set of the identifiers of the ways referencing these nodes.
+        """
+        return set(way_id for way_id, in self._select('SELECT way_id FROM node_ways WHERE node_id IN ({})', node_ids))
+
+    def add_relations(self, relations):
+        """
+        Add new multipolygons, without removing previous ones first.
+        :param relations: An iterable of (relation identifier, list of way identifiers, list of roles) tuples.
+        """
+        relation_rows = []
+        way_relation_rows = []
+        for identifier, ways, roles in relations:
+            relation_rows.append((int(identifier), ','.join(ways), ','.join(roles)))
+            way_relation_rows.extend((int(way_id), int(identifier)) for way_id in set(ways))
+        self.connection.executemany('INSERT INTO relations VALUES (?, ?, ?)', relation_rows)
+        self.connection.executemany('INSERT INTO way_relations VALUES (?, ?)', way_relation_rows)
+
+    def set_relation(self, identifier, ways, roles):
+        """
+        Add or replace a multipolygon.
+        :param identifier: The relation identifier.
+        :param ways: The list of member way identifiers, as text.
+        :param roles: The list of the roles of the member ways.
+        """
+        self.delete_relations([identifier])
+        self.add_relations([(identifier, ways, roles)])
+
+    def delete_relations(self, identifiers):
+        """
+        Remove multipolygons, if they exist.
+        :param identifiers: The relation identifiers.
+        """
+        for chunk in iter_chunks(identifiers):
+            parameters = [int(identifier) for identifier in chunk]
+            placeholders = ', '.join('?' * len(chunk))
+            self.connection.execute('DELETE FROM relations WHERE id IN ({})'.format(placeholders), parameters)
+            self.connection.execute(
+                'DELETE FROM way_relations WHERE relation_id IN ({})'.format(placeholders),
+                parameters
+            )
+
+    def get_relations(self, identifiers):
+        """
+        :param identifiers: The relation identifiers.
+        :return: A dictionary of the multipolygons found, keyed by integer identifier, with (list of way identifiers,
+        list of roles) values.
+        """
+        relations = {}
+        for identifier, ways, roles in self._select('SELECT id, ways, roles FROM relations WHERE id IN ({})',
+                                                    identifiers):
+            relations[identifier] = (ways.split(','), roles.split(',')) if ways != '' else ([], [])
+        return relations
+
+    def relations_of_ways(self, way_ids):
+        """
+        :param way_ids: The way identifiers.
+        :return: The set of the identifiers of the multipolygons having these ways as members.
+        """
+        return set(relation_id for relation_id, in self._select(
+            'SELECT relation_id FROM way_relations WHERE way_id IN ({})',
+            way_ids
+        ))
+
+    def add_unmaintained_relations(self, relations):
+        """
+        Record relations of the output that are not maintained by the updates, without removing previous ones first.
+        :param relations: An iterable of (relation identifier, kind, list of member way identifiers) tuples, the kind
+        being UNMAINTAINED_BOUNDARY or UNMAINTAINED_ROUTE.
+        """
+        relation_rows = []
+        way_relation_rows = []
+        for identifier, kind, ways in relations:
+            relation_rows.append((int(identifier), kind))
+            way_relation_rows.extend((int(way_id), int(identifier)) for way_id in set(ways))
+        self.connection.executemany('INSERT INTO unmaintained_relations VALUES (?, ?)', relation_rows)
+        self.connection.executemany('INSERT INTO way_unmaintained_relations VALUES (?, ?)', way_relation_rows)
+
+    def delete_unmaintained_relations(self, identifiers):
+        """
+        Remove relations that are not maintained by the updates, if they exist.
+        :param identifiers: The relation identifiers.
+        """
+        for chunk in iter_chunks(identifiers):
+            parameters = [int(identifier) for identifier in chunk]
+            placeholders = ', '.join('?' * len(chunk))
+            self.connection.execute(
+                'DELETE FROM unmaintained_relations WHERE id IN ({})'.format(placeholders),
+                parameters
+            )
+            self.connection.execute(
+                'DELETE FROM way_unmaintained_relations WHERE relation_id IN ({})'.format(placeholders),
+                parameters
+            )
+
+    def get_unmaintained_relations(self, identifiers):
+        """
+        :param identifiers: The relation identifiers.
+        :return: A dictionary of the kinds of the relations found that are not maintained by the updates, keyed by
+        integer identifier.
+        """
+        return dict(self._select('SELECT id, kind FROM unmaintained_relations WHERE id IN ({})', identifiers))
+
+    def unmaintained_relations_of_ways(self, way_ids):
+        """
+        :param way_ids: The way identifiers.
+        :return: A dictionary of the kinds of the relations having these ways as members that are not maintained by
+        the updates, keyed by integer identifier.
+        """
+        return dict(self._select(
+            'SELECT DISTINCT relation_id, kind FROM way_unmaintained_relations '
+            'JOIN unmaintained_relations ON relation_id = id WHERE way_id IN ({})',
+            way_ids
+        ))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commit the changes and close the database.
+        """
+        self.connection.commit()
+        self.connection.close()
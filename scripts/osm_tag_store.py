@@ -0,0 +1,109 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Store of the tags that are not saved in a field of their own, written to three tables of the output in long
+    format, so that the size of the store is proportional to the number of tags instead of the number of keys:
+
+    * tag_keys: the distinct keys, with their identifier.
+    * tag_values: the distinct values, with their identifier.
+    * element_tags: one row per tag of an element: the type and identifier of the element, as in the osm_type and id
+      fields of the layers, and the identifiers of the key and of the value.
+
+    The keys and values are interned while the elements are imported: each distinct key or value is written once,
+    the first time it is met.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+from osm_sinks import FIELD_STRING, FIELD_LONG, TAG_FIELD_LENGTH, Field
+
+TAG_KEYS_TABLE = 'tag_keys'
+TAG_VALUES_TABLE = 'tag_values'
+ELEMENT_TAGS_TABLE = 'element_tags'
+
+KEY_ID_FIELD = Field('key_id', FIELD_LONG)
+KEY_FIELD = Field('tag_key', FIELD_STRING, TAG_FIELD_LENGTH)
+VALUE_ID_FIELD = Field('value_id', FIELD_LONG)
+VALUE_FIELD = Field('tag_value', FIELD_STRING, TAG_FIELD_LENGTH)
+# The element fields, defined like the osm_type and id fields of the layers, to join the tags with the features.
+ELEMENT_TYPE_FIELD = Field('osm_type', FIELD_STRING, 8)
+ELEMENT_ID_FIELD = Field('id', FIELD_STRING, 30)
+
+TAG_STORE_TABLES = {
+    TAG_KEYS_TABLE: [KEY_ID_FIELD, KEY_FIELD],
+    TAG_VALUES_TABLE: [VALUE_ID_FIELD, VALUE_FIELD],
+    ELEMENT_TAGS_TABLE: [ELEMENT_TYPE_FIELD, ELEMENT_ID_FIELD, KEY_ID_FIELD, VALUE_ID_FIELD]
+}
+
+
+def create_tag_store_tables(sink):
+    """
+    Create the tables of the tag store, replacing the existing ones.
+    :param sink: The OutputSink.
+    :return: The names of the tables.
+    """
+    return [sink.create_layer(name, None, fields) for name, fields in sorted(TAG_STORE_TABLES.items())]
+
+
+def tag_store_field_names(table):
+    """
+    :param table: The name of a table of the tag store.
+    :return: The names of its fields, in the order of the rows inserted by TagStoreWriter.
+    """
+    return [field.name for field in TAG_STORE_TABLES[table]]
+
+
+class TagStoreWriter(object):
+    """
+    Write tags to the tables of the tag store, through insert cursors. The cursors are entered and exited with the
+    writer.
+    """
+
+    def __init__(self, cursors):
+        """
+        :param cursors: A dictionary of the insert cursor of each table, inserting rows with the fields listed by
+        tag_store_field_names, or None to discard the tags.
+        """
+        self.cursors = cursors
+        self.keys = {}
+        self.values = {}
+        self.count_tags = 0
+
+    def __enter__(self):
+        if self.cursors is not None:
+            for name in sorted(self.cursors):
+                self.cursors[name].__enter__()
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        if self.cursors is not None:
+            for name in sorted(self.cursors, reverse=True):
+                self.cursors[name].__exit__(exception_type, exception_value, traceback)
+        return False
+
+    def add(self, element_type, element_id, tags):
+        """
+        Add the tags of an element.
+        :param element_type: 'node', 'way' or 'relation'.
+        :param element_id: The identifier of the element, as text.
+        :param tags: A list of (key, value) tuples.
+        """
+        if self.cursors is None:
+            return
+        keys = self.keys
+        values = self.values
+        insert_tag = self.cursors[ELEMENT_TAGS_TABLE].insertRow
+        for key, value in tags:
+            key_id = keys.get(key)
+            if key_id is None:
+                key_id = keys[key] = len(keys)
+                self.cursors[TAG_KEYS_TABLE].insertRow([key_id, key])
+            value_id = values.get(value)
+            if value_id is None:
+                value_id = values[value] = len(values)
+                self.cursors[TAG_VALUES_TABLE].insertRow([value_id, value])
+            insert_tag([element_type, element_id, key_id, value_id])
+        self.count_tags += len(tags)
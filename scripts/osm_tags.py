@@ -0,0 +1,372 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    The OSM tags saved as attribute fields, and the mapping of the tags of an element to the attribute fields.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+STANDARD_FIELDS = set((
+    'highway', 'name', 'name_en', 'ref', 'lanes', 'surface', 'oneway', 'maxspeed', 'tracktype', 'access', 'service',
+    'foot', 'bicycle', 'bridge', 'barrier', 'lit', 'layer', 'building', 'building_levels', 'building_height',
+    'addr_housenumber', 'addr_street', 'addr_city', 'addr_postcode', 'addr_country', 'addr_place', 'addr_state',
+    'natural', 'landuse', 'waterway', 'power', 'amenity', 'place', 'height', 'note', 'railway', 'public_transport',
+    'operator', 'guage', 'width', 'tunnel', 'leisure', 'is_in', 'ele', 'shop', 'man_made', 'parking', 'boundary',
+    'aerialway', 'aeroway', 'craft', 'emergency', 'geological', 'historic', 'military', 'office', 'sport', 'tourism',
+    'traffic_calming', 'entrance', 'crossing', 'route', 'network', 'admin_level'
+))
+
+STANDARD_FIELDS_ARRAY = sorted(STANDARD_FIELDS)
+
+# Field names cannot contain colons, so the OSM keys such as 'addr:street' are saved in fields such as 'addr_street'.
+KEY_SEPARATOR = ':'
+FIELD_SEPARATOR = '_'
+
+# The optional field holding the tags that are not saved in a field of their own, encoded by encode_other_tags.
+OTHER_TAGS_FIELD = 'other_tags'
+OTHER_TAGS_LENGTH = 65536
+
+
+def encode_other_tags(tags):
+    """
+    Encode tags as text, in the hstore format of the other_tags field of the OSM driver of GDAL:
+    "key1"=>"value1","key2"=>"value2". The quotes and backslashes of the keys and values are escaped with a backslash.
+    :param tags: A list of (key, value) tuples.
+    :return: The encoded text, or None if there is no tag.
+    """
+    if len(tags) == 0:
+        return None
+    return u','.join(u'"{}"=>"{}"'.format(
+        key.replace(u'\\', u'\\\\').replace(u'"', u'\\"'),
+        value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+    ) for key, value in tags)
+
+
+class TagMapper(object):
+    """
+    Map the tags of an element to a row of attribute values, one value per field. The position of each field is
+    computed once, so that mapping an element only touches the tags it actually has, instead of looking up every
+    field in the tags of the element.
+
+    A field such as 'addr_street' receives the tag 'addr_street', or the tag 'addr:street' when the element does not
+    have the former.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: The ordered list of field names.
+        """
+        self.fields = list(fields)
+        self.template = [None] * len(self.fields)
+        self.field_indexes = {}
+        self.key_indexes = {}
+        for index, field in enumerate(self.fields):
+            self.field_indexes[field] = index
+            key = field.replace(FIELD_SEPARATOR, KEY_SEPARATOR)
+            if key != field:
+                self.key_indexes[key] = index
+
+    def map(self, tag_dict):
+        """
+        Map tags to a row of attribute values.
+        :param tag_dict: The tags of an element.
+        :return: A new list holding a value for each field, None for the fields without a tag.
+        """
+        row = self.template[:]
+        field_indexes = self.field_indexes
+        key_indexes = self.key_indexes
+        for key in tag_dict:
+            index = field_indexes.get(key)
+            if index is not None:
+                row[index] = tag_dict[key]
+            else:
+                index = key_indexes.get(key)
+                if index is not None and key.replace(KEY_SEPARATOR, FIELD_SEPARATOR) not in tag_dict:
+                    row[index] = tag_dict[key]
+        return row
+
+    def other_tags(self, tag_dict):
+        """
+        Find the tags that are not mapped to a field.
+        :param tag_dict: The tags of an element.
+        :return: A list of (key, value) tuples, sorted by key.
+        """
+        field_indexes = self.field_indexes
+        key_indexes = self.key_indexes
+        return sorted((key, value) for key, value in tag_dict.items() if key not in field_indexes and (
+            key not in key_indexes or key.replace(KEY_SEPARATOR, FIELD_SEPARATOR) in tag_dict
+        ))
+
+
+class MeasuringTagMapper(TagMapper):
+    """
+    A TagMapper that also measures, for each field, the number of elements having a value and the length of the
+    longest value, so that the tag fields of the output can be sized from the data.
+    """
+
+    def __init__(self, fields):
+        """
+        :param fields: The ordered list of field names.
+        """
+        TagMapper.__init__(self, fields)
+        self.count_elements = 0
+        self.counts = [0] * len(self.fields)
+        self.max_lengths = [0] * len(self.fields)
+
+    def map(self, tag_dict):
+        row = self.template[:]
+        field_indexes = self.field_indexes
+        key_indexes = self.key_indexes
+        counts = self.counts
+        max_lengths = self.max_lengths
+        self.count_elements += 1
+        for key in tag_dict:
+            index = field_indexes.get(key)
+            if index is None:
+                index = key_indexes.get(key)
+                if index is None or key.replace(KEY_SEPARATOR, FIELD_SEPARATOR) in tag_dict:
+                    continue
+            value = tag_dict[key]
+            row[index] = value
+            counts[index] += 1
+            if len(value) > max_lengths[index]:
+                max_lengths[index] = len(value)
+        return row
+
+    def statistics(self):
+        """
+        :return: The TagStatistics of the elements mapped so far.
+        """
+        return TagStatistics(self.fields, self.count_elements, self.counts, self.max_lengths)
+
+
+class TagStatistics(object):
+    """
+    The number of values and the length of the longest value of each tag field, over a set of elements.
+    """
+
+    def __init__(self, fields, count_elements=0, counts=None, max_lengths=None):
+        """
+        :param fields: The ordered list of field names.
+        :param count_elements: The number of elements measured.
+        :param counts: The number of elements having a value, for each field.
+        :param max_lengths: The length of the longest value, for each field.
+        """
+        self.fields = list(fields)
+        self.count_elements = count_elements
+        self.counts = list(counts) if counts is not None else [0] * len(self.fields)
+        self.max_lengths = list(max_lengths) if max_lengths is not None else [0] * len(self.fields)
+
+    def merge(self, other):
+        """
+        :param other: The TagStatistics of other elements, with the same fields.
+        :return: The TagStatistics of the elements of both.
+        """
+        return TagStatistics(
+            self.fields,
+            self.count_elements + other.count_elements,
+            [count + other_count for count, other_count in zip(self.counts, other.counts)],
+            [max(length, other_length) for length, other_length in zip(self.max_lengths, other.max_lengths)]
+        )
+
+    def used_fields(self):
+        """
+        :return: The fields having at least one value, in order.
+        """
+        return [field for field, count in zip(self.fields, self.counts) if count > 0]
+
+    def to_dict(self):
+        """
+        :return: A json serializable dictionary.
+        """
+        return {
+            'elements': self.count_elements,
+            'fields': dict((field, [count, length]) for field, count, length in zip(
+                self.fields, self.counts, self.max_lengths
+            ) if count > 0)
+        }
+
+    @classmethod
+    def from_dict(cls, fields, content):
+        """
+        :param fields: The ordered list of field names.
+        :param content: A dictionary written by to_dict.
+        :return: The TagStatistics.
+        """
+        measures = [content['fields'].get(field, [0, 0]) for field in fields]
+        return cls(
+            fields,
+            content['elements'],
+            [count for count, length in measures],
+            [length for count, length in measures]
+        )
+
+
+class TagFieldLayout(object):
+    """
+    The tag fields of an output layer, and the selection of their values in the rows mapped by a TagMapper. By
+    default, the layer has all the fields of the mapper with a fixed length. Sized from TagStatistics, the layer only
+    has the fields having values, each one with a length fitting its longest value. The layer may also have the
+    OTHER_TAGS_FIELD, whose value follows the mapped values in the rows.
+    """
+
+    def __init__(self, source_fields, fields=None, lengths=None, other_tags=False):
+        """
+        :param source_fields: The ordered list of the fields of the TagMapper.
+        :param fields: The fields of the layer, in the order of the source fields. All of them when None.
+        :param lengths: An optional dictionary of the length of the fields of the layer.
+        :param other_tags: If True, the layer has the OTHER_TAGS_FIELD after the tag fields.
+        """
+        self.fields = list(source_fields if fields is None else fields)
+        self.lengths = lengths
+        self.other_tags = other_tags
+        self.source_count = len(source_fields)
+        self.positions = None
+        if self.fields != list(source_fields):
+            source_positions = dict((field, index) for index, field in enumerate(source_fields))
+            self.positions = [source_positions[field] for field in self.fields]
+
+    @classmethod
+    def from_statistics(cls, statistics, maximum_length, minimum_length=8, other_tags=False):
+        """
+        Size the fields from the values measured. The lengths are rounded up to a power of two, so that the layers
+        sized from similar extracts share their schema, and are capped by maximum_length unless a value is longer.
+        :param statistics: The TagStatistics.
+        :param maximum_length: The default length of the tag fields.
+        :param minimum_length: The smallest length of a field.
+        :param other_tags: If True, the layer has the OTHER_TAGS_FIELD after the tag fields.
+        :return: The TagFieldLayout.
+        """
+        lengths = {}
+        for field, count, max_length in zip(statistics.fields, statistics.counts, statistics.max_lengths):
+            if count > 0:
+                length = minimum_length
+                while length < max_length:
+                    length *= 2
+                lengths[field] = max(max_length, min(length, maximum_length))
+        return cls(statistics.fields, statistics.used_fields(), lengths, other_tags)
+
+    def layer_fields(self):
+        """
+        :return: The names of the text fields of the layer holding the tags.
+        """
+        return self.fields + [OTHER_TAGS_FIELD] if self.other_tags else self.fields
+
+    def layer_field_lengths(self):
+        """
+        :return: The dictionary of the length of the text fields of the layer holding the tags, or None for the
+        default length.
+        """
+        if not self.other_tags:
+            return self.lengths
+        lengths = dict(self.lengths or {})
+        lengths[OTHER_TAGS_FIELD] = OTHER_TAGS_LENGTH
+        return lengths
+
+    def select(self, row, start=0):
+        """
+        Select the values of the fields of the layer.
+        :param row: A row holding, from the position start, the values mapped by the TagMapper. The values following
+        them, such as the other tags, are kept.
+        :param start: The position of the first tag value in the row.
+        :return: The row with the values of the fields of the layer only. The row itself when the layer has all the
+        fields.
+        """
+        positions = self.positions
+        if positions is None:
+            return row
+        end = start + self.source_count
+        return row[:start] + [row[start + position] for position in positions] + row[end:]
+
+
+ELEMENT_TYPES = ('node', 'way', 'relation')
+ANY_ELEMENT_TYPE = '*'
+ANY_VALUE = '*'
+EXCLUDE_PREFIX = '-'
+
+
+class TagFilter(object):
+    """
+    Decide which elements are kept from their tags. The filter is defined by an expression made of rules separated by
+    semicolons. A rule is a list of element types, a colon, and a list of conditions separated by commas. A rule
+    starting with '-' excludes the elements that match it:
+
+        way: highway, building, landuse=residential|commercial; -way: highway=proposed; node: amenity
+
+    A condition is a key, meaning any value, 'key=*', 'key=value' or 'key=value1|value2'. Element types are 'node',
+    'way', 'relation', or '*' for all of them, and can be combined with '|' (e.g. 'way|relation').
+
+    For each element type, when the expression has include rules, an element is kept if it matches one of their
+    conditions; otherwise every element is kept. Then the elements matching an exclude condition are discarded.
+    """
+
+    def __init__(self, expression):
+        """
+        :param expression: The filter expression.
+        """
+        self.expression = expression
+        self.includes = {element_type: [] for element_type in ELEMENT_TYPES}
+        self.excludes = {element_type: [] for element_type in ELEMENT_TYPES}
+        for rule in expression.split(';'):
+            rule = rule.strip()
+            if rule == '':
+                continue
+            if ':' not in rule:
+                raise ValueError('Invalid filter rule "{}": expected element types and conditions separated by ":"'
+                                 .format(rule))
+            rules = self.includes
+            if rule.startswith(EXCLUDE_PREFIX):
+                rules = self.excludes
+                rule = rule[len(EXCLUDE_PREFIX):]
+            types_text, conditions_text = rule.split(':', 1)
+            conditions = [self._parse_condition(condition) for condition in conditions_text.split(',')
+                          if condition.strip() != '']
+            for element_type in types_text.split('|'):
+                element_type = element_type.strip()
+                if element_type == ANY_ELEMENT_TYPE:
+                    for any_type in ELEMENT_TYPES:
+                        rules[any_type].extend(conditions)
+                elif element_type in rules:
+                    rules[element_type].extend(conditions)
+                else:
+                    raise ValueError('Invalid element type "{}" in filter rule "{}"'.format(element_type, rule))
+
+    @staticmethod
+    def _parse_condition(condition):
+        if '=' not in condition:
+            return condition.strip(), None
+        key, values = condition.split('=', 1)
+        values = values.strip()
+        if values == ANY_VALUE:
+            return key.strip(), None
+        return key.strip(), frozenset(value.strip() for value in values.split('|'))
+
+    @staticmethod
+    def _matches(conditions, tag_dict):
+        for key, values in conditions:
+            if key in tag_dict and (values is None or tag_dict[key] in values):
+                return True
+        return False
+
+    def has_rules(self, element_type):
+        """
+        Tell whether the filter restricts an element type.
+        :param element_type: 'node', 'way' or 'relation'.
+        :return: True if the expression has rules for this element type.
+        """
+        return len(self.includes[element_type]) > 0 or len(self.excludes[element_type]) > 0
+
+    def accepts(self, element_type, tag_dict):
+        """
+        Tell whether an element is kept.
+        :param element_type: 'node', 'way' or 'relation'.
+        :param tag_dict: The tags of the element.
+        :return: True if the element is kept.
+        """
+        includes = self.includes[element_type]
+        if len(includes) > 0 and not self._matches(includes, tag_dict):
+            return False
+        return not self._matches(self.excludes[element_type], tag_dict)
@@ -0,0 +1,487 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    This geoprocessing tool applies an OSM change file (.osc, .osc.gz or .osc.bz2) to an output imported by
+    osm_2_geodatabase with the update state option, instead of importing a full dump again.
+
+    The nodes, ways and multipolygons created, modified or deleted by the change file are deleted from the output
+    layers and inserted again with their new attributes. Only the features depending on the changes are recomputed:
+    the ways whose nodes moved, and the multipolygons whose member ways changed or moved, get a new geometry. The
+    ways and multipolygons are identified by the id field, and by the osm_type field in the polygon layer.
+
+    The boundaries and routes are not maintained: the ones modified by the change file, or whose member ways changed,
+    are left as they are and reported. Only the deleted ones are removed from the output.
+
+    When an element appears several times in the change file, its last version is applied. The change files must be
+    applied in order, each one once.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, bz2, gzip, numpy
+from osm_messages import add_message, add_warning
+from osm_sinks import GEOMETRY_POINT, GEOMETRY_POLYLINE, GEOMETRY_POLYGON, GEOMETRY_FIELD, create_sink
+from osm_tags import STANDARD_FIELDS_ARRAY, TagMapper
+from osm_intermediate import FLAG_HIGHWAY, to_degrees
+from osm_state import FLAG_TAGGED, UNMAINTAINED_BOUNDARY, UNMAINTAINED_ROUTE, UpdateState, update_state_folder
+from osm_2_geodatabase import NODE_SAVED_ATTRIBUTES, WAY_SAVED_ATTRIBUTES, POLYGON_SAVED_ATTRIBUTES, ID_FIELD, \
+    OSM_TYPE_FIELD, OSM_TYPE_WAY, OSM_TYPE_RELATION, NODES_LAYER, WAY_LINES_LAYER, WAY_POLYGONS_LAYER, \
+    ROUTE_LINES_LAYER, DEFAULT_BATCH_SIZE, DenseNodeLocationStore, BatchedCursor, parse_node_children, \
+    parse_way_children, parse_relation_children, linestring_wkb, encode_way_polygon, multipolygon_geometry, timeit, \
+    etree, get_tool_parameter
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+ACTION_CREATE = 'create'
+ACTION_MODIFY = 'modify'
+ACTION_DELETE = 'delete'
+ACTIONS = (ACTION_CREATE, ACTION_MODIFY, ACTION_DELETE)
+
+
+def open_change_file(osc_file):
+    """
+    Open a change file, decompressing it according to its extension.
+    :param osc_file: The path to the change file.
+    :return: A file object.
+    """
+    if osc_file.lower().endswith('.gz'):
+        return gzip.open(osc_file, 'rb')
+    if osc_file.lower().endswith('.bz2'):
+        return bz2.BZ2File(osc_file, 'r')
+    return open(osc_file, 'rb')
+
+
+def iter_change_elements(osc_file):
+    """
+    Parse an OSM change file and yield its element records, preceded by their action:
+        (action, 'node', id, lon, lat, timestamp, tags)
+        (action, 'way', id, timestamp, tags, node_refs)
+        (action, 'relation', id, timestamp, tags, members)
+    The deleted nodes may not have a location, in which case lon and lat are None.
+    :param osc_file: The path to the change file.
+    :return: A generator of element records.
+    """
+    change_file = open_change_file(osc_file)
+    try:
+        action = None
+        action_element = None
+        for event, elem in etree.iterparse(change_file, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag in ACTIONS:
+                    action = elem.tag
+                    action_element = elem
+                continue
+
+            if elem.tag == 'node':
+                attrib = elem.attrib
+                tag_dict = parse_node_children(elem) if len(elem) > 0 else {}
+                yield action, 'node', attrib['id'], attrib.get('lon'), attrib.get('lat'), attrib.get('timestamp'), \
+                    tag_dict
+            elif elem.tag == 'way':
+                tag_dict, nodes = parse_way_children(elem)
+                yield action, 'way', elem.attrib['id'], elem.attrib.get('timestamp'), tag_dict, nodes
+            elif elem.tag == 'relation':
+                tag_dict, members, elem_type, way_members = parse_relation_children(elem)
+                yield action, 'relation', elem.attrib['id'], elem.attrib.get('timestamp'), tag_dict, members
+            else:
+                continue
+            elem.clear()
+            action_element.remove(elem)
+    finally:
+        change_file.close()
+
+
+def read_changes(osc_file):
+    """
+    Read the last version of each element of a change file.
+    :param osc_file: The path to the change file.
+    :return: A tuple of three dictionaries, for the nodes, the ways and the relations, keyed by integer identifier,
+    whose values are the element records of iter_change_elements.
+    """
+    changes = {'node': {}, 'way': {}, 'relation': {}}
+    for element in iter_change_elements(osc_file):
+        changes[element[1]][int(element[2])] = element
+    return changes['node'], changes['way'], changes['relation']
+
+
+def deleted_identifiers(changes):
+    """
+    :param changes: The records of the change file, keyed by identifier.
+    :return: The set of the identifiers of the deleted elements.
+    """
+    return set(identifier for identifier, element in changes.items() if element[0] == ACTION_DELETE)
+
+
+def is_multipolygon(tag_dict):
+    return tag_dict.get('type') == 'multipolygon'
+
+
+class NodeLocations(object):
+    """
+    Look up the coordinates of ways in the node location store of the update state.
+    """
+
+    def __init__(self, node_store):
+        self.node_store = node_store
+
+    def coordinates(self, nodes):
+        """
+        :param nodes: A numpy array of int64 node identifiers.
+        :return: A numpy array of float64 (x, y) pairs in decimal degrees, or None if a node is missing.
+        """
+        coordinates, found = self.node_store.lookup(nodes)
+        if not found.all():
+            return None
+        return numpy.column_stack((to_degrees(coordinates[:, 0]), to_degrees(coordinates[:, 1])))
+
+
+def is_area(flags, nodes):
+    """
+    Tell whether a way is written as a polygon: a closed way, unless it is a highway.
+    """
+    return nodes[0] == nodes[-1] and flags & FLAG_HIGHWAY == 0
+
+
+def way_geometry(locations, flags, nodes):
+    """
+    Build the geometry of a way.
+    :param locations: The NodeLocations.
+    :param flags: The flags of the way.
+    :param nodes: A numpy array of int64 node identifiers.
+    :return: The well-known binary of the line or polygon, or None if a node is missing.
+    """
+    coordinates = locations.coordinates(nodes)
+    if coordinates is None:
+        return None
+    if is_area(flags, nodes):
+        return encode_way_polygon(coordinates)
+    return linestring_wkb(coordinates)
+
+
+def relation_geometry(locations, state, ways, roles):
+    """
+    Build the geometry of a multipolygon from the ways of the update state.
+    :param locations: The NodeLocations.
+    :param state: The UpdateState.
+    :param ways: The list of member way identifiers.
+    :param roles: The list of roles of the member ways.
+    :return: The well-known binary of the multipolygon, or None.
+    """
+    way_nodes = state.get_ways(ways)
+    member_ways = []
+    seen_identifiers = set()
+    for identifier, role in zip(ways, roles):
+        identifier = int(identifier)
+        if identifier not in way_nodes or identifier in seen_identifiers:
+            continue
+        seen_identifiers.add(identifier)
+        flags, nodes = way_nodes[identifier]
+        coordinates = locations.coordinates(nodes)
+        if coordinates is not None:
+            member_ways.append((coordinates, int(nodes[0]), int(nodes[-1]), role))
+    return multipolygon_geometry(member_ways)[0]
+
+
+@timeit
+def apply_node_changes(sink, node_store, node_changes, tag_mapper, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply the node changes to the node location store and to the node layer.
+    :param sink: The OutputSink.
+    :param node_store: The DenseNodeLocationStore of the update state.
+    :param node_changes: The node records of the change file, keyed by identifier.
+    :param tag_mapper: The TagMapper of the tag fields.
+    :param batch_size: The number of rows inserted at once.
+    :return: The identifiers of the nodes that moved or have been deleted.
+    """
+    node_all_attr = [GEOMETRY_FIELD] + [field.name for field in NODE_SAVED_ATTRIBUTES] + STANDARD_FIELDS_ARRAY
+    identifiers = numpy.array(sorted(node_changes.keys()), dtype=numpy.int64)
+    previous_coordinates, previous_found = node_store.lookup(identifiers)
+
+    deleted = [node_id for node_id, element in node_changes.items() if element[0] == ACTION_DELETE]
+    node_store.remove(numpy.array(deleted, dtype=numpy.int64))
+    for action, element_type, node_id, lon, lat, timestamp, tag_dict in node_changes.values():
+        if action != ACTION_DELETE:
+            node_store.add(node_id, lon, lat)
+    node_store.flush()
+
+    coordinates, found = node_store.lookup(identifiers)
+    moved = previous_found & ((coordinates != previous_coordinates).any(axis=1) | ~found)
+
+    sink.delete_rows(NODES_LAYER, ID_FIELD.name, [str(node_id) for node_id in node_changes.keys()])
+    count = 0
+    with BatchedCursor(sink.insert_cursor(NODES_LAYER, node_all_attr), batch_size) as insert_cursor:
+        for action, element_type, node_id, lon, lat, timestamp, tag_dict in node_changes.values():
+            if action != ACTION_DELETE and len(tag_dict) > 0:
+                insert_cursor.insertRow([[float(lon), float(lat)], node_id, lon, lat, timestamp] +
+                                        tag_mapper.map(tag_dict))
+                count += 1
+
+    add_message('Applied {} node changes: {} nodes moved or deleted, {} nodes with attributes inserted'.format(
+        len(node_changes),
+        int(moved.sum()),
+        count
+    ))
+    return identifiers[moved].tolist()
+
+
+@timeit
+def apply_way_changes(sink, state, locations, way_changes, moved_nodes, deleted_relations, tag_mapper,
+                      batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply the way changes to the update state and to the line and polygon layers, and update the geometries of the
+    ways whose nodes moved.
+    :param sink: The OutputSink.
+    :param state: The UpdateState.
+    :param locations: The NodeLocations, already updated with the node changes.
+    :param way_changes: The way records of the change file, keyed by identifier.
+    :param moved_nodes: The identifiers of the nodes that moved or have been deleted.
+    :param deleted_relations: The identifiers of the relations deleted by the change file, left out of the warning
+    about the boundaries and routes whose member ways changed.
+    :param tag_mapper: The TagMapper of the tag fields.
+    :param batch_size: The number of rows inserted at once.
+    :return: The identifiers of the ways whose geometry changed or that have been deleted.
+    """
+    way_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + STANDARD_FIELDS_ARRAY
+    polygon_all_attr = way_all_attr + [OSM_TYPE_FIELD.name]
+    way_filter = {OSM_TYPE_FIELD.name: OSM_TYPE_WAY}
+
+    changed_identifiers = [str(way_id) for way_id in way_changes.keys()]
+    sink.delete_rows(WAY_LINES_LAYER, ID_FIELD.name, changed_identifiers)
+    sink.delete_rows(WAY_POLYGONS_LAYER, ID_FIELD.name, changed_identifiers, way_filter)
+    state.delete_ways(way_changes.keys())
+
+    count_lines = 0
+    count_polygons = 0
+    count_incomplete = 0
+    with BatchedCursor(sink.insert_cursor(WAY_LINES_LAYER, way_all_attr), batch_size) as insert_lines, \
+            BatchedCursor(sink.insert_cursor(WAY_POLYGONS_LAYER, polygon_all_attr), batch_size) as insert_polygons:
+        for action, element_type, way_id, timestamp, tag_dict, nodes in way_changes.values():
+            if action == ACTION_DELETE:
+                continue
+            if len(nodes) < 2:
+                add_warning('Way with id {} has less than 2 nodes'.format(way_id))
+                continue
+            nodes = numpy.array(nodes, dtype=numpy.int64)
+            flags = 0
+            if 'highway' in tag_dict and tag_dict['highway'] != '':
+                flags = FLAG_HIGHWAY
+            if len(tag_dict) > 0:
+                flags |= FLAG_TAGGED
+            state.add_ways([way_id], [flags], [nodes])
+            if len(tag_dict) == 0:
+                continue
+
+            geometry = way_geometry(locations, flags, nodes)
+            if geometry is None:
+                count_incomplete += 1
+                continue
+            row = [geometry, way_id, timestamp] + tag_mapper.map(tag_dict)
+            if is_area(flags, nodes):
+                insert_polygons.insertRow(row + [OSM_TYPE_WAY])
+                count_polygons += 1
+            else:
+                insert_lines.insertRow(row)
+                count_lines += 1
+
+    # The ways that did not change themselves, but whose nodes moved.
+    moved_ways = state.ways_of_nodes(moved_nodes) - set(way_changes.keys())
+    line_geometries = {}
+    polygon_geometries = {}
+    for way_id, (flags, nodes) in state.get_ways(moved_ways).items():
+        if flags & FLAG_TAGGED == 0:
+            continue
+        geometry = way_geometry(locations, flags, nodes)
+        if is_area(flags, nodes):
+            polygon_geometries[str(way_id)] = geometry
+        else:
+            line_geometries[str(way_id)] = geometry
+    sink.update_geometries(WAY_LINES_LAYER, ID_FIELD.name, line_geometries)
+    sink.update_geometries(WAY_POLYGONS_LAYER, ID_FIELD.name, polygon_geometries, way_filter)
+
+    add_message('Applied {} way changes: {} lines and {} polygons inserted, {} ways with moved nodes updated'.format(
+        len(way_changes),
+        count_lines,
+        count_polygons,
+        len(line_geometries) + len(polygon_geometries)
+    ))
+    if count_incomplete > 0:
+        add_warning('{} ways have nodes missing from the update state and were not inserted'.format(count_incomplete))
+    changed_ways = set(way_changes.keys()) | moved_ways
+    report_unmaintained_relations(
+        dict((relation_id, kind) for relation_id, kind in state.unmaintained_relations_of_ways(changed_ways).items()
+             if relation_id not in deleted_relations),
+        'have member ways that changed, their geometries have not been updated'
+    )
+    return changed_ways
+
+
+def report_unmaintained_relations(relations, consequence):
+    """
+    Warn about the boundaries and routes of the output left out of date by the updates.
+    :param relations: A dictionary of the kinds of the relations, keyed by identifier.
+    :param consequence: The end of the warning.
+    """
+    if len(relations) == 0:
+        return
+    kinds = list(relations.values())
+    add_warning('{} boundaries and {} routes {}: {}'.format(
+        kinds.count(UNMAINTAINED_BOUNDARY),
+        kinds.count(UNMAINTAINED_ROUTE),
+        consequence,
+        ', '.join(str(identifier) for identifier in sorted(relations)[:20])
+    ))
+
+
+@timeit
+def apply_relation_changes(sink, state, locations, relation_changes, changed_ways, tag_mapper,
+                           batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply the multipolygon changes to the update state and to the polygon layer, remove the deleted boundaries and
+    routes, and update the geometries of the multipolygons whose member ways changed.
+    :param sink: The OutputSink.
+    :param state: The UpdateState.
+    :param locations: The NodeLocations, already updated with the node changes.
+    :param relation_changes: The relation records of the change file, keyed by identifier.
+    :param changed_ways: The identifiers of the ways whose geometry changed or that have been deleted.
+    :param tag_mapper: The TagMapper of the tag fields.
+    :param batch_size: The number of rows inserted at once.
+    :return: None.
+    """
+    multipolygon_all_attr = [GEOMETRY_FIELD] + [field.name for field in WAY_SAVED_ATTRIBUTES] + \
+        STANDARD_FIELDS_ARRAY + [OSM_TYPE_FIELD.name]
+    relation_filter = {OSM_TYPE_FIELD.name: OSM_TYPE_RELATION}
+
+    # The rows deleted are the previous multipolygons, a relation that is no longer a multipolygon being deleted like
+    # a deleted relation, the new multipolygons, and the deleted relations. The other relations, such as the
+    # boundaries of the polygon layer, are left as they are.
+    previous_multipolygons = state.get_relations(relation_changes.keys())
+    unmaintained_relations = state.get_unmaintained_relations(relation_changes.keys())
+    deleted_relations = deleted_identifiers(relation_changes)
+    new_multipolygons = set(relation_id for relation_id, element in relation_changes.items()
+                            if element[0] != ACTION_DELETE and is_multipolygon(element[4]))
+    replaced_relations = set(previous_multipolygons) | deleted_relations | new_multipolygons
+    sink.delete_rows(
+        WAY_POLYGONS_LAYER,
+        ID_FIELD.name,
+        [str(relation_id) for relation_id in sorted(replaced_relations)],
+        relation_filter
+    )
+    # The routes have their own layer, without osm_type field.
+    sink.delete_rows(
+        ROUTE_LINES_LAYER,
+        ID_FIELD.name,
+        [str(relation_id) for relation_id in sorted(deleted_relations)
+         if unmaintained_relations.get(relation_id) == UNMAINTAINED_ROUTE]
+    )
+    state.delete_relations(relation_changes.keys())
+    state.delete_unmaintained_relations(deleted_relations | new_multipolygons)
+
+    count_inserted = 0
+    with BatchedCursor(sink.insert_cursor(WAY_POLYGONS_LAYER, multipolygon_all_attr), batch_size) as insert_cursor:
+        for action, element_type, relation_id, timestamp, tag_dict, members in relation_changes.values():
+            if action == ACTION_DELETE or not is_multipolygon(tag_dict):
+                continue
+            ways = [ref for member_type, ref, role in members if member_type == 'way']
+            roles = [role.replace(',', ' ').replace('|', ' ') for member_type, ref, role in members
+                     if member_type == 'way']
+            state.add_relations([(relation_id, ways, roles)])
+            geometry = relation_geometry(locations, state, ways, roles)
+            insert_cursor.insertRow([geometry, relation_id, timestamp] + tag_mapper.map(tag_dict) +
+                                    [OSM_TYPE_RELATION])
+            count_inserted += 1
+
+    # The multipolygons that did not change themselves, but whose member ways did.
+    affected_relations = state.relations_of_ways(changed_ways) - set(relation_changes.keys())
+    geometries = {}
+    for relation_id, (ways, roles) in state.get_relations(affected_relations).items():
+        geometries[str(relation_id)] = relation_geometry(locations, state, ways, roles)
+    sink.update_geometries(WAY_POLYGONS_LAYER, ID_FIELD.name, geometries, relation_filter)
+
+    add_message('Applied {} relation changes: {} multipolygons inserted, {} multipolygons with changed members '
+                'updated'.format(len(relation_changes), count_inserted, len(geometries)))
+    report_unmaintained_relations(
+        dict((relation_id, kind) for relation_id, kind in unmaintained_relations.items()
+             if relation_id not in replaced_relations),
+        'have been modified by the change file, and have been left as they are'
+    )
+
+
+def apply_changes(osc_file, output, output_format=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    The main function. Apply a change file to an output and to its update state.
+    :param osc_file: The OSM change file.
+    :param output: The output file geodatabase, GeoPackage, or GeoParquet folder, imported with the update state.
+    :param output_format: The format of the output, as described in osm_sinks.create_sink. Deduced from the
+    extension of the output when not set.
+    :param batch_size: The number of rows buffered before being inserted.
+    :return:
+    """
+    if not os.path.exists(output):
+        raise ValueError('The output {} does not exist'.format(output))
+    state = UpdateState(update_state_folder(output))
+    node_store = DenseNodeLocationStore(state.node_locations_path, overwrite=False)
+    locations = NodeLocations(node_store)
+    tag_mapper = TagMapper(STANDARD_FIELDS_ARRAY)
+
+    node_changes, way_changes, relation_changes = read_changes(osc_file)
+    add_message('Read {} node, {} way and {} relation changes'.format(
+        len(node_changes),
+        len(way_changes),
+        len(relation_changes)
+    ))
+
+    sink = create_sink(output, output_format)
+    sink.create()
+    sink.open_layer(NODES_LAYER, GEOMETRY_POINT, NODE_SAVED_ATTRIBUTES, STANDARD_FIELDS_ARRAY)
+    sink.open_layer(WAY_LINES_LAYER, GEOMETRY_POLYLINE, WAY_SAVED_ATTRIBUTES, STANDARD_FIELDS_ARRAY)
+    sink.open_layer(WAY_POLYGONS_LAYER, GEOMETRY_POLYGON, POLYGON_SAVED_ATTRIBUTES, STANDARD_FIELDS_ARRAY)
+    sink.open_layer(ROUTE_LINES_LAYER, GEOMETRY_POLYLINE, WAY_SAVED_ATTRIBUTES, STANDARD_FIELDS_ARRAY)
+
+    with sink.session() as edit:
+        moved_nodes = apply_node_changes(sink, node_store, node_changes, tag_mapper, batch_size)
+        changed_ways = apply_way_changes(sink, state, locations, way_changes, moved_nodes,
+                                         deleted_identifiers(relation_changes), tag_mapper, batch_size)
+        apply_relation_changes(sink, state, locations, relation_changes, changed_ways, tag_mapper, batch_size)
+
+    for layer in (NODES_LAYER, WAY_LINES_LAYER, WAY_POLYGONS_LAYER, ROUTE_LINES_LAYER):
+        sink.close_layer(layer)
+    sink.finalise()
+    node_store.close(remove=False)
+    state.close()
+
+
+def parse_arguments(arguments):
+    """
+    Read the parameters of the tool from the command line, when it does not run as a geoprocessing tool.
+    :param arguments: The command line arguments.
+    :return: The parsed arguments.
+    """
+    import argparse
+    from osm_sinks import FORMAT_FILE_GEODATABASE, FORMAT_GEOPACKAGE, FORMAT_GEOPARQUET
+    parser = argparse.ArgumentParser(description='Apply an OSM change file to an output imported with the update '
+                                                 'state.')
+    parser.add_argument('osc_file', help='The .osc, .osc.gz or .osc.bz2 file.')
+    parser.add_argument('output', help='The output file geodatabase (.gdb), GeoPackage (.gpkg) or GeoParquet folder.')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--format', choices=[FORMAT_FILE_GEODATABASE, FORMAT_GEOPACKAGE, FORMAT_GEOPARQUET])
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__' and arcpy is None:
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    arguments = parse_arguments(sys.argv[1:])
+    apply_changes(arguments.osc_file, arguments.output, arguments.format, arguments.batch_size)
+
+elif __name__ == '__main__':
+    osc_file = arcpy.GetParameterAsText(0)
+    output = arcpy.GetParameterAsText(1)
+    output_format = get_tool_parameter(2, as_text=True)
+    batch_size = get_tool_parameter(3, DEFAULT_BATCH_SIZE)
+    apply_changes(osc_file, output, output_format, int(batch_size))
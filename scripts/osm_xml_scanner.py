@@ -0,0 +1,174 @@
+'''
+Author: Fabien Ancelin
+Developed for Python 2.7 and ArcMap 10.1 and above.
+
+Summary:
+
+    Streaming scanner of OSM XML, an alternative to the xml parsers for the import. OSM XML is flat and regular: the
+    nodes, ways and relations are children of the root element, and their children (tag, nd and member) are empty
+    elements. Instead of building an element object for every node, way and child, the scanner reads the decompressed
+    file by large buffers, finds the elements with regular expressions, and yields their records directly, as
+    described in osm_2_geodatabase.iter_xml_elements.
+
+    The scanner relies on the way OSM files are written by the OSM API, osmium and osmosis: the characters '<' and
+    '>' are escaped in the attribute values, and there are no CDATA sections. The comments are removed before the
+    elements are scanned, so the elements commented out are skipped, as an xml parser does. The character and entity
+    references of the attribute values are decoded, and their tabs and line breaks are replaced by spaces.
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import re
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# The number of bytes read from the file at once.
+DEFAULT_BUFFER_SIZE = 16 * 1024 * 1024
+
+COMMENT_START = u'<!--'
+COMMENT_PATTERN = re.compile(u'<!--.*?-->', re.DOTALL)
+
+# A complete node, way or relation: the attributes of its start tag, ending with '/' if the element is empty, and the
+# content of the element otherwise.
+ELEMENT_PATTERN = re.compile(u'<(node|way|relation)\\s([^>]*)>(?:(?<=/>)|(.*?)</\\1>)', re.DOTALL)
+# The attributes as written by the OSM tools: double quoted, without references or white space to normalize. The
+# other attributes are parsed with the generic pattern.
+FAST_ATTRIBUTE_PATTERN = re.compile(u'\\s*([^=\\s]+)="([^"]*)"')
+SLOW_ATTRIBUTE_CHARACTERS = re.compile(u'[&\'\\t\\n\\r]')
+ATTRIBUTE_PATTERN = re.compile(u'([\\w:.-]+)\\s*=\\s*(?:"([^"]*)"|\'([^\']*)\')')
+ND_PATTERN = re.compile(u'<nd\\s+ref\\s*=\\s*["\'](-?\\d+)["\']')
+CHILD_TAG_PATTERN = re.compile(u'<tag\\s([^>]*?)/?>')
+MEMBER_PATTERN = re.compile(u'<member\\s([^>]*?)/?>')
+
+# The tags as written by the OSM tools: the key first, then the value, both free of references and white space to
+# normalize. The elements having other tags are parsed with the generic patterns.
+FAST_TAG_PATTERN = re.compile(u'<tag k="([^"&\\t\\n\\r]*)" v="([^"&\\t\\n\\r]*)"\\s*/>')
+
+REFERENCE_PATTERN = re.compile(u'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+ENTITIES = {u'amp': u'&', u'lt': u'<', u'gt': u'>', u'quot': u'"', u'apos': u"'"}
+ATTRIBUTE_WHITE_SPACE = re.compile(u'\r\n|[\t\n\r]')
+
+
+def replace_reference(match):
+    name = match.group(1)
+    if name.startswith(u'#x'):
+        return unichr(int(name[2:], 16))
+    if name.startswith(u'#'):
+        return unichr(int(name[1:]))
+    return ENTITIES[name]
+
+
+def normalize_attribute(value):
+    """
+    Normalize an attribute value as an xml parser does.
+    :param value: The raw value, between the quotes.
+    :return: The value with its white space normalized and its references decoded.
+    """
+    if u'\t' in value or u'\n' in value or u'\r' in value:
+        value = ATTRIBUTE_WHITE_SPACE.sub(u' ', value)
+    if u'&' in value:
+        value = REFERENCE_PATTERN.sub(replace_reference, value)
+    return value
+
+
+def parse_attributes(text):
+    """
+    :param text: The attributes of a start tag.
+    :return: A dictionary of the attribute values.
+    """
+    if SLOW_ATTRIBUTE_CHARACTERS.search(text) is None:
+        return dict(FAST_ATTRIBUTE_PATTERN.findall(text))
+    attributes = {}
+    for name, double_quoted, single_quoted in ATTRIBUTE_PATTERN.findall(text):
+        value = double_quoted or single_quoted
+        if u'&' in value or u'\t' in value or u'\n' in value or u'\r' in value:
+            value = normalize_attribute(value)
+        attributes[name] = value
+    return attributes
+
+
+def parse_tags(body):
+    """
+    :param body: The content of a node, way or relation.
+    :return: The dictionary of its tags.
+    """
+    pairs = FAST_TAG_PATTERN.findall(body)
+    if len(pairs) == body.count(u'<tag'):
+        return dict(pairs)
+    tag_dict = {}
+    for text in CHILD_TAG_PATTERN.findall(body):
+        attributes = parse_attributes(text)
+        tag_dict[attributes['k']] = attributes['v']
+    return tag_dict
+
+
+def iter_scanned_elements(xml_file, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Scan an OSM XML stream and yield its element records, as iter_xml_elements does.
+    :param xml_file: A file object holding the xml content, encoded as utf-8.
+    :param buffer_size: The number of bytes read at once.
+    :return: A generator of element records.
+    """
+    text = u''
+    remainder = b''
+    # The text from the start of a comment not closed yet, held until the end of the comment is read.
+    comment = u''
+    end_of_file = False
+    while not end_of_file:
+        data = xml_file.read(buffer_size)
+        end_of_file = not data
+        data = remainder + data
+        # The buffer is split after the last '>', which is never part of a multibyte character. The elements left
+        # incomplete at the end of the buffer are scanned again with the next one.
+        split = len(data) if end_of_file else data.rfind(b'>') + 1
+        remainder = data[split:]
+        new_text = comment + data[:split].decode('utf-8')
+        comment = u''
+        if COMMENT_START in new_text:
+            new_text = COMMENT_PATTERN.sub(u'', new_text)
+            comment_start = new_text.find(COMMENT_START)
+            if comment_start >= 0:
+                # A comment not closed at the end of the file runs to its end.
+                comment = u'' if end_of_file else new_text[comment_start:]
+                new_text = new_text[:comment_start]
+        text += new_text
+
+        end = 0
+        for match in ELEMENT_PATTERN.finditer(text):
+            name, attribute_text, body = match.groups()
+            end = match.end()
+            attributes = parse_attributes(attribute_text)
+            if name == u'node':
+                yield (
+                    'node',
+                    attributes['id'],
+                    attributes['lon'],
+                    attributes['lat'],
+                    attributes.get('timestamp'),
+                    parse_tags(body) if body else {}
+                )
+            elif name == u'way':
+                yield (
+                    'way',
+                    attributes['id'],
+                    attributes.get('timestamp'),
+                    parse_tags(body) if body else {},
+                    ND_PATTERN.findall(body) if body else []
+                )
+            else:
+                members = []
+                if body:
+                    for member_text in MEMBER_PATTERN.findall(body):
+                        member = parse_attributes(member_text)
+                        members.append((member['type'], member['ref'], member.get('role', u'')))
+                yield (
+                    'relation',
+                    attributes['id'],
+                    attributes.get('timestamp'),
+                    parse_tags(body) if body else {},
+                    members
+                )
+        text = text[end:]
@@ -0,0 +1,82 @@
+'''
+Unit tests of the assembly of the multipolygons of osm_2_geodatabase: the member ways are joined into rings by
+assemble_rings, and the rings are nested into polygons with holes by nest_rings.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, unittest, numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_2_geodatabase import assemble_rings, nest_rings, ring_signed_area
+
+
+def square(x, y, size):
+    """
+    :return: The coordinates of a closed counter clockwise square.
+    """
+    return numpy.array([(x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)], dtype=numpy.float64)
+
+
+class AssembleRingsTest(unittest.TestCase):
+
+    def test_closed_way(self):
+        rings, unclosed = assemble_rings([(square(0, 0, 10), 1, 1, 'outer')])
+        self.assertEqual(unclosed, 0)
+        self.assertEqual(len(rings), 1)
+        self.assertTrue((rings[0][0] == square(0, 0, 10)).all())
+        self.assertEqual(rings[0][1], 'outer')
+
+    def test_open_ways(self):
+        # Nodes 1 to 4 at the corners of a square: the ways 1-2-3, 1-4 and 4-3, the last one reversed.
+        corners = square(0, 0, 10)
+        member_ways = [
+            (corners[0:3], 1, 3, 'outer'),
+            (corners[[0, 3]], 1, 4, 'outer'),
+            (corners[[3, 2]], 4, 3, 'outer'),
+            (numpy.array([(20, 20), (30, 30)], dtype=numpy.float64), 5, 6, 'outer'),
+        ]
+        rings, unclosed = assemble_rings(member_ways)
+        self.assertEqual(unclosed, 1)
+        self.assertEqual(len(rings), 1)
+        coordinates = rings[0][0]
+        self.assertEqual(len(coordinates), 5)
+        self.assertTrue((coordinates[0] == coordinates[-1]).all())
+        self.assertEqual(abs(ring_signed_area(coordinates)), 100.0)
+
+    def test_degenerate_ring(self):
+        line = numpy.array([(0, 0), (1, 1), (0, 0)], dtype=numpy.float64)
+        self.assertEqual(assemble_rings([(line, 1, 1, 'outer')]), ([], 0))
+
+
+class NestRingsTest(unittest.TestCase):
+
+    def test_holes_and_islands(self):
+        rings = [
+            (square(2, 2, 2), 'inner'),
+            (square(0, 0, 10), 'outer'),
+            (square(20, 0, 5)[::-1], 'outer'),
+            # An island in the hole of the first polygon.
+            (square(2.5, 2.5, 1), 'outer'),
+        ]
+        polygons, role_mismatches = nest_rings(rings)
+        self.assertEqual(role_mismatches, 0)
+        self.assertEqual(len(polygons), 3)
+        outer, hole = polygons[0]
+        self.assertEqual(ring_signed_area(outer), -100.0)
+        self.assertEqual(ring_signed_area(hole), 4.0)
+        self.assertEqual([len(polygon) for polygon in polygons[1:]], [1, 1])
+        self.assertEqual(sorted(ring_signed_area(polygon[0]) for polygon in polygons[1:]), [-25.0, -1.0])
+
+    def test_role_mismatches(self):
+        polygons, role_mismatches = nest_rings([(square(0, 0, 10), 'inner'), (square(2, 2, 2), 'outer')])
+        self.assertEqual(role_mismatches, 2)
+        self.assertEqual(len(polygons), 1)
+        self.assertEqual(len(polygons[0]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+'''
+Unit tests of the node location stores of osm_2_geodatabase, used by the DENSE_STORE and SPARSE_STORE joins.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, shutil, tempfile, unittest, numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_2_geodatabase import DenseNodeLocationStore, SparseNodeLocationStore
+from osm_intermediate import COORDINATE_PRECISION, NODE_DTYPE
+
+
+def node_ids(*values):
+    return numpy.array(values, dtype=numpy.int64)
+
+
+class DenseNodeLocationStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = DenseNodeLocationStore(os.path.join(self.folder, 'node_locations.dat'), capacity=4)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.folder)
+
+    def test_lookup(self):
+        self.store.add(3, '1.5', '-2.5')
+        self.store.add(9, 10, 20)
+        self.store.flush()
+        coordinates, found = self.store.lookup(node_ids(3, 9, 4, 100))
+        self.assertEqual(found.tolist(), [True, True, False, False])
+        self.assertEqual(coordinates[0].tolist(), [15000000, -25000000])
+        self.assertEqual(coordinates[1].tolist(), [10 * COORDINATE_PRECISION, 20 * COORDINATE_PRECISION])
+        self.store.remove(node_ids(3, 100))
+        self.assertEqual(self.store.lookup(node_ids(3, 9))[1].tolist(), [False, True])
+
+    def test_negative_identifiers(self):
+        self.store.add(3, 1, 1)
+        self.store.add(-5, 1, 1)
+        self.assertRaises(ValueError, self.store.flush)
+        nodes = numpy.zeros(2, dtype=NODE_DTYPE)
+        nodes['id'] = [1, -2]
+        self.assertRaises(ValueError, self.store.write, nodes)
+        # Negative identifiers wrap around as numpy indices: they must not find the last rows of the file.
+        self.store.add(self.store._capacity - 1, 1, 1)
+        self.store.flush()
+        self.assertEqual(self.store.lookup(node_ids(-1, -5))[1].tolist(), [False, False])
+        self.store.remove(node_ids(-1))
+        self.assertEqual(self.store.lookup(node_ids(self.store._capacity - 1))[1].tolist(), [True])
+
+
+class SparseNodeLocationStoreTest(unittest.TestCase):
+
+    def test_negative_identifiers(self):
+        store = SparseNodeLocationStore()
+        store.add(-5, 1, 2)
+        store.add(3, 3, 4)
+        coordinates, found = store.lookup(node_ids(3, -5, -1))
+        self.assertEqual(found.tolist(), [True, True, False])
+        self.assertEqual(coordinates[1].tolist(), [COORDINATE_PRECISION, 2 * COORDINATE_PRECISION])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
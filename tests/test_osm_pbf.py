@@ -0,0 +1,178 @@
+'''
+Unit tests of the PBF reader of osm_pbf, on a small PBF file encoded by hand: a header block, and a data block with
+dense nodes, a plain node, a way and a relation.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, io, sys, zlib, struct, unittest, numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import osm_pbf
+
+
+def varint(value):
+    """
+    :param value: An integer. Negative integers are encoded as 64 bits two's complement.
+    :return: The varint encoding of the integer.
+    """
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while True:
+        if value < 0x80:
+            encoded.append(value)
+            return bytes(encoded)
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def field(number, value):
+    """
+    :param number: The field number.
+    :param value: An integer, encoded as a varint, or bytes, encoded as a length delimited field.
+    :return: The encoded field.
+    """
+    if isinstance(value, bytes):
+        return varint(number << 3 | osm_pbf.WIRE_LENGTH_DELIMITED) + varint(len(value)) + value
+    return varint(number << 3 | osm_pbf.WIRE_VARINT) + varint(value)
+
+
+def packed(values, encode=varint):
+    return b''.join(encode(value) for value in values)
+
+
+def packed_deltas(values):
+    """
+    :return: The values delta coded, as packed zigzag varints (packed sint64 of the format).
+    """
+    previous = 0
+    deltas = []
+    for value in values:
+        deltas.append(value - previous)
+        previous = value
+    return packed(deltas, lambda delta: varint(zigzag(delta)))
+
+
+def file_block(blob_type, message, compressed=True):
+    """
+    :param blob_type: 'OSMHeader' or 'OSMData'.
+    :param message: The encoded HeaderBlock or PrimitiveBlock.
+    :param compressed: If True, the message is compressed with zlib, otherwise it is stored raw.
+    :return: The encoded BlobHeader and Blob, preceded by the size of the BlobHeader.
+    """
+    if compressed:
+        blob = field(2, len(message)) + field(3, zlib.compress(message))
+    else:
+        blob = field(1, message)
+    header = field(1, blob_type.encode('utf-8')) + field(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+STRINGS = [u'', u'amenity', u'caf\xe9', u'highway', u'residential', u'type', u'multipolygon', u'outer', u'inner']
+# 2020-09-13T12:26:40Z
+TIMESTAMP = 1600000000
+
+
+def header_block(features=('OsmSchema-V0.6', 'DenseNodes')):
+    return b''.join(field(4, feature.encode('utf-8')) for feature in features)
+
+
+def primitive_block():
+    string_table = b''.join(field(1, string.encode('utf-8')) for string in STRINGS)
+    dense_nodes = b''.join([
+        field(1, packed_deltas([1, 2, -3])),
+        field(5, field(2, packed_deltas([TIMESTAMP, TIMESTAMP + 60, TIMESTAMP + 60]))),
+        field(8, packed_deltas([455000000, 455000010, -338000000])),
+        field(9, packed_deltas([22500000, 22500010, 1512000000])),
+        # amenity=cafe on the first node only.
+        field(10, packed([1, 2, 0, 0, 0])),
+    ])
+    node = b''.join([
+        field(1, zigzag(4)),
+        field(2, packed([3])),
+        field(3, packed([4])),
+        field(4, field(2, TIMESTAMP)),
+        field(8, zigzag(-10)),
+        field(9, zigzag(20)),
+    ])
+    way = b''.join([
+        field(1, 10),
+        field(2, packed([3])),
+        field(3, packed([4])),
+        field(8, packed_deltas([1, 2, 4, 1])),
+    ])
+    relation = b''.join([
+        field(1, 20),
+        field(2, packed([5])),
+        field(3, packed([6])),
+        field(8, packed([7, 8])),
+        field(9, packed_deltas([10, 4])),
+        field(10, packed([1, 0])),
+    ])
+    groups = [field(2, dense_nodes), field(1, node), field(3, way), field(4, relation)]
+    return field(1, string_table) + b''.join(field(2, group) for group in groups)
+
+
+def pbf_file(features=('OsmSchema-V0.6', 'DenseNodes')):
+    return file_block(osm_pbf.BLOB_HEADER_TYPE, header_block(features), compressed=False) + \
+        file_block(osm_pbf.BLOB_DATA_TYPE, primitive_block())
+
+
+class PBFReaderTest(unittest.TestCase):
+
+    def test_elements(self):
+        elements = list(osm_pbf.iter_element_records(osm_pbf.iter_pbf_elements(io.BytesIO(pbf_file()))))
+        self.assertEqual(elements, [
+            ('node', '1', '2.2500000', '45.5000000', '2020-09-13T12:26:40Z', {u'amenity': u'caf\xe9'}),
+            ('node', '2', '2.2500010', '45.5000010', '2020-09-13T12:27:40Z', {}),
+            ('node', '-3', '151.2000000', '-33.8000000', '2020-09-13T12:27:40Z', {}),
+            ('node', '4', '0.0000020', '-0.0000010', '2020-09-13T12:26:40Z', {u'highway': u'residential'}),
+            ('way', '10', None, {u'highway': u'residential'}, ['1', '2', '4', '1']),
+            ('relation', '20', None, {u'type': u'multipolygon'}, [('way', '10', u'outer'), ('node', '4', u'inner')]),
+        ])
+
+    def test_node_block(self):
+        elements = list(osm_pbf.iter_pbf_elements(io.BytesIO(pbf_file())))
+        self.assertEqual([element[0] for element in elements], [osm_pbf.NODE_BLOCK, 'node', 'way', 'relation'])
+        node_block = elements[0][1]
+        self.assertEqual(node_block.nodes.tolist(), [
+            (1, 22500000, 455000000), (2, 22500010, 455000010), (-3, 1512000000, -338000000)
+        ])
+        self.assertEqual(node_block.tagged_records(), [
+            ('node', '1', '2.2500000', '45.5000000', '2020-09-13T12:26:40Z', {u'amenity': u'caf\xe9'})
+        ])
+        self.assertEqual(node_block.tagged_records(numpy.array([False, True, True])), [])
+        self.assertEqual(elements[2][4].dtype, numpy.int64)
+        self.assertEqual(elements[2][4].tolist(), [1, 2, 4, 1])
+
+    def test_unsupported_feature(self):
+        osm_file = io.BytesIO(pbf_file(features=('OsmSchema-V0.6', 'HistoricalInformation')))
+        self.assertRaises(ValueError, list, osm_pbf.iter_pbf_elements(osm_file))
+
+    def test_truncated_file(self):
+        content = pbf_file()
+        self.assertRaises(ValueError, list, osm_pbf.iter_pbf_elements(io.BytesIO(content[:-5])))
+        self.assertRaises(ValueError, list, osm_pbf.iter_pbf_elements(io.BytesIO(content + b'\x00\x00')))
+
+    def test_varints(self):
+        for value in (0, 1, 127, 128, 300, 2 ** 35):
+            self.assertEqual(osm_pbf.decode_varint(bytearray(varint(value)), 0), (value, len(varint(value))))
+        self.assertEqual(osm_pbf.signed(osm_pbf.decode_varint(bytearray(varint(-2)), 0)[0]), -2)
+        self.assertEqual([osm_pbf.zigzag(zigzag(value)) for value in (0, -1, 1, -64, 64)], [0, -1, 1, -64, 64])
+        self.assertEqual(osm_pbf.delta_decode([zigzag(5), zigzag(-2), zigzag(0)]).tolist(), [5, 3, 3])
+        values = [0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1]
+        self.assertEqual(osm_pbf.decode_varints(bytearray(packed(values))).tolist(), values)
+        self.assertEqual(osm_pbf.decode_varints(bytearray()).tolist(), [])
+        self.assertRaises(ValueError, osm_pbf.decode_varints, bytearray(varint(300)[:1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+'''
+Unit tests of the spatial keys of osm_spatial_order, against known values of the Hilbert curve and of the quadkeys of
+the web map tiles.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, shutil, tempfile, unittest, numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_spatial_order import KEY_LEVEL, SPATIAL_ORDER_HILBERT, SPATIAL_ORDER_QUADKEY, grid_cells, hilbert_keys, \
+    quadkey_keys, spatial_keys, coordinate_list_keys, order_list_file
+from osm_intermediate import COORDINATE_PRECISION, COORDINATES_DTYPE, ListWriter, iter_list_blocks
+
+# The positions along the Hilbert curve of the cells of a 4 by 4 grid, by row then column.
+HILBERT_4_BY_4 = [
+    [0, 1, 14, 15],
+    [3, 2, 13, 12],
+    [4, 7, 8, 11],
+    [5, 6, 9, 10],
+]
+
+
+def cells(size):
+    columns, rows = numpy.meshgrid(numpy.arange(size), numpy.arange(size))
+    return columns.ravel(), rows.ravel()
+
+
+class SpatialKeysTest(unittest.TestCase):
+
+    def test_hilbert_keys(self):
+        columns, rows = cells(4)
+        self.assertEqual(hilbert_keys(columns, rows, level=2).reshape(4, 4).tolist(), HILBERT_4_BY_4)
+
+    def test_hilbert_curve_is_continuous(self):
+        columns, rows = cells(32)
+        keys = hilbert_keys(columns, rows, level=5)
+        self.assertEqual(sorted(keys.tolist()), list(range(32 * 32)))
+        order = numpy.argsort(keys)
+        steps = numpy.abs(numpy.diff(columns[order])) + numpy.abs(numpy.diff(rows[order]))
+        self.assertTrue((steps == 1).all())
+
+    def test_quadkey_keys(self):
+        # The quadkey of the tile (3, 5) of level 3 is '213', of the tile (35210, 21493) of level 16 is
+        # '1202102332221212'.
+        self.assertEqual(quadkey_keys([3], [5], level=3).tolist(), [int('213', 4)])
+        self.assertEqual(quadkey_keys([35210], [21493], level=16).tolist(), [int('1202102332221212', 4)])
+
+    def test_grid_cells(self):
+        size = 1 << KEY_LEVEL
+        lons = numpy.array([-180, 0, 180, 179.9999999]) * COORDINATE_PRECISION
+        lats = numpy.array([90, 0, -90, -89.9999999]) * COORDINATE_PRECISION
+        columns, rows = grid_cells(lons.round(), lats.round())
+        self.assertEqual(columns.tolist(), [0, size // 2, size - 1, size - 1])
+        self.assertEqual(rows.tolist(), [0, size // 2, size - 1, size - 1])
+
+    def test_unknown_spatial_order(self):
+        self.assertRaises(ValueError, spatial_keys, numpy.zeros(1), numpy.zeros(1), 'ZORDER')
+
+
+class OrderListFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_order_list_file(self):
+        path = os.path.join(self.folder, 'built_ways')
+        # Lines in the four quarters of the world: south east, north west, north east and south west. The Hilbert
+        # curve goes through them from the north west counter clockwise, the quadkeys by row from the north west.
+        lines = [
+            (1, [(100, -40), (110, -45)]),
+            (2, [(-100, 40), (-110, 45), (-105, 50)]),
+            (3, [(100, 40), (110, 45)]),
+            (4, [(-100, -40), (-110, -45)]),
+        ]
+        with ListWriter(path, COORDINATES_DTYPE) as writer:
+            for identifier, coordinates in lines:
+                values = numpy.array(coordinates, dtype=numpy.float64) * COORDINATE_PRECISION
+                writer.add(identifier, [tuple(value) for value in values.astype(numpy.int32)])
+
+        for spatial_order, expected_order in ((SPATIAL_ORDER_HILBERT, [2, 4, 1, 3]),
+                                              (SPATIAL_ORDER_QUADKEY, [2, 3, 4, 1])):
+            order_list_file(path, COORDINATES_DTYPE, lambda block: coordinate_list_keys(block, spatial_order),
+                            self.folder)
+            blocks = list(iter_list_blocks(path, COORDINATES_DTYPE))
+            self.assertEqual([int(identifier) for block in blocks for identifier in block.index['id']],
+                             expected_order)
+            for block in blocks:
+                for identifier, coordinates, flags in block.lists():
+                    expected = numpy.array(dict(lines)[identifier], dtype=numpy.float64) * COORDINATE_PRECISION
+                    self.assertEqual(coordinates['lon'].tolist(), expected[:, 0].astype(numpy.int32).tolist())
+                    self.assertEqual(coordinates['lat'].tolist(), expected[:, 1].astype(numpy.int32).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+'''
+Unit tests of the tag mapper and of the tag filter of osm_tags.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_tags import TagMapper, TagFilter
+
+
+class TagMapperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tag_mapper = TagMapper(['name', 'addr_street', 'highway', 'building_levels'])
+
+    def test_map(self):
+        self.assertEqual(self.tag_mapper.map({'highway': 'primary', 'name': 'Main Street', 'source': 'survey'}),
+                         ['Main Street', None, 'primary', None])
+        self.assertEqual(self.tag_mapper.map({}), [None, None, None, None])
+
+    def test_key_with_colons(self):
+        self.assertEqual(self.tag_mapper.map({'addr:street': 'Main Street', 'building:levels': '3'}),
+                         [None, 'Main Street', None, '3'])
+
+    def test_field_name_first(self):
+        # The tag named as the field takes precedence, whatever the order of the tags.
+        self.assertEqual(self.tag_mapper.map({'addr:street': 'Main Street', 'addr_street': 'High Street'}),
+                         [None, 'High Street', None, None])
+        self.assertEqual(self.tag_mapper.map({'addr_street': 'High Street', 'addr:street': 'Main Street'}),
+                         [None, 'High Street', None, None])
+
+    def test_rows_are_independent(self):
+        row = self.tag_mapper.map({'name': 'Main Street'})
+        row[0] = 'changed'
+        self.assertEqual(self.tag_mapper.map({}), [None, None, None, None])
+
+
+class TagFilterTest(unittest.TestCase):
+
+    def test_includes_and_excludes(self):
+        tag_filter = TagFilter('way: highway, building, landuse=residential|commercial; -way: highway=proposed; '
+                               'node: amenity')
+        self.assertTrue(tag_filter.accepts('way', {'highway': 'primary'}))
+        self.assertTrue(tag_filter.accepts('way', {'building': 'yes', 'name': 'Town hall'}))
+        self.assertTrue(tag_filter.accepts('way', {'landuse': 'commercial'}))
+        self.assertFalse(tag_filter.accepts('way', {'landuse': 'forest'}))
+        self.assertFalse(tag_filter.accepts('way', {'highway': 'proposed'}))
+        self.assertFalse(tag_filter.accepts('way', {}))
+        self.assertTrue(tag_filter.accepts('node', {'amenity': 'cafe'}))
+        self.assertFalse(tag_filter.accepts('node', {'highway': 'crossing'}))
+        # Relations have no rules, they are all kept.
+        self.assertFalse(tag_filter.has_rules('relation'))
+        self.assertTrue(tag_filter.accepts('relation', {}))
+
+    def test_element_types(self):
+        tag_filter = TagFilter('way|relation: natural=*; -*: access=private')
+        self.assertTrue(tag_filter.accepts('relation', {'natural': 'water'}))
+        self.assertFalse(tag_filter.accepts('relation', {'natural': 'water', 'access': 'private'}))
+        self.assertTrue(tag_filter.has_rules('node'))
+        self.assertTrue(tag_filter.accepts('node', {}))
+        self.assertFalse(tag_filter.accepts('node', {'access': 'private'}))
+
+    def test_empty_expression(self):
+        tag_filter = TagFilter(' ; ')
+        for element_type in ('node', 'way', 'relation'):
+            self.assertFalse(tag_filter.has_rules(element_type))
+            self.assertTrue(tag_filter.accepts(element_type, {'highway': 'primary'}))
+
+    def test_invalid_expressions(self):
+        self.assertRaises(ValueError, TagFilter, 'highway')
+        self.assertRaises(ValueError, TagFilter, 'area: building')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+'''
+Unit tests of osm_update, without arcpy: a small OSM file is imported into a GeoPackage with the update state, and a
+change file is applied to it.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, shutil, sqlite3, struct, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_2_geodatabase import NODES_LAYER, WAY_LINES_LAYER, WAY_POLYGONS_LAYER, ROUTE_LINES_LAYER, process
+from osm_sinks import FORMAT_GEOPACKAGE, GEOPACKAGE_HEADER, GEOPACKAGE_GEOMETRY_COLUMN
+from osm_update import apply_changes
+
+# A building with a courtyard, a multipolygon of the building and of the courtyard, a highway along the building, and
+# a boundary and a route on their own ways.
+OSM_FILE = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lon="0" lat="0" timestamp="2020-01-01T00:00:00Z"><tag k="amenity" v="cafe"/></node>
+ <node id="2" lon="1" lat="0" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="3" lon="1" lat="1" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="4" lon="0" lat="1" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="5" lon="0.2" lat="0.2" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="6" lon="0.4" lat="0.2" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="7" lon="0.4" lat="0.4" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="8" lon="0.2" lat="0.4" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="30" lon="2" lat="0" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="31" lon="3" lat="0" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="32" lon="3" lat="1" timestamp="2020-01-01T00:00:00Z"/>
+ <node id="33" lon="2" lat="1" timestamp="2020-01-01T00:00:00Z"/>
+ <way id="10" timestamp="2020-01-01T00:00:00Z"><nd ref="1"/><nd ref="2"/><nd ref="3"/>
+  <tag k="highway" v="residential"/></way>
+ <way id="11" timestamp="2020-01-01T00:00:00Z"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="1"/>
+  <tag k="building" v="yes"/></way>
+ <way id="12" timestamp="2020-01-01T00:00:00Z"><nd ref="5"/><nd ref="6"/><nd ref="7"/><nd ref="8"/><nd ref="5"/></way>
+ <way id="13" timestamp="2020-01-01T00:00:00Z"><nd ref="30"/><nd ref="31"/></way>
+ <way id="14" timestamp="2020-01-01T00:00:00Z"><nd ref="30"/><nd ref="31"/><nd ref="32"/><nd ref="33"/><nd ref="30"/>
+ </way>
+ <relation id="20" timestamp="2020-01-01T00:00:00Z"><member type="way" ref="11" role="outer"/>
+  <member type="way" ref="12" role="inner"/><tag k="type" v="multipolygon"/><tag k="landuse" v="forest"/></relation>
+ <relation id="21" timestamp="2020-01-01T00:00:00Z"><member type="way" ref="14" role="outer"/>
+  <tag k="type" v="boundary"/><tag k="boundary" v="administrative"/><tag k="name" v="Area"/></relation>
+ <relation id="22" timestamp="2020-01-01T00:00:00Z"><member type="way" ref="13" role=""/>
+  <tag k="type" v="route"/><tag k="route" v="bus"/><tag k="name" v="Bus"/></relation>
+</osm>
+'''
+
+# The node 3 moves, the highway gets a name, the multipolygon loses its courtyard, and the boundary and the route are
+# deleted.
+CHANGE_FILE = '''<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+ <modify>
+  <node id="3" lon="1.5" lat="1.5" timestamp="2020-02-01T00:00:00Z"/>
+  <way id="10" timestamp="2020-02-01T00:00:00Z"><nd ref="1"/><nd ref="2"/><nd ref="3"/>
+   <tag k="highway" v="residential"/><tag k="name" v="Main"/></way>
+  <relation id="20" timestamp="2020-02-01T00:00:00Z"><member type="way" ref="11" role="outer"/>
+   <tag k="type" v="multipolygon"/><tag k="landuse" v="meadow"/></relation>
+ </modify>
+ <delete>
+  <relation id="21"/>
+  <relation id="22"/>
+ </delete>
+</osmChange>
+'''
+
+BUILDING = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+MOVED_BUILDING = [(0, 0), (1, 0), (1.5, 1.5), (0, 1), (0, 0)]
+COURTYARD = [(0.2, 0.2), (0.4, 0.2), (0.4, 0.4), (0.2, 0.4), (0.2, 0.2)]
+
+
+def read_wkb(wkb, offset=0):
+    """
+    Decode a point, line, polygon or multi geometry of well-known binary.
+    :return: A tuple with the geometry as nested lists of (x, y) tuples, and the offset after it.
+    """
+    geometry_type = struct.unpack_from('<I', wkb, offset + 1)[0]
+    offset += 5
+    if geometry_type == 1:
+        return struct.unpack_from('<dd', wkb, offset), offset + 16
+    count = struct.unpack_from('<I', wkb, offset)[0]
+    offset += 4
+    if geometry_type == 2:
+        values = struct.unpack_from('<{}d'.format(2 * count), wkb, offset)
+        return list(zip(values[::2], values[1::2])), offset + 16 * count
+    if geometry_type == 3:
+        rings = []
+        for ring in range(count):
+            size = struct.unpack_from('<I', wkb, offset)[0]
+            values = struct.unpack_from('<{}d'.format(2 * size), wkb, offset + 4)
+            rings.append(list(zip(values[::2], values[1::2])))
+            offset += 4 + 16 * size
+        return rings, offset
+    parts = []
+    for part in range(count):
+        geometry, offset = read_wkb(wkb, offset)
+        parts.append(geometry)
+    return parts, offset
+
+
+def ring_vertices(ring):
+    """
+    :return: The set of the vertices of a ring, whatever its orientation and its first vertex.
+    """
+    return set((round(x, 7), round(y, 7)) for x, y in ring)
+
+
+class ApplyChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output = os.path.join(self.folder, 'output.gpkg')
+        osm_file = os.path.join(self.folder, 'input.osm')
+        with open(osm_file, 'w') as osm:
+            osm.write(OSM_FILE)
+        processing_folder = os.path.join(self.folder, 'processing')
+        os.mkdir(processing_folder)
+        process(osm_file, self.output, processing_folder, output_format=FORMAT_GEOPACKAGE, update_state=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read_rows(self, layer, field_names='id, timestamp'):
+        """
+        :return: The rows of a layer, as lists of the values of the fields followed by the geometry, sorted.
+        """
+        connection = sqlite3.connect(self.output)
+        try:
+            rows = connection.execute('SELECT {}, {} FROM {}'.format(field_names, GEOPACKAGE_GEOMETRY_COLUMN, layer))
+            return sorted(list(row[:-1]) + [read_wkb(bytes(row[-1])[len(GEOPACKAGE_HEADER):])[0]] for row in rows)
+        finally:
+            connection.close()
+
+    def test_import(self):
+        self.assertEqual(self.read_rows(NODES_LAYER), [['1', '2020-01-01T00:00:00Z', (0, 0)]])
+        self.assertEqual(self.read_rows(WAY_LINES_LAYER, 'id, name'), [['10', None, [(0, 0), (1, 0), (1, 1)]]])
+        polygons = self.read_rows(WAY_POLYGONS_LAYER, 'osm_type, id, landuse')
+        self.assertEqual([row[:-1] for row in polygons],
+                         [['relation', '20', 'forest'], ['relation', '21', None], ['way', '11', None]])
+        self.assertEqual([[ring_vertices(ring) for ring in polygon] for polygon in polygons[0][-1]],
+                         [[ring_vertices(BUILDING), ring_vertices(COURTYARD)]])
+        self.assertEqual(ring_vertices(polygons[2][-1][0]), ring_vertices(BUILDING))
+        self.assertEqual(self.read_rows(ROUTE_LINES_LAYER, 'id, name'), [['22', 'Bus', [[(2, 0), (3, 0)]]]])
+
+    def test_apply_changes(self):
+        change_file = os.path.join(self.folder, 'change.osc')
+        with open(change_file, 'w') as osc:
+            osc.write(CHANGE_FILE)
+        apply_changes(change_file, self.output)
+
+        self.assertEqual(self.read_rows(NODES_LAYER), [['1', '2020-01-01T00:00:00Z', (0, 0)]])
+        self.assertEqual(self.read_rows(WAY_LINES_LAYER, 'id, timestamp, name'),
+                         [['10', '2020-02-01T00:00:00Z', 'Main', [(0, 0), (1, 0), (1.5, 1.5)]]])
+        polygons = self.read_rows(WAY_POLYGONS_LAYER, 'osm_type, id, timestamp, landuse')
+        self.assertEqual([row[:-1] for row in polygons],
+                         [['relation', '20', '2020-02-01T00:00:00Z', 'meadow'],
+                          ['way', '11', '2020-01-01T00:00:00Z', None]])
+        # The multipolygon is built again without its courtyard, the building follows its moved node.
+        self.assertEqual([[ring_vertices(ring) for ring in polygon] for polygon in polygons[0][-1]],
+                         [[ring_vertices(MOVED_BUILDING)]])
+        self.assertEqual([ring_vertices(ring) for ring in polygons[1][-1]], [ring_vertices(MOVED_BUILDING)])
+        self.assertEqual(self.read_rows(ROUTE_LINES_LAYER), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+'''
+Unit tests of the scanner of osm_xml_scanner: its records are compared with the records of
+osm_2_geodatabase.iter_xml_elements on the same content, with buffers of every size.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, io, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from osm_2_geodatabase import iter_xml_elements
+from osm_xml_scanner import iter_scanned_elements
+
+OSM_XML = u'''<?xml version="1.0" encoding="UTF-8"?>
+<!-- Written by <a tool>, <node id="100" lat="1" lon="1"/> is not a node. -->
+<osm version="0.6" generator="test">
+ <bounds minlat="45.0" minlon="2.0" maxlat="46.0" maxlon="3.0"/>
+ <node id="1" version="2" timestamp="2020-09-13T12:26:40Z" lat="45.5" lon="2.25"/>
+ <node id="2" lat="45.6" lon="2.35">
+  <tag k="name" v="Caf\xe9 &quot;Chez Marcel&quot; &amp; fils &#x263A;"/>
+  <tag k="amenity" v="cafe"/>
+ </node>
+ <node lon='2.45' lat='45.7' id='-3'><tag v='multi&#10;line	text' k='note'/></node>
+ <!-- <node id="4" lat="45.8" lon="2.55"/>
+ <way id="11"><nd ref="1"/><nd ref="2"/></way> -->
+ <node id="5" lat="45.9" lon="2.65"><!-- a > b --><tag k="highway" v="crossing"/></node>
+ <way id="10" timestamp="2020-09-13T12:27:40Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <!-- <nd ref="4"/> -->
+  <nd ref="-3"/>
+  <nd ref="1"/>
+  <tag k="landuse" v="grass"/>
+ </way>
+ <way id="12"/>
+ <relation id="20">
+  <member type="way" ref="10" role="outer"/>
+  <member type="node" ref="5" role=""/>
+  <member type="relation" ref="21"/>
+  <tag k="type" v="multipolygon"/>
+ </relation>
+</osm>
+'''.encode('utf-8')
+
+
+class XMLScannerTest(unittest.TestCase):
+
+    def test_same_records_as_the_xml_parser(self):
+        expected = list(iter_xml_elements(io.BytesIO(OSM_XML)))
+        self.assertEqual([record[:2] for record in expected], [
+            ('node', '1'), ('node', '2'), ('node', '-3'), ('node', '5'), ('way', '10'), ('way', '12'),
+            ('relation', '20')
+        ])
+        for buffer_size in range(1, len(OSM_XML) + 2):
+            records = list(iter_scanned_elements(io.BytesIO(OSM_XML), buffer_size))
+            self.assertEqual(records, expected, 'Buffer size {}'.format(buffer_size))
+
+    def test_unclosed_comment(self):
+        content = OSM_XML.replace(b'</osm>', b'<!-- <node id="6" lat="1" lon="1"/>')
+        records = list(iter_scanned_elements(io.BytesIO(content), 64))
+        self.assertEqual(records[-1][:2], ('relation', '20'))
+
+
+if __name__ == '__main__':
+    unittest.main()
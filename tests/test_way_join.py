@@ -0,0 +1,156 @@
+'''
+Unit tests of the join of ways and nodes of osm_2_geodatabase, on small intermediate files: the nodes are not ordered
+by identifier, and are read by chunks of a few nodes.
+
+Usage: python -m unittest discover tests
+
+Licence: Apache 2: https://github.com/fabanc/OSM2ArcMap/blob/master/LICENSE
+'''
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+import osm_2_geodatabase
+from osm_2_geodatabase import STAGE_JOIN, build_ways, build_ways_sort_merge
+from osm_intermediate import COORDINATE_PRECISION, COORDINATES_DTYPE, REF_DTYPE, FLAG_HIGHWAY, NodeWriter, \
+    ListWriter, iter_list_blocks
+from osm_checkpoint import Manifest
+
+# Nodes in the order of the file: the first chunks locate the nodes of the following ones out of order.
+NODE_IDS = [7, 3, 10, 1, 5, 8, 2]
+
+# (way identifier, node identifiers, flags)
+WAYS = [
+    (100, [1, 2, 3], 0),
+    (101, [5, 7, 8, 5], 0),
+    (102, [2, 10, 7, 2], FLAG_HIGHWAY),
+    (103, [1, 99], 0),
+    (104, [10, 3], 0),
+]
+
+# Ways partly outside of a clip area, 99 and 98 being outside: (way identifier, node identifiers, flags)
+CLIPPED_WAYS = [
+    (200, [1, 99, 2, 3], 0),
+    (201, [99, 5, 7, 8, 99], 0),
+    (202, [5, 99, 7, 5], 0),
+    (203, [1, 98], 0),
+    (204, [2, 10, 99, 2], FLAG_HIGHWAY),
+]
+
+
+def node_coordinates(node_id):
+    return node_id * COORDINATE_PRECISION, 2 * node_id * COORDINATE_PRECISION
+
+
+def read_built_ways(path):
+    """
+    :param path: A list file of COORDINATES_DTYPE.
+    :return: A dictionary of the lists of (lon, lat) tuples of the file, keyed by identifier.
+    """
+    built_ways = {}
+    for block in iter_list_blocks(path, COORDINATES_DTYPE):
+        for identifier, start, end in zip(block.index['id'], block.starts, block.ends):
+            built_ways[int(identifier)] = [(int(lon), int(lat)) for lon, lat in block.values[start:end]]
+    return built_ways
+
+
+class WayJoinTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.nodes_path = os.path.join(self.folder, 'nodes.bin')
+        self.way_nodes_path = os.path.join(self.folder, 'way_nodes')
+        self.built_ways_path = os.path.join(self.folder, 'built_ways')
+        self.built_areas_path = os.path.join(self.folder, 'built_areas')
+        with NodeWriter(self.nodes_path) as node_writer:
+            for node_id in NODE_IDS:
+                node_writer.add(node_id, node_id, 2 * node_id)
+        with ListWriter(self.way_nodes_path, REF_DTYPE) as way_nodes_writer:
+            for way_id, node_ids, flags in WAYS:
+                way_nodes_writer.add(way_id, node_ids, flags)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def check_built_ways(self):
+        expected_ways = dict((way_id, [node_coordinates(node_id) for node_id in node_ids])
+                             for way_id, node_ids, flags in WAYS)
+        built_ways = read_built_ways(self.built_ways_path)
+        built_areas = read_built_ways(self.built_areas_path)
+        # A closed way is an area unless it is a highway, a way with a missing node is not built.
+        self.assertEqual(sorted(built_ways), [100, 102, 104])
+        self.assertEqual(sorted(built_areas), [101])
+        for way_id, coordinates in list(built_ways.items()) + list(built_areas.items()):
+            self.assertEqual(coordinates, expected_ways[way_id])
+
+    def test_sort_merge(self):
+        # The sort merge join requires the nodes ordered by identifier, as in the OSM files.
+        with NodeWriter(self.nodes_path) as node_writer:
+            for node_id in sorted(NODE_IDS):
+                node_writer.add(node_id, node_id, 2 * node_id)
+        build_ways(self.nodes_path, self.way_nodes_path, self.built_ways_path, self.built_areas_path, 3)
+        chunked = read_built_ways(self.built_ways_path), read_built_ways(self.built_areas_path)
+        for run_size in (1, 3, len(NODE_IDS)):
+            build_ways_sort_merge(self.nodes_path, self.way_nodes_path, self.built_ways_path, self.built_areas_path,
+                                  self.folder, run_size)
+            # The sort merge join builds the same lines and areas as the chunked join.
+            self.assertEqual((read_built_ways(self.built_ways_path), read_built_ways(self.built_areas_path)), chunked)
+            self.check_built_ways()
+
+    def test_clipped_ways(self):
+        with ListWriter(self.way_nodes_path, REF_DTYPE) as way_nodes_writer:
+            for way_id, node_ids, flags in CLIPPED_WAYS:
+                way_nodes_writer.add(way_id, node_ids, flags)
+        for nodes_chunk_size in (1, 3, len(NODE_IDS)):
+            build_ways(self.nodes_path, self.way_nodes_path, self.built_ways_path, self.built_areas_path,
+                       nodes_chunk_size, clipped=True)
+            # The missing nodes are dropped. An area whose first node is missing is closed again with its first
+            # located node, an area left with less than 4 nodes or a line with less than 2 nodes is not built.
+            self.assertEqual(read_built_ways(self.built_ways_path), {
+                200: [node_coordinates(node_id) for node_id in (1, 2, 3)],
+                204: [node_coordinates(node_id) for node_id in (2, 10, 2)],
+            })
+            self.assertEqual(read_built_ways(self.built_areas_path), {
+                201: [node_coordinates(node_id) for node_id in (5, 7, 8, 5)],
+            })
+
+    def test_unordered_nodes(self):
+        for nodes_chunk_size in (1, 3, len(NODE_IDS)):
+            build_ways(self.nodes_path, self.way_nodes_path, self.built_ways_path, self.built_areas_path,
+                       nodes_chunk_size)
+            self.check_built_ways()
+
+    def test_resume(self):
+        process_way_chunk = osm_2_geodatabase.process_way_chunk
+        calls = []
+        interrupted_call = [2]
+
+        def failing_process_way_chunk(*arguments, **keywords):
+            calls.append(len(arguments[0]))
+            if len(calls) == interrupted_call[0]:
+                raise RuntimeError('Interrupted')
+            return process_way_chunk(*arguments, **keywords)
+
+        osm_2_geodatabase.process_way_chunk = failing_process_way_chunk
+        try:
+            manifest = Manifest(self.folder, {'test': 'resume'})
+            self.assertRaises(RuntimeError, build_ways, self.nodes_path, self.way_nodes_path, self.built_ways_path,
+                              self.built_areas_path, 3, manifest)
+            self.assertEqual(manifest.progress(STAGE_JOIN)['nodes_read'], 3)
+
+            # The join resumes after the first chunk, with a manifest read again from the processing folder.
+            del calls[:]
+            interrupted_call[0] = None
+            manifest = Manifest(self.folder, {'test': 'resume'})
+            self.assertTrue(manifest.resumed)
+            build_ways(self.nodes_path, self.way_nodes_path, self.built_ways_path, self.built_areas_path, 3,
+                       manifest)
+            self.assertEqual(calls, [3, 1])
+        finally:
+            osm_2_geodatabase.process_way_chunk = process_way_chunk
+        self.check_built_ways()
+
+
+if __name__ == '__main__':
+    unittest.main()